@@ -2,14 +2,77 @@
 """
 admin.py - Admin and staff management routes
 """
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify
 from functools import wraps
-from db import get_db_connection
+from db import from_epoch, get_db_connection, insert_event, package_connection, status_name, user_role
 from datetime import datetime
+import io
+import os
 import sqlite3
+import cache_bus
+import ledger
+import partitions
+import queries
+import reconcile
+import sharding
+import slowlog
+import summaries
+import tracking_numbers
+from serializers import RowMapper, Bool, Call, Format, Or, Status, Timestamp, fast_jsonify
 
 admin_routes = Blueprint('admin_routes', __name__)
 
+# Location list (reference data), dropped in every worker when a location is added
+REFERENCE_CACHE_TTL = float(os.environ.get('REFERENCE_CACHE_TTL', 300))
+reference_cache = cache_bus.LocalCache('reference', REFERENCE_CACHE_TTL)
+
+ADMIN_PACKAGE = RowMapper({
+    'tracking_number': Call(tracking_numbers.public, 'package_id'),
+    'sender': 'sender_name',
+    'recipient': 'recipient_name',
+    'destination': Format('{}, {}', 'recipient_city', 'recipient_state'),
+    'customer': 'customer_name',
+    'service': 'service_name',
+    'date_shipped': 'date_shipped',
+    'date_delivered': 'date_delivered',
+    'current_status': Status('current_status', 'Unknown'),
+    'current_location': Or('current_location', 'Unknown')
+})
+
+LOCATION = RowMapper({
+    'location_id': 'location_id',
+    'type': 'type',
+    'name': 'name',
+    'city': 'city',
+    'state': 'state'
+})
+
+RECENT_EVENT = RowMapper({
+    'timestamp': Timestamp('timestamp'),
+    'status': Status('status'),
+    'tracking_number': Call(tracking_numbers.public, 'package_id'),
+    'location': 'location_name'
+})
+
+STAFF_USER = RowMapper({
+    'user_id': 'user_id',
+    'email': 'email',
+    'role': 'role'
+})
+
+CUSTOMER = RowMapper({
+    'customer_id': 'customer_id',
+    'user_id': 'user_id',
+    'name': 'name',
+    'email': 'email',
+    'phone': 'phone',
+    'has_contract': Bool('has_contract'),
+    'account_number': 'account_number',
+    'total_packages': 'total_packages',
+    'shipped_this_month': 'shipped_this_month',
+    'unpaid_balance': 'unpaid_balance'
+})
+
 def staff_required(f):
     """
     Decorator to require staff or admin role.
@@ -25,18 +88,13 @@ def staff_required(f):
             user_id = int(token)
             
             # Check if user is staff or admin
-            conn = get_db_connection()
-            user = conn.execute(
-                "SELECT role FROM User WHERE user_id = ?",
-                (user_id,)
-            ).fetchone()
-            conn.close()
+            role = user_role(user_id)
             
-            if not user or user['role'] not in ['staff', 'admin']:
+            if role not in ['staff', 'admin']:
                 return jsonify({'error': 'Staff access required'}), 403
             
             request.user_id = user_id
-            request.user_role = user['role']
+            request.user_role = role
         except (IndexError, ValueError):
             return jsonify({'error': 'Invalid token'}), 401
             
@@ -58,18 +116,13 @@ def admin_required(f):
             user_id = int(token)
             
             # Check if user is admin
-            conn = get_db_connection()
-            user = conn.execute(
-                "SELECT role FROM User WHERE user_id = ?",
-                (user_id,)
-            ).fetchone()
-            conn.close()
+            role = user_role(user_id)
             
-            if not user or user['role'] != 'admin':
+            if role != 'admin':
                 return jsonify({'error': 'Admin access required'}), 403
             
             request.user_id = user_id
-            request.user_role = user['role']
+            request.user_role = role
         except (IndexError, ValueError):
             return jsonify({'error': 'Invalid token'}), 401
             
@@ -100,77 +153,27 @@ def get_all_packages():
       200:
         description: List of packages
     """
-    conn = get_db_connection()
-    
     try:
-        query = """
-            SELECT 
-                p.package_id,
-                p.sender_name,
-                p.recipient_name,
-                p.recipient_city,
-                p.recipient_state,
-                p.date_shipped,
-                p.date_delivered,
-                c.name as customer_name,
-                st.name as service_name,
-                (
-                    SELECT te.status 
-                    FROM TrackingEvent te 
-                    WHERE te.package_id = p.package_id 
-                    ORDER BY te.timestamp DESC 
-                    LIMIT 1
-                ) as current_status,
-                (
-                    SELECT l.name
-                    FROM TrackingEvent te
-                    JOIN Location l ON te.location_id = l.location_id
-                    WHERE te.package_id = p.package_id
-                    ORDER BY te.timestamp DESC
-                    LIMIT 1
-                ) as current_location
-            FROM Package p
-            JOIN Customer c ON p.customer_id = c.customer_id
-            JOIN ServiceType st ON p.service_id = st.service_id
-            ORDER BY p.date_shipped DESC
-            LIMIT 100
-        """
-        
-        packages = conn.execute(query).fetchall()
+        # Newest 100 of every shard, merged
+        packages = ADMIN_PACKAGE.many(
+            sharding.query(queries.ADMIN_PACKAGES, key=lambda row: row['date_shipped'], reverse=True, limit=100)
+        )
         
-        return jsonify({
-            'packages': [
-                {
-                    'tracking_number': pkg['package_id'],
-                    'sender': pkg['sender_name'],
-                    'recipient': pkg['recipient_name'],
-                    'destination': f"{pkg['recipient_city']}, {pkg['recipient_state']}",
-                    'customer': pkg['customer_name'],
-                    'service': pkg['service_name'],
-                    'date_shipped': pkg['date_shipped'],
-                    'date_delivered': pkg['date_delivered'],
-                    'current_status': pkg['current_status'] or 'Unknown',
-                    'current_location': pkg['current_location'] or 'Unknown'
-                }
-                for pkg in packages
-            ]
-        }), 200
+        return fast_jsonify({'packages': packages}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
 
 
-@admin_routes.route('/admin/packages/<int:package_id>/update-status', methods=['POST'])
+@admin_routes.route('/admin/packages/<int:tracking_number>/update-status', methods=['POST'])
 @staff_required
-def update_package_status(package_id):
+def update_package_status(tracking_number):
     """
     Add a new tracking event for a package.
     ---
     parameters:
       - in: path
-        name: package_id
+        name: tracking_number
         required: true
         schema:
           type: integer
@@ -189,45 +192,47 @@ def update_package_status(package_id):
               type: string
             notes:
               type: string
+            timestamp:
+              type: string
+              description: Scan time (YYYY-MM-DD HH:MM:SS), default now. Late uploads are placed in scan order.
     responses:
       201:
         description: Tracking event added
+      404:
+        description: Package not found
     """
+    package_id = tracking_numbers.lookup(tracking_number)
+    if package_id is None:
+        return jsonify({'error': 'Package not found'}), 404
     data = request.get_json()
-    conn = get_db_connection()
+    conn = package_connection(package_id)
     
     try:
         # Verify package exists
-        package = conn.execute(
-            "SELECT package_id FROM Package WHERE package_id = ?",
-            (package_id,)
-        ).fetchone()
+        package = conn.execute(queries.PACKAGE_EXISTS, (package_id,)).fetchone()
         
         if not package:
             return jsonify({'error': 'Package not found'}), 404
         
+        # A late scan may renumber events in any of the package's months
+        partitions.hint_package(conn, package_id)
+        scanned_at = data.get('timestamp') or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        
         # Add tracking event
         cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO TrackingEvent (package_id, location_id, timestamp, status, notes)
-            VALUES (?, ?, ?, ?, ?)
-        """, (
+        event_id = insert_event(
+            cursor,
             package_id,
             data['location_id'],
-            datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            scanned_at,
             data['status'],
             data.get('notes', '')
-        ))
+        )
         
         # If status is delivered, update package
         if data['status'] == 'delivered':
-            cursor.execute("""
-                UPDATE Package
-                SET date_delivered = ?,
-                    delivered_signature = ?
-                WHERE package_id = ?
-            """, (
-                datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            cursor.execute(queries.MARK_DELIVERED, (
+                scanned_at,
                 data.get('signature', 'Staff'),
                 package_id
             ))
@@ -236,9 +241,12 @@ def update_package_status(package_id):
         
         return jsonify({
             'message': 'Package status updated successfully',
-            'event_id': cursor.lastrowid
+            'event_id': event_id
         }), 201
         
+    except ValueError as e:
+        conn.rollback()
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         conn.rollback()
         return jsonify({'error': str(e)}), 500
@@ -262,38 +270,27 @@ def manage_locations():
     
     try:
         if request.method == 'GET':
-            locations = conn.execute(
-                "SELECT * FROM Location ORDER BY type, name"
-            ).fetchall()
+            body = reference_cache.get('locations')
+            if body is None:
+                body = fast_jsonify({'locations': LOCATION.all(conn.execute(queries.LOCATIONS))}).get_data()
+                reference_cache.set('locations', body)
             
-            return jsonify({
-                'locations': [
-                    {
-                        'location_id': loc['location_id'],
-                        'type': loc['type'],
-                        'name': loc['name'],
-                        'city': loc['city'],
-                        'state': loc['state']
-                    }
-                    for loc in locations
-                ]
-            }), 200
+            return Response(body, mimetype='application/json'), 200
         
         # POST - Create new location
         data = request.get_json()
         
         cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO Location (type, name, city, state)
-            VALUES (?, ?, ?, ?)
-        """, (
+        cursor.execute(queries.INSERT_LOCATION, (
             data['type'],
             data['name'],
             data.get('city'),
             data.get('state')
         ))
+        cache_bus.publish(conn, 'reference', 'locations')
         
         conn.commit()
+        sharding.replicate('Location', cursor.lastrowid)
         
         return jsonify({
             'message': 'Location created successfully',
@@ -318,103 +315,58 @@ def get_stats():
       200:
         description: Statistics data
     """
-    conn = get_db_connection()
-    
     try:
-        # Total packages
-        total_packages = conn.execute(
-            "SELECT COUNT(*) as count FROM Package"
-        ).fetchone()['count']
-        
-        # In transit packages
-        in_transit = conn.execute("""
-            SELECT COUNT(*) as count FROM Package
-            WHERE date_delivered IS NULL
-        """).fetchone()['count']
-        
-        # Delivered today
-        delivered_today = conn.execute("""
-            SELECT COUNT(*) as count FROM Package
-            WHERE date(date_delivered) = date('now')
-        """).fetchone()['count']
-        
-        # Total customers
-        total_customers = conn.execute(
-            "SELECT COUNT(*) as count FROM Customer"
-        ).fetchone()['count']
+        # Package and customer counts, summed over the shards
+        counts = sharding.fan_out(lambda conn: conn.execute(queries.ADMIN_COUNTS).fetchone(), replica=True)
+        total_packages, in_transit, delivered_today, total_customers = (
+            sum(row[i] for row in counts) for i in range(4)
+        )
         
         # Recent activity
-        recent_events = conn.execute("""
-            SELECT 
-                te.timestamp,
-                te.status,
-                p.package_id,
-                l.name as location_name
-            FROM TrackingEvent te
-            JOIN Package p ON te.package_id = p.package_id
-            JOIN Location l ON te.location_id = l.location_id
-            ORDER BY te.timestamp DESC
-            LIMIT 10
-        """).fetchall()
+        recent_events = RECENT_EVENT.many(sharding.query(
+            queries.RECENT_EVENTS, key=lambda row: row['timestamp'], reverse=True, limit=10, replica=True
+        ))
         
-        return jsonify({
+        return fast_jsonify({
             'stats': {
                 'total_packages': total_packages,
                 'in_transit': in_transit,
                 'delivered_today': delivered_today,
                 'total_customers': total_customers
             },
-            'recent_activity': [
-                {
-                    'timestamp': event['timestamp'],
-                    'status': event['status'],
-                    'tracking_number': event['package_id'],
-                    'location': event['location_name']
-                }
-                for event in recent_events
-            ]
+            'recent_activity': recent_events
         }), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
 
 
-@admin_routes.route('/admin/packages/<int:package_id>/location', methods=['GET'])
+@admin_routes.route('/admin/packages/<int:tracking_number>/location', methods=['GET'])
 @staff_required
-def get_package_location(package_id):
+def get_package_location(tracking_number):
     """
     Get current location of a package.
     ---
     parameters:
       - in: path
-        name: package_id
+        name: tracking_number
         required: true
         schema:
           type: integer
     responses:
       200:
         description: Package location information
+      404:
+        description: Package not found or no location data
     """
-    conn = get_db_connection()
+    package_id = tracking_numbers.lookup(tracking_number)
+    if package_id is None:
+        return jsonify({'error': 'Package not found or no location data'}), 404
+    conn = package_connection(package_id)
     
     try:
-        location_info = conn.execute("""
-            SELECT 
-                l.location_id,
-                l.type,
-                l.name,
-                l.city,
-                l.state,
-                te.timestamp,
-                te.status
-            FROM TrackingEvent te
-            JOIN Location l ON te.location_id = l.location_id
-            WHERE te.package_id = ?
-            ORDER BY te.timestamp DESC
-            LIMIT 1
-        """, (package_id,)).fetchone()
+        partitions.hint_package(conn, package_id)
+        location_info = conn.execute(queries.PACKAGE_LOCATION, (package_id,)).fetchone()
         
         if not location_info:
             return jsonify({'error': 'Package not found or no location data'}), 404
@@ -426,8 +378,8 @@ def get_package_location(package_id):
                 'name': location_info['name'],
                 'city': location_info['city'],
                 'state': location_info['state'],
-                'last_update': location_info['timestamp'],
-                'status': location_info['status']
+                'last_update': from_epoch(location_info['timestamp']),
+                'status': status_name(location_info['status'])
             }
         }), 200
         
@@ -450,23 +402,9 @@ def get_all_users():
     conn = get_db_connection()
     
     try:
-        users = conn.execute("""
-            SELECT user_id, email, role
-            FROM User
-            WHERE role IN ('staff', 'admin')
-            ORDER BY role, email
-        """).fetchall()
+        users = STAFF_USER.all(conn.execute(queries.STAFF_USERS))
         
-        return jsonify({
-            'users': [
-                {
-                    'user_id': u['user_id'],
-                    'email': u['email'],
-                    'role': u['role']
-                }
-                for u in users
-            ]
-        }), 200
+        return fast_jsonify({'users': users}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -517,10 +455,7 @@ def create_staff_user():
             return jsonify({'error': 'Role must be staff or admin'}), 400
         
         # Check if email already exists
-        existing = conn.execute(
-            "SELECT user_id FROM User WHERE email = ?",
-            (data['email'],)
-        ).fetchone()
+        existing = conn.execute(queries.USER_ID_BY_EMAIL, (data['email'],)).fetchone()
         
         if existing:
             return jsonify({'error': 'Email already exists'}), 400
@@ -528,10 +463,7 @@ def create_staff_user():
         cursor = conn.cursor()
         
         # Create user account
-        cursor.execute("""
-            INSERT INTO User (email, password, role)
-            VALUES (?, ?, ?)
-        """, (
+        cursor.execute(queries.INSERT_USER, (
             data['email'],
             data['password'],  # In production, hash this!
             data['role']
@@ -541,10 +473,7 @@ def create_staff_user():
         
         # Create staff record if provided
         if 'employee_number' in data or 'department' in data:
-            cursor.execute("""
-                INSERT INTO Staff (user_id, employee_number, hire_date, department)
-                VALUES (?, ?, ?, ?)
-            """, (
+            cursor.execute(queries.INSERT_STAFF, (
                 user_id,
                 data.get('employee_number', f'EMP{user_id:05d}'),
                 datetime.now().strftime('%Y-%m-%d'),
@@ -552,6 +481,7 @@ def create_staff_user():
             ))
         
         conn.commit()
+        sharding.replicate('User', user_id)
         
         return jsonify({
             'message': f'{data["role"].capitalize()} user created successfully',
@@ -600,10 +530,7 @@ def delete_user(user_id):
             return jsonify({'error': 'Cannot delete your own account'}), 400
         
         # Check user exists and is staff/admin
-        user = conn.execute(
-            "SELECT role FROM User WHERE user_id = ?",
-            (user_id,)
-        ).fetchone()
+        user = conn.execute(queries.USER_ROLE, (user_id,)).fetchone()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -614,12 +541,14 @@ def delete_user(user_id):
         cursor = conn.cursor()
         
         # Delete staff record if exists
-        cursor.execute("DELETE FROM Staff WHERE user_id = ?", (user_id,))
+        cursor.execute(queries.DELETE_STAFF, (user_id,))
         
         # Delete user
-        cursor.execute("DELETE FROM User WHERE user_id = ?", (user_id,))
+        cursor.execute(queries.DELETE_USER, (user_id,))
+        cache_bus.publish(conn, 'principal', user_id)
         
         conn.commit()
+        sharding.replicate('User', user_id)
         
         return jsonify({
             'message': 'User deleted successfully',
@@ -676,16 +605,14 @@ def update_user_role(user_id):
         
         # Update role
         cursor = conn.cursor()
-        cursor.execute("""
-            UPDATE User
-            SET role = ?
-            WHERE user_id = ? AND role IN ('staff', 'admin')
-        """, (data['role'], user_id))
+        cursor.execute(queries.UPDATE_USER_ROLE, (data['role'], user_id))
         
         if cursor.rowcount == 0:
             return jsonify({'error': 'User not found or not a staff/admin'}), 404
+        cache_bus.publish(conn, 'principal', user_id)
         
         conn.commit()
+        sharding.replicate('User', user_id)
         
         return jsonify({
             'message': 'Role updated successfully',
@@ -704,53 +631,89 @@ def update_user_role(user_id):
 @staff_required
 def get_all_customers():
     """
-    Get all customer accounts.
+    Get one page of customer accounts with their package counts and balance.
     ---
+    parameters:
+      - in: query
+        name: page
+        schema:
+          type: integer
+          default: 1
+      - in: query
+        name: per_page
+        schema:
+          type: integer
+          default: 50
+          maximum: 500
+      - in: query
+        name: sort
+        schema:
+          type: string
+          enum: [customer_id, name, total_packages, shipped_this_month, unpaid_balance]
+          default: customer_id
+      - in: query
+        name: order
+        schema:
+          type: string
+          enum: [asc, desc]
+          default: desc
     responses:
       200:
-        description: List of customers
+        description: Page of customers plus overall totals
+      400:
+        description: Invalid paging or sort parameters
+    """
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 50, type=int)
+    sort = request.args.get('sort', 'customer_id')
+    order = request.args.get('order', 'desc')
+
+    if page < 1 or not 1 <= per_page <= 500:
+        return jsonify({'error': 'page must be >= 1 and per_page between 1 and 500'}), 400
+    if sort not in summaries.SORT_COLUMNS or order not in ('asc', 'desc'):
+        return jsonify({'error': f"sort must be one of {', '.join(summaries.SORT_COLUMNS)}, order asc or desc"}), 400
+
+    try:
+        customers = CUSTOMER.many(sharding.page(
+            summaries.page_query(sort, order == 'desc'),
+            (summaries.this_month(),), page, per_page,
+            key=lambda row: (row[sort], row['customer_id']),
+            reverse=order == 'desc',
+            replica=True
+        ))
+        
+        return fast_jsonify({
+            'customers': customers,
+            'page': page,
+            'per_page': per_page,
+            'totals': summaries.totals_all(replica=True)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@admin_routes.route('/admin/customers/verify', methods=['GET', 'POST'])
+@admin_required
+def verify_customer_summaries():
+    """
+    Recompute customer summaries from Package and report drift.
+    POST also rebuilds them.
+    ---
+    responses:
+      200:
+        description: Customers whose summary disagreed with Package
     """
-    conn = get_db_connection()
-    
     try:
-        customers = conn.execute("""
-            SELECT 
-                c.customer_id,
-                c.user_id,
-                c.name,
-                c.phone,
-                c.has_contract,
-                c.account_number,
-                u.email,
-                u.role,
-                COUNT(p.package_id) as total_packages
-            FROM Customer c
-            LEFT JOIN User u ON c.user_id = u.user_id
-            LEFT JOIN Package p ON c.customer_id = p.customer_id
-            GROUP BY c.customer_id
-            ORDER BY c.customer_id DESC
-        """).fetchall()
+        drift = summaries.verify_all(fix=request.method == 'POST')
         
         return jsonify({
-            'customers': [
-                {
-                    'customer_id': c['customer_id'],
-                    'user_id': c['user_id'],
-                    'name': c['name'],
-                    'email': c['email'],
-                    'phone': c['phone'],
-                    'has_contract': bool(c['has_contract']),
-                    'account_number': c['account_number'],
-                    'total_packages': c['total_packages']
-                }
-                for c in customers
-            ]
+            'drift': drift,
+            'repaired': request.method == 'POST'
         }), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
 
 
 @admin_routes.route('/admin/customers/<int:customer_id>/contract', methods=['POST'])
@@ -783,10 +746,7 @@ def toggle_contract_status(customer_id):
         cursor = conn.cursor()
         
         # Get customer info
-        customer = conn.execute(
-            "SELECT * FROM Customer WHERE customer_id = ?",
-            (customer_id,)
-        ).fetchone()
+        customer = conn.execute(queries.CUSTOMER_BY_ID, (customer_id,)).fetchone()
         
         if not customer:
             return jsonify({'error': 'Customer not found'}), 404
@@ -796,32 +756,23 @@ def toggle_contract_status(customer_id):
             # Generate account number if they don't have one
             if not customer['account_number']:
                 # Get highest account number and add 1
-                max_account = conn.execute(
-                    "SELECT MAX(account_number) as max_num FROM Customer"
-                ).fetchone()['max_num']
+                max_account = conn.execute(queries.MAX_ACCOUNT_NUMBER).fetchone()['max_num']
                 
                 account_number = (max_account or 1000) + 1
             else:
                 account_number = customer['account_number']
             
-            cursor.execute("""
-                UPDATE Customer
-                SET has_contract = 1, account_number = ?
-                WHERE customer_id = ?
-            """, (account_number, customer_id))
+            cursor.execute(queries.SET_CONTRACT, (account_number, customer_id))
             
             message = f'Customer converted to contract account #{account_number}'
         else:
             # Remove contract status
-            cursor.execute("""
-                UPDATE Customer
-                SET has_contract = 0
-                WHERE customer_id = ?
-            """, (customer_id,))
+            cursor.execute(queries.CLEAR_CONTRACT, (customer_id,))
             
             message = 'Contract status removed'
         
         conn.commit()
+        sharding.save_customer(customer_id)
         
         return jsonify({
             'message': message,
@@ -835,3 +786,103 @@ def toggle_contract_status(customer_id):
         return jsonify({'error': str(e)}), 500
     finally:
         conn.close()
+
+
+@admin_routes.route('/admin/billing/verify', methods=['GET', 'POST'])
+@admin_required
+def verify_billing():
+    """
+    Recompute balances and statement totals from the ledger and report drift.
+    POST also repairs the drifted values.
+    ---
+    responses:
+      200:
+        description: Drifted balances and statement totals
+    """
+    try:
+        drift = ledger.verify_all(fix=request.method == 'POST')
+        
+        return jsonify({
+            'drift': drift,
+            'repaired': request.method == 'POST'
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@admin_routes.route('/admin/db/query-stats', methods=['GET', 'DELETE'])
+@admin_required
+def get_query_stats():
+    """
+    Per-statement SQL timings for this worker, with query plans of slow statements.
+    DELETE resets the counters.
+    ---
+    parameters:
+      - in: query
+        name: sort
+        schema:
+          type: string
+          enum: [total, max, calls, slow]
+          default: total
+      - in: query
+        name: limit
+        schema:
+          type: integer
+          default: 50
+    responses:
+      200:
+        description: Statements ordered by the chosen field
+      400:
+        description: Unknown sort field
+    """
+    if request.method == 'DELETE':
+        slowlog.reset()
+        return jsonify({'message': 'Query stats reset'}), 200
+
+    try:
+        statements = slowlog.get_stats(request.args.get('sort', 'total'),
+                                       request.args.get('limit', 50, type=int))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({
+        'slow_query_ms': slowlog.threshold * 1000,
+        'statements': statements
+    }), 200
+
+
+@admin_routes.route('/admin/billing/reconcile', methods=['POST'])
+@admin_required
+def reconcile_payments():
+    """
+    Import a bank/ACH remittance CSV and apply it to contract statements.
+    Accepts a multipart upload named "file" or a raw text/csv body.
+    ---
+    consumes:
+      - multipart/form-data
+      - text/csv
+    parameters:
+      - in: formData
+        name: file
+        type: file
+    responses:
+      200:
+        description: Import summary with the exceptions report
+    """
+    upload = request.files.get('file')
+    stream = upload.stream if upload else request.stream
+    conns = sharding.connections()
+    
+    try:
+        lines = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+        summary = reconcile.import_remittance(conns, lines)
+        return jsonify(summary), 200
+        
+    except Exception as e:
+        for conn in conns:
+            conn.rollback()
+        return jsonify({'error': str(e)}), 500
+    finally:
+        for conn in conns:
+            conn.close()
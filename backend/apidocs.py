@@ -0,0 +1,147 @@
+# backend/apidocs.py
+"""
+apidocs.py - Swagger UI and the OpenAPI spec, built only when asked for
+
+The spec comes from the YAML blocks in the route docstrings (flasgger).
+Importing flasgger (jsonschema, marshmallow, mistune) is a large share of
+a worker's import time and memory, and no API request needs it, so how
+the docs are served is a setting:
+
+    APIDOCS=lazy     (default) /apidocs/ and /apispec_1.json exist from the
+                     start, but flasgger is imported and the spec built on
+                     the first request to either; the spec is then cached
+    APIDOCS=static   /apispec_1.json serves APISPEC_PATH as written by
+                     `python apidocs.py build` (e.g. at image build time);
+                     the UI page still imports flasgger on first use
+    APIDOCS=eager    flasgger's own Swagger(app) at app creation
+    APIDOCS=off      no docs routes
+
+    python apidocs.py build [--out apispec.json]
+"""
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import threading
+from flask import Blueprint, Response, abort, current_app
+
+DEFAULTS = {
+    'APIDOCS': os.environ.get('APIDOCS', 'lazy'),
+    'APISPEC_PATH': os.environ.get('APISPEC_PATH', os.path.join(os.path.dirname(__file__), 'apispec.json')),
+}
+
+MODES = ('lazy', 'static', 'eager', 'off')
+
+TEMPLATE = {
+    'info': {
+        'title': 'Package Delivery API',
+        'version': '1.0',
+    },
+}
+
+# flasgger's endpoint names; its UI template builds URLs from them
+BLUEPRINT = 'flasgger'
+SPEC_ENDPOINT = 'apispec_1'
+
+_lock = threading.Lock()
+
+
+def _ui_folder(name):
+    # Locate flasgger's bundled UI without importing the package
+    package = os.path.dirname(importlib.util.find_spec('flasgger').origin)
+    return os.path.join(package, 'ui3', name)
+
+
+def _swagger_config():
+    from flasgger import Swagger
+    return dict(Swagger.DEFAULT_CONFIG, title=TEMPLATE['info']['title'])
+
+
+def build_spec(app):
+    """
+    Build the OpenAPI spec for every route of `app` (imports flasgger).
+    """
+    from flasgger import Swagger
+    swagger = Swagger(config=_swagger_config(), template=TEMPLATE)
+    swagger.app = app
+    with app.app_context():
+        return swagger.get_apispecs(SPEC_ENDPOINT)
+
+
+def _spec_json():
+    # Rendered once per app; `static` reads the file written at build time
+    state = current_app.extensions['apidocs']
+    with _lock:
+        if state.get('spec') is None:
+            if current_app.config['APIDOCS'] == 'static':
+                try:
+                    with open(current_app.config['APISPEC_PATH'], 'rb') as f:
+                        state['spec'] = f.read()
+                except FileNotFoundError:
+                    abort(404, description='Spec not built; run `python apidocs.py build`')
+            else:
+                state['spec'] = json.dumps(build_spec(current_app._get_current_object())).encode()
+    return state['spec']
+
+
+def get_spec():
+    return Response(_spec_json(), mimetype='application/json')
+
+
+def get_ui():
+    from flasgger.base import APIDocsView
+    with _lock:
+        view = current_app.extensions['apidocs'].get('ui')
+        if view is None:
+            view = APIDocsView.as_view('apidocs', view_args=dict(config=_swagger_config()))
+            current_app.extensions['apidocs']['ui'] = view
+    return view()
+
+
+def init_apidocs(app):
+    """
+    Serve the API docs on a Flask app according to APIDOCS.
+    Call after every blueprint is registered.
+    """
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
+    mode = app.config['APIDOCS']
+    if mode not in MODES:
+        raise ValueError(f"APIDOCS must be one of {', '.join(MODES)}, not {mode!r}")
+    if mode == 'off':
+        return
+    if mode == 'eager':
+        from flasgger import Swagger
+        Swagger(app, config=_swagger_config(), template=TEMPLATE)
+        return
+
+    app.extensions['apidocs'] = {}
+    blueprint = Blueprint(BLUEPRINT, __name__,
+                          template_folder=_ui_folder('templates'),
+                          static_folder=_ui_folder('static'),
+                          static_url_path='/flasgger_static')
+    blueprint.add_url_rule('/apidocs/', 'apidocs', get_ui)
+    blueprint.add_url_rule(f'/{SPEC_ENDPOINT}.json', SPEC_ENDPOINT, get_spec)
+    app.register_blueprint(blueprint)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-generate the OpenAPI spec")
+    sub = parser.add_subparsers(dest='command', required=True)
+    build = sub.add_parser('build')
+    build.add_argument('--out', default=DEFAULTS['APISPEC_PATH'])
+    args = parser.parse_args(argv)
+
+    from main import create_app
+    spec = build_spec(create_app({'APIDOCS': 'off'}))
+    tmp = args.out + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(spec, f)
+    os.replace(tmp, args.out)
+    print(f"{len(spec.get('paths', {}))} paths -> {args.out}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,261 @@
+# backend/archive.py
+"""
+archive.py - Hot/cold archival of delivered packages
+
+Packages delivered more than N days ago are moved, with their tracking
+events, out of the live database into an archive file attached as schema
+"archive" (ARCHIVE_PATH, default shipping-archive.db next to DB_PATH).
+The live tables only hold the working set.
+
+The archive is laid out for cold reads:
+    archive.Package        same columns as Package plus archived_at
+    archive.TrackingEvent  WITHOUT ROWID, clustered on (package_id, event_id),
+                           so a package's history is one contiguous range
+                           and needs no secondary index
+
+Each batch is one transaction: copy into the archive, delete from the live
+tables, and add the moved packages back to CustomerSummary (the delete
+trigger subtracted them, but they still count for the customer); the change
+feed gets them as op "archive" instead of "delete". Copies use
+INSERT OR REPLACE, so a batch interrupted between the two databases is
+simply redone.
+
+With EVENT_PARTITIONS on, the batch's events are also moved out of the
+monthly partitions its packages shipped and were delivered in. Only
+MAX_ATTACHED partitions can be attached at once, so when the batch spans
+more months the events of the older ones are moved ahead of the batch's
+transaction, MAX_ATTACHED months per commit.
+
+Readers fall back to the archive with attach() + the {schema} placeholder
+(see tracking.py and billing.py).
+
+    python archive.py run --days 365 [--batch 500] [--loop 3600] [--vacuum]
+    python archive.py stats
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+import db
+import partitions
+import queries
+
+BATCH_SIZE = 500
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 365))
+
+
+def archive_path():
+    """
+    Archive file for the current DB_PATH (ARCHIVE_PATH overrides it).
+    """
+    return os.environ.get('ARCHIVE_PATH') or os.path.splitext(db.DB_PATH)[0] + '-archive.db'
+
+
+def _columns(conn, schema, table):
+    return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def _create_schema(conn):
+    packages = conn.execute("PRAGMA main.table_info(Package)").fetchall()
+    events = conn.execute("PRAGMA main.table_info(TrackingEvent)").fetchall()
+
+    package_cols = ',\n'.join(
+        f"{row[1]} INTEGER PRIMARY KEY" if row[1] == 'package_id' else f"{row[1]} {row[2]}" for row in packages
+    )
+    event_cols = ',\n'.join(f"{row[1]} {row[2]}" for row in events)
+    conn.executescript(f"""
+        CREATE TABLE IF NOT EXISTS archive.Package (
+            {package_cols},
+            archived_at TEXT
+        );
+        CREATE INDEX IF NOT EXISTS archive.idx_archive_package_customer ON Package(customer_id);
+        CREATE TABLE IF NOT EXISTS archive.TrackingEvent (
+            {event_cols},
+            PRIMARY KEY (package_id, event_id)
+        ) WITHOUT ROWID;
+    """)
+
+
+def attach(conn, create=False):
+    """
+    Attach the archive to conn as schema "archive". Returns False when there
+    is no archive yet (and create is False). Must be called outside a transaction.
+    """
+    path = archive_path()
+    if getattr(conn, 'archive_path', None) == path:
+        return True
+    if not create and not os.path.exists(path):
+        return False
+
+    conn.execute("ATTACH DATABASE ? AS archive", (path,))
+    if create:
+        _create_schema(conn)
+    conn.archive_path = path
+    return True
+
+
+def union_all(conn, sql, order_by=''):
+    """
+    Run a query template over the live tables and, when an archive exists,
+    the archive too. `sql` uses {schema} for the schema of Package and
+    TrackingEvent. Returns (sql, copies): pass the parameters `copies` times.
+    """
+    if not attach(conn):
+        return queries.derive(sql, sql.format(schema='main') + order_by), 1
+    union = sql.format(schema='main') + '\nUNION ALL\n' + sql.format(schema='archive') + order_by
+    return queries.derive(sql, union), 2
+
+
+def _partition_months(first, last):
+    # Months from first through last that have an event partition
+    if not db.EVENT_PARTITIONS or not first:
+        return []
+    available = set(partitions.existing())
+    return [m for m in partitions.months_between(first, last or partitions.current_month()) if m in available]
+
+
+def _move_events(cursor, schemas, event_cols):
+    # Copy the batch's events from each schema's TrackingEvent into the archive and delete them
+    for schema in schemas:
+        cursor.execute(f"""
+            INSERT OR REPLACE INTO archive.TrackingEvent ({event_cols})
+            SELECT {event_cols} FROM {schema}.TrackingEvent
+            WHERE package_id IN (SELECT package_id FROM temp.archive_batch)
+        """)
+        cursor.execute(f"DELETE FROM {schema}.TrackingEvent "
+                       "WHERE package_id IN (SELECT package_id FROM temp.archive_batch)")
+
+
+def archive_batch(conn, cutoff, batch_size=BATCH_SIZE):
+    """
+    Move up to batch_size packages delivered before `cutoff` (and their events)
+    into the archive. Returns the number of packages moved.
+    """
+    cursor = conn.cursor()
+    cursor.execute("DROP TABLE IF EXISTS temp.archive_batch")
+    cursor.execute("""
+        CREATE TEMP TABLE archive_batch AS
+        SELECT package_id, customer_id, substr(date_shipped, 1, 7) as month
+        FROM main.Package
+        WHERE date_delivered IS NOT NULL AND date_delivered < ?
+        ORDER BY date_delivered
+        LIMIT ?
+    """, (cutoff, batch_size))
+    moved = cursor.execute("SELECT COUNT(*) FROM temp.archive_batch").fetchone()[0]
+    if not moved:
+        conn.commit()
+        return 0
+
+    # Events of the batch may also sit in monthly partitions (attach them before the transaction)
+    first, last = cursor.execute("""
+        SELECT MIN(date_shipped), MAX(date_delivered) FROM main.Package
+        WHERE package_id IN (SELECT package_id FROM temp.archive_batch)
+    """).fetchone()
+    event_cols = ', '.join(c for c in _columns(conn, 'main', 'TrackingEvent')
+                           if c in _columns(conn, 'archive', 'TrackingEvent'))
+    # At most MAX_ATTACHED partitions fit next to each other: events in the
+    # older months of a longer range are moved first, a window at a time
+    older = _partition_months(first, last)[:-partitions.MAX_ATTACHED]
+    for start in range(0, len(older), partitions.MAX_ATTACHED):
+        window = older[start:start + partitions.MAX_ATTACHED]
+        _move_events(cursor, partitions.hint(conn, window[0], window[-1]), event_cols)
+        conn.commit()
+    event_schemas = ['main'] + partitions.hint(conn, first, last)
+
+    package_cols = ', '.join(c for c in _columns(conn, 'main', 'Package')
+                             if c in _columns(conn, 'archive', 'Package'))
+    archived_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    cursor.execute(f"""
+        INSERT OR REPLACE INTO archive.Package ({package_cols}, archived_at)
+        SELECT {package_cols}, ? FROM main.Package
+        WHERE package_id IN (SELECT package_id FROM temp.archive_batch)
+    """, (archived_at,))
+    _move_events(cursor, event_schemas, event_cols)
+    logged = cursor.execute("SELECT COALESCE(MAX(position), 0) FROM main.ChangeLog").fetchone()[0]
+    cursor.execute("DELETE FROM main.Package WHERE package_id IN (SELECT package_id FROM temp.archive_batch)")
+    # The change feed reports these as archived rather than deleted
+    cursor.execute("UPDATE main.ChangeLog SET op = 'archive' WHERE position > ? AND entity = 'package'", (logged,))
+
+    # Archived packages still belong to the customer's totals
+    cursor.execute("""
+        UPDATE CustomerSummary SET
+            total_packages = total_packages + (
+                SELECT COUNT(*) FROM temp.archive_batch b
+                WHERE b.customer_id = CustomerSummary.customer_id),
+            month_packages = month_packages + (
+                SELECT COUNT(*) FROM temp.archive_batch b
+                WHERE b.customer_id = CustomerSummary.customer_id AND b.month = CustomerSummary.current_month)
+        WHERE customer_id IN (SELECT customer_id FROM temp.archive_batch)
+    """)
+    conn.commit()
+    return moved
+
+
+def run(conn, days=ARCHIVE_AFTER_DAYS, batch_size=BATCH_SIZE, pause=0.05):
+    """
+    Archive everything older than `days` in batches, pausing between batches
+    so live writers can take the lock. Returns the number of packages moved.
+    """
+    attach(conn, create=True)
+    cutoff = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+    total = 0
+    while True:
+        moved = archive_batch(conn, cutoff, batch_size)
+        total += moved
+        if moved < batch_size:
+            return total
+        time.sleep(pause)
+
+
+def stats(conn):
+    """
+    Row counts and file sizes of the live and archive databases.
+    """
+    attach(conn)
+    result = {}
+    for schema, path in (('main', db.DB_PATH), ('archive', archive_path())):
+        if schema == 'archive' and getattr(conn, 'archive_path', None) is None:
+            continue
+        result[schema] = {
+            'packages': conn.execute(f"SELECT COUNT(*) FROM {schema}.Package").fetchone()[0],
+            'tracking_events': conn.execute(f"SELECT COUNT(*) FROM {schema}.TrackingEvent").fetchone()[0],
+            'file_bytes': os.path.getsize(path)
+        }
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move old delivered packages to the archive database")
+    sub = parser.add_subparsers(dest='command', required=True)
+    run_parser = sub.add_parser('run')
+    run_parser.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS)
+    run_parser.add_argument('--batch', type=int, default=BATCH_SIZE)
+    run_parser.add_argument('--pause', type=float, default=0.05, help='seconds between batches')
+    run_parser.add_argument('--loop', type=float, help='keep running, every LOOP seconds')
+    run_parser.add_argument('--vacuum', action='store_true', help='VACUUM the live database afterwards')
+    sub.add_parser('stats')
+    args = parser.parse_args(argv)
+
+    conn = db.get_db_connection()
+    try:
+        if args.command == 'stats':
+            for schema, values in stats(conn).items():
+                print(schema, values)
+            return 0
+
+        while True:
+            moved = run(conn, args.days, args.batch, args.pause)
+            print(f"Archived {moved} package(s) delivered more than {args.days} days ago")
+            if moved and args.vacuum:
+                conn.execute("VACUUM main")
+            if not args.loop:
+                return 0
+            time.sleep(args.loop)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,258 @@
+# backend/backup.py
+"""
+backup.py - Online backups and the read replica
+
+Copies are made with SQLite's online backup API (Connection.backup) in
+steps of BACKUP_PAGES pages with a short pause in between, so the copy
+never holds the database for long and writers keep going (in WAL mode
+they are not blocked at all). A step that sees a write made by another
+connection makes SQLite restart the copy, so every finished copy is a
+consistent point in time; after MAX_RESTARTS restarts the rest is copied in
+a single step.
+
+    snapshots   BACKUP_DIR/shipping-YYYYmmdd-HHMMSS-ffffff.db, the newest
+                BACKUP_KEEP are kept
+    replica     REPLICA_PATH (default shipping-replica.db), rebuilt every
+                REPLICA_REFRESH seconds into a temp file and renamed into
+                place; open connections keep reading the copy they opened
+
+Report-style reads (admin stats and customer list, staff exports) use
+replica_connection(), which falls back to the primary when the replica is
+older than REPLICA_MAX_AGE seconds or missing. Its age is measured from
+the start of the copy that produced it. With DB_SHARDS or EVENT_PARTITIONS
+the data spans several files and reads stay on the primary.
+
+The background refresher only copies in the process holding the lock file
+next to the replica; any other process that starts one stands by and takes
+over when the holder exits.
+
+    python backup.py snapshot [--dir backups] [--keep 7]
+    python backup.py replica [--loop 30]
+"""
+import argparse
+import fcntl
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+import db
+
+logger = logging.getLogger('backup')
+
+DEFAULTS = {
+    'REPLICA_REFRESH': float(os.environ.get('REPLICA_REFRESH', 0)),
+    'REPLICA_MAX_AGE': float(os.environ.get('REPLICA_MAX_AGE', 120)),
+    'BACKUP_INTERVAL': float(os.environ.get('BACKUP_INTERVAL', 0)),
+}
+
+BACKUP_PAGES = int(os.environ.get('BACKUP_PAGES', 1024))
+BACKUP_PAUSE = float(os.environ.get('BACKUP_PAUSE_MS', 5)) / 1000
+BACKUP_KEEP = int(os.environ.get('BACKUP_KEEP', 7))
+# Restarts (caused by concurrent writes) tolerated before finishing in one step
+MAX_RESTARTS = 3
+
+# Staleness bound in seconds, set from app.config by init_replica()
+max_age = DEFAULTS['REPLICA_MAX_AGE']
+
+
+def replica_path():
+    return os.environ.get('REPLICA_PATH') or os.path.splitext(db.DB_PATH)[0] + '-replica.db'
+
+
+def backup_dir():
+    return os.environ.get('BACKUP_DIR') or os.path.join(os.path.dirname(os.path.abspath(db.DB_PATH)), 'backups')
+
+
+class _Restarted(Exception):
+    pass
+
+
+def copy_database(dest, pages=BACKUP_PAGES, pause=BACKUP_PAUSE, source=None):
+    """
+    Copy DB_PATH (or `source`) to dest with the online backup API. The copy
+    is written to a temp file and renamed over dest when complete. Returns
+    the copy's start time (its data is at least this fresh).
+    """
+    started = time.time()
+    tmp = dest + '.tmp'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    source = sqlite3.connect(source or db.DB_PATH)
+    target = sqlite3.connect(tmp)
+    remaining_before = None
+    restarts = 0
+
+    def progress(status, remaining, total):
+        nonlocal remaining_before, restarts
+        if remaining_before is not None and remaining > remaining_before:
+            restarts += 1
+            if restarts > MAX_RESTARTS:
+                raise _Restarted()
+        remaining_before = remaining
+
+    try:
+        try:
+            source.backup(target, pages=pages, progress=progress, sleep=pause)
+        except _Restarted:
+            # Writes keep invalidating the incremental copy; finish it in one
+            # read transaction (which doesn't block writers in WAL mode)
+            source.backup(target, pages=-1)
+        # Self-contained file: no -wal to carry along
+        target.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        target.close()
+        source.close()
+    os.utime(tmp, (started, started))
+    os.replace(tmp, dest)
+    return started
+
+
+def snapshot(directory=None, keep=BACKUP_KEEP):
+    """
+    Write a point-in-time copy into the backup directory and prune the
+    oldest beyond `keep`. Returns the new file's path.
+    """
+    directory = directory or backup_dir()
+    os.makedirs(directory, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(db.DB_PATH))[0]
+    path = os.path.join(directory, f"{stem}-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.db")
+    copy_database(path)
+
+    copies = sorted(name for name in os.listdir(directory)
+                    if name.startswith(stem + '-') and name.endswith('.db'))
+    for name in copies[:-keep] if keep else []:
+        os.remove(os.path.join(directory, name))
+    return path
+
+
+def refresh_replica():
+    """
+    Rebuild the read replica from the primary.
+    """
+    return copy_database(replica_path())
+
+
+def replica_age():
+    """
+    Seconds since the replica's copy started, or None when there is none.
+    """
+    try:
+        return max(0.0, time.time() - os.path.getmtime(replica_path()))
+    except OSError:
+        return None
+
+
+def replica_connection(max_age_seconds=None):
+    """
+    Read-only connection to the replica when it is fresh enough, otherwise
+    a regular connection to the primary.
+    """
+    bound = max_age if max_age_seconds is None else max_age_seconds
+    if db.SHARDS or db.EVENT_PARTITIONS:
+        return db.get_db_connection()
+    age = replica_age()
+    if age is None or age > bound:
+        return db.get_db_connection()
+    # Unpooled: a pooled handle would keep reading the copy it first opened
+    return db._connect(f'file:{replica_path()}?mode=ro', uri=True)
+
+
+class Refresher(threading.Thread):
+    """
+    Background thread that refreshes the replica every `refresh` seconds and
+    takes a snapshot every `interval` seconds (0 = never).
+    """
+    def __init__(self, refresh, interval):
+        super().__init__(name='replica-refresher', daemon=True)
+        self.refresh = refresh
+        self.interval = interval
+        self.stopped = threading.Event()
+        self._lock_file = None
+
+    def _has_lock(self):
+        # Only one process refreshes; the others keep trying so one takes over if it exits
+        if self._lock_file is None:
+            handle = open(replica_path() + '.lock', 'w')
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                handle.close()
+                return False
+            self._lock_file = handle
+        return True
+
+    def run(self):
+        last_snapshot = time.time()
+        while not self.stopped.is_set():
+            try:
+                if self._has_lock():
+                    refresh_replica()
+                    if self.interval and time.time() - last_snapshot >= self.interval:
+                        snapshot()
+                        last_snapshot = time.time()
+            except (sqlite3.Error, OSError):
+                logger.exception("replica refresh failed")
+            self.stopped.wait(self.refresh)
+
+
+_refresher = None
+# (refresh, interval) once init_replica() has seen REPLICA_REFRESH > 0
+_refresh_settings = None
+
+
+def start_refresher():
+    """
+    Start the refresher in this process if REPLICA_REFRESH is set and it
+    isn't running here yet (a thread started before a fork doesn't survive it).
+    """
+    global _refresher
+    if _refresh_settings is None or (_refresher is not None and _refresher.is_alive()):
+        return
+    _refresher = Refresher(*_refresh_settings)
+    _refresher.start()
+
+
+def init_replica(app):
+    """
+    Set the staleness bound and, with REPLICA_REFRESH > 0, start the
+    refresher in whichever process gets the lock first (with
+    DEFER_BACKGROUND, later: see start_refresher).
+    """
+    global max_age, _refresh_settings
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
+    max_age = app.config['REPLICA_MAX_AGE']
+    refresh = app.config['REPLICA_REFRESH']
+    if refresh <= 0:
+        return
+    _refresh_settings = (refresh, app.config['BACKUP_INTERVAL'])
+    if not app.config.get('DEFER_BACKGROUND'):
+        start_refresher()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Online backups of the SQLite database")
+    sub = parser.add_subparsers(dest='command', required=True)
+    snap = sub.add_parser('snapshot')
+    snap.add_argument('--dir')
+    snap.add_argument('--keep', type=int, default=BACKUP_KEEP)
+    rep = sub.add_parser('replica')
+    rep.add_argument('--loop', type=float, help='keep refreshing, every LOOP seconds')
+    args = parser.parse_args(argv)
+
+    if args.command == 'snapshot':
+        print(snapshot(args.dir, args.keep))
+        return 0
+    while True:
+        started = refresh_replica()
+        print(f"Replica refreshed in {time.time() - started:.2f} s: {replica_path()}")
+        if not args.loop:
+            return 0
+        time.sleep(args.loop)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
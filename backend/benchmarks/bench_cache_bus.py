@@ -0,0 +1,144 @@
+# backend/benchmarks/bench_cache_bus.py
+"""
+bench_cache_bus.py - Tracking payload caching across worker processes
+
+READERS worker processes (each its own app, caches and connection pool,
+like gunicorn workers) look up a hot set of packages as their owners while
+one writer process scans random hot packages, WRITES per second. Three
+setups:
+
+    no cache        TRACKING_CACHE_TTL=0, every lookup reads the database
+    ttl only        1 s TTL and no bus: other workers serve the old payload
+                    until it expires
+    bus             300 s TTL, invalidations over the bus (CACHE_BUS_POLL)
+
+For each: lookups/s over all readers, cache hit rate, stale reads (a
+payload with fewer events than the package had committed before the
+request started) and, for the bus, the delay from a write's commit to
+each other worker applying its invalidation (p50/p99).
+
+    python benchmarks/bench_cache_bus.py [seconds] [readers] [writes/s]
+"""
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from fixtures import make_scale_db  # noqa: E402
+import db  # noqa: E402
+
+HOT_PACKAGES = 100
+SETUPS = (
+    ('no cache', {'CACHE_BUS': False}, 0),
+    ('ttl only', {'CACHE_BUS': False}, 1),
+    ('bus', {'CACHE_BUS': True}, 300),
+)
+
+
+def _app(path, config, ttl):
+    # A fresh worker: its own app, pools and caches against `path`
+    db.use_database(path)
+    from main import create_app
+    import tracking
+    tracking.payloads.ttl = ttl
+    return create_app({'APIDOCS': 'off', 'METRICS_ENABLED': False, **config})
+
+
+def reader(args):
+    """
+    One worker process: owner lookups until the deadline.
+    """
+    path, config, ttl, hot, deadline, seed = args
+    app = _app(path, config, ttl)
+    import cache_bus
+    import tracking
+    import tracking_numbers
+    client = app.test_client()
+    rng = random.Random(seed)
+    truth = sqlite3.connect(path)
+    bus = sqlite3.connect(cache_bus.bus_path()) if config['CACHE_BUS'] else None
+
+    delays = []
+    lookups = stale = 0
+    start = time.time()
+    while time.time() < deadline:
+        package_id, user_id = rng.choice(hot)
+        committed = truth.execute("SELECT last_event_seq FROM Package WHERE package_id = ?", (package_id,)).fetchone()[0]
+        seen = cache_bus.version()
+        response = client.get(f'/api/tracking/{tracking_numbers.public(package_id)}',
+                              headers={'Authorization': f'Bearer {user_id}'})
+        applied = time.time()
+        lookups += 1
+        if len(response.get_json()['tracking_history']) < committed:
+            stale += 1
+        # The first poll starts at the head, so only later ones can carry another worker's writes
+        if bus is not None and seen and cache_bus.version() > seen:
+            delays += [applied - published for (published,) in bus.execute(
+                "SELECT published_at FROM CacheInvalidation WHERE version > ? AND version <= ? AND publisher != ?",
+                (seen, cache_bus.version(), os.getpid()))]
+    return lookups / (time.time() - start), lookups, tracking.payloads.hits, stale, delays
+
+
+def writer(args):
+    """
+    Scan random hot packages at `rate` per second until the deadline.
+    """
+    path, config, ttl, hot, deadline, rate = args
+    client = _app(path, config, ttl).test_client()
+    import tracking_numbers
+    rng = random.Random(7)
+    writes = 0
+    while time.time() < deadline:
+        package_id = rng.choice(hot)[0]
+        client.post(f'/api/admin/packages/{tracking_numbers.public(package_id)}/update-status',
+                    headers={'Authorization': 'Bearer 2'},
+                    json={'location_id': 1, 'status': 'arrived', 'notes': 'bench scan'})
+        writes += 1
+        time.sleep(1 / rate)
+    return writes
+
+
+def percentile(values, p):
+    return sorted(values)[min(len(values) - 1, int(len(values) * p))] if values else float('nan')
+
+
+def run(seconds=5, readers=4, rate=20):
+    path = make_scale_db(customers=500, packages_per_customer=10, events_per_package=4, months=2)
+    conn = sqlite3.connect(path)
+    hot = conn.execute("""
+        SELECT p.package_id, c.user_id FROM Package p JOIN Customer c ON c.customer_id = p.customer_id
+        ORDER BY p.package_id DESC LIMIT ?
+    """, (HOT_PACKAGES,)).fetchall()
+    conn.close()
+    print(f"{readers} reader processes, 1 writer at {rate} scans/s, {len(hot)} hot packages, {seconds} s each\n")
+    print(f"{'setup':<10} {'lookups/s':>10} {'hit rate':>9} {'stale':>7}   invalidation p50 / p99")
+
+    context = multiprocessing.get_context('fork')
+    try:
+        for label, config, ttl in SETUPS:
+            deadline = time.time() + 1 + seconds
+            with context.Pool(readers + 1) as pool:
+                writes = pool.apply_async(writer, ((path, config, ttl, hot, deadline, rate),))
+                results = pool.map(reader, [(path, config, ttl, hot, deadline, seed) for seed in range(readers)])
+                writes.get()
+            rate_total = sum(r[0] for r in results)
+            lookups = sum(r[1] for r in results)
+            hits = sum(r[2] for r in results)
+            stale = sum(r[3] for r in results)
+            delays = [d for r in results for d in r[4]]
+            latency = (f"{percentile(delays, 0.5) * 1000:.1f} / {percentile(delays, 0.99) * 1000:.1f} ms"
+                       if delays else '-')
+            print(f"{label:<10} {rate_total:>10.0f} {hits / lookups:>9.1%} {stale / lookups:>7.2%}   {latency}")
+    finally:
+        for suffix in ('', '-wal', '-shm', '-cache.db', '-cache.db-wal', '-cache.db-shm'):
+            name = path + suffix if not suffix.startswith('-cache') else os.path.splitext(path)[0] + suffix
+            if os.path.exists(name):
+                os.remove(name)
+
+
+if __name__ == '__main__':
+    run(*(float(arg) if i == 0 else int(arg) for i, arg in enumerate(sys.argv[1:4])))
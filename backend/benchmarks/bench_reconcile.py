@@ -0,0 +1,80 @@
+# backend/benchmarks/bench_reconcile.py
+"""
+bench_reconcile.py - Throughput of the remittance importer
+
+Builds a scale fixture, writes a remittance file covering every statement
+(mostly exact payments with some partial, unmatched and malformed lines)
+and imports it at several batch sizes against a fresh copy of the fixture.
+
+    python benchmarks/bench_reconcile.py [customers]
+"""
+import csv
+import io
+import os
+import random
+import shutil
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from fixtures import make_scale_db, use_database  # noqa: E402
+import db  # noqa: E402
+import reconcile  # noqa: E402
+
+
+def build_remittance(path, seed=4701):
+    """
+    Return remittance CSV text with one line per statement in the fixture.
+    """
+    rng = random.Random(seed)
+    use_database(path)
+    conn = db.get_db_connection()
+    index = reconcile.build_statement_index(conn)
+    conn.close()
+
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(['account_number', 'statement_month', 'amount', 'reference'])
+    for n, ((account_number, month), entry) in enumerate(index.items()):
+        roll = rng.random()
+        if roll < 0.85:
+            writer.writerow([account_number, month, f'{entry[3]:.2f}', f'ACH{n}'])
+        elif roll < 0.90:
+            writer.writerow([account_number, month, f'{entry[3] / 2:.2f}', f'ACH{n}'])
+        elif roll < 0.95:
+            writer.writerow([account_number, '1999-01', '10.00', f'ACH{n}'])
+        else:
+            writer.writerow(['n/a', month, 'ten dollars', f'ACH{n}'])
+    return out.getvalue()
+
+
+def run(customers=5000):
+    print(f"Building fixture with {customers} contract customers...")
+    template = make_scale_db(customers=customers, packages_per_customer=10, events_per_package=1, months=6)
+    remittance = build_remittance(template)
+    line_count = remittance.count('\n') - 1
+    print(f"Remittance file: {line_count} lines, {len(remittance) / 1024:.0f} KiB\n")
+
+    print(f"{'batch size':>10} {'seconds':>10} {'lines/s':>12} {'applied':>10} {'exceptions':>11}")
+    for batch_size in (1, 100, 1000, 10000):
+        work = template + f'.batch{batch_size}'
+        shutil.copyfile(template, work)
+        use_database(work)
+        conn = db.get_db_connection()
+
+        report = csv.DictWriter(io.StringIO(), fieldnames=reconcile.EXCEPTION_FIELDS)
+        start = time.perf_counter()
+        summary = reconcile.import_remittance(conn, io.StringIO(remittance), batch_size, report=report)
+        elapsed = time.perf_counter() - start
+        conn.close()
+        os.remove(work)
+
+        print(f"{batch_size:>10} {elapsed:>10.2f} {line_count / elapsed:>12,.0f} "
+              f"{summary['applied']:>10} {summary['exception_count']:>11}")
+
+    os.remove(template)
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
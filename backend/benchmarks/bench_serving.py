@@ -0,0 +1,126 @@
+# backend/benchmarks/bench_serving.py
+"""
+bench_serving.py - Throughput and latency: dev server vs. pre-fork gunicorn
+
+Starts each server in a subprocess against the same fixture database, then
+drives it from CLIENTS client processes (keep-alive connections) for a fixed
+duration with a mix of cached reference data, tracking lookups and a
+per-user package list. Reports requests/s and p50/p99 latency.
+
+    python benchmarks/bench_serving.py [seconds] [clients]
+"""
+import http.client
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+BACKEND = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from fixtures import make_scale_db, ACCOUNT_BASE  # noqa: E402
+import db  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(kind, path, port):
+    env = dict(os.environ, DB_PATH=path, FLASK_DEBUG='0', ACCESS_LOG='/dev/null')
+    if kind == 'dev':
+        cmd = [sys.executable, '-c',
+               f"from main import app; app.run(host='127.0.0.1', port={port}, threaded=True)"]
+    else:
+        workers = kind.split(':')[1]
+        cmd = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+               '-b', f'127.0.0.1:{port}', '-w', workers, 'main:app']
+    proc = subprocess.Popen(cmd, cwd=BACKEND, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f'{kind} server did not start')
+
+
+def client(args):
+    """
+    One client process: issue requests back to back until the deadline.
+    """
+    port, deadline, requests, seed = args
+    rng = random.Random(seed)
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    latencies, errors = [], 0
+    while time.time() < deadline:
+        url, headers = rng.choice(requests)
+        start = time.perf_counter()
+        try:
+            conn.request('GET', url, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                errors += 1
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            continue
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+    return latencies, errors
+
+
+def drive(port, requests, seconds, clients):
+    deadline = time.time() + seconds
+    with multiprocessing.Pool(clients) as pool:
+        results = pool.map(client, [(port, deadline, requests, i) for i in range(clients)])
+    latencies = sorted(lat for lats, _ in results for lat in lats)
+    errors = sum(err for _, err in results)
+    return latencies, errors
+
+
+def run(seconds=10, clients=16):
+    path = make_scale_db(customers=200, packages_per_customer=20, events_per_package=4, months=2)
+    conn = db.get_db_connection()
+    user_id, customer_id = conn.execute(
+        "SELECT user_id, customer_id FROM Customer WHERE account_number = ?", (ACCOUNT_BASE,)
+    ).fetchone()
+    package_ids = [row[0] for row in conn.execute(
+        "SELECT package_id FROM Package WHERE customer_id = ?", (customer_id,))]
+    conn.close()
+
+    auth = {'Authorization': f'Bearer {user_id}'}
+    requests = [('/api/services', {})] * 2 + [('/api/user/packages', auth)] + \
+               [(f'/api/tracking/{pid}', auth) for pid in package_ids[:5]]
+
+    cores = multiprocessing.cpu_count()
+    print(f"{clients} clients, {seconds}s per server, {cores} CPUs\n")
+    print(f"{'server':<16} {'requests':>9} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for kind in ('dev', 'gunicorn:1', f'gunicorn:{cores * 2 + 1}'):
+        port = free_port()
+        proc = start_server(kind, path, port)
+        try:
+            drive(port, requests, 1, clients)  # warm-up
+            latencies, errors = drive(port, requests, seconds, clients)
+        finally:
+            proc.terminate()
+            proc.wait()
+        count = len(latencies)
+        p50 = latencies[count // 2] * 1000 if count else 0
+        p99 = latencies[int(count * 0.99)] * 1000 if count else 0
+        print(f"{kind:<16} {count:>9} {count / seconds:>8.0f} {p50:>8.2f} {p99:>8.2f} {errors:>7}")
+
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    run(*(int(a) for a in sys.argv[1:3]))
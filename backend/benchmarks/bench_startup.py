@@ -0,0 +1,91 @@
+# backend/benchmarks/bench_startup.py
+"""
+bench_startup.py - Worker startup cost for each APIDOCS mode
+
+Starts fresh interpreters (RUNS per mode) that import main, which creates
+the app, and reports medians of:
+
+    import ms    importing main, including the module-level create_app()
+    factory ms   one more create_app() once the modules are loaded (what a
+                 test pays per app)
+    RSS MiB      peak resident size after startup
+    spec ms      first GET /apispec_1.json (building or reading the spec)
+    RSS spec     peak resident size after that request
+
+then lists the slowest imports (cumulative, from python -X importtime)
+for the default lazy mode and for eager.
+
+    python benchmarks/bench_startup.py [runs] [top]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BACKEND = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+main.create_app()
+created = time.perf_counter()
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+response = main.app.test_client().get('/apispec_1.json')
+spec = time.perf_counter()
+print(json.dumps({
+    'import': (imported - start) * 1000,
+    'factory': (created - imported) * 1000,
+    'rss': rss / 1024,
+    'spec': (spec - created) * 1000 if response.status_code == 200 else float('nan'),
+    'rss_spec': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}))
+"""
+
+
+def probe(env):
+    out = subprocess.run([sys.executable, '-c', PROBE], cwd=BACKEND, env=env,
+                         check=True, capture_output=True, text=True).stdout
+    return json.loads(out.splitlines()[-1])
+
+
+def slowest_imports(env, top):
+    """
+    (cumulative ms, module) for the `top` slowest imports of main.
+    """
+    err = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'], cwd=BACKEND,
+                         env=env, check=True, capture_output=True, text=True).stderr
+    found = []
+    for line in err.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            found.append((int(parts[1]) / 1000, parts[2].rstrip()))
+    return sorted(found, reverse=True)[:top]
+
+
+def run(runs=5, top=12):
+    spec_path = os.path.join(tempfile.mkdtemp(), 'apispec.json')
+    base = dict(os.environ, APISPEC_PATH=spec_path, FLASK_DEBUG='0')
+    subprocess.run([sys.executable, 'apidocs.py', 'build', '--out', spec_path], cwd=BACKEND,
+                   env=base, check=True, capture_output=True)
+
+    print(f"{'APIDOCS':<8} {'import ms':>10} {'factory ms':>11} {'RSS MiB':>8} {'spec ms':>8} {'RSS spec':>9}")
+    for mode in ('eager', 'lazy', 'static', 'off'):
+        env = dict(base, APIDOCS=mode)
+        samples = [probe(env) for _ in range(runs)]
+        median = {key: statistics.median(s[key] for s in samples) for key in samples[0]}
+        print(f"{mode:<8} {median['import']:>10.1f} {median['factory']:>11.1f} {median['rss']:>8.1f} "
+              f"{median['spec']:>8.1f} {median['rss_spec']:>9.1f}")
+
+    for mode in ('lazy', 'eager'):
+        print(f"\nslowest imports, APIDOCS={mode} (cumulative ms)")
+        for ms, module in slowest_imports(dict(base, APIDOCS=mode), top):
+            print(f"{ms:>8.1f}  {module}")
+    os.remove(spec_path)
+
+
+if __name__ == '__main__':
+    run(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,112 @@
+# backend/benchmarks/bench_storage.py
+"""
+bench_storage.py - TrackingEvent storage before and after compact events
+
+Builds a fixture at the schema version before migrations.COMPACT_EVENTS
+(TEXT timestamps and statuses), measures it, applies the migration to the
+same data and measures again:
+
+    size        database file after VACUUM, TrackingEvent table and its
+                indexes (from the dbstat virtual table)
+    range       events in one week, by timestamp
+    latest      the 10 most recent events (admin dashboard)
+    delivered   packages delivered on one day: date(date_delivered) = ?
+                against the index-friendly range the dashboard now uses
+
+"before + index" adds a TEXT timestamp index to the old layout, so the
+index size and range speed are also compared like for like.
+
+    python benchmarks/bench_storage.py [customers]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from fixtures import make_scale_db  # noqa: E402
+import db  # noqa: E402
+import migrations  # noqa: E402
+
+WEEK = ('2025-02-01', '2025-02-08')
+DAY = ('2025-02-10', '2025-02-11')
+
+
+def best_of(fn, repeat=20):
+    """
+    Fastest of `repeat` calls, in milliseconds.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+def sizes(conn):
+    """
+    Bytes used by TrackingEvent and by each of its indexes.
+    """
+    names = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE tbl_name = 'TrackingEvent' AND type IN ('table', 'index')")]
+    return {name: conn.execute("SELECT SUM(pgsize) FROM dbstat WHERE name = ?", (name,)).fetchone()[0]
+            for name in names}
+
+
+def measure(label, path, bound):
+    conn = db._connect(path)
+    conn.execute("VACUUM")
+    used = sizes(conn)
+    week = tuple(bound(value) for value in WEEK)
+    results = {
+        'range': best_of(lambda: conn.execute(
+            "SELECT COUNT(*), MAX(status) FROM TrackingEvent WHERE timestamp >= ? AND timestamp < ?", week
+        ).fetchone()),
+        'latest': best_of(lambda: conn.execute(
+            "SELECT event_id, status FROM TrackingEvent ORDER BY timestamp DESC LIMIT 10").fetchall()),
+        'rows': conn.execute("SELECT COUNT(*) FROM TrackingEvent").fetchone()[0],
+    }
+    conn.close()
+
+    indexes = ', '.join(f"{name} {size / 1024:.0f}" for name, size in used.items() if name != 'TrackingEvent')
+    print(f"{label:<16} {os.path.getsize(path) / 2**20:>8.2f} {used['TrackingEvent'] / 2**20:>9.2f} "
+          f"{results['range']:>9.2f} {results['latest']:>9.2f}   {indexes} (KiB)")
+    return results
+
+
+def run(customers=2000):
+    path = make_scale_db(customers=customers, packages_per_customer=20, events_per_package=6,
+                         months=6, version=migrations.COMPACT_EVENTS - 1)
+    try:
+        conn = db._connect(path)
+        events = conn.execute("SELECT COUNT(*) FROM TrackingEvent").fetchone()[0]
+        print(f"{events} tracking events\n")
+        print(f"{'layout':<16} {'file MiB':>8} {'table MiB':>9} {'range ms':>9} {'latest ms':>9}   indexes")
+
+        measure('before', path, str)
+        conn.execute("CREATE INDEX idx_event_timestamp_text ON TrackingEvent(timestamp)")
+        conn.commit()
+        measure('before + index', path, str)
+        conn.execute("DROP INDEX idx_event_timestamp_text")
+        conn.commit()
+
+        start = time.perf_counter()
+        migrations.migrate(conn, target=migrations.COMPACT_EVENTS, off_peak=True, log=lambda message: None)
+        print(f"{'(migration':<16} {time.perf_counter() - start:>8.2f} s)")
+        measure('after', path, db.epoch_bound)
+
+        # Dashboard "delivered today": the old predicate can't use idx_package_delivered
+        day = DAY[0]
+        old = best_of(lambda: conn.execute(
+            "SELECT COUNT(*) FROM Package WHERE date(date_delivered) = ?", (day,)).fetchone())
+        new = best_of(lambda: conn.execute(
+            "SELECT COUNT(*) FROM Package WHERE date_delivered >= ? AND date_delivered < ?", DAY).fetchone())
+        print(f"\ndelivered on one day: date() = ? {old:.2f} ms, range {new:.2f} ms")
+        conn.close()
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
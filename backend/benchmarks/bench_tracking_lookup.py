@@ -0,0 +1,98 @@
+# backend/benchmarks/bench_tracking_lookup.py
+"""
+bench_tracking_lookup.py - Package lookups with half the requests invalid
+
+Sends a shuffled mix of GET /api/admin/packages/<n>/location through the
+Flask test client:
+
+    50%  tracking numbers of existing packages
+    25%  mistyped numbers (one digit changed: fails the check digit)
+    25%  well-formed numbers of packages that don't exist (guessed ids)
+
+and reports requests per second and mean latency per kind for three
+setups: every number goes to the database (no check digit, no filter),
+check digits only (TRACKING_FILTER=0), and check digits plus the
+known-package bitmap.
+
+    python benchmarks/bench_tracking_lookup.py [customers] [requests]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from fixtures import make_scale_db  # noqa: E402
+from main import app  # noqa: E402
+import tracking_numbers  # noqa: E402
+
+KINDS = ('valid', 'typo', 'unknown')
+
+
+def request_mix(packages, count, rng):
+    """
+    (kind, tracking number) pairs: half valid, a quarter typos, a quarter unknown.
+    """
+    mix = []
+    for i in range(count):
+        if i % 2 == 0:
+            mix.append(('valid', tracking_numbers.public(rng.randint(1, packages))))
+        elif i % 4 == 1:
+            digits = list(str(tracking_numbers.public(rng.randint(1, packages))))
+            position = rng.randrange(1, len(digits))
+            digits[position] = str((int(digits[position]) + rng.randint(1, 9)) % 10)
+            mix.append(('typo', int(''.join(digits))))
+        else:
+            mix.append(('unknown', tracking_numbers.public(packages + rng.randint(1, packages))))
+    rng.shuffle(mix)
+    return mix
+
+
+def measure(label, mix):
+    client = app.test_client()
+    headers = {'Authorization': 'Bearer 2'}
+    client.get(f"/api/admin/packages/{mix[0][1]}/location", headers=headers)  # load the bitmap
+
+    spent = {kind: [] for kind in KINDS}
+    statuses = {kind: set() for kind in KINDS}
+    start = time.perf_counter()
+    for kind, number in mix:
+        began = time.perf_counter()
+        response = client.get(f"/api/admin/packages/{number}/location", headers=headers)
+        spent[kind].append(time.perf_counter() - began)
+        statuses[kind].add(response.status_code)
+    elapsed = time.perf_counter() - start
+
+    means = ' '.join(f"{sum(t) / len(t) * 1e6:>9.0f}" for t in spent.values())
+    print(f"{label:<20} {len(mix) / elapsed:>8.0f} {means}   "
+          f"{', '.join(f'{k} {sorted(s)}' for k, s in statuses.items())}")
+
+
+def run(customers=2000, requests=20000):
+    packages = customers * 20
+    path = make_scale_db(customers=customers, packages_per_customer=20, events_per_package=4, months=3)
+    try:
+        # Seed packages come first; every id up to the fixture's last one exists
+        packages += 5
+        mix = request_mix(packages, requests, random.Random(43))
+        print(f"{packages} packages, {requests} requests\n")
+        print(f"{'setup':<20} {'req/s':>8} " + ' '.join(f"{kind + ' us':>9}" for kind in KINDS))
+
+        lookup = tracking_numbers.lookup
+        # Before: the path parameter was used as the package id as is
+        tracking_numbers.lookup = lambda number: number // 10
+        measure('database only', mix)
+        tracking_numbers.lookup = lookup
+
+        tracking_numbers.ENABLED = False
+        measure('check digit', mix)
+        tracking_numbers.ENABLED = True
+        tracking_numbers.reset()
+        measure('check digit + bitmap', mix)
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    run(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,161 @@
+# backend/benchmarks/fixtures.py
+"""
+fixtures.py - Synthetic scale data for benchmarks
+
+make_scale_db() builds a throwaway database with the real schema and seed
+data, then bulk-loads contract customers, packages, tracking events and
+monthly statements (charged through the ledger) with executemany so that
+fixtures with hundreds of thousands of rows build in seconds.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import db  # noqa: E402
+import ledger  # noqa: E402
+import migrations  # noqa: E402
+
+ACCOUNT_BASE = 100000
+STATUS_FLOW = ['arrived', 'departed', 'loaded', 'arrived', 'out for delivery', 'delivered']
+
+
+def use_database(path):
+    """
+    Point every get_db_connection() call in this process at `path`.
+    """
+    db.use_database(path)
+
+
+def timed(label, fn, *args, **kwargs):
+    """
+    Run fn once and print how long it took. Returns (result, seconds).
+    """
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<48} {elapsed * 1000:10.1f} ms")
+    return result, elapsed
+
+
+def make_scale_db(path=None, customers=1000, packages_per_customer=20,
+                  events_per_package=4, months=3, delivered_ratio=0.7, seed=4701, version=None):
+    """
+    Create a populated database file and return its path. `version` stops
+    the schema at that migration (see migrations.py).
+    """
+    if path is None:
+        fd, path = tempfile.mkstemp(prefix='shipping-bench-', suffix='.db')
+        os.close(fd)
+        os.remove(path)
+
+    rng = random.Random(seed)
+    use_database(path)
+    db.init_db(version)
+
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+
+    prices = {row['service_id']: row['base_price']
+              for row in cursor.execute("SELECT service_id, base_price FROM ServiceType")}
+    location_ids = [row[0] for row in cursor.execute("SELECT location_id FROM Location")]
+
+    cursor.executemany(
+        "INSERT INTO User (email, password, role) VALUES (?, 'bench-pass', 'customer')",
+        ((f'bench{i}@bench.example',) for i in range(customers))
+    )
+    cursor.executemany("""
+        INSERT INTO Customer (user_id, name, city, state, zip, has_contract, account_number)
+        SELECT user_id, ?, 'Hartford', 'CT', '06101', 1, ?
+        FROM User WHERE email = ?
+    """, ((f'Bench Customer {i}', ACCOUNT_BASE + i, f'bench{i}@bench.example') for i in range(customers)))
+
+    customer_ids = [row[0] for row in cursor.execute(
+        "SELECT customer_id FROM Customer WHERE account_number >= ? ORDER BY account_number",
+        (ACCOUNT_BASE,)
+    )]
+
+    next_package = (cursor.execute("SELECT MAX(package_id) FROM Package").fetchone()[0] or 0) + 1
+    next_statement = (cursor.execute("SELECT MAX(statement_id) FROM BillingStatement").fetchone()[0] or 0) + 1
+    first_package = next_package
+    start = datetime(2025, 1, 1)
+
+    packages, events, statements, links, charges = [], [], [], [], []
+    for customer_id in customer_ids:
+        statement_for_month = {}
+        for _ in range(packages_per_customer):
+            month = rng.randrange(months)
+            shipped = start + timedelta(days=30 * month + rng.randrange(28), seconds=rng.randrange(86400))
+            service_id = rng.choice(list(prices))
+            steps = events_per_package
+            delivered = rng.random() < delivered_ratio
+            delivered_at = shipped + timedelta(hours=6 * steps) if delivered else None
+
+            packages.append((
+                next_package, customer_id,
+                'Bench Sender', '1 Sender St', 'Hartford', 'CT', '06101',
+                f'Recipient {next_package}', '2 Recipient Ave', 'Boston', 'MA', '02101',
+                service_id, round(rng.uniform(0.5, 40.0), 1), 'account',
+                shipped.strftime('%Y-%m-%d %H:%M:%S'),
+                delivered_at.strftime('%Y-%m-%d %H:%M:%S') if delivered_at else None
+            ))
+
+            for step in range(steps):
+                status = 'delivered' if delivered and step == steps - 1 else STATUS_FLOW[step % (len(STATUS_FLOW) - 1)]
+                events.append((
+                    next_package, rng.choice(location_ids),
+                    (shipped + timedelta(hours=6 * (step + 1))).strftime('%Y-%m-%d %H:%M:%S'),
+                    status, 'bench event'
+                ))
+
+            statement_month = (start + timedelta(days=30 * month)).strftime('%Y-%m')
+            if statement_month not in statement_for_month:
+                statement_for_month[statement_month] = next_statement
+                statements.append((next_statement, customer_id, statement_month))
+                next_statement += 1
+            statement_id = statement_for_month[statement_month]
+            links.append((statement_id, next_package))
+            charges.append((customer_id, prices[service_id], statement_id, next_package,
+                            shipped.strftime('%Y-%m-%d %H:%M:%S')))
+            next_package += 1
+
+    cursor.executemany("""
+        INSERT INTO Package (
+            package_id, customer_id, sender_name, sender_addr1, sender_city, sender_state, sender_zip,
+            recipient_name, recipient_addr1, recipient_city, recipient_state, recipient_zip,
+            service_id, weight_lb, payment_type, date_shipped, date_delivered
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, packages)
+    if migrations.current_version(conn) >= migrations.COMPACT_EVENTS:
+        events = [(package_id, location_id, *db.encode_event(timestamp, status), notes)
+                  for package_id, location_id, timestamp, status, notes in events]
+    cursor.executemany("""
+        INSERT INTO main.TrackingEvent (package_id, location_id, timestamp, status, notes)
+        VALUES (?, ?, ?, ?, ?)
+    """, events)
+    if migrations.current_version(conn) >= migrations.SEQUENCED_EVENTS:
+        numbered = {'lo': first_package - 1, 'hi': next_package}
+        cursor.execute(migrations.NUMBER_EVENTS.format(schema='main'), numbered)
+        cursor.execute(migrations.COUNT_EVENTS.format(schema='main'), numbered)
+    cursor.executemany("""
+        INSERT INTO BillingStatement (statement_id, customer_id, statement_month, total_amount, status)
+        VALUES (?, ?, ?, 0.00, 'unpaid')
+    """, statements)
+    cursor.executemany(
+        "INSERT INTO StatementPackage (statement_id, package_id) VALUES (?, ?)",
+        links
+    )
+    cursor.executemany("""
+        INSERT INTO LedgerEntry (customer_id, entry_type, amount, statement_id, package_id, created_at, memo)
+        VALUES (?, 'charge', ?, ?, ?, ?, 'Shipment charge')
+    """, charges)
+    conn.commit()
+
+    # Derive balances and statement totals from the ledger in one pass
+    ledger.rebuild_balances(conn)
+    conn.close()
+    return path
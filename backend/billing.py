@@ -4,11 +4,41 @@ billing.py - Billing and invoice routes
 """
 from flask import Blueprint, request, jsonify
 from functools import wraps
-from db import get_db_connection
+from db import user_connection
 from datetime import datetime
+import archive
+import ledger
+import queries
+from serializers import RowMapper, Call, Format, fast_jsonify
+import tracking_numbers
 
 billing_routes = Blueprint('billing_routes', __name__)
 
+STATEMENT = RowMapper({
+    'statement_id': 'statement_id',
+    'statement_month': 'statement_month',
+    'total_amount': 'total_amount',
+    'status': 'status'
+})
+
+STATEMENT_PACKAGE = RowMapper({
+    'tracking_number': Call(tracking_numbers.public, 'package_id'),
+    'recipient_name': 'recipient_name',
+    'recipient_location': Format('{}, {}', 'recipient_city', 'recipient_state'),
+    'date_shipped': 'date_shipped',
+    'weight': 'weight_lb',
+    'service': 'service_name',
+    'cost': 'cost'
+})
+
+PAYMENT = RowMapper({
+    'payment_id': 'payment_id',
+    'date_paid': 'date_paid',
+    'amount': 'amount',
+    'method': 'method',
+    'tracking_number': Call(tracking_numbers.public, 'package_id')
+})
+
 def login_required(f):
     """
     Decorator to require authentication for routes.
@@ -42,15 +72,11 @@ def get_billing_statements():
       403:
         description: Not a contract customer
     """
-    conn = get_db_connection()
+    conn = user_connection(request.user_id)
     
     try:
         # Check if user has a contract
-        customer = conn.execute("""
-            SELECT customer_id, has_contract, account_number
-            FROM Customer
-            WHERE user_id = ?
-        """, (request.user_id,)).fetchone()
+        customer = conn.execute(queries.CUSTOMER_CONTRACT, (request.user_id,)).fetchone()
         
         if not customer:
             return jsonify({'error': 'Customer profile not found'}), 404
@@ -59,24 +85,11 @@ def get_billing_statements():
             return jsonify({'error': 'Only contract customers have billing statements'}), 403
         
         # Get all statements
-        statements = conn.execute("""
-            SELECT *
-            FROM BillingStatement
-            WHERE customer_id = ?
-            ORDER BY statement_month DESC
-        """, (customer['customer_id'],)).fetchall()
+        statements = STATEMENT.all(conn.execute(queries.STATEMENTS, (customer['customer_id'],)))
         
-        return jsonify({
+        return fast_jsonify({
             'account_number': customer['account_number'],
-            'statements': [
-                {
-                    'statement_id': s['statement_id'],
-                    'statement_month': s['statement_month'],
-                    'total_amount': s['total_amount'],
-                    'status': s['status']
-                }
-                for s in statements
-            ]
+            'statements': statements
         }), 200
         
     except Exception as e:
@@ -103,66 +116,29 @@ def get_statement_details(statement_id):
       403:
         description: Unauthorized
     """
-    conn = get_db_connection()
+    conn = user_connection(request.user_id)
     
     try:
         # Get customer
-        customer = conn.execute("""
-            SELECT customer_id
-            FROM Customer
-            WHERE user_id = ?
-        """, (request.user_id,)).fetchone()
+        customer = conn.execute(queries.CUSTOMER_ID, (request.user_id,)).fetchone()
         
         if not customer:
             return jsonify({'error': 'Customer profile not found'}), 404
         
         # Get statement
-        statement = conn.execute("""
-            SELECT *
-            FROM BillingStatement
-            WHERE statement_id = ? AND customer_id = ?
-        """, (statement_id, customer['customer_id'])).fetchone()
+        statement = conn.execute(queries.STATEMENT_FOR_CUSTOMER, (statement_id, customer['customer_id'])).fetchone()
         
         if not statement:
             return jsonify({'error': 'Statement not found or unauthorized'}), 403
         
-        # Get packages in this statement
-        packages = conn.execute("""
-            SELECT 
-                p.package_id,
-                p.recipient_name,
-                p.recipient_city,
-                p.recipient_state,
-                p.date_shipped,
-                p.weight_lb,
-                st.name as service_name,
-                st.base_price as cost
-            FROM Package p
-            JOIN ServiceType st ON p.service_id = st.service_id
-            JOIN StatementPackage sp ON p.package_id = sp.package_id
-            WHERE sp.statement_id = ?
-            ORDER BY p.date_shipped DESC
-        """, (statement_id,)).fetchall()
+        # Get packages in this statement, including any moved to the archive
+        query, copies = archive.union_all(conn, queries.STATEMENT_PACKAGES,
+                                          order_by="\nORDER BY date_shipped DESC")
+        packages = STATEMENT_PACKAGE.all(conn.execute(query, (statement_id,) * copies))
         
-        return jsonify({
-            'statement': {
-                'statement_id': statement['statement_id'],
-                'statement_month': statement['statement_month'],
-                'total_amount': statement['total_amount'],
-                'status': statement['status']
-            },
-            'packages': [
-                {
-                    'tracking_number': p['package_id'],
-                    'recipient_name': p['recipient_name'],
-                    'recipient_location': f"{p['recipient_city']}, {p['recipient_state']}",
-                    'date_shipped': p['date_shipped'],
-                    'weight': p['weight_lb'],
-                    'service': p['service_name'],
-                    'cost': p['cost']
-                }
-                for p in packages
-            ]
+        return fast_jsonify({
+            'statement': STATEMENT.map(statement),
+            'packages': packages
         }), 200
         
     except Exception as e:
@@ -181,41 +157,56 @@ def get_payment_history():
       200:
         description: List of payments
     """
-    conn = get_db_connection()
+    conn = user_connection(request.user_id)
     
     try:
-        customer = conn.execute("""
-            SELECT customer_id
-            FROM Customer
-            WHERE user_id = ?
-        """, (request.user_id,)).fetchone()
+        customer = conn.execute(queries.CUSTOMER_ID, (request.user_id,)).fetchone()
         
         if not customer:
             return jsonify({'error': 'Customer profile not found'}), 404
         
-        payments = conn.execute("""
-            SELECT 
-                payment_id,
-                date_paid,
-                amount,
-                method,
-                package_id
-            FROM Payment
-            WHERE customer_id = ?
-            ORDER BY date_paid DESC
-        """, (customer['customer_id'],)).fetchall()
+        payments = PAYMENT.all(conn.execute(queries.PAYMENTS, (customer['customer_id'],)))
+        
+        return fast_jsonify({'payments': payments}), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+
+
+@billing_routes.route('/billing/balance', methods=['GET'])
+@login_required
+def get_balance():
+    """
+    Get the customer's running balance and current open statement.
+    ---
+    responses:
+      200:
+        description: Balance and open statement total
+      404:
+        description: Customer profile not found
+    """
+    conn = user_connection(request.user_id)
+    
+    try:
+        customer = conn.execute(queries.CUSTOMER_ID, (request.user_id,)).fetchone()
+        
+        if not customer:
+            return jsonify({'error': 'Customer profile not found'}), 404
+        
+        open_statement = conn.execute(
+            queries.OPEN_STATEMENT,
+            (customer['customer_id'], datetime.now().strftime('%Y-%m'))
+        ).fetchone()
         
         return jsonify({
-            'payments': [
-                {
-                    'payment_id': p['payment_id'],
-                    'date_paid': p['date_paid'],
-                    'amount': p['amount'],
-                    'method': p['method'],
-                    'tracking_number': p['package_id']
-                }
-                for p in payments
-            ]
+            'balance': ledger.get_balance(conn, customer['customer_id']),
+            'open_statement': {
+                'statement_id': open_statement['statement_id'],
+                'statement_month': open_statement['statement_month'],
+                'total_amount': open_statement['total_amount']
+            } if open_statement else None
         }), 200
         
     except Exception as e:
@@ -252,44 +243,58 @@ def make_payment():
         description: Payment processed
     """
     data = request.get_json()
-    conn = get_db_connection()
+    amount = data.get('amount')
+    # A zero or negative payment would raise the balance instead of paying it down
+    if isinstance(amount, bool) or not isinstance(amount, (int, float)) or amount <= 0:
+        return jsonify({'error': 'Payment amount must be a positive number'}), 400
+    
+    conn = user_connection(request.user_id)
     
     try:
-        customer = conn.execute("""
-            SELECT customer_id
-            FROM Customer
-            WHERE user_id = ?
-        """, (request.user_id,)).fetchone()
+        customer = conn.execute(queries.CUSTOMER_ID, (request.user_id,)).fetchone()
         
         if not customer:
             return jsonify({'error': 'Customer profile not found'}), 404
         
         cursor = conn.cursor()
+        statement_id = data.get('statement_id')
+        
+        # A statement payment must target one of the caller's own open statements
+        # and cannot exceed what is still owed on it
+        if statement_id is not None:
+            statement = conn.execute(queries.STATEMENT_STATUS, (statement_id, customer['customer_id'])).fetchone()
+            
+            if not statement:
+                return jsonify({'error': 'Statement not found or unauthorized'}), 403
+            
+            if statement['status'] == 'paid':
+                return jsonify({'error': 'Statement is already paid'}), 400
+            
+            due = ledger.amount_due(cursor, statement_id)
+            if data['amount'] > due + ledger.TOLERANCE:
+                return jsonify({'error': f'Payment exceeds amount due ({due:.2f})'}), 400
         
         # Record payment
-        cursor.execute("""
-            INSERT INTO Payment (customer_id, date_paid, amount, method)
-            VALUES (?, ?, ?, ?)
-        """, (
+        cursor.execute(queries.INSERT_PAYMENT, (
             customer['customer_id'],
             datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
             data['amount'],
             data['method']
         ))
         
-        # If paying a statement, update its status
-        if 'statement_id' in data:
-            cursor.execute("""
-                UPDATE BillingStatement
-                SET status = 'paid'
-                WHERE statement_id = ?
-            """, (data['statement_id'],))
+        payment_id = cursor.lastrowid
+        ledger.record_payment(cursor, customer['customer_id'], data['amount'],
+                              payment_id, statement_id=statement_id)
+        
+        # Only a statement that is fully covered is marked paid
+        if statement_id is not None:
+            ledger.settle_if_paid(cursor, statement_id)
         
         conn.commit()
         
         return jsonify({
             'message': 'Payment processed successfully',
-            'payment_id': cursor.lastrowid
+            'payment_id': payment_id
         }), 201
         
     except Exception as e:
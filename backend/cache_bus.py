@@ -0,0 +1,292 @@
+# backend/cache_bus.py
+"""
+cache_bus.py - Cache invalidation across worker processes
+
+Every worker keeps its own in-process caches: micro-cached responses
+(middleware.py), tracking payloads (tracking.py), location lists (admin.py)
+and user roles (db.user_role). A write in one worker must reach the others'
+caches, or they keep serving what was true before it.
+
+A write path names the keys it makes stale on the connection it writes with:
+
+    cache_bus.publish(conn, 'tracking', package_id)
+
+When that connection commits, the keys are dropped from this process's
+caches and appended to the CacheInvalidation table of a small bus file
+(CACHE_BUS_PATH, default shipping-cache.db next to DB_PATH); a rollback
+discards them. Publishing after the commit, not before, means no request
+can read the old row and cache it again once the invalidation has gone
+out. Every worker reads the rows after the last version it applied before
+handling a request, at most every CACHE_BUS_POLL seconds, so a write is
+visible everywhere within about one poll interval. That check is a
+primary-key range read that usually finds nothing.
+
+The TTLs stay as a backstop (a worker that stopped reading the bus, a
+write made outside the app); with the bus they can be long. A worker that
+falls further behind than CACHE_BUS_RETENTION clears all of its caches.
+
+    python cache_bus.py status
+    python cache_bus.py publish http /api/services   # e.g. after editing ServiceType by hand
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+DEFAULTS = {
+    'CACHE_BUS': os.environ.get('CACHE_BUS', '1') == '1',
+    'CACHE_BUS_POLL': float(os.environ.get('CACHE_BUS_POLL', 0.05)),
+}
+
+CACHE_BUS_RETENTION = float(os.environ.get('CACHE_BUS_RETENTION', 3600))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS CacheInvalidation (
+    version          INTEGER PRIMARY KEY AUTOINCREMENT,
+    cache            TEXT NOT NULL,
+    key              TEXT,
+    publisher        INTEGER NOT NULL,
+    published_at     REAL NOT NULL
+);
+"""
+
+enabled = DEFAULTS['CACHE_BUS']
+poll_interval = DEFAULTS['CACHE_BUS_POLL']
+
+# cache name -> function(key) dropping that key (None: everything)
+_subscribers = {}
+_caches = []
+
+
+def subscribe(cache, invalidate):
+    """
+    Route invalidations of `cache` to invalidate(key).
+    """
+    _subscribers[cache] = invalidate
+
+
+class LocalCache:
+    """
+    Thread-safe per-process TTL cache subscribed to the bus under `name`.
+    Keys are compared as strings, the form they travel in.
+    """
+    def __init__(self, name, ttl):
+        self.name = name
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        _caches.append(self)
+        subscribe(name, self.invalidate)
+
+    def get(self, key):
+        entry = self._entries.get(str(key))
+        if entry is None or entry[0] < time.monotonic():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[str(key)] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(str(key), None)
+
+
+def caches():
+    """
+    Every LocalCache in this process.
+    """
+    return list(_caches)
+
+
+def _apply(cache, key):
+    invalidate = _subscribers.get(cache)
+    if invalidate is not None:
+        invalidate(key)
+
+
+def invalidate_all():
+    """
+    Empty every subscribed cache in this process.
+    """
+    for cache in list(_subscribers):
+        _apply(cache, None)
+
+
+# ---------------------------------------------------------------------
+# Bus file
+# ---------------------------------------------------------------------
+
+def bus_path():
+    import db
+    return os.environ.get('CACHE_BUS_PATH') or os.path.splitext(db.DB_PATH)[0] + '-cache.db'
+
+
+class _State:
+    """
+    This process's bus connection and the last version it applied.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.pid = os.getpid()
+        self.conn = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.version = self.conn.execute("SELECT COALESCE(MAX(version), 0) FROM CacheInvalidation").fetchone()[0]
+        self.checked = time.monotonic()
+        self.pruned = 0
+        self.lock = threading.Lock()
+
+
+_state = None
+_state_lock = threading.Lock()
+
+
+def _bus():
+    # Reopened after a fork or when DB_PATH moves (tests, benchmarks)
+    global _state
+    path = bus_path()
+    state = _state
+    if state is None or state.pid != os.getpid() or state.path != path:
+        with _state_lock:
+            if _state is None or _state.pid != os.getpid() or _state.path != path:
+                _state = _State(path)
+            state = _state
+    return state
+
+
+def publish(conn, cache, key=None):
+    """
+    Invalidate `key` of `cache` (None: the whole cache) in every worker once
+    `conn` commits. With no transaction open on `conn` (or conn None) it
+    goes out now.
+    """
+    if conn is None or not conn.in_transaction:
+        send([(cache, key)])
+        return
+    if conn.pending_invalidations is None:
+        conn.pending_invalidations = []
+    conn.pending_invalidations.append((cache, key))
+
+
+def send(keys):
+    """
+    Drop `keys` [(cache, key)] here and broadcast them to the other workers.
+    """
+    for cache, key in keys:
+        _apply(cache, key)
+    if not enabled:
+        return
+    state = _bus()
+    now = time.time()
+    with state.lock:
+        state.conn.execute("BEGIN IMMEDIATE")
+        state.conn.executemany(
+            "INSERT INTO CacheInvalidation (cache, key, publisher, published_at) VALUES (?, ?, ?, ?)",
+            [(cache, None if key is None else str(key), state.pid, now) for cache, key in keys])
+        if now - state.pruned > 60:
+            state.conn.execute("DELETE FROM CacheInvalidation WHERE published_at < ?", (now - CACHE_BUS_RETENTION,))
+            state.pruned = now
+        state.conn.execute("COMMIT")
+
+
+def poll(force=False):
+    """
+    Apply the invalidations other workers published since the last poll.
+    Returns how many were applied. Without `force`, at most once per
+    poll_interval and never while another thread of this process is polling.
+    """
+    if not enabled:
+        return 0
+    state = _bus()
+    if not force and time.monotonic() - state.checked < poll_interval:
+        return 0
+    if not state.lock.acquire(blocking=force):
+        return 0
+    try:
+        state.checked = time.monotonic()
+        rows = state.conn.execute(
+            "SELECT version, cache, key, publisher FROM CacheInvalidation WHERE version > ? ORDER BY version",
+            (state.version,)).fetchall()
+        if not rows:
+            return 0
+        if rows[0][0] > state.version + 1 and state.version:
+            # Rows we never saw were pruned: anything may be stale
+            invalidate_all()
+        for version, cache, key, publisher in rows:
+            if publisher != state.pid:
+                _apply(cache, key)
+        state.version = rows[-1][0]
+        return len(rows)
+    finally:
+        state.lock.release()
+
+
+def version():
+    """
+    Last bus version applied in this process (0 before the first use).
+    """
+    return _state.version if _state is not None and _state.pid == os.getpid() else 0
+
+
+def reset():
+    """
+    Forget the bus connection and empty every cache (DB_PATH changed).
+    """
+    global _state
+    with _state_lock:
+        if _state is not None and _state.pid == os.getpid():
+            _state.conn.close()
+        _state = None
+    invalidate_all()
+
+
+def _before_request():
+    poll()
+
+
+def init_cache_bus(app):
+    """
+    Read the bus before each request (CACHE_BUS=0: local invalidation only).
+    """
+    global enabled, poll_interval
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
+    enabled = app.config['CACHE_BUS']
+    poll_interval = app.config['CACHE_BUS_POLL']
+    if enabled:
+        app.before_request(_before_request)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cross-worker cache invalidation bus")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('status')
+    pub = sub.add_parser('publish')
+    pub.add_argument('cache')
+    pub.add_argument('key', nargs='?')
+    args = parser.parse_args(argv)
+
+    if args.command == 'publish':
+        send([(args.cache, args.key)])
+    state = _bus()
+    count, oldest = state.conn.execute(
+        "SELECT COUNT(*), MIN(published_at) FROM CacheInvalidation").fetchone()
+    print(f"{bus_path()}: version {state.version}, {count} retained"
+          + (f", oldest {time.time() - oldest:.0f} s ago" if oldest else ""))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
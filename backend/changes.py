@@ -0,0 +1,233 @@
+# backend/changes.py
+"""
+changes.py - Change-data-capture feed
+
+Every committed change to a package, tracking event, billing statement or
+payment is appended to ChangeLog with a position that only grows:
+triggers log Package, BillingStatement and Payment rows (migration 8), and
+db.insert_event logs each tracking event (events may be written to
+partition files the triggers can't see). A row is logged in the
+transaction that changes it, and SQLite commits one writer at a time, so
+positions appear in commit order and a consumer that has read up to
+position P has seen every change up to P.
+
+    GET /api/changes?since=<position>&limit=500[&wait=30]   (staff/admin)
+
+returns the changes after `since`, oldest first, each with the row as it
+was after the change (packages and events keyed by tracking number, as in
+the rest of the API). `wait` long-polls: with nothing new the request
+holds for up to that many seconds and returns as soon as a change is
+committed. A consumer keeps the returned `position` and passes it as the
+next `since`. Without `since` the feed starts at the current head, so to
+build a replica: read the head, take an export, then follow from there.
+Archived packages show as op "archive".
+
+The log is pruned after CHANGES_RETENTION_DAYS; a consumer whose `since`
+falls before the oldest kept change gets 410 and must start over. With
+DB_SHARDS each shard has its own log and positions: pass shard=K.
+
+    python changes.py status
+    python changes.py prune [--days 7]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from functools import wraps
+from flask import Blueprint, jsonify, request
+import db
+import queries
+import tracking_numbers
+
+CHANGES_LIMIT = int(os.environ.get('CHANGES_LIMIT', 500))
+CHANGES_MAX_WAIT = float(os.environ.get('CHANGES_MAX_WAIT', 30))
+CHANGES_POLL = float(os.environ.get('CHANGES_POLL', 0.2))
+CHANGES_RETENTION_DAYS = float(os.environ.get('CHANGES_RETENTION_DAYS', 7))
+
+changes_routes = Blueprint('changes_routes', __name__)
+
+
+def record(cursor, entity, entity_id, op, data):
+    """
+    Log a change made outside the ChangeLog triggers, in the caller's
+    transaction. Uses its own cursor so the caller's lastrowid is kept.
+    """
+    cursor.connection.execute(
+        "INSERT INTO ChangeLog (entity, entity_id, op, data, changed_at) VALUES (?, ?, ?, ?, ?)",
+        (entity, entity_id, op, json.dumps(data), time.time())
+    )
+
+
+def _public(data, *keys):
+    # Internal package ids as tracking numbers
+    for key in keys:
+        if data.get(key) is not None:
+            data[key] = tracking_numbers.public(data[key])
+    return data
+
+
+def describe(row):
+    """
+    API form of a ChangeLog row.
+    """
+    data = json.loads(row['data']) if row['data'] else None
+    key = row['entity_id']
+    if row['entity'] == 'package':
+        key = tracking_numbers.public(key)
+        if data:
+            del data['package_id']
+            data = {'tracking_number': key, **data}
+    elif row['entity'] == 'tracking_event' and data:
+        _public(data, 'package_id')
+        data['tracking_number'] = data.pop('package_id')
+        data['timestamp'] = db.from_epoch(data['timestamp'])
+        data['status'] = db.status_name(data['status'])
+    elif row['entity'] == 'payment' and data:
+        _public(data, 'package_id')
+    return {
+        'position': row['position'],
+        'entity': row['entity'],
+        'id': key,
+        'op': row['op'],
+        'data': data,
+        'changed_at': db.from_epoch(row['changed_at']),
+    }
+
+
+def _connection(shard):
+    if db.SHARDS:
+        return db.get_shard_connection(shard)
+    return db.get_db_connection()
+
+
+def staff_required(f):
+    """
+    Decorator to require staff or admin role.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        auth_header = request.headers.get('Authorization')
+        if not auth_header:
+            return jsonify({'error': 'Authentication required'}), 401
+
+        try:
+            user_id = int(auth_header.split(' ')[1])
+        except (IndexError, ValueError):
+            return jsonify({'error': 'Invalid token'}), 401
+
+        if db.user_role(user_id) not in ['staff', 'admin']:
+            return jsonify({'error': 'Staff access required'}), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+@changes_routes.route('/changes', methods=['GET'])
+@staff_required
+def get_changes():
+    """
+    Changes after a position, oldest first
+    ---
+    parameters:
+      - name: since
+        in: query
+        type: integer
+        description: Last position already seen; without it, start from the current head
+      - name: limit
+        in: query
+        type: integer
+        default: 500
+      - name: wait
+        in: query
+        type: number
+        default: 0
+        description: Seconds to hold the request when there is nothing new (long poll)
+      - name: shard
+        in: query
+        type: integer
+        default: 0
+        description: Shard whose log to read (DB_SHARDS only)
+    responses:
+      200:
+        description: Changes, the position to pass as the next since, and the current head
+      400:
+        description: Bad parameter
+      410:
+        description: Changes after since have been pruned; start over from an export
+    """
+    try:
+        since = request.args.get('since', type=int)
+        limit = min(max(request.args.get('limit', CHANGES_LIMIT, type=int), 1), CHANGES_LIMIT)
+        wait = min(max(request.args.get('wait', 0, type=float), 0), CHANGES_MAX_WAIT)
+        shard = request.args.get('shard', 0, type=int)
+        if not 0 <= shard < max(db.SHARDS, 1):
+            return jsonify({'error': 'No such shard'}), 400
+
+        conn = _connection(shard)
+        try:
+            oldest, head = conn.execute(queries.CHANGE_BOUNDS).fetchone()
+            if since is None:
+                since = head or 0
+            elif oldest is not None and oldest > since + 1:
+                return jsonify({'error': 'Changes after this position have been pruned', 'oldest': oldest}), 410
+
+            deadline = time.monotonic() + wait
+            rows = conn.execute(queries.CHANGES_SINCE, (since, limit)).fetchall()
+            while not rows and time.monotonic() < deadline:
+                time.sleep(CHANGES_POLL)
+                rows = conn.execute(queries.CHANGES_SINCE, (since, limit)).fetchall()
+            if rows:
+                head = max(head or 0, rows[-1]['position'])
+        finally:
+            conn.close()
+
+        return jsonify({
+            'changes': [describe(row) for row in rows],
+            'position': rows[-1]['position'] if rows else since,
+            'head': head or 0,
+            'more': len(rows) == limit,
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+def prune(conn, days=CHANGES_RETENTION_DAYS):
+    """
+    Delete changes older than `days`, always keeping the latest so the
+    head position survives. Returns the number deleted.
+    """
+    cutoff = time.time() - days * 86400
+    deleted = conn.execute("""
+        DELETE FROM ChangeLog
+        WHERE changed_at < ? AND position < (SELECT MAX(position) FROM ChangeLog)
+    """, (cutoff,)).rowcount
+    conn.commit()
+    return deleted
+
+
+def _connections():
+    return [db.get_shard_connection(shard) for shard in range(db.SHARDS)] or [db.get_db_connection()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Change-data-capture log")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('status')
+    old = sub.add_parser('prune')
+    old.add_argument('--days', type=float, default=CHANGES_RETENTION_DAYS)
+    args = parser.parse_args(argv)
+
+    for shard, conn in enumerate(_connections()):
+        try:
+            if args.command == 'status':
+                oldest, head = conn.execute(queries.CHANGE_BOUNDS).fetchone()
+                print(f"shard {shard}: positions {oldest}..{head}")
+            else:
+                print(f"shard {shard}: pruned {prune(conn, args.days)} change(s)")
+        finally:
+            conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,14 +3,20 @@
 db.py
 """
 
+import calendar
 import os
 import sqlite3
+import threading
+import time
 from datetime import datetime, timedelta
+import cache_bus
+import queries
 
 # Path to SQLite database file
-DB_PATH = os.path.join(os.path.dirname(__file__), 'shipping.db')
+DB_PATH = os.environ.get('DB_PATH', os.path.join(os.path.dirname(__file__), 'shipping.db'))
 
-# SQL schema to create tables
+# Baseline schema (migration 1). Later changes are versioned migrations in
+# migrations.py; don't edit this script to change an existing database.
 SCHEMA = """
 PRAGMA foreign_keys = ON;
 
@@ -181,24 +187,576 @@ CREATE TABLE IF NOT EXISTS Staff (
     
     FOREIGN KEY (user_id) REFERENCES User(user_id)
 );
+
+----------------------------------------------------------------------
+-- Billing ledger (append-only) and running balances
+----------------------------------------------------------------------
+
+-- Every charge, payment and adjustment ever applied to a customer.
+-- Amounts are signed: charges are positive, payments are negative.
+CREATE TABLE IF NOT EXISTS LedgerEntry (
+    entry_id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    customer_id      INTEGER NOT NULL,
+    entry_type       TEXT NOT NULL CHECK (entry_type IN ('charge', 'payment', 'adjustment')),
+    amount           REAL NOT NULL,
+    statement_id     INTEGER,
+    package_id       INTEGER,
+    payment_id       INTEGER,
+    created_at       TEXT NOT NULL,
+    memo             TEXT,
+
+    FOREIGN KEY (customer_id) REFERENCES Customer(customer_id),
+    FOREIGN KEY (statement_id) REFERENCES BillingStatement(statement_id),
+    FOREIGN KEY (package_id) REFERENCES Package(package_id),
+    FOREIGN KEY (payment_id) REFERENCES Payment(payment_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_ledger_customer ON LedgerEntry(customer_id, entry_id);
+CREATE INDEX IF NOT EXISTS idx_ledger_statement ON LedgerEntry(statement_id);
+
+CREATE TRIGGER IF NOT EXISTS ledger_no_update
+BEFORE UPDATE ON LedgerEntry
+BEGIN
+    SELECT RAISE(ABORT, 'LedgerEntry is append-only');
+END;
+
+CREATE TRIGGER IF NOT EXISTS ledger_no_delete
+BEFORE DELETE ON LedgerEntry
+BEGIN
+    SELECT RAISE(ABORT, 'LedgerEntry is append-only');
+END;
+
+-- Running balance per customer, maintained alongside each ledger insert
+CREATE TABLE IF NOT EXISTS CustomerBalance (
+    customer_id      INTEGER PRIMARY KEY,
+    balance          REAL NOT NULL DEFAULT 0.00,
+    last_entry_id    INTEGER,
+    updated_at       TEXT,
+
+    FOREIGN KEY (customer_id) REFERENCES Customer(customer_id)
+);
+
+-- Open statement lookup by customer and month
+CREATE INDEX IF NOT EXISTS idx_statement_customer_month ON BillingStatement(customer_id, statement_month);
+
+----------------------------------------------------------------------
+-- Per-customer package counts, kept current by the triggers below
+-- (month_packages counts packages shipped in current_month, the latest
+-- month this customer shipped in)
+----------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS CustomerSummary (
+    customer_id      INTEGER PRIMARY KEY,
+    total_packages   INTEGER NOT NULL DEFAULT 0,
+    current_month    TEXT,
+    month_packages   INTEGER NOT NULL DEFAULT 0,
+
+    FOREIGN KEY (customer_id) REFERENCES Customer(customer_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_summary_total_packages ON CustomerSummary(total_packages);
+
+-- Archival: find old deliveries, and move/delete a package's events without a full scan
+CREATE INDEX IF NOT EXISTS idx_package_delivered ON Package(date_delivered) WHERE date_delivered IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_event_package ON TrackingEvent(package_id);
+
+CREATE TRIGGER IF NOT EXISTS customer_summary_new AFTER INSERT ON Customer
+BEGIN
+    INSERT OR IGNORE INTO CustomerSummary (customer_id) VALUES (NEW.customer_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS package_summary_insert AFTER INSERT ON Package
+BEGIN
+    INSERT INTO CustomerSummary (customer_id, total_packages, current_month, month_packages)
+    VALUES (NEW.customer_id, 1, substr(NEW.date_shipped, 1, 7), 1)
+    ON CONFLICT(customer_id) DO UPDATE SET
+        total_packages = total_packages + 1,
+        month_packages = CASE
+            WHEN current_month = excluded.current_month THEN month_packages + 1
+            WHEN current_month IS NULL OR current_month < excluded.current_month THEN 1
+            ELSE month_packages
+        END,
+        current_month = MAX(COALESCE(current_month, ''), excluded.current_month);
+END;
+
+CREATE TRIGGER IF NOT EXISTS package_summary_delete AFTER DELETE ON Package
+BEGIN
+    UPDATE CustomerSummary SET
+        total_packages = total_packages - 1,
+        month_packages = month_packages - (current_month = substr(OLD.date_shipped, 1, 7))
+    WHERE customer_id = OLD.customer_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS package_summary_move AFTER UPDATE OF customer_id, date_shipped ON Package
+WHEN OLD.customer_id != NEW.customer_id OR OLD.date_shipped != NEW.date_shipped
+BEGIN
+    UPDATE CustomerSummary SET
+        total_packages = total_packages - 1,
+        month_packages = month_packages - (current_month = substr(OLD.date_shipped, 1, 7))
+    WHERE customer_id = OLD.customer_id;
+    INSERT INTO CustomerSummary (customer_id, total_packages, current_month, month_packages)
+    VALUES (NEW.customer_id, 1, substr(NEW.date_shipped, 1, 7), 1)
+    ON CONFLICT(customer_id) DO UPDATE SET
+        total_packages = total_packages + 1,
+        month_packages = CASE
+            WHEN current_month = excluded.current_month THEN month_packages + 1
+            WHEN current_month IS NULL OR current_month < excluded.current_month THEN 1
+            ELSE month_packages
+        END,
+        current_month = MAX(COALESCE(current_month, ''), excluded.current_month);
+END;
 """
 
-def get_db_connection():
+# Idle connections kept open per process for reuse; 0 opens a new connection per call
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 0))
+
+# Prepared statements cached per connection: every registered query (see
+# queries.py) plus room for the helper modules' own SQL
+STATEMENT_CACHE = int(os.environ.get('DB_STATEMENT_CACHE', 0)) or queries.statement_count() + 64
+
+# Customer shards (see sharding.py); 0 keeps every table in DB_PATH
+SHARDS = int(os.environ.get('DB_SHARDS', 0))
+
+# A package_id carries its shard above this bit: shard = package_id >> SHARD_BITS
+SHARD_BITS = 40
+
+# Write new tracking events to monthly partition files (see partitions.py)
+EVENT_PARTITIONS = os.environ.get('EVENT_PARTITIONS', '0') == '1'
+
+# Observers called as hook(event, cursor, sql, params, seconds) for every
+# 'checkout' of a connection (cursor, sql and params are None) and every
+# 'execute'/'executemany'. Empty list = no timing at all.
+DB_HOOKS = []
+
+
+def _notify(event, cursor, sql, params, seconds):
+    for hook in DB_HOOKS:
+        hook(event, cursor, sql, params, seconds)
+
+
+class Cursor(sqlite3.Cursor):
     """
-    Establish and return a connection to the SQLite database.
+    Cursor that reports each statement and its duration to DB_HOOKS.
     """
-    conn = sqlite3.connect(DB_PATH)
+    def execute(self, sql, parameters=()):
+        if not DB_HOOKS:
+            return super().execute(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _notify('execute', self, sql, parameters, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        if not DB_HOOKS:
+            return super().executemany(sql, seq_of_parameters)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _notify('executemany', self, sql, None, time.perf_counter() - start)
+
+
+class Connection(sqlite3.Connection):
+    """
+    Connection whose cursors (including the implicit one behind
+    Connection.execute) are instrumented Cursors, and whose commit sends
+    the cache invalidations published on it (cache_bus.publish).
+    """
+    pending_invalidations = None
+
+    def commit(self):
+        super().commit()
+        if self.pending_invalidations:
+            pending, self.pending_invalidations = self.pending_invalidations, None
+            cache_bus.send(pending)
+
+    def rollback(self):
+        super().rollback()
+        self.pending_invalidations = None
+
+    def cursor(self, factory=Cursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class PooledConnection(Connection):
+    """
+    Connection whose close() hands it back to its pool instead of closing it.
+    """
+    pool = None
+
+    def close(self):
+        if self.pool is not None and self.pool.release(self):
+            return
+        super().close()
+
+
+class ConnectionPool:
+    """
+    Per-process pool of open connections to one database file.
+
+    Connections are created on demand and at most `size` idle ones are kept.
+    A pool belongs to the process that created it; after a fork the child
+    starts a fresh one (SQLite handles must not cross fork()).
+    """
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.pid = os.getpid()
+        self.created = 0
+        self.in_use = 0
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _open(self):
+        conn = _connect(self.path, factory=PooledConnection, check_same_thread=False)
+        conn.pool = self
+        self.created += 1
+        return conn
+
+    def acquire(self):
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+            self.in_use += 1
+        return conn or self._open()
+
+    def release(self, conn):
+        """
+        Take a connection back. Returns False when it should really be closed.
+        """
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            self.in_use -= 1
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return True
+        conn.pool = None
+        return False
+
+    def warm(self, count=None):
+        """
+        Open connections up front so the first requests don't pay for it.
+        """
+        conns = [self.acquire() for _ in range(count or self.size)]
+        for conn in conns:
+            conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+            conn.close()
+
+    def stats(self):
+        return {'size': self.size, 'idle': len(self._idle), 'in_use': self.in_use, 'created': self.created}
+
+
+_pools = {}
+
+
+def get_pool(path=None):
+    """
+    Return this process's pool for path (default DB_PATH), creating it on first use.
+    """
+    path = path or DB_PATH
+    pool = _pools.get(path)
+    if pool is None or pool.pid != os.getpid():
+        pool = _pools[path] = ConnectionPool(path, POOL_SIZE)
+    return pool
+
+
+def _connect(path, factory=Connection, **kwargs):
+    conn = sqlite3.connect(path, factory=factory, cached_statements=STATEMENT_CACHE, **kwargs)
     conn.row_factory = sqlite3.Row
     return conn
 
 
-def init_db():
+def _checkout(path):
+    conn = get_pool(path).acquire() if POOL_SIZE > 0 else _connect(path)
+    if EVENT_PARTITIONS:
+        import partitions
+        partitions.prepare(conn)
+    return conn
+
+
+def get_db_connection(path=None):
+    """
+    Establish and return a connection to the SQLite database
+    (the global one unless another file is given).
+    """
+    path = path or DB_PATH
+    if not DB_HOOKS:
+        return _checkout(path)
+    start = time.perf_counter()
+    conn = _checkout(path)
+    _notify('checkout', None, None, None, time.perf_counter() - start)
+    return conn
+
+
+def use_database(path):
     """
-    Initialize the database by creating tables and adding sample data.
+    Point this process at another database file (tests, benchmarks) and
+    forget what was cached about the previous one. Returns the old path.
     """
-    conn = get_db_connection()
-    conn.executescript(SCHEMA)
+    global DB_PATH
+    previous, DB_PATH = DB_PATH, path
+    _customer_of_user.clear()
+    cache_bus.reset()
+    return previous
+
+
+# user_id -> role, for the auth decorators; admin.py publishes 'principal'
+# invalidations when a role changes or a user is deleted
+PRINCIPAL_CACHE_TTL = float(os.environ.get('PRINCIPAL_CACHE_TTL', 300))
+_roles = cache_bus.LocalCache('principal', PRINCIPAL_CACHE_TTL)
+
+
+def user_role(user_id):
+    """
+    Role of a user, or None for an unknown id.
+    """
+    role = _roles.get(user_id)
+    if role is None:
+        conn = get_db_connection()
+        try:
+            row = conn.execute(queries.USER_ROLE, (user_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        role = row['role']
+        _roles.set(user_id, role)
+    return role
+
+
+# ---------------------------------------------------------------------
+# Shard router. With DB_SHARDS=N, customers and everything they own
+# (packages, tracking events, statements, payments, ledger) live in
+# shard customer_id % N; User, ServiceType and Location are replicated
+# into every shard. DB_PATH stays the global database and keeps the
+# Customer directory. With DB_SHARDS=0 every helper returns a connection
+# to DB_PATH.
+# ---------------------------------------------------------------------
+
+# user_id -> customer_id; a user's customer row never changes id
+_customer_of_user = {}
+
+
+def shard_path(shard):
+    return f"{os.path.splitext(DB_PATH)[0]}-shard{shard}.db"
+
+
+def shard_of_customer(customer_id):
+    return customer_id % SHARDS
+
+
+def shard_of_package(package_id):
+    return package_id >> SHARD_BITS
+
+
+def get_shard_connection(shard):
+    """
+    Connection to one shard (the global database when not sharded).
+    """
+    return get_db_connection(shard_path(shard) if SHARDS else None)
+
+
+def customer_connection(customer_id):
+    """
+    Connection to the shard holding customer_id.
+    """
+    if not SHARDS:
+        return get_db_connection()
+    return get_shard_connection(shard_of_customer(customer_id))
+
+
+def package_connection(package_id):
+    """
+    Connection to the shard holding package_id. Ids that don't name a shard
+    get the shard 0 connection, where the lookup simply finds nothing.
+    """
+    if not SHARDS:
+        return get_db_connection()
+    shard = shard_of_package(package_id)
+    return get_shard_connection(shard if shard < SHARDS else 0)
+
+
+def user_connection(user_id):
+    """
+    Connection to the shard holding the logged-in user's customer profile
+    (the global database for users without one).
+    """
+    if not SHARDS:
+        return get_db_connection()
+    customer_id = _customer_of_user.get(user_id)
+    if customer_id is None:
+        conn = get_db_connection()
+        try:
+            row = conn.execute("SELECT customer_id FROM Customer WHERE user_id = ?", (user_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return get_db_connection()
+        customer_id = _customer_of_user[user_id] = row[0]
+    return customer_connection(customer_id)
+
+
+# Since migration 4 TrackingEvent stores timestamps as INTEGER seconds since
+# the epoch and statuses as small codes. The seconds are those of the
+# wall-clock text read as UTC, so they convert back to exactly the same
+# 'YYYY-MM-DD HH:MM:SS'; the API keeps the text forms (serializers.Timestamp
+# and serializers.Status convert at the boundary).
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+EVENT_STATUSES = ('processing', 'arrived', 'departed', 'loaded', 'out for delivery', 'delivered')
+STATUS_CODES = {name: code for code, name in enumerate(EVENT_STATUSES, 1)}
+
+
+def to_epoch(text):
+    """
+    Stored form of a 'YYYY-MM-DD HH:MM:SS' timestamp.
+    """
+    return calendar.timegm(time.strptime(text, TIME_FORMAT))
+
+
+def from_epoch(seconds):
+    """
+    'YYYY-MM-DD HH:MM:SS' text of a stored timestamp (None stays None).
+    """
+    return None if seconds is None else time.strftime(TIME_FORMAT, time.gmtime(seconds))
+
+
+def epoch_bound(prefix):
+    """
+    Stored form of the start of a date range given as a prefix of the text
+    format ('2025', '2025-06', '2025-06-01 12:00'), as used by the
+    date_from/date_to filters. An empty prefix is the start of time.
+    """
+    if not prefix:
+        return 0
+    return to_epoch(prefix + '0000-01-01 00:00:00'[len(prefix):])
+
+
+def status_code(name):
+    """
+    Stored code of an event status; ValueError for unknown statuses.
+    """
+    try:
+        return STATUS_CODES[name]
+    except KeyError:
+        raise ValueError(f"Invalid status: {name}") from None
+
+
+def status_name(code):
+    return None if code is None else EVENT_STATUSES[code - 1]
+
+
+def encode_event(timestamp, status):
+    """
+    (timestamp, status) as stored.
+    """
+    return to_epoch(timestamp), status_code(status)
+
+
+def insert_event(cursor, package_id, location_id, timestamp, status, notes=None, notify=True):
+    """
+    Insert a tracking event (timestamp and status in their text forms). With
+    EVENT_PARTITIONS on it goes to its month's partition instead of the live
+    table (see partitions.event_month). Returns the event_id.
+
+    The event is logged to ChangeLog (changes.py), and with `notify` also
+    queued in the outbox for each of the customer's webhook subscriptions,
+    in the same transaction (webhooks.py). Cached tracking payloads of the
+    package are dropped in every worker when the transaction commits.
+
+    Events get the package's next sequence number (Package.last_event_seq),
+    so history and the latest event are read in seq order. A late arrival,
+    scanned before events already recorded but uploaded after them, takes
+    the seq of the first event scanned after it and moves those up by one:
+    the order is always scan time, with same-second scans in arrival order.
+    With partitions on, hint the package first so all of its months are
+    attached.
+    """
+    stored_time, code = encode_event(timestamp, status)
+    tables = ['TrackingEvent']
+    table = 'TrackingEvent'
+    if EVENT_PARTITIONS:
+        import partitions
+        table = partitions.insert_table(cursor.connection,
+                                        partitions.event_month(cursor.connection, package_id, stored_time))
+        tables = partitions.event_tables(cursor.connection)
+
+    row = cursor.execute(
+        "UPDATE Package SET last_event_seq = last_event_seq + 1 WHERE package_id = ? RETURNING last_event_seq",
+        (package_id,)
+    ).fetchone()
+    if row is None:
+        raise ValueError(f"Package {package_id} not found")
+    seq = row[0]
+
+    later = [cursor.execute(f"SELECT MIN(seq) FROM {t} WHERE package_id = ? AND timestamp > ?",
+                            (package_id, stored_time)).fetchone()[0] for t in tables]
+    later = [s for s in later if s is not None]
+    if later:
+        seq = min(later)
+        for t in tables:
+            # Two steps, so the unique (package_id, seq) index never sees a duplicate
+            cursor.execute(f"UPDATE {t} SET seq = -(seq + 1) WHERE package_id = ? AND seq >= ?", (package_id, seq))
+            cursor.execute(f"UPDATE {t} SET seq = -seq WHERE package_id = ? AND seq < 0", (package_id,))
+
+    cursor.execute(f"""
+        INSERT INTO {table} (package_id, seq, location_id, timestamp, status, notes)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (package_id, seq, location_id, stored_time, code, notes))
+    event_id = cursor.lastrowid
+    import changes
+    changes.record(cursor, 'tracking_event', event_id, 'insert', {
+        'event_id': event_id, 'package_id': package_id, 'location_id': location_id,
+        'timestamp': stored_time, 'status': code, 'notes': notes,
+    })
+    cache_bus.publish(cursor.connection, 'tracking', package_id)
+    if notify:
+        import webhooks
+        webhooks.enqueue(cursor, event_id, package_id, location_id, stored_time, code, notes)
+    return event_id
+
+
+def enable_wal():
+    """
+    Switch the database file to write-ahead logging so that readers in other
+    worker processes don't block the writer. The mode is persistent.
+    """
+    conn = _connect(DB_PATH)
+    mode = conn.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+    conn.close()
+    return mode
+
+
+def init_db(version=None):
+    """
+    Initialize the database by migrating the schema (to `version`, default
+    the latest) and adding sample data.
+    """
+    import ledger
+    import migrations
+
+    # Unpooled: the schema script turns on PRAGMAs that must not leak into the pool
+    conn = _connect(DB_PATH)
+    migrations.migrate(conn, target=version, off_peak=True, log=lambda message: None)
     cursor = conn.cursor()
+    # Sample events in the format of the schema version being built
+    version_built = migrations.current_version(conn)
+
+    def add_event(package_id, location_id, timestamp, status, notes):
+        if version_built >= migrations.SEQUENCED_EVENTS:
+            # Sample data has no subscribers (and the outbox may not exist yet)
+            return insert_event(cursor, package_id, location_id, timestamp, status, notes, notify=False)
+        if version_built >= migrations.COMPACT_EVENTS:
+            timestamp, status = encode_event(timestamp, status)
+        cursor.execute("""
+            INSERT INTO TrackingEvent (package_id, location_id, timestamp, status, notes)
+            VALUES (?, ?, ?, ?, ?)
+        """, (package_id, location_id, timestamp, status, notes))
     
     # Create admin user
     cursor.execute("""
@@ -276,16 +834,13 @@ def init_db():
         package_id = cursor.lastrowid
 
         # Add tracking event for the package
-        cursor.execute("""
-            INSERT INTO TrackingEvent (package_id, location_id, timestamp, status, notes)
-            VALUES (?, ?, ?, ?, ?)
-        """, (
+        add_event(
             package_id,
             1,  # location_id (warehouse)
             "2025-12-01 10:30:00",
             "processing",
             "Package received at distribution center"
-        ))
+        )
     
     # ===== CONTRACT CUSTOMER =====
     # Create contract customer user
@@ -354,104 +909,77 @@ def init_db():
                     deliver_dt = datetime.strptime(delivery_date, '%Y-%m-%d %H:%M:%S')
                     
                     # Event 1: Package received at origin
-                    cursor.execute("""
-                        INSERT INTO TrackingEvent (package_id, location_id, timestamp, status, notes)
-                        VALUES (?, ?, ?, ?, ?)
-                    """, (pkg_id, 1, ship_date, "arrived", "Package received at origin facility"))
+                    add_event(pkg_id, 1, ship_date, "arrived", "Package received at origin facility")
                     
                     # Event 2: Departed origin (2 hours later)
                     event2_time = (ship_dt + timedelta(hours=2)).strftime('%Y-%m-%d %H:%M:%S')
-                    cursor.execute("""
-                        INSERT INTO TrackingEvent (package_id, location_id, timestamp, status, notes)
-                        VALUES (?, ?, ?, ?, ?)
-                    """, (pkg_id, 1, event2_time, "departed", "Departed origin facility"))
+                    add_event(pkg_id, 1, event2_time, "departed", "Departed origin facility")
                     
                     # Event 3: In transit on plane/truck (halfway through journey)
                     mid_time = ship_dt + (deliver_dt - ship_dt) / 2
-                    cursor.execute("""
-                        INSERT INTO TrackingEvent (package_id, location_id, timestamp, status, notes)
-                        VALUES (?, ?, ?, ?, ?)
-                    """, (pkg_id, 4, mid_time.strftime('%Y-%m-%d %H:%M:%S'), "loaded", "In transit"))
+                    add_event(pkg_id, 4, mid_time.strftime('%Y-%m-%d %H:%M:%S'), "loaded", "In transit")
                     
                     # Event 4: Arrived at destination facility (2 hours before delivery)
                     event4_time = (deliver_dt - timedelta(hours=2)).strftime('%Y-%m-%d %H:%M:%S')
-                    cursor.execute("""
-                        INSERT INTO TrackingEvent (package_id, location_id, timestamp, status, notes)
-                        VALUES (?, ?, ?, ?, ?)
-                    """, (pkg_id, 2, event4_time, "arrived", "Arrived at destination facility"))
+                    add_event(pkg_id, 2, event4_time, "arrived", "Arrived at destination facility")
                     
                     # Event 5: Out for delivery (30 min before delivery)
                     event5_time = (deliver_dt - timedelta(minutes=30)).strftime('%Y-%m-%d %H:%M:%S')
-                    cursor.execute("""
-                        INSERT INTO TrackingEvent (package_id, location_id, timestamp, status, notes)
-                        VALUES (?, ?, ?, ?, ?)
-                    """, (pkg_id, 3, event5_time, "out for delivery", "Out for delivery"))
+                    add_event(pkg_id, 3, event5_time, "out for delivery", "Out for delivery")
                     
                     # Event 6: Delivered
-                    cursor.execute("""
-                        INSERT INTO TrackingEvent (package_id, location_id, timestamp, status, notes)
-                        VALUES (?, ?, ?, ?, ?)
-                    """, (pkg_id, 3, delivery_date, "delivered", "Delivered and signed for"))
+                    add_event(pkg_id, 3, delivery_date, "delivered", "Delivered and signed for")
                     
                 else:  # In transit packages
                     # Event 1: Package received
-                    cursor.execute("""
-                        INSERT INTO TrackingEvent (package_id, location_id, timestamp, status, notes)
-                        VALUES (?, ?, ?, ?, ?)
-                    """, (pkg_id, 1, ship_date, "arrived", "Package received at origin facility"))
+                    add_event(pkg_id, 1, ship_date, "arrived", "Package received at origin facility")
                     
                     # Event 2: Processing (1 hour later)
                     ship_dt = datetime.strptime(ship_date, '%Y-%m-%d %H:%M:%S')
                     event2_time = (ship_dt + timedelta(hours=1)).strftime('%Y-%m-%d %H:%M:%S')
-                    cursor.execute("""
-                        INSERT INTO TrackingEvent (package_id, location_id, timestamp, status, notes)
-                        VALUES (?, ?, ?, ?, ?)
-                    """, (pkg_id, 1, event2_time, "processing", "Package is being processed for shipment"))
+                    add_event(pkg_id, 1, event2_time, "processing", "Package is being processed for shipment")
             
             # Create billing statements for contract customer
             # November statement (closed/paid)
             cursor.execute("""
                 INSERT INTO BillingStatement (customer_id, statement_month, total_amount, status)
                 VALUES (?, ?, ?, ?)
-            """, (contract_customer_id, "2025-11", 65.97, "paid"))
+            """, (contract_customer_id, "2025-11", 0.00, "paid"))
             
             nov_statement_id = cursor.lastrowid
             
-            # Link November packages to statement
-            cursor.execute("""
-                INSERT INTO StatementPackage (statement_id, package_id)
-                VALUES (?, ?)
-            """, (nov_statement_id, package_ids[0]))
-            
-            cursor.execute("""
-                INSERT INTO StatementPackage (statement_id, package_id)
-                VALUES (?, ?)
-            """, (nov_statement_id, package_ids[1]))
-            
             # December statement (unpaid)
             cursor.execute("""
                 INSERT INTO BillingStatement (customer_id, statement_month, total_amount, status)
                 VALUES (?, ?, ?, ?)
-            """, (contract_customer_id, "2025-12", 35.98, "unpaid"))
+            """, (contract_customer_id, "2025-12", 0.00, "unpaid"))
             
             dec_statement_id = cursor.lastrowid
             
-            # Link December packages to statement
-            cursor.execute("""
-                INSERT INTO StatementPackage (statement_id, package_id)
-                VALUES (?, ?)
-            """, (dec_statement_id, package_ids[2]))
+            # Charge each package to its statement through the ledger so the
+            # statement totals and running balance start out consistent
+            statement_for = [nov_statement_id, nov_statement_id, dec_statement_id, dec_statement_id]
+            for pkg_id, pkg_data, statement_id in zip(package_ids, packages_data, statement_for):
+                price = cursor.execute(
+                    "SELECT base_price FROM ServiceType WHERE service_id = ?",
+                    (pkg_data[10],)
+                ).fetchone()['base_price']
+                ledger.record_charge(cursor, contract_customer_id, price, pkg_id,
+                                     statement_id=statement_id, created_at=pkg_data[-2])
             
-            cursor.execute("""
-                INSERT INTO StatementPackage (statement_id, package_id)
-                VALUES (?, ?)
-            """, (dec_statement_id, package_ids[3]))
+            nov_total = cursor.execute(
+                "SELECT total_amount FROM BillingStatement WHERE statement_id = ?",
+                (nov_statement_id,)
+            ).fetchone()['total_amount']
             
             # Add payment for November statement
             cursor.execute("""
                 INSERT INTO Payment (customer_id, date_paid, amount, method)
                 VALUES (?, ?, ?, ?)
-            """, (contract_customer_id, "2025-11-30 16:00:00", 65.97, "account"))
+            """, (contract_customer_id, "2025-11-30 16:00:00", nov_total, "account"))
+            
+            ledger.record_payment(cursor, contract_customer_id, nov_total, cursor.lastrowid,
+                                  statement_id=nov_statement_id, created_at="2025-11-30 16:00:00")
     
     conn.commit()
     conn.close()
@@ -0,0 +1,121 @@
+# backend/debug.py
+"""
+debug.py - Diagnostics routes (admin only)
+
+GET    /debug/trace   recent request traces from this worker's ring buffer
+POST   /debug/trace   switch tracing / the slow-request profiler on or off
+DELETE /debug/trace   clear the buffer
+
+Settings changed here apply to the worker process that served the call.
+"""
+import os
+from flask import Blueprint, current_app, jsonify, request
+from admin import admin_required
+import tracing
+
+debug_routes = Blueprint('debug_routes', __name__)
+
+
+@debug_routes.route('/debug/trace', methods=['GET'])
+@admin_required
+def get_traces():
+    """
+    Recent request traces from this worker process (admin only)
+    ---
+    parameters:
+      - in: query
+        name: limit
+        schema:
+          type: integer
+          default: 50
+      - in: query
+        name: min_ms
+        description: Only traces at least this slow
+        schema:
+          type: number
+      - in: query
+        name: path
+        description: Only traces whose path starts with this prefix
+        schema:
+          type: string
+    responses:
+      200:
+        description: Traces, newest first
+      403:
+        description: Admin access required
+    """
+    limit = request.args.get('limit', 50, type=int)
+    min_ms = request.args.get('min_ms', 0, type=float)
+    prefix = request.args.get('path', '')
+
+    selected = []
+    for trace in reversed(list(tracing.traces)):
+        if len(selected) >= limit:
+            break
+        if trace.duration * 1000 >= min_ms and trace.path.startswith(prefix):
+            selected.append(trace.to_dict())
+
+    config = current_app.config
+    return jsonify({
+        'enabled': config['TRACE_ENABLED'],
+        'profile_slow_ms': config['TRACE_PROFILE_SLOW_MS'],
+        'buffered': len(tracing.traces),
+        'pid': os.getpid(),
+        'traces': selected
+    }), 200
+
+
+@debug_routes.route('/debug/trace', methods=['POST'])
+@admin_required
+def configure_tracing():
+    """
+    Turn tracing and the slow-request profiler on or off in this worker (admin only)
+    ---
+    parameters:
+      - in: body
+        name: body
+        schema:
+          properties:
+            enabled:
+              type: boolean
+            profile_slow_ms:
+              type: number
+              description: Profile requests slower than this; 0 disables the profiler
+    responses:
+      200:
+        description: Updated settings
+      400:
+        description: Invalid settings
+    """
+    data = request.get_json(silent=True) or {}
+    config = current_app.config
+    try:
+        if 'enabled' in data:
+            config['TRACE_ENABLED'] = bool(data['enabled'])
+        if 'profile_slow_ms' in data:
+            config['TRACE_PROFILE_SLOW_MS'] = max(0.0, float(data['profile_slow_ms']))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'profile_slow_ms must be a number'}), 400
+
+    if not config['TRACE_ENABLED'] or config['TRACE_PROFILE_SLOW_MS'] == 0:
+        tracing.sampler.stop()
+
+    return jsonify({
+        'enabled': config['TRACE_ENABLED'],
+        'profile_slow_ms': config['TRACE_PROFILE_SLOW_MS'],
+        'pid': os.getpid()
+    }), 200
+
+
+@debug_routes.route('/debug/trace', methods=['DELETE'])
+@admin_required
+def clear_traces():
+    """
+    Empty this worker's trace buffer (admin only)
+    ---
+    responses:
+      200:
+        description: Buffer cleared
+    """
+    tracing.traces.clear()
+    return jsonify({'message': 'Trace buffer cleared'}), 200
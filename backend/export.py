@@ -0,0 +1,341 @@
+# backend/export.py
+"""
+export.py - Streaming CSV/NDJSON export routes
+
+Rows are pulled from the SQLite cursor one at a time and written into
+~64 KiB chunks, so memory stays flat no matter how many rows are exported.
+The response has no Content-Length and goes out with chunked transfer
+encoding; pass gzip=1 to compress the stream on the fly.
+"""
+import csv
+import io
+import itertools
+import json
+import zlib
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from functools import wraps
+from db import epoch_bound, from_epoch, status_name, user_connection
+from admin import staff_required
+import archive
+import queries
+import sharding
+import tracking_numbers
+
+export_routes = Blueprint('export_routes', __name__)
+
+CHUNK_SIZE = 64 * 1024
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson'
+}
+
+
+def login_required(f):
+    """
+    Decorator to require authentication for routes.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        auth_header = request.headers.get('Authorization')
+        if not auth_header:
+            return jsonify({'error': 'Authentication required'}), 401
+
+        try:
+            token = auth_header.split(' ')[1]
+            user_id = int(token)
+            request.user_id = user_id
+        except (IndexError, ValueError):
+            return jsonify({'error': 'Invalid token'}), 401
+
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def _csv_chunks(cursor, columns):
+    """
+    Yield CSV text in chunks of roughly CHUNK_SIZE characters.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in cursor:
+        writer.writerow(row)
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _ndjson_chunks(cursor, columns):
+    """
+    Yield newline-delimited JSON objects in chunks of roughly CHUNK_SIZE characters.
+    """
+    parts = []
+    size = 0
+    for row in cursor:
+        line = json.dumps(dict(zip(columns, row)), separators=(',', ':'))
+        parts.append(line)
+        size += len(line) + 1
+        if size >= CHUNK_SIZE:
+            parts.append('')
+            yield '\n'.join(parts)
+            parts = []
+            size = 0
+    if parts:
+        parts.append('')
+        yield '\n'.join(parts)
+
+
+def _gzip_chunks(chunks):
+    """
+    Compress a stream of text chunks into a gzip byte stream.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _close(conns):
+    for conn in conns:
+        conn.close()
+
+
+def _public_first(row):
+    return (tracking_numbers.public(row[0]), *row[1:])
+
+
+def _public_last(row):
+    return (*row[:-1], tracking_numbers.public(row[-1]))
+
+
+def stream_query(conns, query, params, filename, convert=None):
+    """
+    Build a streaming Response for a query over one connection or a list of
+    them (one per shard, streamed one after another). `convert`, when given,
+    maps each row tuple before it is written. The connections are closed
+    when the stream finishes or the response is closed, whichever is first
+    (the client may go away before the first chunk is pulled).
+    """
+    if not isinstance(conns, list):
+        conns = [conns]
+    fmt = request.args.get('format', 'csv')
+    if fmt not in FORMATS:
+        _close(conns)
+        return jsonify({'error': f'Unsupported format: {fmt}'}), 400
+
+    cursors = [conn.execute(query, params) for conn in conns]
+    columns = [d[0] for d in cursors[0].description]
+    cursor = itertools.chain.from_iterable(cursors)
+    if convert is not None:
+        cursor = map(convert, cursor)
+    rows = _csv_chunks(cursor, columns) if fmt == 'csv' else _ndjson_chunks(cursor, columns)
+
+    closed = []
+
+    def close():
+        if not closed:
+            closed.append(True)
+            _close(conns)
+
+    def generate():
+        try:
+            yield from rows
+        finally:
+            close()
+
+    body = generate()
+    headers = {'Content-Disposition': f'attachment; filename="{filename}.{fmt}"'}
+    if request.args.get('gzip') in ('1', 'true'):
+        body = _gzip_chunks(body)
+        headers['Content-Encoding'] = 'gzip'
+
+    response = Response(stream_with_context(body), mimetype=FORMATS[fmt], headers=headers)
+    # A generator that never started has no finally to run: also close with the response
+    response.call_on_close(close)
+    return response
+
+
+def _customer_id(conn):
+    """
+    Return the customer_id of the authenticated user, or None.
+    """
+    customer = conn.execute(queries.CUSTOMER_ID, (request.user_id,)).fetchone()
+    return customer['customer_id'] if customer else None
+
+
+@export_routes.route('/export/statements/<int:statement_id>', methods=['GET'])
+@login_required
+def export_statement(statement_id):
+    """
+    Stream the packages on one of the customer's billing statements.
+    ---
+    parameters:
+      - in: path
+        name: statement_id
+        required: true
+        schema:
+          type: integer
+      - in: query
+        name: format
+        schema:
+          type: string
+          enum: [csv, ndjson]
+      - in: query
+        name: gzip
+        schema:
+          type: boolean
+    responses:
+      200:
+        description: Statement lines as CSV or NDJSON
+      403:
+        description: Statement not found or unauthorized
+    """
+    conn = user_connection(request.user_id)
+
+    try:
+        customer_id = _customer_id(conn)
+        statement = conn.execute(queries.STATEMENT_ID, (statement_id, customer_id)).fetchone()
+
+        if not statement:
+            conn.close()
+            return jsonify({'error': 'Statement not found or unauthorized'}), 403
+
+        query, copies = archive.union_all(conn, queries.EXPORT_STATEMENT)
+        return stream_query(conn, query, (statement_id,) * copies, f'statement-{statement_id}',
+                            convert=_public_first)
+
+    except Exception as e:
+        conn.close()
+        return jsonify({'error': str(e)}), 500
+
+
+@export_routes.route('/export/payment-history', methods=['GET'])
+@login_required
+def export_payment_history():
+    """
+    Stream the customer's payment history.
+    ---
+    parameters:
+      - in: query
+        name: format
+        schema:
+          type: string
+          enum: [csv, ndjson]
+      - in: query
+        name: gzip
+        schema:
+          type: boolean
+    responses:
+      200:
+        description: Payments as CSV or NDJSON
+      404:
+        description: Customer profile not found
+    """
+    conn = user_connection(request.user_id)
+
+    try:
+        customer_id = _customer_id(conn)
+        if customer_id is None:
+            conn.close()
+            return jsonify({'error': 'Customer profile not found'}), 404
+
+        return stream_query(conn, queries.EXPORT_PAYMENTS, (customer_id,), 'payment-history', convert=_public_last)
+
+    except Exception as e:
+        conn.close()
+        return jsonify({'error': str(e)}), 500
+
+
+@export_routes.route('/export/packages', methods=['GET'])
+@staff_required
+def export_packages():
+    """
+    Stream every package in the system, optionally limited to a ship-date range.
+    ---
+    parameters:
+      - in: query
+        name: date_from
+        schema:
+          type: string
+      - in: query
+        name: date_to
+        schema:
+          type: string
+      - in: query
+        name: format
+        schema:
+          type: string
+          enum: [csv, ndjson]
+      - in: query
+        name: gzip
+        schema:
+          type: boolean
+    responses:
+      200:
+        description: Packages as CSV or NDJSON
+    """
+    conns = sharding.connections(replica=True)
+
+    try:
+        return stream_query(conns, queries.EXPORT_PACKAGES, (
+            request.args.get('date_from', ''),
+            request.args.get('date_to', '9999'),
+        ), 'packages', convert=_public_first)
+
+    except Exception as e:
+        _close(conns)
+        return jsonify({'error': str(e)}), 500
+
+
+def _event_row(row):
+    event_id, package_id, timestamp, status, *rest = row
+    return (event_id, tracking_numbers.public(package_id), from_epoch(timestamp), status_name(status), *rest)
+
+
+@export_routes.route('/export/tracking-events', methods=['GET'])
+@staff_required
+def export_tracking_events():
+    """
+    Stream tracking events, optionally limited to a time range.
+    ---
+    parameters:
+      - in: query
+        name: date_from
+        schema:
+          type: string
+      - in: query
+        name: date_to
+        schema:
+          type: string
+      - in: query
+        name: format
+        schema:
+          type: string
+          enum: [csv, ndjson]
+      - in: query
+        name: gzip
+        schema:
+          type: boolean
+    responses:
+      200:
+        description: Tracking events as CSV or NDJSON
+    """
+    conns = sharding.connections(replica=True)
+
+    try:
+        return stream_query(conns, queries.EXPORT_EVENTS, (
+            epoch_bound(request.args.get('date_from', '')),
+            epoch_bound(request.args.get('date_to', '9999')),
+        ), 'tracking-events', convert=_event_row)
+
+    except ValueError as e:
+        _close(conns)
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        _close(conns)
+        return jsonify({'error': str(e)}), 500
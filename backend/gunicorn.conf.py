@@ -0,0 +1,65 @@
+# backend/gunicorn.conf.py
+"""
+gunicorn.conf.py - Production serving configuration
+
+Runs the API under gunicorn's pre-fork server:
+
+    gunicorn -c gunicorn.conf.py main:app
+
+The app is imported once in the master (preload_app) and forked into
+WEB_CONCURRENCY worker processes, each serving WEB_THREADS requests at a
+time. After the fork every worker opens its own SQLite connection pool and
+warms the reference caches before it accepts traffic.
+
+Threads don't survive fork(), so background threads (replica refresher,
+webhook delivery) are not started in the master: DEFER_BACKGROUND holds
+them back in create_app() and each worker starts its own in post_fork.
+Their lock files make sure only one worker does the work at a time.
+
+Graceful reload: `kill -HUP <master pid>` starts a fresh set of workers and
+lets the old ones finish their in-flight requests (up to graceful_timeout)
+while the listening socket stays open, so no request is dropped. Because the
+app is preloaded, new code needs a new master: `kill -USR2 <master pid>`,
+then `kill -TERM <old master pid>` once the new one is serving.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('WEB_THREADS', 4))
+worker_class = 'gthread'
+preload_app = True
+keepalive = 5
+timeout = 30
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', 30))
+# Recycle workers now and then so slow leaks can't accumulate
+max_requests = int(os.environ.get('MAX_REQUESTS', 10000))
+max_requests_jitter = max_requests // 10
+accesslog = os.environ.get('ACCESS_LOG', '-')
+
+# One pooled connection per worker thread unless overridden
+os.environ.setdefault('DB_POOL_SIZE', str(threads))
+# The preloaded master must not start background threads; workers do (post_fork)
+os.environ['DEFER_BACKGROUND'] = '1'
+
+# Requests served by each worker right after fork to fill its caches
+WARM_PATHS = ['/', '/api/services']
+
+
+def on_starting(server):
+    import db
+    mode = db.enable_wal()
+    server.log.info("SQLite journal mode: %s", mode)
+
+
+def post_fork(server, worker):
+    import db
+    from main import app, start_background
+
+    db.get_pool().warm()
+    client = app.test_client()
+    for path in WARM_PATHS:
+        client.get(path)
+    start_background()
+    server.log.info("Worker %s warmed (%s)", worker.pid, ', '.join(WARM_PATHS))
@@ -0,0 +1,777 @@
+# backend/jobs.py
+"""
+jobs.py - Persistent background jobs for long-running operations
+
+Exports, remittance imports and billing checks can take longer than a
+proxy will wait and tie up a web worker meanwhile. Submitted as jobs they
+return 202 with a job id at once and run in a separate pool of worker
+processes:
+
+    POST /api/jobs/export          {"path": "/api/export/packages", "query": {"format": "csv"}}
+    POST /api/jobs/reconcile       remittance CSV (multipart "file" or text/csv body), admin
+    POST /api/jobs/billing-verify  {"fix": false}, admin
+    GET  /api/jobs                 the caller's recent jobs
+    GET  /api/jobs/<id>            state, progress, error, result
+    GET  /api/jobs/<id>/result     the result file (exports, reconcile exceptions)
+    POST /api/jobs/<id>/cancel
+
+Jobs live in their own SQLite file (JOBS_PATH, default shipping-jobs.db next
+to DB_PATH) so queue traffic never contends with the main database, and
+uploads and result files in JOBS_DIR. A job is queued -> running ->
+succeeded | failed | cancelled.
+
+Workers claim the next job in one write transaction, lowest priority class
+first (interactive before bulk), oldest first. At most JOB_BULK_SLOTS bulk
+jobs run at a time across all workers, so with more workers than that an
+interactive job (a single statement export) never waits behind imports.
+A running job heartbeats from a side thread of its worker (and whenever it
+reports progress); a job whose worker died (no heartbeat for JOB_LEASE
+seconds) is queued again, and the lost worker's late result is dropped. Failures other
+than bad input are retried up to the kind's attempt limit with exponential
+backoff. Cancelling a queued job is immediate; a running one stops at its
+next progress report.
+
+    python jobs.py work [--processes 2]
+    python jobs.py list
+    python jobs.py purge [--days 7]
+"""
+import argparse
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import sqlite3
+import sys
+import threading
+import time
+from functools import wraps
+from flask import Blueprint, jsonify, request, send_file
+import db
+import ledger
+import reconcile
+import sharding
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_BULK_SLOTS = int(os.environ.get('JOB_BULK_SLOTS', 1))
+JOB_LEASE = float(os.environ.get('JOB_LEASE', 300))
+JOB_RETRY_DELAY = float(os.environ.get('JOB_RETRY_DELAY', 5))
+JOB_POLL = float(os.environ.get('JOB_POLL', 0.5))
+JOB_RETENTION_DAYS = float(os.environ.get('JOB_RETENTION_DAYS', 7))
+
+PRIORITIES = {'interactive': 0, 'bulk': 1}
+BULK = PRIORITIES['bulk']
+FINISHED = ('succeeded', 'failed', 'cancelled')
+
+logger = logging.getLogger('jobs')
+
+jobs_routes = Blueprint('jobs_routes', __name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS Job (
+    job_id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind             TEXT NOT NULL,
+    params           TEXT NOT NULL,
+    priority         INTEGER NOT NULL,
+    state            TEXT NOT NULL DEFAULT 'queued'
+                     CHECK (state IN ('queued', 'running', 'succeeded', 'failed', 'cancelled')),
+    created_by       INTEGER NOT NULL,
+    created_at       REAL NOT NULL,
+    run_after        REAL,
+    attempts         INTEGER NOT NULL DEFAULT 0,
+    max_attempts     INTEGER NOT NULL,
+    started_at       REAL,
+    heartbeat        REAL,
+    finished_at      REAL,
+    worker           TEXT,
+    progress         REAL,
+    progress_note    TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    result           TEXT,
+    result_file      TEXT,
+    error            TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_job_queue ON Job(priority, job_id) WHERE state = 'queued';
+CREATE INDEX IF NOT EXISTS idx_job_running ON Job(heartbeat) WHERE state = 'running';
+CREATE INDEX IF NOT EXISTS idx_job_owner ON Job(created_by, job_id);
+"""
+
+
+def jobs_path():
+    return os.environ.get('JOBS_PATH') or os.path.splitext(db.DB_PATH)[0] + '-jobs.db'
+
+
+def jobs_dir():
+    return os.environ.get('JOBS_DIR') or os.path.splitext(db.DB_PATH)[0] + '-jobs'
+
+
+_ready = set()
+
+
+def connect():
+    """
+    Connection to the job store, creating it on first use.
+    """
+    path = jobs_path()
+    conn = db._connect(path, timeout=30)
+    if path not in _ready:
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.executescript(SCHEMA)
+        os.makedirs(jobs_dir(), exist_ok=True)
+        _ready.add(path)
+    return conn
+
+
+# ---------------------------------------------------------------------
+# Job kinds
+# ---------------------------------------------------------------------
+
+class JobError(Exception):
+    """
+    The job can't succeed as submitted; fail it without retrying.
+    """
+
+
+class Cancelled(Exception):
+    pass
+
+
+class Kind:
+    def __init__(self, name, fn, priority, max_attempts):
+        self.name = name
+        self.fn = fn
+        self.priority = priority
+        self.max_attempts = max_attempts
+
+
+KINDS = {}
+
+
+def kind(name, priority='bulk', max_attempts=3):
+    """
+    Register the decorated function as the runner for job kind `name`.
+    It is called as fn(job, ctx) and returns a JSON-able result.
+    """
+    def register(fn):
+        KINDS[name] = Kind(name, fn, PRIORITIES[priority], max_attempts)
+        return fn
+    return register
+
+
+class Context:
+    """
+    Handed to a running job: progress reporting (which also heartbeats and
+    notices cancellation) and the job's files.
+    """
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.result_file = None
+
+    def progress(self, fraction=None, note=None):
+        conn = connect()
+        try:
+            conn.execute("UPDATE Job SET progress = COALESCE(?, progress), progress_note = ?, heartbeat = ? "
+                         "WHERE job_id = ?", (fraction, note, time.time(), self.job_id))
+            conn.commit()
+            cancel = conn.execute("SELECT cancel_requested FROM Job WHERE job_id = ?", (self.job_id,)).fetchone()[0]
+        finally:
+            conn.close()
+        if cancel:
+            raise Cancelled()
+
+    def file(self, name):
+        return os.path.join(jobs_dir(), f'{self.job_id}-{name}')
+
+
+@kind('export')
+def run_export(job, ctx):
+    """
+    Run one of the /api/export endpoints as the submitting user and keep
+    the streamed body as the result file.
+    """
+    import main
+    params = json.loads(job['params'])
+    response = main.app.test_client().get(params['path'], query_string=params.get('query') or {},
+                                          headers={'Authorization': f"Bearer {job['created_by']}"}, buffered=False)
+    try:
+        if response.status_code != 200:
+            raise JobError(f"{response.status_code}: {response.get_data(as_text=True)[:200]}")
+        ext = {'text/csv': 'csv', 'application/x-ndjson': 'ndjson'}.get(response.mimetype, 'out')
+        ctx.result_file = ctx.file(f'export.{ext}' + ('.gz' if response.headers.get('Content-Encoding') == 'gzip' else ''))
+        written = 0
+        with open(ctx.result_file, 'wb') as f:
+            for chunk in response.response:
+                f.write(chunk if isinstance(chunk, bytes) else chunk.encode('utf-8'))
+                written += len(chunk)
+                ctx.progress(note=f'{written} bytes')
+    finally:
+        response.close()
+    return {'bytes': written, 'mimetype': response.mimetype}
+
+
+@kind('reconcile', max_attempts=1)
+def run_reconcile(job, ctx):
+    """
+    Apply an uploaded remittance file; exceptions go to the result file.
+    Not retried: batches already committed would be applied twice.
+    """
+    upload = ctx.file('remittance.csv')
+    with open(upload, encoding='utf-8-sig', newline='') as f:
+        total = max(sum(1 for _ in f) - 1, 1)
+    ctx.result_file = ctx.file('exceptions.csv')
+    conns = sharding.connections()
+    try:
+        with open(upload, encoding='utf-8-sig', newline='') as lines, \
+                open(ctx.result_file, 'w', newline='') as out:
+            report = csv.DictWriter(out, fieldnames=reconcile.EXCEPTION_FIELDS)
+            report.writeheader()
+            return reconcile.import_remittance(
+                conns, lines, report=report,
+                progress=lambda summary: ctx.progress(summary['lines'] / total, f"{summary['lines']} of {total} lines"))
+    finally:
+        for conn in conns:
+            conn.close()
+
+
+@kind('billing-verify')
+def run_billing_verify(job, ctx):
+    """
+    Recompute balances and statement totals from the ledger (and repair
+    them with fix).
+    """
+    ctx.progress(0, 'recomputing')
+    fix = json.loads(job['params']).get('fix')
+    drift = ledger.verify_all(fix)
+    return {'drift': drift, 'repaired': bool(fix)}
+
+
+# ---------------------------------------------------------------------
+# Queue
+# ---------------------------------------------------------------------
+
+def submit(kind_name, params, user_id, priority=None, hold=False):
+    """
+    Queue a job and return its id. A held job isn't claimed until
+    release() is called, e.g. once its upload is on disk.
+    """
+    spec = KINDS[kind_name]
+    now = time.time()
+    conn = connect()
+    try:
+        cursor = conn.execute("""
+            INSERT INTO Job (kind, params, priority, created_by, created_at, run_after, max_attempts)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (kind_name, json.dumps(params), spec.priority if priority is None else PRIORITIES[priority],
+              user_id, now, None if hold else now, spec.max_attempts))
+        conn.commit()
+        return cursor.lastrowid
+    finally:
+        conn.close()
+
+
+def release(job_id):
+    """
+    Make a held job runnable.
+    """
+    conn = connect()
+    try:
+        conn.execute("UPDATE Job SET run_after = ? WHERE job_id = ?", (time.time(), job_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _requeue_lost(conn, now):
+    # Jobs whose worker stopped heartbeating go back to the queue (or fail when out of attempts)
+    conn.execute("""
+        UPDATE Job SET
+            state = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+            error = 'worker lost', finished_at = CASE WHEN attempts >= max_attempts THEN ? END,
+            run_after = ?
+        WHERE state = 'running' AND heartbeat < ?
+    """, (now, now, now - JOB_LEASE))
+
+
+def claim(worker):
+    """
+    Mark the next runnable job as running by `worker` and return it, or None.
+    """
+    conn = connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        now = time.time()
+        _requeue_lost(conn, now)
+        bulk_running = conn.execute("SELECT COUNT(*) FROM Job WHERE state = 'running' AND priority >= ?",
+                                    (BULK,)).fetchone()[0]
+        max_priority = BULK if bulk_running < JOB_BULK_SLOTS else BULK - 1
+        job = conn.execute("""
+            UPDATE Job SET state = 'running', worker = ?, started_at = ?, heartbeat = ?,
+                           attempts = attempts + 1, error = NULL
+            WHERE job_id = (
+                SELECT job_id FROM Job
+                WHERE state = 'queued' AND priority <= ? AND run_after <= ?
+                ORDER BY priority, job_id
+                LIMIT 1
+            )
+            RETURNING *
+        """, (worker, now, now, max_priority, now)).fetchone()
+        conn.commit()
+        return job
+    finally:
+        conn.close()
+
+
+def _finish(job, **fields):
+    # Only the claim that is still running may finish it: after a lost lease
+    # the job belongs to the queue (or to the worker that claimed it again)
+    fields['finished_at'] = time.time()
+    conn = connect()
+    try:
+        assignments = ', '.join(f'{name} = ?' for name in fields)
+        conn.execute(f"UPDATE Job SET {assignments} WHERE job_id = ? AND state = 'running' AND attempts = ?",
+                     (*fields.values(), job['job_id'], job['attempts']))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _retry_or_fail(job, error):
+    if job['attempts'] >= job['max_attempts']:
+        _finish(job, state='failed', error=error)
+        return
+    conn = connect()
+    try:
+        delay = JOB_RETRY_DELAY * 2 ** (job['attempts'] - 1)
+        conn.execute("UPDATE Job SET state = 'queued', run_after = ?, error = ? "
+                     "WHERE job_id = ? AND state = 'running' AND attempts = ?",
+                     (time.time() + delay, error, job['job_id'], job['attempts']))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _heartbeat(job, stopped):
+    # Keeps the lease of a job that runs long between progress reports
+    while not stopped.wait(JOB_LEASE / 3):
+        conn = connect()
+        try:
+            conn.execute("UPDATE Job SET heartbeat = ? WHERE job_id = ? AND state = 'running' AND attempts = ?",
+                         (time.time(), job['job_id'], job['attempts']))
+            conn.commit()
+        except sqlite3.Error:
+            logger.exception("heartbeat for job %s failed", job['job_id'])
+        finally:
+            conn.close()
+
+
+def execute(job):
+    """
+    Run a claimed job to its next state.
+    """
+    ctx = Context(job['job_id'])
+    stopped = threading.Event()
+    threading.Thread(target=_heartbeat, args=(job, stopped), daemon=True,
+                     name=f"job-{job['job_id']}-heartbeat").start()
+    try:
+        result = KINDS[job['kind']].fn(job, ctx)
+    except Cancelled:
+        _finish(job, state='cancelled')
+    except JobError as e:
+        _finish(job, state='failed', error=str(e))
+    except Exception as e:
+        logger.exception("job %s (%s) failed", job['job_id'], job['kind'])
+        _retry_or_fail(job, f'{type(e).__name__}: {e}')
+    else:
+        _finish(job, state='succeeded', progress=1.0, result=json.dumps(result),
+                result_file=ctx.result_file and os.path.basename(ctx.result_file))
+    finally:
+        stopped.set()
+
+
+def run_next(worker=None):
+    """
+    Claim and run one job in this process. Returns its id, or None when
+    nothing is runnable.
+    """
+    job = claim(worker or f'{os.getpid()}')
+    if job is None:
+        return None
+    execute(job)
+    return job['job_id']
+
+
+def cancel(job_id):
+    """
+    Cancel a queued job now, or ask a running one to stop. Returns the new
+    state, or None for an unknown job.
+    """
+    conn = connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT state FROM Job WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        state = row['state']
+        if state == 'queued':
+            conn.execute("UPDATE Job SET state = 'cancelled', finished_at = ? WHERE job_id = ?",
+                         (time.time(), job_id))
+            state = 'cancelled'
+        elif state == 'running':
+            conn.execute("UPDATE Job SET cancel_requested = 1 WHERE job_id = ?", (job_id,))
+        conn.commit()
+        return state
+    finally:
+        conn.close()
+
+
+def purge(days=JOB_RETENTION_DAYS):
+    """
+    Delete finished jobs older than `days` and their files.
+    """
+    cutoff = time.time() - days * 86400
+    conn = connect()
+    try:
+        old = [row[0] for row in conn.execute(
+            "SELECT job_id FROM Job WHERE state IN ('succeeded', 'failed', 'cancelled') AND finished_at < ?",
+            (cutoff,))]
+        for job_id in old:
+            for name in os.listdir(jobs_dir()):
+                if name.startswith(f'{job_id}-'):
+                    os.remove(os.path.join(jobs_dir(), name))
+        conn.executemany("DELETE FROM Job WHERE job_id = ?", ((job_id,) for job_id in old))
+        conn.commit()
+        return len(old)
+    finally:
+        conn.close()
+
+
+def describe(job):
+    """
+    JSON view of a job row.
+    """
+    return {
+        'job_id': job['job_id'],
+        'kind': job['kind'],
+        'priority': 'interactive' if job['priority'] < BULK else 'bulk',
+        'state': job['state'],
+        'progress': job['progress'],
+        'progress_note': job['progress_note'],
+        'attempts': job['attempts'],
+        'created_at': db.from_epoch(job['created_at']),
+        'started_at': db.from_epoch(job['started_at']),
+        'finished_at': db.from_epoch(job['finished_at']),
+        'error': job['error'],
+        'result': json.loads(job['result']) if job['result'] else None,
+        'result_url': f"/api/jobs/{job['job_id']}/result" if job['result_file'] else None,
+    }
+
+
+# ---------------------------------------------------------------------
+# Worker pool
+# ---------------------------------------------------------------------
+
+def work(stopped, name):
+    """
+    One worker: run jobs until `stopped` is set, polling when idle.
+    """
+    while not stopped.is_set():
+        try:
+            if run_next(name) is None:
+                stopped.wait(JOB_POLL)
+        except sqlite3.Error:
+            logger.exception("job worker %s", name)
+            stopped.wait(JOB_POLL)
+
+
+def _worker_process(stopped, number):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    work(stopped, f'{os.getpid()}-{number}')
+
+
+def run_pool(processes=JOB_WORKERS):
+    """
+    Run `processes` worker processes until interrupted; purges old jobs hourly.
+    """
+    stopped = multiprocessing.Event()
+    pool = [multiprocessing.Process(target=_worker_process, args=(stopped, n), name=f'job-worker-{n}')
+            for n in range(processes)]
+    for process in pool:
+        process.start()
+    try:
+        while True:
+            purge()
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stopped.set()
+        for process in pool:
+            process.join()
+
+
+# ---------------------------------------------------------------------
+# Routes
+# ---------------------------------------------------------------------
+
+def login_required(f):
+    """
+    Decorator to require authentication; sets request.user_id and request.user_role.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        auth_header = request.headers.get('Authorization')
+        if not auth_header:
+            return jsonify({'error': 'Authentication required'}), 401
+
+        try:
+            token = auth_header.split(' ')[1]
+            user_id = int(token)
+        except (IndexError, ValueError):
+            return jsonify({'error': 'Invalid token'}), 401
+
+        role = db.user_role(user_id)
+        if role is None:
+            return jsonify({'error': 'Invalid token'}), 401
+        request.user_id = user_id
+        request.user_role = role
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def _accepted(job_id):
+    return jsonify({'job_id': job_id, 'status_url': f'/api/jobs/{job_id}'}), 202
+
+
+def _own_job(job_id):
+    # The job row if the caller may see it (its creator or an admin), else None
+    conn = connect()
+    try:
+        job = conn.execute("SELECT * FROM Job WHERE job_id = ?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+    if job is None or (job['created_by'] != request.user_id and request.user_role != 'admin'):
+        return None
+    return job
+
+
+@jobs_routes.route('/jobs/export', methods=['POST'])
+@login_required
+def submit_export():
+    """
+    Run an export in the background; the file is kept as the job's result.
+    ---
+    parameters:
+      - in: body
+        name: job
+        required: true
+        schema:
+          type: object
+          required:
+            - path
+          properties:
+            path:
+              type: string
+              example: /api/export/packages
+            query:
+              type: object
+              example: {"format": "csv", "gzip": "1"}
+    responses:
+      202:
+        description: Job queued
+      400:
+        description: Not an export path
+    """
+    data = request.get_json() or {}
+    path = data.get('path', '')
+    if not path.startswith('/api/export/'):
+        return jsonify({'error': 'path must be one of the /api/export/ endpoints'}), 400
+    # One statement is small and someone is waiting for it; everything else is bulk
+    priority = 'interactive' if path.startswith('/api/export/statements/') else 'bulk'
+    return _accepted(submit('export', {'path': path, 'query': data.get('query') or {}}, request.user_id, priority))
+
+
+@jobs_routes.route('/jobs/reconcile', methods=['POST'])
+@login_required
+def submit_reconcile():
+    """
+    Import a bank/ACH remittance CSV in the background (admin only).
+    Accepts a multipart upload named "file" or a raw text/csv body.
+    ---
+    consumes:
+      - multipart/form-data
+      - text/csv
+    parameters:
+      - in: formData
+        name: file
+        type: file
+    responses:
+      202:
+        description: Job queued; the result is the import summary, exceptions in the result file
+      403:
+        description: Admin access required
+    """
+    if request.user_role != 'admin':
+        return jsonify({'error': 'Admin access required'}), 403
+    upload = request.files.get('file')
+    stream = upload.stream if upload else request.stream
+
+    job_id = submit('reconcile', {}, request.user_id, hold=True)
+    try:
+        with open(Context(job_id).file('remittance.csv'), 'wb') as f:
+            shutil.copyfileobj(stream, f)
+    except Exception as e:
+        # Never released, the held job would sit in the queue for good
+        cancel(job_id)
+        return jsonify({'error': str(e)}), 500
+    release(job_id)
+    return _accepted(job_id)
+
+
+@jobs_routes.route('/jobs/billing-verify', methods=['POST'])
+@login_required
+def submit_billing_verify():
+    """
+    Recompute balances and statement totals in the background (admin only).
+    ---
+    parameters:
+      - in: body
+        name: job
+        schema:
+          type: object
+          properties:
+            fix:
+              type: boolean
+              description: Repair drifted values
+    responses:
+      202:
+        description: Job queued
+      403:
+        description: Admin access required
+    """
+    if request.user_role != 'admin':
+        return jsonify({'error': 'Admin access required'}), 403
+    data = request.get_json(silent=True) or {}
+    return _accepted(submit('billing-verify', {'fix': bool(data.get('fix'))}, request.user_id))
+
+
+@jobs_routes.route('/jobs', methods=['GET'])
+@login_required
+def list_jobs():
+    """
+    The caller's 50 most recent jobs.
+    ---
+    responses:
+      200:
+        description: Jobs, newest first
+    """
+    conn = connect()
+    try:
+        rows = conn.execute("SELECT * FROM Job WHERE created_by = ? ORDER BY job_id DESC LIMIT 50",
+                            (request.user_id,)).fetchall()
+    finally:
+        conn.close()
+    return jsonify({'jobs': [describe(row) for row in rows]}), 200
+
+
+@jobs_routes.route('/jobs/<int:job_id>', methods=['GET'])
+@login_required
+def get_job(job_id):
+    """
+    State, progress and result of a job.
+    ---
+    parameters:
+      - name: job_id
+        in: path
+        type: integer
+        required: true
+    responses:
+      200:
+        description: The job
+      404:
+        description: Job not found
+    """
+    job = _own_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(describe(job)), 200
+
+
+@jobs_routes.route('/jobs/<int:job_id>/result', methods=['GET'])
+@login_required
+def get_job_result(job_id):
+    """
+    Download a finished job's result file.
+    ---
+    parameters:
+      - name: job_id
+        in: path
+        type: integer
+        required: true
+    responses:
+      200:
+        description: The file
+      404:
+        description: Job not found or it has no result file
+      409:
+        description: Job not finished
+    """
+    job = _own_job(job_id)
+    if job is None or (job['state'] == 'succeeded' and not job['result_file']):
+        return jsonify({'error': 'Job not found or it has no result file'}), 404
+    if job['state'] != 'succeeded':
+        return jsonify({'error': f"Job is {job['state']}"}), 409
+    path = os.path.join(jobs_dir(), job['result_file'])
+    return send_file(path, as_attachment=True, download_name=job['result_file'].split('-', 1)[1])
+
+
+@jobs_routes.route('/jobs/<int:job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_job(job_id):
+    """
+    Cancel a queued job, or ask a running one to stop.
+    ---
+    parameters:
+      - name: job_id
+        in: path
+        type: integer
+        required: true
+    responses:
+      200:
+        description: The job's state after the request
+      404:
+        description: Job not found
+    """
+    if _own_job(job_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({'job_id': job_id, 'state': cancel(job_id)}), 200
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Background job workers")
+    sub = parser.add_subparsers(dest='command', required=True)
+    run = sub.add_parser('work')
+    run.add_argument('--processes', type=int, default=JOB_WORKERS)
+    sub.add_parser('list')
+    old = sub.add_parser('purge')
+    old.add_argument('--days', type=float, default=JOB_RETENTION_DAYS)
+    args = parser.parse_args(argv)
+
+    if args.command == 'work':
+        logging.basicConfig(level=logging.INFO)
+        run_pool(args.processes)
+    elif args.command == 'list':
+        conn = connect()
+        try:
+            for row in conn.execute("SELECT * FROM Job ORDER BY job_id DESC LIMIT 50"):
+                print(json.dumps(describe(row)))
+        finally:
+            conn.close()
+    else:
+        print(f"Purged {purge(args.days)} job(s)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,269 @@
+# backend/ledger.py
+"""
+ledger.py - Append-only billing ledger and running balances
+
+Every charge, payment and adjustment is written to LedgerEntry in the same
+transaction as the write that caused it, and CustomerBalance plus the open
+BillingStatement total are bumped in place. Reads never have to re-aggregate.
+
+Run directly to check (or repair) the incrementally maintained values:
+    python ledger.py verify
+    python ledger.py verify --fix
+"""
+import sys
+from datetime import datetime
+import sharding
+
+# Differences below half a cent are float noise, not drift
+TOLERANCE = 0.005
+
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _append(cursor, customer_id, entry_type, amount, statement_id=None,
+            package_id=None, payment_id=None, memo=None, created_at=None):
+    """
+    Insert one ledger row and apply it to the customer's running balance.
+    """
+    created_at = created_at or _now()
+    cursor.execute("""
+        INSERT INTO LedgerEntry (
+            customer_id, entry_type, amount, statement_id,
+            package_id, payment_id, created_at, memo
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, (customer_id, entry_type, amount, statement_id,
+          package_id, payment_id, created_at, memo))
+    entry_id = cursor.lastrowid
+
+    cursor.execute("""
+        INSERT INTO CustomerBalance (customer_id, balance, last_entry_id, updated_at)
+        VALUES (?, ROUND(?, 2), ?, ?)
+        ON CONFLICT(customer_id) DO UPDATE SET
+            balance = ROUND(balance + excluded.balance, 2),
+            last_entry_id = excluded.last_entry_id,
+            updated_at = excluded.updated_at
+    """, (customer_id, amount, entry_id, created_at))
+
+    if statement_id is not None and entry_type != 'payment':
+        cursor.execute("""
+            UPDATE BillingStatement
+            SET total_amount = ROUND(total_amount + ?, 2)
+            WHERE statement_id = ?
+        """, (amount, statement_id))
+
+    return entry_id
+
+
+def get_open_statement(cursor, customer_id, statement_month=None):
+    """
+    Return the id of the customer's unpaid statement for the month,
+    creating an empty one if it does not exist yet.
+    """
+    statement_month = statement_month or datetime.now().strftime('%Y-%m')
+    statement = cursor.execute("""
+        SELECT statement_id
+        FROM BillingStatement
+        WHERE customer_id = ? AND statement_month = ? AND status = 'unpaid'
+        ORDER BY statement_id DESC
+        LIMIT 1
+    """, (customer_id, statement_month)).fetchone()
+
+    if statement:
+        return statement[0]
+
+    cursor.execute("""
+        INSERT INTO BillingStatement (customer_id, statement_month, total_amount, status)
+        VALUES (?, ?, 0.00, 'unpaid')
+    """, (customer_id, statement_month))
+    return cursor.lastrowid
+
+
+def record_charge(cursor, customer_id, amount, package_id, statement_id=None, created_at=None):
+    """
+    Charge a shipment to the customer. When a statement is given the package
+    is linked to it and the statement total is increased.
+    """
+    if statement_id is not None:
+        cursor.execute("""
+            INSERT INTO StatementPackage (statement_id, package_id)
+            VALUES (?, ?)
+        """, (statement_id, package_id))
+
+    return _append(cursor, customer_id, 'charge', amount,
+                   statement_id=statement_id, package_id=package_id,
+                   memo='Shipment charge', created_at=created_at)
+
+
+def record_payment(cursor, customer_id, amount, payment_id, statement_id=None, created_at=None):
+    """
+    Credit a payment against the customer's balance.
+    """
+    return _append(cursor, customer_id, 'payment', -amount,
+                   statement_id=statement_id, payment_id=payment_id,
+                   memo='Payment received', created_at=created_at)
+
+
+def record_adjustment(cursor, customer_id, amount, memo, statement_id=None):
+    """
+    Apply a manual credit (negative) or debit (positive) to the customer.
+    """
+    return _append(cursor, customer_id, 'adjustment', amount,
+                   statement_id=statement_id, memo=memo)
+
+
+def amount_due(cursor, statement_id):
+    """
+    Return what is still owed on a statement: its total less the payments
+    already posted against it.
+    """
+    row = cursor.execute("""
+        SELECT
+            bs.total_amount,
+            COALESCE((
+                SELECT -SUM(le.amount)
+                FROM LedgerEntry le
+                WHERE le.statement_id = bs.statement_id AND le.entry_type = 'payment'
+            ), 0) as paid
+        FROM BillingStatement bs
+        WHERE bs.statement_id = ?
+    """, (statement_id,)).fetchone()
+    return round(row[0] - row[1], 2) if row else None
+
+
+def settle_if_paid(cursor, statement_id):
+    """
+    Mark the statement paid once nothing is left owing on it.
+    Returns True if the statement is now paid.
+    """
+    due = amount_due(cursor, statement_id)
+    if due is None or due > TOLERANCE:
+        return False
+
+    cursor.execute(
+        "UPDATE BillingStatement SET status = 'paid' WHERE statement_id = ?",
+        (statement_id,)
+    )
+    return True
+
+
+def get_balance(conn, customer_id):
+    """
+    Return the running balance for a customer (0.0 if nothing posted yet).
+    """
+    row = conn.execute(
+        "SELECT balance FROM CustomerBalance WHERE customer_id = ?",
+        (customer_id,)
+    ).fetchone()
+    return row[0] if row else 0.0
+
+
+def verify_balances(conn):
+    """
+    Recompute every balance and statement total from the ledger in bulk
+    and return the rows whose maintained value has drifted.
+    """
+    drift = []
+
+    balances = conn.execute("""
+        SELECT
+            c.customer_id,
+            COALESCE(cb.balance, 0) as maintained,
+            COALESCE(le.total, 0) as expected
+        FROM Customer c
+        LEFT JOIN CustomerBalance cb ON cb.customer_id = c.customer_id
+        LEFT JOIN (
+            SELECT customer_id, ROUND(SUM(amount), 2) as total
+            FROM LedgerEntry
+            GROUP BY customer_id
+        ) le ON le.customer_id = c.customer_id
+    """).fetchall()
+
+    for row in balances:
+        if abs(row[1] - row[2]) > TOLERANCE:
+            drift.append({
+                'kind': 'balance',
+                'customer_id': row[0],
+                'maintained': row[1],
+                'expected': row[2]
+            })
+
+    statements = conn.execute("""
+        SELECT
+            bs.statement_id,
+            bs.customer_id,
+            COALESCE(bs.total_amount, 0) as maintained,
+            COALESCE(le.total, 0) as expected
+        FROM BillingStatement bs
+        LEFT JOIN (
+            SELECT statement_id, ROUND(SUM(amount), 2) as total
+            FROM LedgerEntry
+            WHERE statement_id IS NOT NULL AND entry_type != 'payment'
+            GROUP BY statement_id
+        ) le ON le.statement_id = bs.statement_id
+    """).fetchall()
+
+    for row in statements:
+        if abs(row[2] - row[3]) > TOLERANCE:
+            drift.append({
+                'kind': 'statement',
+                'statement_id': row[0],
+                'customer_id': row[1],
+                'maintained': row[2],
+                'expected': row[3]
+            })
+
+    return drift
+
+
+def rebuild_balances(conn):
+    """
+    Overwrite the maintained balances and statement totals with the values
+    recomputed from the ledger. Returns the drift that was repaired.
+    """
+    drift = verify_balances(conn)
+    cursor = conn.cursor()
+
+    for item in drift:
+        if item['kind'] == 'balance':
+            cursor.execute("""
+                INSERT INTO CustomerBalance (customer_id, balance, last_entry_id, updated_at)
+                VALUES (?, ?, (SELECT MAX(entry_id) FROM LedgerEntry WHERE customer_id = ?), ?)
+                ON CONFLICT(customer_id) DO UPDATE SET
+                    balance = excluded.balance,
+                    last_entry_id = excluded.last_entry_id,
+                    updated_at = excluded.updated_at
+            """, (item['customer_id'], item['expected'], item['customer_id'], _now()))
+        else:
+            cursor.execute(
+                "UPDATE BillingStatement SET total_amount = ? WHERE statement_id = ?",
+                (item['expected'], item['statement_id'])
+            )
+
+    conn.commit()
+    return drift
+
+
+def verify_all(fix=False):
+    """
+    verify_balances() (rebuild_balances() with fix) on every shard, drift concatenated.
+    """
+    check = rebuild_balances if fix else verify_balances
+    return [item for drift in sharding.fan_out(check) for item in drift]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'verify':
+        print("Usage: python ledger.py verify [--fix]")
+        sys.exit(2)
+
+    found = verify_all('--fix' in sys.argv)
+    if '--fix' in sys.argv:
+        print(f"Repaired {len(found)} drifted value(s)")
+    else:
+        for item in found:
+            print(item)
+        print(f"{len(found)} drifted value(s)")
+
+    sys.exit(1 if found and '--fix' not in sys.argv else 0)
@@ -1,30 +1,40 @@
 # backend/main.py
 """
-main.py
+main.py - Application factory
+
+create_app() builds a configured Flask app; `app` is the one gunicorn,
+the development server and the test suite use. Config values passed to
+create_app() take precedence over each module's environment defaults, so
+tests can build apps with their own settings.
+
+Background threads (replica refresher, webhook delivery) start with the
+app unless DEFER_BACKGROUND=1, in which case start_background() starts
+them: gunicorn builds the app in its master and calls it after each fork.
 """
 
+import os
 from flask import Flask, jsonify, send_from_directory
-from flasgger import Swagger
 from flask_cors import CORS
 from user import user_routes
 from tracking import tracking_routes
 from package import package_routes
 from billing import billing_routes
 from admin import admin_routes
+from export import export_routes
+from jobs import jobs_routes
+from changes import changes_routes
+from debug import debug_routes
+from metrics import metrics_routes, init_metrics
 import db
+from middleware import init_http
+from tracing import init_tracing
+from slowlog import init_slowlog
+from backup import init_replica, start_refresher
+from apidocs import init_apidocs
+from webhooks import init_webhooks, start_delivery
+from cache_bus import init_cache_bus
 
-app = Flask(__name__)
-CORS(app, supports_credentials=True)
-
-# Register all blueprints
-app.register_blueprint(user_routes, url_prefix='/api')
-app.register_blueprint(tracking_routes, url_prefix='/api')
-app.register_blueprint(package_routes, url_prefix='/api')
-app.register_blueprint(billing_routes, url_prefix='/api')
-app.register_blueprint(admin_routes, url_prefix='/api')
 
-
-@app.route('/')
 def home():
     """
     Home endpoint
@@ -41,5 +51,67 @@ def home():
     return jsonify({"message": "Package Delivery API is running."})
 
 
+def create_app(config=None):
+    """
+    Create the Flask app with every blueprint and request hook installed.
+    `config` overrides the environment defaults.
+    """
+    app = Flask(__name__)
+    app.config.update(config or {})
+    app.config.setdefault('DEFER_BACKGROUND', os.environ.get('DEFER_BACKGROUND', '0') == '1')
+    CORS(app, supports_credentials=True)
+
+    # Register all blueprints
+    app.add_url_rule('/', 'home', home)
+    app.register_blueprint(user_routes, url_prefix='/api')
+    app.register_blueprint(tracking_routes, url_prefix='/api')
+    app.register_blueprint(package_routes, url_prefix='/api')
+    app.register_blueprint(billing_routes, url_prefix='/api')
+    app.register_blueprint(admin_routes, url_prefix='/api')
+    app.register_blueprint(export_routes, url_prefix='/api')
+    app.register_blueprint(jobs_routes, url_prefix='/api')
+    app.register_blueprint(changes_routes, url_prefix='/api')
+    app.register_blueprint(debug_routes)
+    app.register_blueprint(metrics_routes)
+
+    # Request/DB metrics for /metrics; registered first so it sees the final response
+    init_metrics(app)
+
+    # Compression and Cache-Control for every response
+    init_http(app)
+
+    # Request tracing (off unless TRACE_ENABLED=1 or switched on at /debug/trace)
+    init_tracing(app)
+
+    # Per-statement SQL stats; statements over SLOW_QUERY_MS are logged with their plan
+    init_slowlog(app)
+
+    # Report reads may use the read replica; REPLICA_REFRESH > 0 keeps it refreshed
+    init_replica(app)
+
+    # In-process caches hear about writes made by other workers (CACHE_BUS_POLL)
+    init_cache_bus(app)
+
+    # Tracking events queued for webhook subscribers; WEBHOOK_WORKER=1 delivers them from this process
+    init_webhooks(app)
+
+    # Swagger UI at /apidocs/; the spec is built on first use unless APIDOCS says otherwise
+    init_apidocs(app)
+
+    return app
+
+
+def start_background():
+    """
+    Start this process's background threads (see DEFER_BACKGROUND).
+    """
+    start_refresher()
+    start_delivery()
+
+
+app = create_app()
+
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8000, debug=True)
+    # Development server; production runs under gunicorn (see gunicorn.conf.py)
+    app.run(host='0.0.0.0', port=8000, debug=os.environ.get('FLASK_DEBUG', '1') == '1')
@@ -0,0 +1,326 @@
+# backend/metrics.py
+"""
+metrics.py - Prometheus metrics endpoint
+
+GET /metrics returns, in the Prometheus text exposition format:
+
+    http_requests_total                 by blueprint, route, method, status
+    http_request_duration_seconds       histogram by blueprint, route, method
+    http_response_size_bytes            histogram by blueprint, route, method
+    db_statements_total / db_statement_duration_seconds   by statement verb
+    db_queries_total                    executions per registered query (queries.py)
+    db_checkout_duration_seconds        time to get a connection
+    db_pool_connections                 pool utilization (idle / in_use / created)
+    cache_requests_total                micro-cache hits and misses
+    sqlite_file_size_bytes              database, WAL, archive, replica and event partition sizes
+    db_replica_age_seconds              staleness of the read replica
+
+Counters and histograms are recorded into a per-thread shard without any
+locking; a scrape walks all shards and sums them. When a thread exits its
+shard is folded into one shared total for finished threads, so the number
+of shards follows the live threads, not every thread ever started. Routes are labelled with
+their URL rule (e.g. /api/tracking/<int:tracking_number>) so label values
+stay bounded. Under gunicorn every worker process keeps its own numbers.
+
+Set METRICS_TOKEN to require "Authorization: Bearer <token>" on scrapes, or
+METRICS_ENABLED=0 to turn collection off.
+"""
+import os
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from functools import lru_cache
+from flask import Blueprint, Response, current_app, g, request
+import archive
+import backup
+import cache_bus
+import db
+import partitions
+import queries
+from middleware import micro_cache
+
+metrics_routes = Blueprint('metrics_routes', __name__)
+
+DEFAULTS = {
+    'METRICS_ENABLED': os.environ.get('METRICS_ENABLED', '1') == '1',
+    'METRICS_TOKEN': os.environ.get('METRICS_TOKEN'),
+}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+DB_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+START_TIME = time.time()
+
+
+def _reset_start_time():
+    global START_TIME
+    START_TIME = time.time()
+
+
+# A preloaded app is imported in the gunicorn master; each worker starts its own clock
+os.register_at_fork(after_in_child=_reset_start_time)
+
+
+class _Shard:
+    """
+    One thread's private counters: {(metric, labels): value} and
+    {(metric, labels): [bucket counts..., sum, count]}.
+    """
+    __slots__ = ('counters', 'histograms')
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+
+
+class _Owner:
+    """
+    Lives in a thread's local state; collected when the thread exits.
+    """
+    __slots__ = ('__weakref__',)
+
+
+_local = threading.local()
+_shards = []
+# Everything recorded by threads that have exited
+_retired = _Shard()
+_shards_lock = threading.Lock()
+
+
+def _add(counters, histograms, shard):
+    for key, value in shard.counters.copy().items():
+        counters[key] = counters.get(key, 0) + value
+    for key, slots in shard.histograms.copy().items():
+        total = histograms.get(key)
+        if total is None:
+            histograms[key] = list(slots)
+        else:
+            for i, value in enumerate(slots):
+                total[i] += value
+
+
+def _retire(shard):
+    with _shards_lock:
+        _shards.remove(shard)
+        _add(_retired.counters, _retired.histograms, shard)
+
+
+def _shard():
+    try:
+        return _local.shard
+    except AttributeError:
+        shard = _local.shard = _Shard()
+        with _shards_lock:
+            _shards.append(shard)
+        _local.owner = _Owner()
+        weakref.finalize(_local.owner, _retire, shard)
+        return shard
+
+
+class Metric:
+    """
+    A counter or histogram family with fixed label names.
+    """
+    def __init__(self, name, kind, help_text, labels=(), buckets=None):
+        self.name = name
+        self.kind = kind
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+
+    def inc(self, *labels, value=1):
+        counters = _shard().counters
+        key = (self, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, value, *labels):
+        histograms = _shard().histograms
+        key = (self, labels)
+        slots = histograms.get(key)
+        if slots is None:
+            slots = histograms[key] = [0] * (len(self.buckets) + 3)
+        slots[bisect_left(self.buckets, value)] += 1
+        slots[-2] += value
+        slots[-1] += 1
+
+
+HTTP_REQUESTS = Metric('http_requests_total', 'counter', 'HTTP requests handled',
+                       ('blueprint', 'route', 'method', 'status'))
+HTTP_DURATION = Metric('http_request_duration_seconds', 'histogram', 'Time spent handling a request',
+                       ('blueprint', 'route', 'method'), LATENCY_BUCKETS)
+HTTP_SIZE = Metric('http_response_size_bytes', 'histogram', 'Response body size (buffered responses)',
+                   ('blueprint', 'route', 'method'), SIZE_BUCKETS)
+DB_STATEMENTS = Metric('db_statements_total', 'counter', 'SQL statements executed', ('verb',))
+DB_DURATION = Metric('db_statement_duration_seconds', 'histogram', 'SQL statement execution time',
+                     ('verb',), DB_BUCKETS)
+DB_CHECKOUT = Metric('db_checkout_duration_seconds', 'histogram', 'Time to obtain a database connection',
+                     (), DB_BUCKETS)
+DB_QUERIES = Metric('db_queries_total', 'counter', 'Registered queries executed', ('query',))
+
+METRICS = (HTTP_REQUESTS, HTTP_DURATION, HTTP_SIZE, DB_STATEMENTS, DB_DURATION, DB_CHECKOUT, DB_QUERIES)
+
+
+@lru_cache(maxsize=1024)
+def _verb(sql):
+    words = sql.split(None, 1)
+    return words[0].upper() if words else ''
+
+
+def _db_hook(event, cursor, sql, params, seconds):
+    if event == 'checkout':
+        DB_CHECKOUT.observe(seconds)
+        return
+    verb = _verb(sql)
+    DB_STATEMENTS.inc(verb)
+    DB_DURATION.observe(seconds, verb)
+    if sql.__class__ is queries.Query:
+        DB_QUERIES.inc(sql.name)
+
+
+def _start_timer():
+    g.metrics_start = time.perf_counter()
+
+
+def _record(response):
+    start = g.pop('metrics_start', None)
+    if start is None:
+        return response
+    rule = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    labels = (request.blueprint or '', rule, request.method)
+    HTTP_REQUESTS.inc(*labels, str(response.status_code))
+    HTTP_DURATION.observe(time.perf_counter() - start, *labels)
+    if response.content_length is not None:
+        HTTP_SIZE.observe(response.content_length, *labels)
+    return response
+
+
+def collect():
+    """
+    Sum every thread's shard: returns (counters, histograms) keyed like a shard.
+    """
+    counters, histograms = {}, {}
+    with _shards_lock:
+        shards = list(_shards)
+        _add(counters, histograms, _retired)
+    for shard in shards:
+        _add(counters, histograms, shard)
+    return counters, histograms
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _render_histogram(metric, values, slots, lines):
+    cumulative = 0
+    for bound, count in zip(metric.buckets + ('+Inf',), slots):
+        cumulative += count
+        le = 'le="%s"' % bound
+        lines.append(f'{metric.name}_bucket{_labels(metric.labels, values, le)} {cumulative}')
+    lines.append(f'{metric.name}_sum{_labels(metric.labels, values)} {slots[-2]}')
+    lines.append(f'{metric.name}_count{_labels(metric.labels, values)} {slots[-1]}')
+
+
+def _gauges():
+    """
+    Point-in-time values read at scrape time: (name, help, [(labels dict, value)]).
+    """
+    pool = db.get_pool().stats() if db.POOL_SIZE > 0 else {'size': 0, 'idle': 0, 'in_use': 0, 'created': 0}
+    lookups = micro_cache.hits + micro_cache.misses
+    local_caches = cache_bus.caches()
+    replica_age = backup.replica_age()
+    sizes = []
+    for label, path in (('db', db.DB_PATH), ('wal', db.DB_PATH + '-wal'), ('archive', archive.archive_path()),
+                        ('replica', backup.replica_path())):
+        sizes.append(({'file': label}, os.path.getsize(path) if os.path.exists(path) else 0))
+    sizes.append(({'file': 'events'}, sum(os.path.getsize(partitions.partition_path(m))
+                                          for m in partitions.existing())))
+
+    return [
+        ('db_pool_connections', 'Connections in this worker\'s pool',
+         [({'state': state}, pool[state]) for state in ('size', 'idle', 'in_use', 'created')]),
+        ('cache_requests_total', 'Micro-cache and local cache lookups',
+         [({'cache': 'micro', 'result': 'hit'}, micro_cache.hits),
+          ({'cache': 'micro', 'result': 'miss'}, micro_cache.misses)]
+         + [({'cache': c.name, 'result': 'hit'}, c.hits) for c in local_caches]
+         + [({'cache': c.name, 'result': 'miss'}, c.misses) for c in local_caches]),
+        ('cache_hit_ratio', 'Micro-cache and local cache hit ratio since start',
+         [({'cache': 'micro'}, micro_cache.hits / lookups if lookups else 0)]
+         + [({'cache': c.name}, c.hits / (c.hits + c.misses) if c.hits + c.misses else 0) for c in local_caches]),
+        ('cache_bus_version', 'Last cache invalidation bus version applied by this worker',
+         [({}, cache_bus.version())]),
+        ('sqlite_file_size_bytes', 'SQLite database, WAL, archive, replica and event partition file sizes', sizes),
+        ('db_replica_age_seconds', 'Age of the read replica (-1 when there is none)',
+         [({}, -1 if replica_age is None else replica_age)]),
+        ('process_start_time_seconds', 'Start time of this worker process', [({}, START_TIME)]),
+    ]
+
+
+def render():
+    """
+    Render all metrics in the Prometheus text exposition format.
+    """
+    counters, histograms = collect()
+    lines = []
+    for metric in METRICS:
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        source = counters if metric.kind == 'counter' else histograms
+        for (owner, values), data in sorted(source.items(), key=lambda item: item[0][1]):
+            if owner is not metric:
+                continue
+            if metric.kind == 'counter':
+                lines.append(f'{metric.name}{_labels(metric.labels, values)} {data}')
+            else:
+                _render_histogram(metric, values, data, lines)
+
+    for name, help_text, samples in _gauges():
+        kind = 'counter' if name.endswith('_total') else 'gauge'
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in samples:
+            lines.append(f'{name}{_labels(labels.keys(), labels.values())} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def init_metrics(app):
+    """
+    Start collecting request and database metrics for a Flask app.
+    Call before init_http() so the recorded size is the compressed one.
+    """
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
+    if not app.config['METRICS_ENABLED']:
+        return
+    if _db_hook not in db.DB_HOOKS:
+        db.DB_HOOKS.append(_db_hook)
+    app.before_request(_start_timer)
+    app.after_request(_record)
+
+
+@metrics_routes.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Prometheus metrics for this worker process
+    ---
+    produces:
+      - text/plain
+    responses:
+      200:
+        description: Metrics in the Prometheus text format
+      401:
+        description: METRICS_TOKEN is set and the request did not present it
+    """
+    token = current_app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return Response('unauthorized\n', status=401, mimetype='text/plain')
+    return Response(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,234 @@
+# backend/middleware.py
+"""
+middleware.py - Response compression and HTTP caching policy
+
+init_http(app) installs one after_request hook that, in order:
+
+1. applies the route's cache policy (Cache-Control, ETag, 304 handling),
+2. compresses the body with brotli or gzip when the client accepts it and
+   the body is at least COMPRESS_MIN_SIZE bytes.
+
+Policies are picked per view with @cache_policy(...) or fall back to a
+per-blueprint default:
+
+    'public'   shared reference data, cacheable by browsers and proxies
+    'private'  per-user data, cacheable only by the browser and always revalidated
+    'no-store' admin and auth responses, never cached
+
+@micro_cached(ttl) keeps a whole response body in a process-wide TTL cache
+so hot public endpoints such as /services skip the database entirely.
+Entries are keyed by path; requests with a query string bypass the cache,
+and at most MICRO_CACHE_ENTRIES bodies are kept.
+Publishing an 'http' invalidation with a path prefix (cache_bus.py) drops
+matching entries in every worker.
+"""
+import gzip
+import os
+import threading
+import time
+from functools import wraps
+from flask import current_app, make_response, request, Response
+import cache_bus
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DEFAULTS = {
+    'COMPRESS_MIN_SIZE': int(os.environ.get('COMPRESS_MIN_SIZE', 1024)),
+    'COMPRESS_LEVEL': int(os.environ.get('COMPRESS_LEVEL', 6)),
+    'COMPRESS_BR_QUALITY': int(os.environ.get('COMPRESS_BR_QUALITY', 4)),
+    'PUBLIC_MAX_AGE': int(os.environ.get('PUBLIC_MAX_AGE', 3600)),
+    'MICRO_CACHE_TTL': float(os.environ.get('MICRO_CACHE_TTL', 5)),
+}
+
+MICRO_CACHE_ENTRIES = int(os.environ.get('MICRO_CACHE_ENTRIES', 256))
+
+BLUEPRINT_POLICIES = {
+    'admin_routes': 'no-store',
+    'user_routes': 'no-store',
+    'debug_routes': 'no-store',
+    'metrics_routes': 'no-store',
+    'billing_routes': 'private',
+    'tracking_routes': 'private',
+    'package_routes': 'private',
+    'export_routes': 'private',
+}
+
+COMPRESSIBLE = ('application/json', 'text/', 'application/javascript', 'application/x-ndjson')
+
+
+def cache_policy(policy, max_age=None):
+    """
+    Decorator to set the cache policy of a single view.
+    """
+    def decorator(f):
+        f.cache_policy = (policy, max_age)
+        return f
+    return decorator
+
+
+class MicroCache:
+    """
+    Thread-safe TTL cache of full response bodies, shared by every request
+    handled in this process. Holds at most max_entries bodies.
+    """
+    def __init__(self, max_entries=MICRO_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1:]
+
+    def set(self, key, ttl, body, mimetype):
+        now = time.monotonic()
+        with self._lock:
+            self._entries.pop(key, None)
+            if len(self._entries) >= self.max_entries:
+                for stale in [k for k, entry in self._entries.items() if entry[0] < now]:
+                    del self._entries[stale]
+            # Still full: drop the oldest entries
+            while self._entries and len(self._entries) >= self.max_entries:
+                del self._entries[next(iter(self._entries))]
+            self._entries[key] = (now + ttl, body, mimetype)
+
+    def invalidate(self, prefix=''):
+        """
+        Drop every entry whose key (request path) starts with prefix.
+        """
+        with self._lock:
+            for key in [k for k in self._entries if k.startswith(prefix)]:
+                del self._entries[key]
+
+
+micro_cache = MicroCache()
+# 'http' invalidations carry a path prefix
+cache_bus.subscribe('http', lambda prefix: micro_cache.invalidate(prefix or ''))
+
+
+def micro_cached(ttl=None):
+    """
+    Decorator to serve a public GET view from the micro-cache.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            # Every distinct query string would be an entry of its own
+            if request.args:
+                return f(*args, **kwargs)
+            key = request.path
+            hit = micro_cache.get(key)
+            if hit is not None:
+                return Response(hit[0], mimetype=hit[1])
+
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                micro_cache.set(key, ttl or current_app.config['MICRO_CACHE_TTL'],
+                                response.get_data(), response.mimetype)
+            return response
+        return decorated_function
+    return decorator
+
+
+def _resolve_policy():
+    view = current_app.view_functions.get(request.endpoint)
+    policy = getattr(view, 'cache_policy', None)
+    if policy:
+        return policy
+    return BLUEPRINT_POLICIES.get(request.blueprint), None
+
+
+def apply_cache_policy(response):
+    """
+    Set Cache-Control/ETag for GET responses and answer conditional requests.
+    """
+    if 'Cache-Control' in response.headers or request.method not in ('GET', 'HEAD'):
+        return response
+
+    if response.status_code >= 400:
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+    policy, max_age = _resolve_policy()
+    if policy is None:
+        return response
+
+    if policy == 'no-store':
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+    if policy == 'public':
+        max_age = max_age if max_age is not None else current_app.config['PUBLIC_MAX_AGE']
+        response.headers['Cache-Control'] = f'public, max-age={max_age}'
+    else:
+        response.headers['Cache-Control'] = 'private, no-cache'
+
+    if not response.is_streamed:
+        response.add_etag()
+        response.make_conditional(request)
+    return response
+
+
+def _pick_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress_response(response):
+    """
+    Compress a buffered response body in place when it is worth it.
+    """
+    if (response.is_streamed
+            or response.direct_passthrough
+            or response.status_code not in (200, 201)
+            or 'Content-Encoding' in response.headers
+            or not (response.mimetype or '').startswith(COMPRESSIBLE)):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    config = current_app.config
+    if response.content_length is None or response.content_length < config['COMPRESS_MIN_SIZE']:
+        return response
+
+    encoding = _pick_encoding()
+    if encoding is None:
+        return response
+
+    body = response.get_data()
+    if encoding == 'br':
+        data = brotli.compress(body, quality=config['COMPRESS_BR_QUALITY'])
+    else:
+        data = gzip.compress(body, compresslevel=config['COMPRESS_LEVEL'], mtime=0)
+
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    tag = response.get_etag()[0]
+    if tag:
+        # Same resource, different bytes: only a weak validator still holds
+        response.set_etag(tag, weak=True)
+    return response
+
+
+def init_http(app):
+    """
+    Install compression and caching on a Flask app.
+    """
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
+
+    @app.after_request
+    def http_policies(response):
+        return compress_response(apply_cache_policy(response))
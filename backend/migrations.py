@@ -0,0 +1,662 @@
+# backend/migrations.py
+"""
+migrations.py - Versioned schema migrations
+
+Every schema change after the baseline (db.SCHEMA, version 1) is a numbered
+migration below. The schema_version table records each migration applied,
+with its timing, so a database of any age can be brought forward with:
+
+    python migrations.py status
+    python migrations.py migrate [--target N] [--off-peak]
+    python migrations.py estimate [--customers 1000]
+
+Migrations are plain functions taking a Context:
+    ctx.execute(sql)            DDL / small statements, one transaction
+    ctx.backfill(...)           batched UPDATE/INSERT over key ranges of a
+                                table; every batch commits and records its
+                                position in migration_progress, so an
+                                interrupted run resumes where it stopped
+    ctx.create_index(sql)       index build, timed and logged
+
+A migration declared off_peak (e.g. an index on a large table) is only
+applied inside MIGRATION_WINDOW (local hours, default "1-5") or with
+--off-peak; a brand-new database applies everything.
+
+`estimate` builds the scale fixture at the current version, times the
+pending migrations on it and scales each one by the row count of the table
+it walks, giving a rough duration for this database before running them.
+"""
+import argparse
+import os
+import re
+import sys
+import time
+from datetime import datetime
+import archive
+import db
+import partitions
+
+BATCH_SIZE = 1000
+# First version that stores TrackingEvent timestamps/statuses as integers
+COMPACT_EVENTS = 4
+# First version that numbers each package's events (TrackingEvent.seq)
+SEQUENCED_EVENTS = 5
+# First version with webhook subscriptions and the event outbox
+WEBHOOK_OUTBOX = 7
+# First version with the ChangeLog feed
+CHANGE_LOG = 8
+# First version whose ledger covers statements and payments from before it
+OPENING_BALANCES = 9
+# First version that stores remittance references on payments
+PAYMENT_REFERENCES = 10
+MIGRATION_WINDOW = os.environ.get('MIGRATION_WINDOW', '1-5')
+
+VERSION_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version          INTEGER PRIMARY KEY,
+    name             TEXT NOT NULL,
+    applied_at       TEXT NOT NULL,
+    duration_ms      REAL
+);
+CREATE TABLE IF NOT EXISTS migration_progress (
+    version          INTEGER PRIMARY KEY,
+    position         INTEGER NOT NULL,
+    updated_at       TEXT NOT NULL
+);
+"""
+
+
+class Migration:
+    """
+    One numbered schema change. `table` is the table its cost grows with.
+    """
+    def __init__(self, version, name, fn, table=None, off_peak=False):
+        self.version = version
+        self.name = name
+        self.fn = fn
+        self.table = table
+        self.off_peak = off_peak
+
+
+MIGRATIONS = []
+
+
+def migration(version, table=None, off_peak=False):
+    """
+    Register the decorated function as migration `version`.
+    """
+    def register(fn):
+        assert not MIGRATIONS or MIGRATIONS[-1].version < version, "migrations must be in order"
+        MIGRATIONS.append(Migration(version, fn.__name__, fn, table, off_peak))
+        return fn
+    return register
+
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+class Context:
+    """
+    What a migration function gets: the connection plus batched helpers.
+    """
+    def __init__(self, conn, version, log=print):
+        self.conn = conn
+        self.version = version
+        self.log = log
+
+    def execute(self, sql):
+        self.conn.executescript(sql)
+
+    def create_index(self, sql):
+        start = time.perf_counter()
+        self.conn.execute(sql)
+        self.conn.commit()
+        self.log(f"  index built in {time.perf_counter() - start:.2f} s")
+
+    def _position(self):
+        row = self.conn.execute("SELECT position FROM migration_progress WHERE version = ?",
+                                (self.version,)).fetchone()
+        return row[0] if row else None
+
+    def backfill(self, table, key, statement, batch_size=None):
+        """
+        Run `statement` (or a list of statements) once per key range of
+        `table`, with named parameters :lo and :hi (rows with lo < key <= hi).
+        Each batch is its own transaction; progress is saved so a rerun
+        continues after the last committed batch.
+        """
+        statements = [statement] if isinstance(statement, str) else statement
+        batch_size = batch_size or BATCH_SIZE
+        low, high = self.conn.execute(f"SELECT MIN({key}), MAX({key}) FROM {table}").fetchone()
+        if high is None:
+            return
+        position = self._position()
+        lo = position if position is not None else low - 1
+        if position is not None:
+            self.log(f"  resuming after {key} {position}")
+
+        while lo < high:
+            hi = lo + batch_size
+            for sql in statements:
+                self.conn.execute(sql, {'lo': lo, 'hi': hi})
+            self.conn.execute("""
+                INSERT INTO migration_progress (version, position, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT(version) DO UPDATE SET position = excluded.position, updated_at = excluded.updated_at
+            """, (self.version, hi, _now()))
+            self.conn.commit()
+            lo = hi
+            self.log(f"  {table}: {min(hi, high) - low + 1}/{high - low + 1} {key} values done")
+
+
+# ---------------------------------------------------------------------
+# Migrations. Never edit one that has shipped; add a new version instead.
+# ---------------------------------------------------------------------
+
+@migration(1)
+def baseline(ctx):
+    """
+    Schema as of the introduction of migrations.
+    """
+    ctx.execute(db.SCHEMA)
+
+
+@migration(2, table='Customer')
+def backfill_customer_summaries(ctx):
+    """
+    Customers created before CustomerSummary existed have no summary row.
+    """
+    ctx.backfill('Customer', 'customer_id', """
+        INSERT OR IGNORE INTO CustomerSummary (customer_id, total_packages, current_month, month_packages)
+        WITH per_month AS (
+            SELECT customer_id, substr(date_shipped, 1, 7) as month, COUNT(*) as packages
+            FROM Package
+            WHERE customer_id > :lo AND customer_id <= :hi
+            GROUP BY customer_id, month
+        ), per_customer AS (
+            SELECT customer_id, SUM(packages) as total, MAX(month) as latest
+            FROM per_month
+            GROUP BY customer_id
+        )
+        SELECT c.customer_id, COALESCE(t.total, 0), t.latest, COALESCE(m.packages, 0)
+        FROM Customer c
+        LEFT JOIN per_customer t ON t.customer_id = c.customer_id
+        LEFT JOIN per_month m ON m.customer_id = c.customer_id AND m.month = t.latest
+        WHERE c.customer_id > :lo AND c.customer_id <= :hi
+    """)
+
+
+@migration(3, table='Package', off_peak=True)
+def index_package_customer(ctx):
+    """
+    A customer's packages newest first (user package list, statements).
+    """
+    ctx.create_index("CREATE INDEX IF NOT EXISTS idx_package_customer ON Package(customer_id, date_shipped)")
+
+
+def _event_files():
+    """
+    TrackingEvent tables kept in their own files: monthly partitions, oldest
+    first, then the archive.
+    """
+    files = [partitions.partition_path(month) for month in partitions.existing()]
+    return files + ([archive.archive_path()] if os.path.exists(archive.archive_path()) else [])
+
+
+def _has_column(conn, schema, table, column):
+    return any(row[1] == column for row in conn.execute(f"PRAGMA {schema}.table_info({table})"))
+
+
+def _is_compact(conn, schema):
+    types = {row[1]: row[2] for row in conn.execute(f"PRAGMA {schema}.table_info(TrackingEvent)")}
+    return types.get('timestamp') == 'INTEGER'
+
+
+def _compact_events_table(conn, schema):
+    """
+    Create {schema}.TrackingEvent_compact: TrackingEvent's definition with
+    INTEGER timestamp and status. Returns the INSERT ... SELECT column lists
+    that convert rows into it.
+    """
+    sql = conn.execute(f"SELECT sql FROM {schema}.sqlite_master WHERE name = 'TrackingEvent'").fetchone()[0]
+    sql = re.sub(r'\btimestamp\s+TEXT\b', 'timestamp INTEGER', sql)
+    sql = re.sub(r'\bstatus\s+TEXT.*?(,?)$',
+                 rf'status INTEGER NOT NULL CHECK (status BETWEEN 1 AND {len(db.EVENT_STATUSES)})\1', sql, flags=re.M)
+    sql = re.sub(r'^CREATE TABLE (IF NOT EXISTS )?\S+', f'CREATE TABLE IF NOT EXISTS {schema}.TrackingEvent_compact', sql)
+    conn.execute(sql)
+    conn.commit()
+
+    status = ' '.join(f"WHEN '{name}' THEN {code}" for name, code in db.STATUS_CODES.items())
+    converted = {
+        'timestamp': "CAST(strftime('%s', timestamp) AS INTEGER)",
+        'status': f"CASE status {status} END",
+    }
+    columns = [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info(TrackingEvent)")]
+    return ', '.join(columns), ', '.join(converted.get(c, c) for c in columns)
+
+
+def _swap_events_table(conn, schema):
+    """
+    Replace TrackingEvent with TrackingEvent_compact in one transaction,
+    keeping its indexes and AUTOINCREMENT high-water mark.
+    """
+    indexes = [row[0] for row in conn.execute(
+        f"SELECT sql FROM {schema}.sqlite_master WHERE type = 'index' AND tbl_name = 'TrackingEvent' AND sql IS NOT NULL")]
+    has_sequence = conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE name = 'sqlite_sequence'").fetchone()
+    seq = has_sequence and conn.execute(
+        f"SELECT seq FROM {schema}.sqlite_sequence WHERE name = 'TrackingEvent'").fetchone()
+
+    conn.execute("BEGIN")
+    conn.execute(f"DROP TABLE {schema}.TrackingEvent")
+    conn.execute(f"ALTER TABLE {schema}.TrackingEvent_compact RENAME TO TrackingEvent")
+    for sql in indexes:
+        conn.execute(re.sub(r'^CREATE INDEX (\w+)', rf'CREATE INDEX {schema}.\1', sql))
+    if seq:
+        conn.execute(f"INSERT INTO {schema}.sqlite_sequence (name, seq) SELECT 'TrackingEvent', 0 WHERE NOT EXISTS "
+                     f"(SELECT 1 FROM {schema}.sqlite_sequence WHERE name = 'TrackingEvent')")
+        conn.execute(f"UPDATE {schema}.sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'TrackingEvent'", (seq[0],))
+    conn.commit()
+
+
+@migration(COMPACT_EVENTS, table='TrackingEvent', off_peak=True)
+def compact_tracking_events(ctx):
+    """
+    TrackingEvent timestamps as epoch seconds and statuses as small codes
+    (see db.encode_event), plus an index for time-range reads. The rows are
+    copied into a new table in batches and swapped in at the end; archived
+    and partitioned events are converted in their own files.
+    """
+    conn = ctx.conn
+    if not _is_compact(conn, 'main'):
+        columns, values = _compact_events_table(conn, 'main')
+        ctx.backfill('TrackingEvent', 'event_id', f"""
+            INSERT INTO main.TrackingEvent_compact ({columns})
+            SELECT {values} FROM main.TrackingEvent
+            WHERE event_id > :lo AND event_id <= :hi
+        """)
+        _swap_events_table(conn, 'main')
+    ctx.create_index("CREATE INDEX IF NOT EXISTS idx_event_timestamp ON TrackingEvent(timestamp)")
+
+    for path in _event_files():
+        conn.execute("ATTACH DATABASE ? AS events_file", (path,))
+        try:
+            if not _is_compact(conn, 'events_file'):
+                columns, values = _compact_events_table(conn, 'events_file')
+                conn.execute(f"INSERT INTO events_file.TrackingEvent_compact ({columns}) "
+                             f"SELECT {values} FROM events_file.TrackingEvent")
+                conn.commit()
+                _swap_events_table(conn, 'events_file')
+                ctx.log(f"  converted {os.path.basename(path)}")
+        finally:
+            conn.execute("DETACH DATABASE events_file")
+
+
+# Numbers a package's events in scan order (ties in event_id order, i.e.
+# arrival), continuing from Package.last_event_seq, then records the last
+# number on the package
+NUMBER_EVENTS = """
+    UPDATE {schema}.TrackingEvent SET seq = numbered.seq FROM (
+        SELECT e.package_id, e.event_id,
+               ROW_NUMBER() OVER (PARTITION BY e.package_id ORDER BY e.timestamp, e.event_id)
+               + COALESCE(p.last_event_seq, 0) as seq
+        FROM {schema}.TrackingEvent e
+        LEFT JOIN main.Package p ON p.package_id = e.package_id
+        WHERE e.package_id > :lo AND e.package_id <= :hi
+    ) numbered
+    WHERE TrackingEvent.package_id = numbered.package_id AND TrackingEvent.event_id = numbered.event_id
+"""
+COUNT_EVENTS = """
+    UPDATE main.Package SET last_event_seq = (
+        SELECT MAX(seq) FROM {schema}.TrackingEvent e WHERE e.package_id = Package.package_id
+    )
+    WHERE package_id > :lo AND package_id <= :hi
+      AND EXISTS (SELECT 1 FROM {schema}.TrackingEvent e WHERE e.package_id = Package.package_id)
+"""
+
+
+@migration(SEQUENCED_EVENTS, table='TrackingEvent', off_peak=True)
+def sequence_tracking_events(ctx):
+    """
+    Per-package event numbers (TrackingEvent.seq, counter in
+    Package.last_event_seq) so history and "latest event" read the
+    (package_id, seq DESC) index instead of sorting by timestamp. Partition
+    files continue the numbering in month order; the archive numbers its
+    packages on its own.
+    """
+    conn = ctx.conn
+    if not _has_column(conn, 'main', 'Package', 'last_event_seq'):
+        conn.execute("ALTER TABLE Package ADD COLUMN last_event_seq INTEGER NOT NULL DEFAULT 0")
+    if not _has_column(conn, 'main', 'TrackingEvent', 'seq'):
+        conn.execute("ALTER TABLE TrackingEvent ADD COLUMN seq INTEGER")
+    conn.commit()
+    ctx.backfill('Package', 'package_id', [NUMBER_EVENTS.format(schema='main'), COUNT_EVENTS.format(schema='main')])
+    ctx.create_index("CREATE UNIQUE INDEX IF NOT EXISTS idx_event_package_seq ON TrackingEvent(package_id, seq DESC)")
+    # Its leading column makes the old index redundant
+    ctx.execute("DROP INDEX IF EXISTS idx_event_package")
+
+    everything = {'lo': -1, 'hi': 1 << 62}
+    for path in _event_files():
+        conn.execute("ATTACH DATABASE ? AS events_file", (path,))
+        try:
+            if _has_column(conn, 'events_file', 'TrackingEvent', 'seq'):
+                continue
+            conn.execute("BEGIN")
+            conn.execute("ALTER TABLE events_file.TrackingEvent ADD COLUMN seq INTEGER")
+            # Archived packages are no longer in Package, so they number from 1
+            conn.execute(NUMBER_EVENTS.format(schema='events_file'), everything)
+            conn.execute(COUNT_EVENTS.format(schema='events_file'), everything)
+            if path != archive.archive_path():
+                # The archive is clustered by package and needs no index
+                conn.execute("DROP INDEX IF EXISTS events_file.idx_event_package")
+                conn.execute("CREATE UNIQUE INDEX events_file.idx_event_package_seq ON TrackingEvent(package_id, seq DESC)")
+            conn.commit()
+            ctx.log(f"  numbered {os.path.basename(path)}")
+        finally:
+            conn.execute("DETACH DATABASE events_file")
+
+
+@migration(6, table='Package', off_peak=True)
+def index_shipped_and_payments(ctx):
+    """
+    Packages by ship date (admin list, package export) and a customer's
+    payments newest first, so no registered query scans them (see queries.py).
+    """
+    ctx.create_index("CREATE INDEX IF NOT EXISTS idx_package_shipped ON Package(date_shipped)")
+    ctx.create_index("CREATE INDEX IF NOT EXISTS idx_payment_customer ON Payment(customer_id, date_paid)")
+
+
+@migration(WEBHOOK_OUTBOX)
+def webhook_outbox(ctx):
+    """
+    Webhook subscriptions and the outbox their events wait in (see webhooks.py).
+    """
+    ctx.execute("""
+        CREATE TABLE IF NOT EXISTS WebhookSubscription (
+            subscription_id  INTEGER PRIMARY KEY AUTOINCREMENT,
+            customer_id      INTEGER NOT NULL,
+            url              TEXT NOT NULL CHECK (url LIKE 'http://%' OR url LIKE 'https://%'),
+            secret           TEXT,
+            active           INTEGER NOT NULL DEFAULT 1,
+            created_at       TEXT NOT NULL,
+            failures         INTEGER NOT NULL DEFAULT 0,
+            retry_at         REAL NOT NULL DEFAULT 0,
+            last_error       TEXT,
+
+            FOREIGN KEY (customer_id) REFERENCES Customer(customer_id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_subscription_customer ON WebhookSubscription(customer_id, active);
+
+        CREATE TABLE IF NOT EXISTS Outbox (
+            outbox_id        INTEGER PRIMARY KEY AUTOINCREMENT,
+            subscription_id  INTEGER NOT NULL,
+            event_id         INTEGER NOT NULL,
+            package_id       INTEGER NOT NULL,
+            location_id      INTEGER NOT NULL,
+            timestamp        INTEGER NOT NULL,
+            status           INTEGER NOT NULL,
+            notes            TEXT,
+            created_at       REAL NOT NULL,
+
+            FOREIGN KEY (subscription_id) REFERENCES WebhookSubscription(subscription_id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_outbox_subscription ON Outbox(subscription_id, outbox_id);
+    """)
+
+
+# Epoch seconds (with fractions) in trigger SQL
+_TRIGGER_NOW = "(julianday('now') - 2440587.5) * 86400.0"
+
+
+def _change_triggers(table, entity, key, columns):
+    """
+    Insert/update/delete triggers logging `table` rows to ChangeLog as
+    `entity`, with the row's `columns` as JSON (none for a delete). Updates
+    that touch none of `columns` are not logged.
+    """
+    def image(ref):
+        return 'json_object(' + ', '.join(f"'{column}', {ref}.{column}" for column in columns) + ')'
+
+    return f"""
+        CREATE TRIGGER IF NOT EXISTS {entity}_change_insert AFTER INSERT ON {table}
+        BEGIN
+            INSERT INTO ChangeLog (entity, entity_id, op, data, changed_at)
+            VALUES ('{entity}', NEW.{key}, 'insert', {image('NEW')}, {_TRIGGER_NOW});
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS {entity}_change_update AFTER UPDATE OF {', '.join(columns)} ON {table}
+        BEGIN
+            INSERT INTO ChangeLog (entity, entity_id, op, data, changed_at)
+            VALUES ('{entity}', NEW.{key}, 'update', {image('NEW')}, {_TRIGGER_NOW});
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS {entity}_change_delete AFTER DELETE ON {table}
+        BEGIN
+            INSERT INTO ChangeLog (entity, entity_id, op, data, changed_at)
+            VALUES ('{entity}', OLD.{key}, 'delete', NULL, {_TRIGGER_NOW});
+        END;
+    """
+
+
+@migration(CHANGE_LOG)
+def change_log(ctx):
+    """
+    Append-only log of package, statement and payment changes, written by
+    triggers, for the /api/changes feed (see changes.py). Tracking events
+    are logged by db.insert_event, since they may go to partition files.
+    Existing rows are not backfilled: consumers start from an export.
+    """
+    ctx.execute("""
+        CREATE TABLE IF NOT EXISTS ChangeLog (
+            position         INTEGER PRIMARY KEY AUTOINCREMENT,
+            entity           TEXT NOT NULL,
+            entity_id        INTEGER NOT NULL,
+            op               TEXT NOT NULL CHECK (op IN ('insert', 'update', 'delete', 'archive')),
+            data             TEXT,
+            changed_at       REAL NOT NULL
+        );
+    """)
+    ctx.execute(_change_triggers('Package', 'package', 'package_id', [
+        'package_id', 'customer_id',
+        'sender_name', 'sender_addr1', 'sender_addr2', 'sender_city', 'sender_state', 'sender_zip',
+        'recipient_name', 'recipient_addr1', 'recipient_addr2', 'recipient_city', 'recipient_state', 'recipient_zip',
+        'service_id', 'weight_lb', 'is_hazardous', 'is_international', 'declared_value', 'customs_desc',
+        'payment_type', 'date_shipped', 'date_delivered', 'delivered_signature',
+    ]))
+    ctx.execute(_change_triggers('BillingStatement', 'billing_statement', 'statement_id', [
+        'statement_id', 'customer_id', 'statement_month', 'total_amount', 'status',
+    ]))
+    ctx.execute(_change_triggers('Payment', 'payment', 'payment_id', [
+        'payment_id', 'customer_id', 'package_id', 'date_paid', 'amount', 'method',
+    ]))
+
+
+# Per customer range: an opening entry for whatever of each statement's
+# total the ledger doesn't account for, the payments it has no entry for,
+# then the running balance recomputed from the ledger
+OPENING_STATEMENTS = """
+    INSERT INTO LedgerEntry (customer_id, entry_type, amount, statement_id, created_at, memo)
+    SELECT bs.customer_id, 'adjustment', ROUND(bs.total_amount - COALESCE((
+               SELECT SUM(le.amount) FROM LedgerEntry le
+               WHERE le.statement_id = bs.statement_id AND le.entry_type != 'payment'
+           ), 0), 2) as opening,
+           bs.statement_id, bs.statement_month || '-01 00:00:00', 'Opening balance'
+    FROM BillingStatement bs
+    WHERE bs.customer_id > :lo AND bs.customer_id <= :hi AND opening != 0
+"""
+OPENING_PAYMENTS = """
+    INSERT INTO LedgerEntry (customer_id, entry_type, amount, payment_id, created_at, memo)
+    SELECT p.customer_id, 'payment', -p.amount, p.payment_id, p.date_paid, 'Payment received'
+    FROM Payment p
+    WHERE p.customer_id > :lo AND p.customer_id <= :hi
+      AND NOT EXISTS (SELECT 1 FROM LedgerEntry le WHERE le.customer_id = p.customer_id AND le.payment_id = p.payment_id)
+"""
+OPENING_BALANCE = """
+    INSERT INTO CustomerBalance (customer_id, balance, last_entry_id, updated_at)
+    SELECT customer_id, ROUND(SUM(amount), 2), MAX(entry_id), datetime('now', 'localtime')
+    FROM LedgerEntry
+    WHERE customer_id > :lo AND customer_id <= :hi
+    GROUP BY customer_id
+    ON CONFLICT(customer_id) DO UPDATE SET
+        balance = excluded.balance,
+        last_entry_id = excluded.last_entry_id,
+        updated_at = excluded.updated_at
+"""
+
+
+@migration(OPENING_BALANCES, table='Customer')
+def opening_balances(ctx):
+    """
+    Statements and payments written before the ledger existed have no
+    LedgerEntry rows, so the ledger (and ledger.py verify --fix) would put
+    their balances at 0. Post an opening adjustment per statement for the
+    part of its total the ledger doesn't cover, a payment entry per
+    unrecorded payment, and recompute each customer's running balance.
+    Statement totals themselves are left as they are.
+    """
+    ctx.backfill('Customer', 'customer_id', [OPENING_STATEMENTS, OPENING_PAYMENTS, OPENING_BALANCE])
+
+
+@migration(PAYMENT_REFERENCES)
+def payment_references(ctx):
+    """
+    The bank reference of payments posted from a remittance file, unique so
+    a line imported twice is refused (see reconcile.py).
+    """
+    if not _has_column(ctx.conn, 'main', 'Payment', 'reference'):
+        ctx.execute("ALTER TABLE Payment ADD COLUMN reference TEXT")
+    ctx.create_index("CREATE UNIQUE INDEX IF NOT EXISTS idx_payment_reference ON Payment(reference)")
+
+
+# ---------------------------------------------------------------------
+# Runner
+# ---------------------------------------------------------------------
+
+def latest_version():
+    return MIGRATIONS[-1].version
+
+
+def current_version(conn):
+    conn.executescript(VERSION_TABLE)
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def pending(conn, target=None):
+    version = current_version(conn)
+    target = latest_version() if target is None else target
+    return [m for m in MIGRATIONS if version < m.version <= target]
+
+
+def in_window(now=None):
+    """
+    Whether the local time is inside MIGRATION_WINDOW ("1-5" = 01:00 to 04:59).
+    """
+    first, last = (int(part) for part in MIGRATION_WINDOW.split('-'))
+    hour = (now or datetime.now()).hour
+    return first <= hour < last if first <= last else hour >= first or hour < last
+
+
+def migrate(conn, target=None, off_peak=None, log=print):
+    """
+    Apply pending migrations up to `target`, in order. off_peak=None allows
+    off-peak migrations inside MIGRATION_WINDOW or on a new database.
+    Returns the versions applied; stops before the first off-peak migration
+    that isn't allowed.
+    """
+    fresh = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'Package'").fetchone() is None
+    if off_peak is None:
+        off_peak = fresh or in_window()
+
+    applied = []
+    for m in pending(conn, target):
+        if m.off_peak and not off_peak:
+            log(f"{m.version} {m.name}: waiting for the off-peak window ({MIGRATION_WINDOW})")
+            break
+        log(f"{m.version} {m.name}")
+        start = time.perf_counter()
+        m.fn(Context(conn, m.version, log))
+        elapsed = (time.perf_counter() - start) * 1000
+        conn.execute("INSERT INTO schema_version (version, name, applied_at, duration_ms) VALUES (?, ?, ?, ?)",
+                     (m.version, m.name, _now(), round(elapsed, 1)))
+        conn.execute("DELETE FROM migration_progress WHERE version = ?", (m.version,))
+        conn.commit()
+        applied.append(m.version)
+    return applied
+
+
+def estimate(conn, customers=1000, log=print):
+    """
+    Time the pending migrations on a scale fixture built at this database's
+    version and scale them to its row counts. Returns
+    [(migration, fixture_seconds, estimated_seconds)].
+    """
+    from benchmarks import fixtures
+
+    todo = pending(conn)
+    if not todo:
+        return []
+    # A database from before migrations (version 0) already has the baseline tables
+    version = max(current_version(conn), 1)
+    todo = [m for m in todo if m.version > version]
+    counts = {m.table: conn.execute(f"SELECT COUNT(*) FROM {m.table}").fetchone()[0] for m in todo if m.table}
+
+    primary = db.DB_PATH
+    path = fixtures.make_scale_db(customers=customers, version=version)
+    fixture = db._connect(path)
+    try:
+        results = []
+        for m in todo:
+            rows = fixture.execute(f"SELECT COUNT(*) FROM {m.table}").fetchone()[0] if m.table else 0
+            start = time.perf_counter()
+            migrate(fixture, target=m.version, off_peak=True, log=lambda message: None)
+            seconds = time.perf_counter() - start
+            scale = counts[m.table] / rows if m.table and rows else 1
+            results.append((m, seconds, seconds * scale))
+            log(f"{m.version} {m.name}: {seconds:.3f} s on {rows} {m.table or ''} rows "
+                f"-> ~{seconds * scale:.2f} s here{' (off-peak)' if m.off_peak else ''}")
+        return results
+    finally:
+        fixture.close()
+        os.remove(path)
+        db.DB_PATH = primary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply versioned schema migrations")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('status')
+    run = sub.add_parser('migrate')
+    run.add_argument('--target', type=int)
+    run.add_argument('--off-peak', action='store_true', help='apply off-peak migrations now')
+    est = sub.add_parser('estimate')
+    est.add_argument('--customers', type=int, default=1000, help='scale fixture size')
+    args = parser.parse_args(argv)
+
+    if args.command == 'estimate':
+        conn = db._connect(db.DB_PATH)
+        try:
+            estimate(conn, args.customers)
+        finally:
+            conn.close()
+        return 0
+
+    # Shard files (DB_SHARDS) carry the same schema and are migrated alongside
+    paths = [db.DB_PATH] + [db.shard_path(s) for s in range(db.SHARDS) if os.path.exists(db.shard_path(s))]
+    for path in paths:
+        if len(paths) > 1:
+            print(path)
+        conn = db._connect(path)
+        try:
+            if args.command == 'status':
+                print(f"version {current_version(conn)} of {latest_version()}")
+                for m in pending(conn):
+                    print(f"  pending {m.version} {m.name}{' (off-peak)' if m.off_peak else ''}")
+            else:
+                applied = migrate(conn, args.target, True if args.off_peak else None)
+                print(f"Applied {len(applied)} migration(s); now at version {current_version(conn)}")
+        finally:
+            conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,11 +4,26 @@ package.py - Package creation and management routes
 """
 from flask import Blueprint, request, jsonify
 from functools import wraps
-from db import get_db_connection
+from db import get_db_connection, insert_event, user_connection
 from datetime import datetime
+import ledger
+import queries
+import sharding
+import tracking_numbers
+import webhooks
+from serializers import RowMapper, fast_jsonify
+from middleware import cache_policy, micro_cached
 
 package_routes = Blueprint('package_routes', __name__)
 
+SERVICE = RowMapper({
+    'service_id': 'service_id',
+    'name': 'name',
+    'max_weight_lb': 'max_weight_lb',
+    'base_price': 'base_price',
+    'delivery_speed': 'delivery_speed'
+})
+
 def login_required(f):
     """
     Decorator to require authentication for routes.
@@ -31,6 +46,8 @@ def login_required(f):
 
 
 @package_routes.route('/services', methods=['GET'])
+@cache_policy('public')
+@micro_cached()
 def get_services():
     """
     Get all available shipping services.
@@ -42,22 +59,9 @@ def get_services():
     conn = get_db_connection()
     
     try:
-        services = conn.execute(
-            "SELECT * FROM ServiceType ORDER BY delivery_speed, base_price"
-        ).fetchall()
+        services = SERVICE.all(conn.execute(queries.SERVICES))
         
-        return jsonify({
-            'services': [
-                {
-                    'service_id': s['service_id'],
-                    'name': s['name'],
-                    'max_weight_lb': s['max_weight_lb'],
-                    'base_price': s['base_price'],
-                    'delivery_speed': s['delivery_speed']
-                }
-                for s in services
-            ]
-        }), 200
+        return fast_jsonify({'services': services}), 200
     finally:
         conn.close()
 
@@ -135,14 +139,11 @@ def create_shipment():
         description: Invalid input
     """
     data = request.get_json()
-    conn = get_db_connection()
+    conn = user_connection(request.user_id)
     
     try:
         # Get customer_id for the user
-        customer = conn.execute(
-            "SELECT customer_id FROM Customer WHERE user_id = ?",
-            (request.user_id,)
-        ).fetchone()
+        customer = conn.execute(queries.CUSTOMER_ID, (request.user_id,)).fetchone()
         
         if not customer:
             return jsonify({'error': 'Customer profile not found. Please complete your profile.'}), 400
@@ -150,10 +151,7 @@ def create_shipment():
         customer_id = customer['customer_id']
         
         # Validate service and weight
-        service = conn.execute(
-            "SELECT * FROM ServiceType WHERE service_id = ?",
-            (data['service_id'],)
-        ).fetchone()
+        service = conn.execute(queries.SERVICE_BY_ID, (data['service_id'],)).fetchone()
         
         if not service:
             return jsonify({'error': 'Invalid service type'}), 400
@@ -166,26 +164,14 @@ def create_shipment():
         # Validate payment type
         if data['payment_type'] == 'account':
             # Check if customer has a contract
-            has_contract = conn.execute(
-                "SELECT has_contract FROM Customer WHERE customer_id = ?",
-                (customer_id,)
-            ).fetchone()['has_contract']
+            has_contract = conn.execute(queries.CUSTOMER_HAS_CONTRACT, (customer_id,)).fetchone()['has_contract']
             
             if not has_contract:
                 return jsonify({'error': 'Account billing requires a contract. Please use credit card.'}), 400
         
         # Insert package
         cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO Package (
-                customer_id, sender_name, sender_addr1, sender_addr2,
-                sender_city, sender_state, sender_zip,
-                recipient_name, recipient_addr1, recipient_addr2,
-                recipient_city, recipient_state, recipient_zip,
-                service_id, weight_lb, is_hazardous, is_international,
-                declared_value, customs_desc, payment_type, date_shipped
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
+        cursor.execute(queries.INSERT_PACKAGE, (
             customer_id,
             data['sender_name'],
             data['sender_addr1'],
@@ -211,29 +197,31 @@ def create_shipment():
         
         package_id = cursor.lastrowid
         
+        # Account shipments go onto this month's open statement
+        if data['payment_type'] == 'account':
+            statement_id = ledger.get_open_statement(cursor, customer_id)
+            ledger.record_charge(cursor, customer_id, service['base_price'], package_id, statement_id)
+        
         # Create initial tracking event
         # Get a default location (first warehouse)
-        location = conn.execute(
-            "SELECT location_id FROM Location WHERE type = 'warehouse' LIMIT 1"
-        ).fetchone()
+        location = conn.execute(queries.WAREHOUSE).fetchone()
         
         if location:
-            cursor.execute("""
-                INSERT INTO TrackingEvent (package_id, location_id, timestamp, status, notes)
-                VALUES (?, ?, ?, ?, ?)
-            """, (
+            insert_event(
+                cursor,
                 package_id,
                 location['location_id'],
                 datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
                 'processing',
                 'Package received and being processed'
-            ))
+            )
         
         conn.commit()
+        tracking_numbers.add(package_id)
         
         return jsonify({
             'message': 'Package created successfully',
-            'tracking_number': package_id,
+            'tracking_number': tracking_numbers.public(package_id),
             'estimated_cost': service['base_price']
         }), 201
         
@@ -258,10 +246,7 @@ def customer_profile():
     
     try:
         if request.method == 'GET':
-            customer = conn.execute(
-                "SELECT * FROM Customer WHERE user_id = ?",
-                (request.user_id,)
-            ).fetchone()
+            customer = conn.execute(queries.CUSTOMER_FOR_USER, (request.user_id,)).fetchone()
             
             if not customer:
                 return jsonify({'exists': False}), 200
@@ -286,10 +271,8 @@ def customer_profile():
         data = request.get_json()
         
         cursor = conn.cursor()
-        cursor.execute("""
-            INSERT OR REPLACE INTO Customer (user_id, name, phone, address_line1, address_line2, city, state, zip)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
+        # Upsert keeps the customer_id (and with it the shard) stable
+        cursor.execute(queries.UPSERT_CUSTOMER, (
             request.user_id,
             data['name'],
             data.get('phone', ''),
@@ -302,9 +285,123 @@ def customer_profile():
         
         conn.commit()
         
+        customer_id = conn.execute(queries.CUSTOMER_ID, (request.user_id,)).fetchone()['customer_id']
+        sharding.save_customer(customer_id)
+        
         return jsonify({'message': 'Profile created/updated successfully'}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     finally:
         conn.close()
+
+
+@package_routes.route('/customer/webhooks', methods=['GET', 'POST'])
+@login_required
+def customer_webhooks():
+    """
+    List or add webhook subscriptions: every tracking event of the
+    customer's packages is POSTed to each subscribed URL (see webhooks.py).
+    ---
+    parameters:
+      - in: body
+        name: subscription
+        required: false
+        schema:
+          type: object
+          required:
+            - url
+          properties:
+            url:
+              type: string
+              example: https://example.com/hooks/tracking
+            secret:
+              type: string
+              description: Signs each delivery (X-Webhook-Signature, HMAC-SHA256 of the body)
+    responses:
+      200:
+        description: Subscriptions with their queued event counts
+      201:
+        description: Subscription created
+      400:
+        description: Missing body, URL not http(s) or not a public host, or no customer profile
+    """
+    conn = user_connection(request.user_id)
+    
+    try:
+        customer = conn.execute(queries.CUSTOMER_ID, (request.user_id,)).fetchone()
+        
+        if not customer:
+            return jsonify({'error': 'Customer profile not found. Please complete your profile.'}), 400
+        
+        if request.method == 'GET':
+            subscriptions = [dict(row) for row in conn.execute(queries.WEBHOOKS, (customer['customer_id'],))]
+            for subscription in subscriptions:
+                subscription['active'] = bool(subscription['active'])
+            return jsonify({'subscriptions': subscriptions}), 200
+        
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not isinstance(data.get('url'), str):
+            return jsonify({'error': 'A JSON body with a url is required'}), 400
+        url = data['url']
+        try:
+            webhooks.check_url(url)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        cursor = conn.cursor()
+        cursor.execute(queries.INSERT_WEBHOOK, (
+            customer['customer_id'],
+            url,
+            data.get('secret'),
+            datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        ))
+        conn.commit()
+        
+        return jsonify({
+            'message': 'Subscription created',
+            'subscription_id': cursor.lastrowid
+        }), 201
+        
+    except Exception as e:
+        conn.rollback()
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+
+
+@package_routes.route('/customer/webhooks/<int:subscription_id>', methods=['DELETE'])
+@login_required
+def delete_webhook(subscription_id):
+    """
+    Remove a webhook subscription and drop its undelivered events.
+    ---
+    parameters:
+      - name: subscription_id
+        in: path
+        type: integer
+        required: true
+    responses:
+      200:
+        description: Subscription removed
+      404:
+        description: Subscription not found
+    """
+    conn = user_connection(request.user_id)
+    
+    try:
+        customer = conn.execute(queries.CUSTOMER_ID, (request.user_id,)).fetchone()
+        
+        if not customer or conn.execute(queries.DELETE_WEBHOOK, (subscription_id, customer['customer_id'])).rowcount == 0:
+            return jsonify({'error': 'Subscription not found'}), 404
+        
+        conn.execute(queries.DELETE_WEBHOOK_OUTBOX, (subscription_id,))
+        conn.commit()
+        
+        return jsonify({'message': 'Subscription removed'}), 200
+        
+    except Exception as e:
+        conn.rollback()
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
@@ -0,0 +1,328 @@
+# backend/partitions.py
+"""
+partitions.py - Monthly TrackingEvent partitions
+
+With EVENT_PARTITIONS=1 new tracking events are written to one SQLite file
+per month, events-YYYY-MM.db in EVENT_PARTITION_DIR (default
+shipping-events/ next to DB_PATH), attached as schema ev_YYYY_MM:
+
+    writes   db.insert_event() sends each event to the partition of the
+             month it was scanned in, kept within the months hint() attaches
+             for its package, so a late upload, a correction or a backfill
+             is still read back. The current month is attached at checkout
+             (ATTACH can't run inside a transaction); other months are
+             attached, and created, when the insert comes first.
+    reads    a TEMP VIEW named TrackingEvent shadows main.TrackingEvent and
+             UNION ALLs it with the attached partitions, so existing queries
+             run unchanged. Reads by package call hint() first, which
+             attaches the months from the package's date_shipped through its
+             delivery (usually one or two files). Unhinted reads (dashboards,
+             exports) see the live table plus the RECENT_PARTITIONS latest months.
+    ids      each partition's AUTOINCREMENT starts at (year * 12 + month) << 32,
+             so event_ids stay unique across partitions and the live table
+
+Old months are dropped by deleting their file: O(1), no DELETE, no VACUUM.
+Connections that still have a dropped month attached let go of it at their
+next checkout. SQLite allows 10 attached databases; MAX_ATTACHED of them are
+used for partitions (the archive takes another).
+
+    python partitions.py list
+    python partitions.py migrate          # move main.TrackingEvent rows into partitions
+    python partitions.py drop 2024-01
+"""
+import argparse
+import os
+import re
+import sys
+from collections import OrderedDict
+from datetime import datetime
+import cache_bus
+import db
+
+MAX_ATTACHED = 8
+RECENT_PARTITIONS = int(os.environ.get('EVENT_PARTITIONS_RECENT', 2))
+
+FILE_PATTERN = re.compile(r'^events-(\d{4}-\d{2})\.db$')
+
+
+def partition_dir():
+    """
+    Directory holding the partition files for the current DB_PATH.
+    """
+    return os.environ.get('EVENT_PARTITION_DIR') or os.path.splitext(db.DB_PATH)[0] + '-events'
+
+
+def partition_path(month):
+    return os.path.join(partition_dir(), f'events-{month}.db')
+
+
+def schema_for(month):
+    return 'ev_' + month.replace('-', '_')
+
+
+def current_month():
+    return datetime.now().strftime('%Y-%m')
+
+
+def months_between(first, last):
+    """
+    Every 'YYYY-MM' from first through last (both 'YYYY-MM...' strings).
+    """
+    year, month = int(first[:4]), int(first[5:7])
+    end = (int(last[:4]), int(last[5:7]))
+    months = []
+    while (year, month) <= end:
+        months.append(f'{year:04d}-{month:02d}')
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def existing():
+    """
+    Months that have a partition file, oldest first.
+    """
+    try:
+        names = os.listdir(partition_dir())
+    except FileNotFoundError:
+        return []
+    return sorted(m.group(1) for m in map(FILE_PATTERN.match, names) if m)
+
+
+def _create_schema(conn, schema, month):
+    # Same columns as the live table; no foreign keys, they can't cross databases
+    columns = conn.execute("PRAGMA main.table_info(TrackingEvent)").fetchall()
+    column_defs = ',\n'.join(
+        f"{row[1]} INTEGER PRIMARY KEY AUTOINCREMENT" if row[5] else
+        f"{row[1]} {row[2]}{' NOT NULL' if row[3] else ''}" for row in columns
+    )
+    conn.executescript(f"""
+        CREATE TABLE IF NOT EXISTS {schema}.TrackingEvent (
+            {column_defs}
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS {schema}.idx_event_package_seq ON TrackingEvent(package_id, seq DESC);
+    """)
+    first_id = (int(month[:4]) * 12 + int(month[5:7])) << 32
+    conn.execute(f"""
+        INSERT INTO {schema}.sqlite_sequence (name, seq)
+        SELECT 'TrackingEvent', ? WHERE NOT EXISTS (SELECT 1 FROM {schema}.sqlite_sequence)
+    """, (first_id,))
+    conn.commit()
+
+
+def _attached(conn):
+    if not hasattr(conn, 'partitions'):
+        conn.partitions = OrderedDict()
+    return conn.partitions
+
+
+def _refresh_view(conn):
+    columns = ', '.join(row[1] for row in conn.execute("PRAGMA main.table_info(TrackingEvent)"))
+    selects = [f"SELECT {columns} FROM main.TrackingEvent"]
+    selects += [f"SELECT {columns} FROM {schema}.TrackingEvent" for schema in _attached(conn).values()]
+    conn.execute("DROP VIEW IF EXISTS temp.TrackingEvent")
+    conn.execute("CREATE TEMP VIEW TrackingEvent AS\n" + '\nUNION ALL\n'.join(selects))
+
+
+def detach(conn, month):
+    """
+    Detach one month's partition from conn. Must be called outside a transaction.
+    """
+    schema = _attached(conn).pop(month, None)
+    if schema is None:
+        return False
+    # The view references the schema, so it has to go first
+    conn.execute("DROP VIEW IF EXISTS temp.TrackingEvent")
+    conn.execute(f"DETACH DATABASE {schema}")
+    _refresh_view(conn)
+    return True
+
+
+def attach(conn, month, create=False, refresh=True):
+    """
+    Attach one month's partition. Returns False when it doesn't exist (and
+    create is False). The least recently used partition is detached when
+    MAX_ATTACHED are already attached. Must be called outside a transaction.
+    """
+    attached = _attached(conn)
+    if month in attached:
+        attached.move_to_end(month)
+        return True
+    path = partition_path(month)
+    if not create and not os.path.exists(path):
+        return False
+
+    while len(attached) >= MAX_ATTACHED:
+        detach(conn, next(iter(attached)))
+    if create:
+        os.makedirs(partition_dir(), exist_ok=True)
+    schema = schema_for(month)
+    conn.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+    if create:
+        _create_schema(conn, schema, month)
+    attached[month] = schema
+    if refresh:
+        _refresh_view(conn)
+    return True
+
+
+def prepare(conn):
+    """
+    Called by db at checkout: attach this month's partition (creating it) and
+    the other recent ones, and drop any that were deleted since last time.
+    """
+    attached = _attached(conn)
+    for month in [m for m in attached if not os.path.exists(partition_path(m))]:
+        detach(conn, month)
+
+    month = current_month()
+    if month in attached:
+        return
+    for recent in existing()[-RECENT_PARTITIONS:]:
+        attach(conn, recent, refresh=False)
+    attach(conn, month, create=True, refresh=False)
+    _refresh_view(conn)
+
+
+def event_tables(conn):
+    """
+    Every TrackingEvent table attached to conn: the live one, then the partitions.
+    """
+    return ['main.TrackingEvent'] + [f'{schema}.TrackingEvent' for schema in _attached(conn).values()]
+
+
+def event_month(conn, package_id, stored_time):
+    """
+    Month whose partition an event of the package belongs in: the month of
+    its own timestamp, moved into the range hint() attaches for the package
+    (date_shipped through date_delivered, or the current month).
+    """
+    month = db.from_epoch(stored_time)[:7]
+    row = conn.execute("SELECT date_shipped, date_delivered FROM main.Package WHERE package_id = ?",
+                       (package_id,)).fetchone()
+    if row is None or not row[0]:
+        return min(month, current_month())
+    return min(max(month, row[0][:7]), (row[1] or current_month())[:7])
+
+
+def insert_table(conn, month=None):
+    """
+    Table new events of `month` (default the current one) go to: that
+    month's partition, attached (and created) if need be. Inside a
+    transaction, where nothing can be attached, the live table instead.
+    """
+    month = month or current_month()
+    schema = _attached(conn).get(month)
+    if schema is None and not conn.in_transaction:
+        attach(conn, month, create=True)
+        schema = _attached(conn)[month]
+    return f'{schema}.TrackingEvent' if schema else 'main.TrackingEvent'
+
+
+def hint(conn, date_shipped, date_delivered=None):
+    """
+    Attach the partitions that can hold events of a package shipped on
+    date_shipped and delivered on date_delivered (or still moving).
+    Returns their schema names. Must be called outside a transaction.
+    """
+    if not db.EVENT_PARTITIONS or not date_shipped:
+        return []
+    months = months_between(date_shipped, date_delivered or current_month())
+    available = set(existing())
+    months = [m for m in months if m in available][-MAX_ATTACHED:]
+    attached = _attached(conn)
+    missing = [m for m in months if m not in attached]
+    for month in months:
+        attach(conn, month, refresh=False)
+    if missing:
+        _refresh_view(conn)
+    return [attached[m] for m in months]
+
+
+def hint_package(conn, package_id):
+    """
+    hint() for a package id, looked up in the live Package table.
+    """
+    if not db.EVENT_PARTITIONS:
+        return []
+    row = conn.execute("SELECT date_shipped, date_delivered FROM main.Package WHERE package_id = ?",
+                       (package_id,)).fetchone()
+    return hint(conn, row[0], row[1]) if row else []
+
+
+def drop(month):
+    """
+    Delete one month's partition file. Returns the bytes freed.
+    Every worker drops its cached tracking payloads.
+    """
+    freed = 0
+    for path in (partition_path(month), partition_path(month) + '-wal', partition_path(month) + '-shm'):
+        if os.path.exists(path):
+            freed += os.path.getsize(path)
+            os.remove(path)
+    cache_bus.publish(None, 'tracking')
+    return freed
+
+
+def month_range(month):
+    """
+    Stored timestamps [start, end) of one 'YYYY-MM' month.
+    """
+    year, number = int(month[:4]), int(month[5:7])
+    following = f'{year + 1:04d}-01' if number == 12 else f'{year:04d}-{number + 1:02d}'
+    return db.epoch_bound(month), db.epoch_bound(following)
+
+
+def migrate(conn):
+    """
+    Move events from the live table into their month's partition, one month
+    per transaction. Returns {month: events moved}.
+    """
+    columns = ', '.join(row[1] for row in conn.execute("PRAGMA main.table_info(TrackingEvent)"))
+    months = [row[0] for row in conn.execute(
+        "SELECT DISTINCT strftime('%Y-%m', timestamp, 'unixepoch') FROM main.TrackingEvent ORDER BY 1")]
+    moved = {}
+    for month in months:
+        attach(conn, month, create=True)
+        schema = _attached(conn)[month]
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            INSERT INTO {schema}.TrackingEvent ({columns})
+            SELECT {columns} FROM main.TrackingEvent WHERE timestamp >= ? AND timestamp < ?
+        """, month_range(month))
+        moved[month] = cursor.rowcount
+        cursor.execute("DELETE FROM main.TrackingEvent WHERE timestamp >= ? AND timestamp < ?", month_range(month))
+        conn.commit()
+    return moved
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage monthly TrackingEvent partitions")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('list')
+    sub.add_parser('migrate')
+    drop_parser = sub.add_parser('drop')
+    drop_parser.add_argument('month', help='YYYY-MM')
+    args = parser.parse_args(argv)
+
+    if args.command == 'list':
+        for month in existing():
+            print(month, os.path.getsize(partition_path(month)), 'bytes')
+        return 0
+    if args.command == 'drop':
+        if args.month not in existing():
+            print(f"No partition for {args.month}")
+            return 1
+        print(f"Dropped {args.month}, {drop(args.month)} bytes freed")
+        return 0
+
+    conn = db._connect(db.DB_PATH)
+    try:
+        for month, count in migrate(conn).items():
+            print(f"{month}: {count} event(s)")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,579 @@
+# backend/queries.py
+"""
+queries.py - Named SQL statements used by the route blueprints
+
+Every statement a blueprint runs is declared here once, under a name:
+
+    CUSTOMER_ID = query('customer.id_for_user', "SELECT customer_id FROM Customer WHERE user_id = ?")
+    conn.execute(queries.CUSTOMER_ID, (request.user_id,))
+
+A Query is a str, so it goes anywhere SQL text does (conn.execute,
+sharding.query, archive.union_all). Templates ({schema}, {events}) list the
+values they are filled with in `variants`; format() returns a Query with the
+same name for each filled-in text, and archive.union_all() names its UNION
+ALL the same way. Because the text of a named statement never changes,
+sqlite3's per-connection statement cache (db.STATEMENT_CACHE, sized from
+this registry) prepares it once per connection and reuses it.
+
+The name travels with the text into db.DB_HOOKS, so the slow-query stats
+(GET /api/admin/db/query-stats) and db_queries_total in /metrics count
+executions per query.
+
+`allow` lists the plan lines a query is expected to have: prefixes such as
+'SCAN Location' or 'USE TEMP B-TREE FOR ORDER BY'. plan_problems() reports
+every other full scan or temp b-tree sort; the test suite runs it over the
+whole registry.
+
+Helper modules (ledger, summaries, archive, partitions, migrations) keep
+their own SQL next to the code that maintains those tables.
+"""
+import sqlite3
+import textwrap
+
+REGISTRY = {}
+
+# Expected plan lines that are never a problem
+_ALWAYS_ALLOWED = ('SCAN CONSTANT ROW',)
+
+LIVE_AND_ARCHIVE = ({'schema': 'main'}, {'schema': 'archive'})
+
+
+class Query(str):
+    """
+    SQL text registered under `name`.
+    """
+    def __new__(cls, name, sql, allow=(), variants=()):
+        self = super().__new__(cls, sql)
+        self.name = name
+        self.allow = tuple(allow)
+        self.variants = tuple(variants)
+        self._derived = {}
+        self._formatted = {}
+        return self
+
+    def derive(self, text):
+        """
+        The same query with its text rewritten (filled in, unioned). One
+        object per text, so repeated calls hand sqlite3 an identical string.
+        """
+        derived = self._derived.get(text)
+        if derived is None:
+            derived = self._derived[text] = Query(self.name, text, self.allow)
+        return derived
+
+    def format(self, *args, **kwargs):
+        key = (args, tuple(kwargs.items()))
+        formatted = self._formatted.get(key)
+        if formatted is None:
+            formatted = self._formatted[key] = self.derive(str.format(self, *args, **kwargs))
+        return formatted
+
+    def texts(self):
+        """
+        Every concrete statement: the text itself or each filled-in variant.
+        """
+        return [self.format(**variant) for variant in self.variants] or [self]
+
+
+def query(name, sql, allow=(), variants=()):
+    """
+    Register a statement and return it.
+    """
+    if name in REGISTRY:
+        raise ValueError(f"Query {name} is already registered")
+    REGISTRY[name] = Query(name, textwrap.dedent(sql).strip(), allow, variants)
+    return REGISTRY[name]
+
+
+def derive(sql, text):
+    """
+    `text` under the name of `sql` when that is a registered Query.
+    """
+    return sql.derive(text) if isinstance(sql, Query) else text
+
+
+def statement_count():
+    """
+    Distinct statement texts the registry can produce: one per query, or one
+    per variant plus their UNION ALL for templates.
+    """
+    return sum(len(q.variants) + 1 if q.variants else 1 for q in REGISTRY.values())
+
+
+def plan_problems(conn, sql):
+    """
+    EXPLAIN QUERY PLAN lines of `sql` (every variant) that scan a table or
+    sort in a temp b-tree without being listed in its `allow`.
+    """
+    allowed = _ALWAYS_ALLOWED + getattr(sql, 'allow', ())
+    problems = []
+    for text in getattr(sql, 'texts', lambda: [sql])():
+        params = (None,) * text.count('?')
+        # Base-class execute: a plan check is not a query execution
+        for row in sqlite3.Connection.execute(conn, 'EXPLAIN QUERY PLAN ' + text, params):
+            detail = row[3]
+            if (detail.startswith('SCAN ') or 'TEMP B-TREE' in detail) and not detail.startswith(allowed):
+                problems.append(detail)
+    return problems
+
+
+# ---------------------------------------------------------------------
+# Users and customers
+# ---------------------------------------------------------------------
+
+USER_LOGIN = query('user.login', "SELECT * FROM User WHERE email = ? AND password = ?")
+
+USER_ROLE = query('user.role', "SELECT role FROM User WHERE user_id = ?")
+
+USER_ID_BY_EMAIL = query('user.id_by_email', "SELECT user_id FROM User WHERE email = ?")
+
+INSERT_USER = query('user.insert', "INSERT INTO User (email, password, role) VALUES (?, ?, ?)")
+
+STAFF_USERS = query('user.staff_list', """
+    SELECT user_id, email, role
+    FROM User
+    WHERE role IN ('staff', 'admin')
+    ORDER BY role, email
+""", allow=('SCAN User', 'USE TEMP B-TREE FOR ORDER BY'))
+
+INSERT_STAFF = query('user.insert_staff', """
+    INSERT INTO Staff (user_id, employee_number, hire_date, department)
+    VALUES (?, ?, ?, ?)
+""")
+
+DELETE_STAFF = query('user.delete_staff', "DELETE FROM Staff WHERE user_id = ?",
+                     allow=('SCAN Staff',))
+
+DELETE_USER = query('user.delete', "DELETE FROM User WHERE user_id = ?")
+
+UPDATE_USER_ROLE = query('user.update_role', """
+    UPDATE User
+    SET role = ?
+    WHERE user_id = ? AND role IN ('staff', 'admin')
+""")
+
+CUSTOMER_FOR_USER = query('customer.for_user', "SELECT * FROM Customer WHERE user_id = ?")
+
+CUSTOMER_ID = query('customer.id_for_user', "SELECT customer_id FROM Customer WHERE user_id = ?")
+
+CUSTOMER_CONTRACT = query('customer.contract_for_user', """
+    SELECT customer_id, has_contract, account_number
+    FROM Customer
+    WHERE user_id = ?
+""")
+
+CUSTOMER_HAS_CONTRACT = query('customer.has_contract', "SELECT has_contract FROM Customer WHERE customer_id = ?")
+
+CUSTOMER_OWNS = query('customer.owned_by_user', """
+    SELECT c.customer_id
+    FROM Customer c
+    WHERE c.user_id = ? AND c.customer_id = ?
+""")
+
+CUSTOMER_BY_ID = query('customer.by_id', "SELECT * FROM Customer WHERE customer_id = ?")
+
+UPSERT_CUSTOMER = query('customer.upsert', """
+    INSERT INTO Customer (user_id, name, phone, address_line1, address_line2, city, state, zip)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(user_id) DO UPDATE SET
+        name = excluded.name,
+        phone = excluded.phone,
+        address_line1 = excluded.address_line1,
+        address_line2 = excluded.address_line2,
+        city = excluded.city,
+        state = excluded.state,
+        zip = excluded.zip
+""")
+
+MAX_ACCOUNT_NUMBER = query('customer.max_account_number',
+                           "SELECT MAX(account_number) as max_num FROM Customer",
+                           allow=('SCAN Customer',))
+
+SET_CONTRACT = query('customer.set_contract', """
+    UPDATE Customer
+    SET has_contract = 1, account_number = ?
+    WHERE customer_id = ?
+""")
+
+CLEAR_CONTRACT = query('customer.clear_contract', """
+    UPDATE Customer
+    SET has_contract = 0
+    WHERE customer_id = ?
+""")
+
+# ---------------------------------------------------------------------
+# Services and locations
+# ---------------------------------------------------------------------
+
+SERVICES = query('service.list', "SELECT * FROM ServiceType ORDER BY delivery_speed, base_price",
+                 allow=('SCAN ServiceType', 'USE TEMP B-TREE FOR ORDER BY'))
+
+SERVICE_BY_ID = query('service.by_id', "SELECT * FROM ServiceType WHERE service_id = ?")
+
+LOCATIONS = query('location.list', "SELECT * FROM Location ORDER BY type, name",
+                  allow=('SCAN Location', 'USE TEMP B-TREE FOR ORDER BY'))
+
+WAREHOUSE = query('location.warehouse', "SELECT location_id FROM Location WHERE type = 'warehouse' LIMIT 1",
+                  allow=('SCAN Location',))
+
+INSERT_LOCATION = query('location.insert', """
+    INSERT INTO Location (type, name, city, state)
+    VALUES (?, ?, ?, ?)
+""")
+
+# ---------------------------------------------------------------------
+# Packages and tracking
+# ---------------------------------------------------------------------
+
+INSERT_PACKAGE = query('package.insert', """
+    INSERT INTO Package (
+        customer_id, sender_name, sender_addr1, sender_addr2,
+        sender_city, sender_state, sender_zip,
+        recipient_name, recipient_addr1, recipient_addr2,
+        recipient_city, recipient_state, recipient_zip,
+        service_id, weight_lb, is_hazardous, is_international,
+        declared_value, customs_desc, payment_type, date_shipped
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+""")
+
+PACKAGE_EXISTS = query('package.exists', "SELECT package_id FROM Package WHERE package_id = ?")
+
+MARK_DELIVERED = query('package.mark_delivered', """
+    UPDATE Package
+    SET date_delivered = ?,
+        delivered_signature = ?
+    WHERE package_id = ?
+""")
+
+# {schema}: main, or archive for packages moved there (see archive.py)
+PACKAGE_DETAIL = query('package.detail', """
+    SELECT
+        p.package_id,
+        p.recipient_name,
+        p.recipient_addr1,
+        p.recipient_addr2,
+        p.recipient_city,
+        p.recipient_state,
+        p.recipient_zip,
+        p.sender_name,
+        p.sender_addr1,
+        p.sender_addr2,
+        p.sender_city,
+        p.sender_state,
+        p.sender_zip,
+        p.weight_lb,
+        p.date_shipped,
+        p.date_delivered,
+        p.delivered_signature,
+        p.is_hazardous,
+        p.is_international,
+        st.name as service_name,
+        st.delivery_speed,
+        c.customer_id
+    FROM {schema}.Package p
+    JOIN ServiceType st ON p.service_id = st.service_id
+    JOIN Customer c ON p.customer_id = c.customer_id
+    WHERE p.package_id = ?
+""", variants=LIVE_AND_ARCHIVE)
+
+TRACKING_HISTORY = query('tracking.history', """
+    SELECT
+        te.timestamp,
+        te.status,
+        te.notes,
+        l.type as location_type,
+        l.name as location_name,
+        l.city as location_city,
+        l.state as location_state
+    FROM {events} te
+    JOIN Location l ON te.location_id = l.location_id
+    WHERE te.package_id = ?
+    ORDER BY te.seq DESC
+""", variants=({'events': 'TrackingEvent'}, {'events': 'archive.TrackingEvent'}),
+    # The archive is clustered by package, so this sorts one package's few events
+    allow=('USE TEMP B-TREE FOR ORDER BY',))
+
+USER_PACKAGES = query('tracking.user_packages', """
+    SELECT
+        p.package_id,
+        p.recipient_name,
+        p.recipient_city,
+        p.recipient_state,
+        p.date_shipped,
+        p.date_delivered,
+        st.name as service_name,
+        (
+            SELECT te.status
+            FROM TrackingEvent te
+            WHERE te.package_id = p.package_id
+            ORDER BY te.seq DESC
+            LIMIT 1
+        ) as current_status
+    FROM Package p
+    JOIN ServiceType st ON p.service_id = st.service_id
+    JOIN Customer c ON p.customer_id = c.customer_id
+    WHERE c.user_id = ?
+    ORDER BY p.date_shipped DESC
+""", allow=('USE TEMP B-TREE FOR ORDER BY',))
+
+PACKAGE_LOCATION = query('tracking.current_location', """
+    SELECT
+        l.location_id,
+        l.type,
+        l.name,
+        l.city,
+        l.state,
+        te.timestamp,
+        te.status
+    FROM TrackingEvent te
+    JOIN Location l ON te.location_id = l.location_id
+    WHERE te.package_id = ?
+    ORDER BY te.seq DESC
+    LIMIT 1
+""")
+
+# ---------------------------------------------------------------------
+# Admin dashboard
+# ---------------------------------------------------------------------
+
+ADMIN_PACKAGES = query('admin.packages', """
+    SELECT
+        p.package_id,
+        p.sender_name,
+        p.recipient_name,
+        p.recipient_city,
+        p.recipient_state,
+        p.date_shipped,
+        p.date_delivered,
+        c.name as customer_name,
+        st.name as service_name,
+        (
+            SELECT te.status
+            FROM TrackingEvent te
+            WHERE te.package_id = p.package_id
+            ORDER BY te.seq DESC
+            LIMIT 1
+        ) as current_status,
+        (
+            SELECT l.name
+            FROM TrackingEvent te
+            JOIN Location l ON te.location_id = l.location_id
+            WHERE te.package_id = p.package_id
+            ORDER BY te.seq DESC
+            LIMIT 1
+        ) as current_location
+    FROM Package p
+    JOIN Customer c ON p.customer_id = c.customer_id
+    JOIN ServiceType st ON p.service_id = st.service_id
+    ORDER BY p.date_shipped DESC
+    LIMIT 100
+""", allow=('SCAN p USING INDEX idx_package_shipped',))
+
+ADMIN_COUNTS = query('admin.counts', """
+    SELECT
+        (SELECT COUNT(*) FROM Package) as total_packages,
+        (SELECT COUNT(*) FROM Package WHERE date_delivered IS NULL) as in_transit,
+        (SELECT COUNT(*) FROM Package
+         WHERE date_delivered >= date('now') AND date_delivered < date('now', '+1 day')) as delivered_today,
+        (SELECT COUNT(*) FROM Customer) as total_customers
+""", allow=('SCAN Package', 'SCAN Customer'))
+
+RECENT_EVENTS = query('admin.recent_events', """
+    SELECT
+        te.timestamp,
+        te.status,
+        p.package_id,
+        l.name as location_name
+    FROM TrackingEvent te
+    JOIN Package p ON te.package_id = p.package_id
+    JOIN Location l ON te.location_id = l.location_id
+    ORDER BY te.timestamp DESC
+    LIMIT 10
+""", allow=('SCAN te USING INDEX idx_event_timestamp',))
+
+# ---------------------------------------------------------------------
+# Billing
+# ---------------------------------------------------------------------
+
+STATEMENTS = query('billing.statements', """
+    SELECT *
+    FROM BillingStatement
+    WHERE customer_id = ?
+    ORDER BY statement_month DESC
+""")
+
+STATEMENT_FOR_CUSTOMER = query('billing.statement', """
+    SELECT *
+    FROM BillingStatement
+    WHERE statement_id = ? AND customer_id = ?
+""")
+
+STATEMENT_STATUS = query('billing.statement_status', """
+    SELECT statement_id, status
+    FROM BillingStatement
+    WHERE statement_id = ? AND customer_id = ?
+""")
+
+# Older statements may include packages that were moved to the archive
+STATEMENT_PACKAGES = query('billing.statement_packages', """
+    SELECT
+        p.package_id,
+        p.recipient_name,
+        p.recipient_city,
+        p.recipient_state,
+        p.date_shipped,
+        p.weight_lb,
+        st.name as service_name,
+        COALESCE(le.amount, st.base_price) as cost
+    FROM {schema}.Package p
+    JOIN ServiceType st ON p.service_id = st.service_id
+    JOIN StatementPackage sp ON p.package_id = sp.package_id
+    LEFT JOIN LedgerEntry le ON le.statement_id = sp.statement_id
+        AND le.package_id = p.package_id
+        AND le.entry_type = 'charge'
+    WHERE sp.statement_id = ?
+""", variants=LIVE_AND_ARCHIVE)
+
+PAYMENTS = query('billing.payments', """
+    SELECT
+        payment_id,
+        date_paid,
+        amount,
+        method,
+        package_id
+    FROM Payment
+    WHERE customer_id = ?
+    ORDER BY date_paid DESC
+""")
+
+OPEN_STATEMENT = query('billing.open_statement', """
+    SELECT statement_id, statement_month, total_amount
+    FROM BillingStatement
+    WHERE customer_id = ? AND statement_month = ? AND status = 'unpaid'
+    ORDER BY statement_id DESC
+    LIMIT 1
+""")
+
+INSERT_PAYMENT = query('billing.insert_payment', """
+    INSERT INTO Payment (customer_id, date_paid, amount, method)
+    VALUES (?, ?, ?, ?)
+""")
+
+# ---------------------------------------------------------------------
+# Webhooks (delivery SQL lives in webhooks.py)
+# ---------------------------------------------------------------------
+
+WEBHOOKS = query('webhook.list', """
+    SELECT
+        s.subscription_id, s.url, s.active, s.created_at, s.failures, s.last_error,
+        (SELECT COUNT(*) FROM Outbox o WHERE o.subscription_id = s.subscription_id) as queued
+    FROM WebhookSubscription s
+    WHERE s.customer_id = ?
+    ORDER BY s.subscription_id
+""", allow=('USE TEMP B-TREE FOR ORDER BY',))  # a customer's handful of subscriptions
+
+INSERT_WEBHOOK = query('webhook.insert', """
+    INSERT INTO WebhookSubscription (customer_id, url, secret, created_at)
+    VALUES (?, ?, ?, ?)
+""")
+
+DELETE_WEBHOOK = query('webhook.delete', """
+    DELETE FROM WebhookSubscription
+    WHERE subscription_id = ? AND customer_id = ?
+""")
+
+DELETE_WEBHOOK_OUTBOX = query('webhook.delete_outbox', "DELETE FROM Outbox WHERE subscription_id = ?")
+
+
+# ---------------------------------------------------------------------
+# Change feed (ChangeLog is written by triggers and db.insert_event)
+# ---------------------------------------------------------------------
+
+CHANGES_SINCE = query('changes.since', """
+    SELECT position, entity, entity_id, op, data, changed_at
+    FROM ChangeLog
+    WHERE position > ?
+    ORDER BY position
+    LIMIT ?
+""")
+
+CHANGE_BOUNDS = query('changes.bounds', """
+    SELECT
+        (SELECT MIN(position) FROM ChangeLog),
+        (SELECT MAX(position) FROM ChangeLog)
+""")
+
+
+# ---------------------------------------------------------------------
+# Exports (whole-table reads by design)
+# ---------------------------------------------------------------------
+
+STATEMENT_ID = query('export.statement', """
+    SELECT statement_id
+    FROM BillingStatement
+    WHERE statement_id = ? AND customer_id = ?
+""")
+
+EXPORT_STATEMENT = query('export.statement_lines', """
+    SELECT
+        p.package_id as tracking_number,
+        p.recipient_name,
+        p.recipient_city,
+        p.recipient_state,
+        p.date_shipped,
+        p.weight_lb as weight,
+        st.name as service,
+        COALESCE(le.amount, st.base_price) as cost
+    FROM StatementPackage sp
+    JOIN {schema}.Package p ON p.package_id = sp.package_id
+    JOIN ServiceType st ON p.service_id = st.service_id
+    LEFT JOIN LedgerEntry le ON le.statement_id = sp.statement_id
+        AND le.package_id = p.package_id
+        AND le.entry_type = 'charge'
+    WHERE sp.statement_id = ?
+""", variants=LIVE_AND_ARCHIVE)
+
+EXPORT_PAYMENTS = query('export.payments', """
+    SELECT
+        payment_id,
+        date_paid,
+        amount,
+        method,
+        package_id as tracking_number
+    FROM Payment
+    WHERE customer_id = ?
+    ORDER BY date_paid DESC
+""")
+
+EXPORT_PACKAGES = query('export.packages', """
+    SELECT
+        p.package_id as tracking_number,
+        c.name as customer,
+        p.sender_name as sender,
+        p.recipient_name as recipient,
+        p.recipient_city,
+        p.recipient_state,
+        st.name as service,
+        p.weight_lb as weight,
+        p.payment_type,
+        p.date_shipped,
+        p.date_delivered
+    FROM Package p
+    JOIN Customer c ON p.customer_id = c.customer_id
+    JOIN ServiceType st ON p.service_id = st.service_id
+    WHERE p.date_shipped >= ? AND p.date_shipped < ?
+""")
+
+EXPORT_EVENTS = query('export.tracking_events', """
+    SELECT
+        te.event_id,
+        te.package_id as tracking_number,
+        te.timestamp,
+        te.status,
+        l.name as location,
+        l.type as location_type,
+        te.notes
+    FROM TrackingEvent te
+    JOIN Location l ON te.location_id = l.location_id
+    WHERE te.timestamp >= ? AND te.timestamp < ?
+""")
@@ -0,0 +1,257 @@
+# backend/reconcile.py
+"""
+reconcile.py - Bulk payment reconciliation for contract accounts
+
+Reads a bank/ACH remittance CSV one line at a time, matches each line to a
+BillingStatement by (account_number, statement_month) through an in-memory
+index, and posts the Payment and ledger rows in batched transactions. Lines
+that cannot be applied cleanly are written to an exceptions report.
+
+With DB_SHARDS the index covers every shard and each line is posted on
+the shard that owns its customer.
+
+A line's reference is stored on its Payment (unique), so importing a file
+again, or a line repeated within one, is reported as duplicate_reference
+instead of being posted twice. Lines without a reference can't be told
+apart and are always posted.
+
+Required columns: account_number, statement_month, amount
+Optional columns: date_paid, reference
+
+Run directly:
+    python reconcile.py remittance.csv --report exceptions.csv
+"""
+import argparse
+import csv
+import re
+import sys
+from datetime import datetime
+import ledger
+import sharding
+
+BATCH_SIZE = 1000
+
+EXCEPTION_FIELDS = ['line', 'reason', 'account_number', 'statement_month', 'amount', 'reference', 'detail']
+
+_MONTH = re.compile(r'^\d{4}-\d{2}$')
+
+
+def build_statement_index(conn):
+    """
+    Load every contract statement into a dict keyed by
+    (account_number, statement_month). Each value is a mutable
+    [statement_id, customer_id, status, amount_due] list so the importer
+    can track what it has applied without going back to the database.
+    When a month has several statements the oldest unpaid one wins.
+    """
+    rows = conn.execute("""
+        SELECT
+            c.account_number,
+            bs.statement_month,
+            bs.statement_id,
+            bs.customer_id,
+            bs.status,
+            ROUND(bs.total_amount - COALESCE(paid.amount, 0), 2) as amount_due
+        FROM BillingStatement bs
+        JOIN Customer c ON bs.customer_id = c.customer_id
+        LEFT JOIN (
+            SELECT statement_id, -SUM(amount) as amount
+            FROM LedgerEntry
+            WHERE entry_type = 'payment' AND statement_id IS NOT NULL
+            GROUP BY statement_id
+        ) paid ON paid.statement_id = bs.statement_id
+        WHERE c.account_number IS NOT NULL
+        ORDER BY bs.statement_id
+    """)
+
+    index = {}
+    for account_number, month, statement_id, customer_id, status, due in rows:
+        key = (account_number, month)
+        current = index.get(key)
+        if current is None or (current[2] == 'paid' and status == 'unpaid'):
+            index[key] = [statement_id, customer_id, status, due]
+    return index
+
+
+def _parse_line(row):
+    """
+    Validate one remittance row, returning (account_number, month, amount)
+    or raising ValueError with a human-readable reason.
+    """
+    try:
+        account_number = int(row['account_number'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('account_number is not an integer')
+
+    month = (row.get('statement_month') or '').strip()
+    if not _MONTH.match(month):
+        raise ValueError('statement_month must be YYYY-MM')
+
+    try:
+        amount = round(float(row['amount']), 2)
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('amount is not a number')
+    if amount <= 0:
+        raise ValueError('amount must be positive')
+
+    return account_number, month, amount
+
+
+def _reject_reason(cursors, entry, amount, reference):
+    """
+    Return (reason, detail) when a parsed line cannot be applied to the
+    indexed statement, or (None, None) when it can.
+    """
+    if reference:
+        for cursor in cursors:
+            posted = cursor.execute("SELECT payment_id FROM Payment WHERE reference = ?", (reference,)).fetchone()
+            if posted:
+                return 'duplicate_reference', f'payment {posted[0]}'
+    if entry is None:
+        return 'no_matching_statement', ''
+    if entry[2] == 'paid':
+        return 'already_paid', f'statement {entry[0]}'
+    if amount > entry[3] + ledger.TOLERANCE:
+        return 'overpayment', f'amount due {entry[3]:.2f}'
+    return None, None
+
+
+def _post_payment(cursor, entry, amount, date_paid, reference):
+    """
+    Insert the Payment and ledger rows for one line and update the index
+    entry. Returns True if the statement is now fully paid.
+    """
+    statement_id, customer_id = entry[0], entry[1]
+    cursor.execute("""
+        INSERT INTO Payment (customer_id, date_paid, amount, method, reference)
+        VALUES (?, ?, ?, 'account', ?)
+    """, (customer_id, date_paid, amount, reference))
+    ledger.record_payment(cursor, customer_id, amount, cursor.lastrowid,
+                          statement_id=statement_id, created_at=date_paid)
+
+    entry[3] = round(entry[3] - amount, 2)
+    if entry[3] > ledger.TOLERANCE:
+        return False
+
+    cursor.execute(
+        "UPDATE BillingStatement SET status = 'paid' WHERE statement_id = ?",
+        (statement_id,)
+    )
+    entry[2] = 'paid'
+    return True
+
+
+def _commit(conns):
+    for conn in conns:
+        conn.commit()
+
+
+def import_remittance(conn, lines, batch_size=BATCH_SIZE, report=None, progress=None):
+    """
+    Apply a remittance file to the database.
+
+    `conn` is a connection, or a list with one per shard in shard order
+    (sharding.connections()). `lines` is any iterable of CSV text lines
+    (an open file, an upload stream). Exceptions are written to the `report` csv.DictWriter as they
+    are found, or collected in the returned summary when no report is given.
+    `progress`, if given, is called with the running summary after each
+    batch is committed.
+    """
+    conns = conn if isinstance(conn, list) else [conn]
+    index = {key: entry for shard_conn in conns for key, entry in build_statement_index(shard_conn).items()}
+    cursors = [shard_conn.cursor() for shard_conn in conns]
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    summary = {
+        'lines': 0,
+        'applied': 0,
+        'statements_paid': 0,
+        'amount_applied': 0.0,
+        'exception_count': 0,
+        'batches': 0
+    }
+    exceptions = []
+    sink = report.writerow if report is not None else exceptions.append
+    progress = progress or (lambda summary: None)
+
+    def flag(line_no, reason, row, detail=''):
+        item = {
+            'line': line_no,
+            'reason': reason,
+            'account_number': row.get('account_number'),
+            'statement_month': row.get('statement_month'),
+            'amount': row.get('amount'),
+            'reference': row.get('reference'),
+            'detail': detail
+        }
+        summary['exception_count'] += 1
+        sink(item)
+
+    pending = 0
+    # Line 1 is the header
+    for line_no, row in enumerate(csv.DictReader(lines), start=2):
+        summary['lines'] += 1
+
+        try:
+            account_number, month, amount = _parse_line(row)
+        except ValueError as e:
+            flag(line_no, 'malformed', row, str(e))
+            continue
+
+        reference = (row.get('reference') or '').strip() or None
+        entry = index.get((account_number, month))
+        reason, detail = _reject_reason(cursors, entry, amount, reference)
+        if reason:
+            flag(line_no, reason, row, detail)
+            continue
+
+        summary['applied'] += 1
+        summary['amount_applied'] = round(summary['amount_applied'] + amount, 2)
+        # customer_id % shard count is the owning shard (always 0 unsharded)
+        cursor = cursors[entry[1] % len(cursors)]
+        if _post_payment(cursor, entry, amount, row.get('date_paid') or now, reference):
+            summary['statements_paid'] += 1
+        else:
+            flag(line_no, 'partial_payment', row, f'{entry[3]:.2f} still due')
+
+        pending += 1
+        if pending >= batch_size:
+            _commit(conns)
+            summary['batches'] += 1
+            pending = 0
+            progress(summary)
+
+    if pending:
+        _commit(conns)
+        summary['batches'] += 1
+
+    if report is None:
+        summary['exceptions'] = exceptions
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Apply a remittance CSV to billing statements')
+    parser.add_argument('file', help='remittance CSV file')
+    parser.add_argument('--report', help='write the exceptions report to this CSV file')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    conns = sharding.connections()
+    report_file = open(args.report, 'w', newline='') if args.report else sys.stdout
+    try:
+        writer = csv.DictWriter(report_file, fieldnames=EXCEPTION_FIELDS)
+        writer.writeheader()
+        with open(args.file, newline='', encoding='utf-8-sig') as remittance:
+            result = import_remittance(conns, remittance, args.batch_size, report=writer)
+    except Exception:
+        for conn in conns:
+            conn.rollback()
+        raise
+    finally:
+        for conn in conns:
+            conn.close()
+        if args.report:
+            report_file.close()
+
+    print(result, file=sys.stderr)
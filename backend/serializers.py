@@ -0,0 +1,230 @@
+# backend/serializers.py
+"""
+serializers.py - Precompiled row mappers and a fast JSON response path
+
+A RowMapper describes the JSON shape of a query result once, e.g.
+
+    PACKAGE_ROW = RowMapper({
+        'tracking_number': 'package_id',
+        'destination': Format('{}, {}', 'recipient_city', 'recipient_state'),
+        'current_status': Or('current_status', 'Unknown'),
+    })
+
+The first time it sees a cursor with a given column list it generates and
+compiles a plain Python function that builds the output dict straight from
+the row tuple by position (no sqlite3.Row objects, no per-key name lookups,
+no intermediate dicts). The compiled function is cached per column list.
+Timestamp and Status turn TrackingEvent's stored integers back into the
+API's text forms there.
+
+fast_jsonify() encodes with orjson when it is installed and falls back to
+the stdlib C encoder (compact separators, no key sorting) otherwise.
+"""
+import json
+from flask import Response
+from db import EVENT_STATUSES, from_epoch
+from tracing import span
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class Or:
+    """
+    Column value, or `fallback` when it is empty (same as `row[name] or fallback`).
+    """
+    def __init__(self, name, fallback):
+        self.name = name
+        self.fallback = fallback
+
+    def render(self, col, const, expr):
+        return f'({col(self.name)} or {const(self.fallback)})'
+
+
+class Bool:
+    """
+    Column value coerced to a JSON boolean.
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def render(self, col, const, expr):
+        return f'bool({col(self.name)})'
+
+
+class Format:
+    """
+    str.format() template filled with the given columns.
+    """
+    def __init__(self, template, *names):
+        self.template = template
+        self.names = names
+
+    def render(self, col, const, expr):
+        args = ', '.join(col(name) for name in self.names)
+        return f'{const(self.template.format)}({args})'
+
+
+class Call:
+    """
+    Arbitrary function applied to the given columns.
+    """
+    def __init__(self, fn, *names):
+        self.fn = fn
+        self.names = names
+
+    def render(self, col, const, expr):
+        args = ', '.join(col(name) for name in self.names)
+        return f'{const(self.fn)}({args})'
+
+
+class Timestamp:
+    """
+    Stored epoch seconds as 'YYYY-MM-DD HH:MM:SS' text (see db.TIME_FORMAT).
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def render(self, col, const, expr):
+        return f'{const(from_epoch)}({col(self.name)})'
+
+
+class Status:
+    """
+    Stored event status code as its name, or `fallback` when there is none.
+    """
+    def __init__(self, name, fallback=None):
+        self.name = name
+        self.fallback = fallback
+
+    def render(self, col, const, expr):
+        names = const((self.fallback,) + EVENT_STATUSES)
+        return f'{names}[{col(self.name)} or 0]'
+
+
+class When:
+    """
+    Nested spec that is emitted only when `name` is truthy, otherwise None.
+    """
+    def __init__(self, name, spec):
+        self.name = name
+        self.spec = spec
+
+    def render(self, col, const, expr):
+        return f'({expr(self.spec)} if {col(self.name)} else None)'
+
+
+def _compile(spec, columns):
+    """
+    Generate and compile `def _map(r): return {...}` for one column layout.
+    """
+    index = {name: i for i, name in enumerate(columns)}
+    namespace = {}
+
+    def col(name):
+        if name not in index:
+            raise KeyError(f"Column '{name}' is not in the result set {columns}")
+        return f'r[{index[name]}]'
+
+    def const(value):
+        key = f'_c{len(namespace)}'
+        namespace[key] = value
+        return key
+
+    def expr(node):
+        if isinstance(node, str):
+            return col(node)
+        if isinstance(node, dict):
+            items = ', '.join(f'{key!r}: {expr(value)}' for key, value in node.items())
+            return '{' + items + '}'
+        if hasattr(node, 'render'):
+            return node.render(col, const, expr)
+        raise TypeError(f'Unsupported mapper spec: {node!r}')
+
+    source = f'def _map(r):\n    return {expr(spec)}\n'
+    exec(compile(source, f'<row mapper {tuple(spec)}>', 'exec'), namespace)
+    return namespace['_map']
+
+
+class RowMapper:
+    """
+    Compiled row-to-dict mapper for one query's output shape.
+    """
+    def __init__(self, spec):
+        self.spec = spec
+        self._compiled = {}
+
+    def compile(self, columns):
+        """
+        Return the mapping function for a column layout, compiling it once.
+        """
+        columns = tuple(columns)
+        fn = self._compiled.get(columns)
+        if fn is None:
+            fn = self._compiled[columns] = _compile(self.spec, columns)
+        return fn
+
+    def _prepare(self, cursor):
+        fn = self.compile(d[0] for d in cursor.description)
+        # Plain tuples are cheaper to build than sqlite3.Row
+        cursor.row_factory = None
+        return fn
+
+    def map(self, row):
+        """
+        Map a single sqlite3.Row that has already been fetched.
+        """
+        return self.compile(row.keys())(row)
+
+    def all(self, cursor):
+        """
+        Map every remaining row of an executed cursor.
+        """
+        fn = self._prepare(cursor)
+        with span('fetch+map'):
+            return list(map(fn, cursor))
+
+    def many(self, rows):
+        """
+        Map a list of already fetched sqlite3.Rows (e.g. merged from several shards).
+        """
+        if not rows:
+            return []
+        fn = self.compile(rows[0].keys())
+        with span('map'):
+            return list(map(fn, rows))
+
+    def one(self, cursor):
+        """
+        Map the next row of an executed cursor, or return None.
+        """
+        fn = self._prepare(cursor)
+        row = cursor.fetchone()
+        return fn(row) if row is not None else None
+
+
+if orjson is not None:
+    def dumps(obj):
+        """
+        Encode obj as compact JSON bytes.
+        """
+        return orjson.dumps(obj)
+else:
+    _encode = json.JSONEncoder(separators=(',', ':')).encode
+
+    def dumps(obj):
+        """
+        Encode obj as compact JSON text.
+        """
+        return _encode(obj)
+
+
+def fast_jsonify(payload):
+    """
+    Drop-in replacement for flask.jsonify() for large payloads.
+    """
+    with span('serialize'):
+        body = dumps(payload)
+    return Response(body, mimetype='application/json')
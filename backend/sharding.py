@@ -0,0 +1,235 @@
+# backend/sharding.py
+"""
+sharding.py - Customer-sharded database layout
+
+With DB_SHARDS=N the data is spread over N+1 SQLite files, each with its
+own writer lock:
+
+    shipping.db             global: User, ServiceType, Location, Staff and
+                            the Customer directory (user_id -> customer_id)
+    shipping-shardK.db      every customer with customer_id % N == K, with
+                            their packages, tracking events, statements,
+                            payments, ledger, balance and summary; plus
+                            replicas of User, ServiceType and Location so
+                            joins stay local
+
+Package ids carry their shard in the bits above db.SHARD_BITS, so a
+tracking number alone routes to the right file (see the router in db.py).
+Global rows are written to shipping.db first and then copied to the shards
+with replicate(); customer profile writes go through save_customer().
+
+Admin reads fan out: query() runs the same statement on every shard in
+parallel threads and merges the per-shard results (ordered merge when the
+statement has an ORDER BY, so LIMIT n only needs n rows from each shard).
+With DB_SHARDS=0 (the default) all of this runs once, against DB_PATH.
+Not combined with EVENT_PARTITIONS.
+
+Build the shard files from the current database (the global file keeps its
+copy of the moved rows, which are no longer read):
+    DB_SHARDS=4 python sharding.py init
+    DB_SHARDS=4 python sharding.py status
+"""
+import heapq
+import itertools
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+import backup
+import db
+import migrations
+
+GLOBAL_TABLES = {'User': 'user_id', 'ServiceType': 'service_id', 'Location': 'location_id'}
+
+# Rows a shard owns, in insert order: table -> WHERE clause over src (? = shard count, shard)
+OWNED_TABLES = {
+    'Customer': "customer_id % ? = ?",
+    'Package': "customer_id % ? = ?",
+    'TrackingEvent': "package_id IN (SELECT package_id FROM src.Package WHERE customer_id % ? = ?)",
+    'BillingStatement': "customer_id % ? = ?",
+    'StatementPackage': "statement_id IN (SELECT statement_id FROM src.BillingStatement WHERE customer_id % ? = ?)",
+    'Payment': "customer_id % ? = ?",
+    'LedgerEntry': "customer_id % ? = ?",
+    'CustomerBalance': "customer_id % ? = ?",
+}
+
+_executor = None
+_executor_pid = None
+
+
+def _threads():
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ThreadPoolExecutor(max_workers=max(db.SHARDS, 1), thread_name_prefix='shard')
+        _executor_pid = os.getpid()
+    return _executor
+
+
+def fan_out(fn, replica=False):
+    """
+    Call fn(conn) once per shard, in parallel. Returns the results in shard order.
+    replica=True lets an unsharded read go to the read replica (see backup.py).
+    """
+    if not db.SHARDS:
+        conn = backup.replica_connection() if replica else db.get_db_connection()
+        try:
+            return [fn(conn)]
+        finally:
+            conn.close()
+
+    def run(shard):
+        conn = db.get_shard_connection(shard)
+        try:
+            return fn(conn)
+        finally:
+            conn.close()
+
+    return list(_threads().map(run, range(db.SHARDS)))
+
+
+def connections(replica=False):
+    """
+    One open connection per shard, for callers that stream from each in turn.
+    """
+    if not db.SHARDS:
+        return [backup.replica_connection() if replica else db.get_db_connection()]
+    return [db.get_shard_connection(shard) for shard in range(db.SHARDS)]
+
+
+def query(sql, params=(), key=None, reverse=False, limit=None, replica=False):
+    """
+    Run a read on every shard and merge the rows. With `key`, each shard's
+    rows must already be ordered by it (ORDER BY ... DESC for reverse=True)
+    and the merged list keeps that order; `limit` cuts the merged list.
+    """
+    results = fan_out(lambda conn: conn.execute(sql, params).fetchall(), replica)
+    if key is None:
+        rows = itertools.chain.from_iterable(results)
+    else:
+        rows = heapq.merge(*results, key=key, reverse=reverse)
+    return list(itertools.islice(rows, limit))
+
+
+def page(sql, params, number, per_page, key, reverse=False, replica=False):
+    """
+    One page of a sorted query whose last two parameters are LIMIT and OFFSET
+    (pass the others in `params`). Across shards each one returns its first
+    number * per_page rows and the merge picks the page.
+    """
+    skip = 0 if db.SHARDS else (number - 1) * per_page
+    rows = query(sql, tuple(params) + (number * per_page - skip, skip), key=key, reverse=reverse, replica=replica)
+    return rows[(number - 1) * per_page - skip:][:per_page]
+
+
+def total(sql, params=()):
+    """
+    Sum a single-value aggregate (COUNT, SUM) over every shard.
+    """
+    return sum(value or 0 for value in fan_out(lambda conn: conn.execute(sql, params).fetchone()[0]))
+
+
+def _copy_row(conn, table, key_column, row, key):
+    if row is None:
+        conn.execute(f"DELETE FROM {table} WHERE {key_column} = ?", (key,))
+    else:
+        columns = row.keys()
+        conn.execute(f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) "
+                     f"VALUES ({', '.join('?' * len(columns))})", tuple(row))
+    conn.commit()
+
+
+def replicate(table, key):
+    """
+    Copy one global row (or its deletion) from DB_PATH to every shard.
+    """
+    if not db.SHARDS:
+        return
+    key_column = GLOBAL_TABLES[table]
+    conn = db.get_db_connection()
+    try:
+        row = conn.execute(f"SELECT * FROM {table} WHERE {key_column} = ?", (key,)).fetchone()
+    finally:
+        conn.close()
+    fan_out(lambda shard_conn: _copy_row(shard_conn, table, key_column, row, key))
+
+
+def save_customer(customer_id):
+    """
+    Copy a customer's directory row from DB_PATH to the shard that owns it.
+    """
+    if not db.SHARDS:
+        return
+    conn = db.get_db_connection()
+    try:
+        row = conn.execute("SELECT * FROM Customer WHERE customer_id = ?", (customer_id,)).fetchone()
+    finally:
+        conn.close()
+    shard_conn = db.customer_connection(customer_id)
+    try:
+        _copy_row(shard_conn, 'Customer', 'customer_id', row, customer_id)
+    finally:
+        shard_conn.close()
+
+
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA main.table_info({table})")]
+
+
+def _build_shard(shard, count):
+    offset = shard << db.SHARD_BITS
+    conn = db._connect(db.shard_path(shard))
+    try:
+        migrations.migrate(conn, off_peak=True, log=lambda message: None)
+        # Rows are copied parent-first, but replicated parents can lag behind
+        conn.execute("PRAGMA foreign_keys = OFF")
+        conn.execute("ATTACH DATABASE ? AS src", (db.DB_PATH,))
+
+        for table in GLOBAL_TABLES:
+            conn.execute(f"INSERT INTO main.{table} SELECT * FROM src.{table}")
+        for table, where in OWNED_TABLES.items():
+            columns = _columns(conn, table)
+            # Package ids move into this shard's range
+            values = [f"{c} + {offset}" if c == 'package_id' else c for c in columns]
+            conn.execute(f"INSERT INTO main.{table} ({', '.join(columns)}) "
+                         f"SELECT {', '.join(values)} FROM src.{table} WHERE {where}", (count, shard))
+
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) SELECT 'Package', 0 "
+                     "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'Package')")
+        conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'Package'", (offset,))
+        conn.commit()
+        conn.execute("DETACH DATABASE src")
+    finally:
+        conn.close()
+
+
+def init_shards():
+    """
+    Create the DB_SHARDS shard files from the global database.
+    Returns status() afterwards.
+    """
+    if not db.SHARDS:
+        raise ValueError("DB_SHARDS is not set")
+    existing = [db.shard_path(s) for s in range(db.SHARDS) if os.path.exists(db.shard_path(s))]
+    if existing:
+        raise FileExistsError(f"Shard files already exist: {', '.join(existing)}")
+    for shard in range(db.SHARDS):
+        _build_shard(shard, db.SHARDS)
+    return status()
+
+
+def status():
+    """
+    Customers and packages per shard.
+    """
+    counts = fan_out(lambda conn: (conn.execute("SELECT COUNT(*) FROM Customer").fetchone()[0],
+                                   conn.execute("SELECT COUNT(*) FROM Package").fetchone()[0]))
+    return {shard: {'customers': c, 'packages': p} for shard, (c, p) in enumerate(counts)}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in ('init', 'status'):
+        print("Usage: DB_SHARDS=N python sharding.py init|status")
+        sys.exit(2)
+    if sys.argv[1] == 'init':
+        init_shards()
+    for shard, counts in status().items():
+        print(f"shard {shard}: {counts['customers']} customers, {counts['packages']} packages")
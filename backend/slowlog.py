@@ -0,0 +1,151 @@
+# backend/slowlog.py
+"""
+slowlog.py - Slow-query log and per-statement statistics
+
+Hooks into db.DB_HOOKS, so every statement run through get_db_connection()
+is timed. Statistics are aggregated per normalized statement (literals
+replaced by ?, whitespace collapsed): calls, total/max time, the parameter
+shape of the slowest call, and how many calls crossed the threshold.
+Statements from the query registry also carry their name (see queries.py).
+Times cover execute(), i.e. the statement's first step; rows fetched later
+are not included.
+
+A statement slower than SLOW_QUERY_MS is logged on the 'slowlog' logger
+with its parameter shape (types only, never values) and its
+EXPLAIN QUERY PLAN, which is captured on the same connection the first
+time the statement turns up slow and cached afterwards.
+
+Admins read the table at GET /api/admin/db/query-stats.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import db
+from tracing import normalize_sql
+
+logger = logging.getLogger('slowlog')
+
+DEFAULTS = {
+    'SLOW_QUERY_MS': float(os.environ.get('SLOW_QUERY_MS', 100)),
+}
+
+# Threshold in seconds, set from app.config by init_slowlog()
+threshold = DEFAULTS['SLOW_QUERY_MS'] / 1000
+
+
+class StatementStats:
+    """
+    Running totals for one normalized statement.
+    """
+    __slots__ = ('sql', 'query', 'calls', 'total', 'max', 'slow', 'shape', 'plan')
+
+    def __init__(self, sql, query=None):
+        self.sql = sql
+        self.query = query
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slow = 0
+        self.shape = None
+        self.plan = None
+
+    def to_dict(self):
+        return {
+            'sql': self.sql,
+            'query': self.query,
+            'calls': self.calls,
+            'total_ms': round(self.total * 1000, 3),
+            'mean_ms': round(self.total * 1000 / self.calls, 3) if self.calls else 0,
+            'max_ms': round(self.max * 1000, 3),
+            'slow_calls': self.slow,
+            'slowest_params': self.shape,
+            'plan': self.plan
+        }
+
+
+SORT_FIELDS = ('total', 'max', 'calls', 'slow')
+
+_stats = {}
+_lock = threading.Lock()
+
+
+def param_shape(params):
+    """
+    Describe bound parameters by type only, e.g. '(int, str, null)'.
+    """
+    if params is None:
+        return 'many'
+
+    def name(value):
+        return 'null' if value is None else type(value).__name__
+
+    if isinstance(params, dict):
+        return '{' + ', '.join(f'{key}: {name(value)}' for key, value in params.items()) + '}'
+    return '(' + ', '.join(name(value) for value in params) + ')'
+
+
+def explain(conn, sql, params):
+    """
+    EXPLAIN QUERY PLAN lines for a statement, or None when it can't be explained.
+    """
+    if params is None:
+        return None
+    try:
+        # Base-class execute: the EXPLAIN itself must not go through the hooks
+        rows = sqlite3.Connection.execute(conn, 'EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+    except sqlite3.Error:
+        return None
+    return [row[3] for row in rows]
+
+
+def _db_hook(event, cursor, sql, params, seconds):
+    if event == 'checkout':
+        return
+    key = normalize_sql(sql)
+    with _lock:
+        stats = _stats.get(key)
+        if stats is None:
+            stats = _stats[key] = StatementStats(key, getattr(sql, 'name', None))
+        stats.calls += 1
+        stats.total += seconds
+        if seconds > stats.max:
+            stats.max = seconds
+            stats.shape = param_shape(params)
+        if seconds < threshold:
+            return
+        stats.slow += 1
+        need_plan = stats.plan is None
+
+    if need_plan:
+        stats.plan = explain(cursor.connection, sql, params)
+    logger.warning("slow query %.1f ms params=%s plan=%s: %s", seconds * 1000,
+                   param_shape(params), ' | '.join(stats.plan or ['n/a']), key)
+
+
+def get_stats(sort='total', limit=50):
+    """
+    Per-statement stats, largest first by 'total', 'max', 'calls' or 'slow'.
+    """
+    if sort not in SORT_FIELDS:
+        raise ValueError(f"sort must be one of {', '.join(SORT_FIELDS)}")
+    with _lock:
+        rows = sorted(_stats.values(), key=lambda s: getattr(s, sort), reverse=True)[:limit]
+        return [s.to_dict() for s in rows]
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+def init_slowlog(app):
+    """
+    Start timing every statement; statements over SLOW_QUERY_MS get logged.
+    """
+    global threshold
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
+    threshold = app.config['SLOW_QUERY_MS'] / 1000
+    if _db_hook not in db.DB_HOOKS:
+        db.DB_HOOKS.append(_db_hook)
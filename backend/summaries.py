@@ -0,0 +1,171 @@
+# backend/summaries.py
+"""
+summaries.py - Per-customer summary rows for the admin customer list
+
+CustomerSummary holds each customer's package count and the number of
+packages shipped in the latest month they shipped in. Triggers on Customer
+and Package (see db.SCHEMA) keep it current inside the writing transaction,
+so every insert path (shipments, seeding, bulk loads) is covered and
+/admin/customers never aggregates Package. Archived packages keep counting
+(archive.py adds them back after moving them). The unpaid balance comes
+from the ledger's CustomerBalance row.
+
+Run directly to check (or rebuild) the summaries:
+    python summaries.py verify
+    python summaries.py verify --fix
+"""
+import sys
+from datetime import datetime
+import archive
+import sharding
+
+# Sort keys accepted by /admin/customers -> ORDER BY expression
+SORT_COLUMNS = {
+    'customer_id': 's.customer_id',
+    'name': 'c.name',
+    'total_packages': 's.total_packages',
+    'shipped_this_month': 'shipped_this_month',
+    'unpaid_balance': 'unpaid_balance',
+}
+
+# Summaries recomputed from Package in one pass: (customer_id, total, latest month, count in that month)
+EXPECTED = """
+    WITH per_month AS (
+        SELECT customer_id, substr(date_shipped, 1, 7) as month, COUNT(*) as packages
+        FROM ({packages})
+        GROUP BY customer_id, month
+    ), per_customer AS (
+        SELECT customer_id, SUM(packages) as total, MAX(month) as latest
+        FROM per_month
+        GROUP BY customer_id
+    )
+    SELECT c.customer_id, COALESCE(t.total, 0), t.latest, COALESCE(m.packages, 0)
+    FROM Customer c
+    LEFT JOIN per_customer t ON t.customer_id = c.customer_id
+    LEFT JOIN per_month m ON m.customer_id = c.customer_id AND m.month = t.latest
+"""
+
+
+def _expected(conn):
+    # Archived packages still count towards their customer's totals
+    packages, _ = archive.union_all(conn, "SELECT customer_id, date_shipped FROM {schema}.Package")
+    return EXPECTED.format(packages=packages)
+
+
+def this_month():
+    return datetime.now().strftime('%Y-%m')
+
+
+def page_query(sort, descending):
+    """
+    SQL for one page of the customer list, ordered by a SORT_COLUMNS key.
+    Parameters: (month, limit, offset).
+    """
+    order = 'DESC' if descending else 'ASC'
+    return f"""
+        SELECT
+            c.customer_id,
+            c.user_id,
+            c.name,
+            c.phone,
+            c.has_contract,
+            c.account_number,
+            u.email,
+            u.role,
+            s.total_packages,
+            CASE WHEN s.current_month = ? THEN s.month_packages ELSE 0 END as shipped_this_month,
+            COALESCE(b.balance, 0) as unpaid_balance
+        FROM CustomerSummary s
+        JOIN Customer c ON c.customer_id = s.customer_id
+        LEFT JOIN User u ON c.user_id = u.user_id
+        LEFT JOIN CustomerBalance b ON b.customer_id = s.customer_id
+        ORDER BY {SORT_COLUMNS[sort]} {order}, s.customer_id {order}
+        LIMIT ? OFFSET ?
+    """
+
+
+def totals(conn):
+    """
+    Customer, contract customer and package totals for the list header.
+    """
+    row = conn.execute("""
+        SELECT COUNT(*), COALESCE(SUM(c.has_contract), 0), COALESCE(SUM(s.total_packages), 0)
+        FROM CustomerSummary s
+        JOIN Customer c ON c.customer_id = s.customer_id
+    """).fetchone()
+    return {'customers': row[0], 'contract_customers': row[1], 'packages': row[2]}
+
+
+def totals_all(replica=False):
+    """
+    totals() summed over every shard.
+    """
+    parts = sharding.fan_out(totals, replica)
+    return {key: sum(part[key] for part in parts) for key in parts[0]}
+
+
+def _consistent(have, total, latest, in_month):
+    if have is None or have[0] != total:
+        return False
+    if have[1] == latest:
+        return have[2] == in_month
+    # Deletes can leave current_month on a month that no longer has packages
+    return (have[1] or '') > (latest or '') and have[2] == 0
+
+
+def verify_summaries(conn):
+    """
+    Recompute every summary from Package and return the rows that disagree.
+    """
+    maintained = {row[0]: tuple(row[1:]) for row in conn.execute(
+        "SELECT customer_id, total_packages, current_month, month_packages FROM CustomerSummary")}
+
+    drift = []
+    for customer_id, total, latest, in_month in conn.execute(_expected(conn)).fetchall():
+        have = maintained.get(customer_id)
+        if not _consistent(have, total, latest, in_month):
+            drift.append({
+                'customer_id': customer_id,
+                'maintained': dict(zip(('total_packages', 'current_month', 'month_packages'), have))
+                if have else None,
+                'expected': {'total_packages': total, 'current_month': latest, 'month_packages': in_month}
+            })
+    return drift
+
+
+def rebuild_summaries(conn):
+    """
+    Rebuild every summary row from Package. Returns the drift that was repaired.
+    """
+    drift = verify_summaries(conn)
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM CustomerSummary")
+    cursor.execute(
+        "INSERT INTO CustomerSummary (customer_id, total_packages, current_month, month_packages) " + _expected(conn)
+    )
+    conn.commit()
+    return drift
+
+
+def verify_all(fix=False):
+    """
+    verify_summaries() (rebuild_summaries() with fix) on every shard, drift concatenated.
+    """
+    check = rebuild_summaries if fix else verify_summaries
+    return [item for drift in sharding.fan_out(check) for item in drift]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'verify':
+        print("Usage: python summaries.py verify [--fix]")
+        sys.exit(2)
+
+    found = verify_all('--fix' in sys.argv)
+    if '--fix' in sys.argv:
+        print(f"Rebuilt summaries, {len(found)} had drifted")
+    else:
+        for item in found:
+            print(item)
+        print(f"{len(found)} drifted summar{'y' if len(found) == 1 else 'ies'}")
+
+    sys.exit(1 if found and '--fix' not in sys.argv else 0)
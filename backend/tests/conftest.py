@@ -0,0 +1,48 @@
+# backend/tests/conftest.py
+"""
+Shared fixtures: every test runs against its own copy of the seed database
+
+The schema is migrated and the sample data loaded once per test process,
+into a template file. Before each test the template is copied with
+SQLite's backup API into the test's tmp_path and DB_PATH is pointed at the
+copy (archive, replica, shard and partition files follow it there), so
+tests neither see each other's writes nor touch backend/shipping.db.
+
+Under pytest-xdist (`pytest -n auto`) each worker builds its own template.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import backup  # noqa: E402
+import db  # noqa: E402
+import tracking_numbers  # noqa: E402
+from middleware import micro_cache  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def template_db(tmp_path_factory):
+    """Seeded database built once per test process"""
+    path = str(tmp_path_factory.mktemp('template') / 'shipping.db')
+    previous = db.use_database(path)
+    try:
+        db.init_db()
+    finally:
+        db.use_database(previous)
+    return path
+
+
+@pytest.fixture(autouse=True)
+def database(template_db, tmp_path):
+    """Fresh copy of the template as DB_PATH for one test"""
+    path = str(tmp_path / 'shipping.db')
+    backup.copy_database(path, pages=-1, pause=0, source=template_db)
+    previous = db.use_database(path)
+    tracking_numbers.reset()
+    micro_cache.invalidate()
+    yield path
+    tracking_numbers.reset()
+    db.use_database(previous)
@@ -2,7 +2,9 @@
 """
 Basic API tests for the package delivery system
 """
+import json
 import pytest
+import sqlite3
 import sys
 import os
 
@@ -11,15 +13,14 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 
 from main import app
 from db import init_db, get_db_connection
+import cache_bus
+import tracking_numbers
 
 @pytest.fixture
 def client():
-    """Create a test client"""
+    """Create a test client (against this test's copy of the database, see conftest.py)"""
     app.config['TESTING'] = True
     
-    # Initialize test database
-    init_db()
-    
     with app.test_client() as client:
         yield client
 
@@ -122,6 +123,45 @@ class TestPackageTracking:
         """Test that user packages endpoint requires auth"""
         response = client.get('/api/user/packages')
         assert response.status_code == 401
+    
+    def test_tracking_returns_nested_package(self, client, auth_token):
+        """Test the tracking payload shape for the owner's package"""
+        headers = {'Authorization': f'Bearer {auth_token}'}
+        packages = client.get('/api/user/packages', headers=headers).get_json()['packages']
+        assert packages
+        
+        response = client.get(f"/api/tracking/{packages[0]['tracking_number']}", headers=headers)
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data['package']['tracking_number'] == packages[0]['tracking_number']
+        assert data['package']['recipient']['name'] == packages[0]['recipient_name']
+        assert isinstance(data['package']['is_hazardous'], bool)
+        assert data['current_status']['status'] == data['tracking_history'][0]['status']
+
+
+class TestRowMappers:
+    """Test the precompiled row-to-dict mappers"""
+    
+    def test_mapper_builds_nested_dict_from_row(self):
+        """Test that a compiled mapper matches a hand-built dict"""
+        from serializers import RowMapper, Bool, Format, Or
+        
+        mapper = RowMapper({
+            'id': 'package_id',
+            'where': Format('{}, {}', 'city', 'state'),
+            'status': Or('status', 'Unknown'),
+            'flags': {'hazardous': Bool('is_hazardous')}
+        })
+        conn = get_db_connection()
+        cursor = conn.execute("SELECT 7 as package_id, 'Storrs' as city, 'CT' as state, "
+                              "NULL as status, 1 as is_hazardous")
+        assert mapper.all(cursor) == [{
+            'id': 7,
+            'where': 'Storrs, CT',
+            'status': 'Unknown',
+            'flags': {'hazardous': True}
+        }]
+        conn.close()
 
 
 class TestAdminEndpoints:
@@ -159,6 +199,1545 @@ class TestAdminEndpoints:
         assert response.status_code == 403
 
 
+class TestCustomerSummaries:
+    """Test the trigger-maintained customer summaries behind /admin/customers"""
+    
+    def _customer(self, client, **params):
+        response = client.get('/api/admin/customers', headers={'Authorization': 'Bearer 1'},
+                              query_string={'per_page': 500, **params})
+        assert response.status_code == 200
+        return response.get_json()
+    
+    def test_shipment_updates_summary(self, client):
+        """Test that a new shipment bumps the total and this month's count"""
+        token = TestBillingLedger()._contract_token(client)
+        before = next(c for c in self._customer(client)['customers'] if c['account_number'] == 1001)
+        
+        assert TestBillingLedger()._ship_on_account(client, token).status_code == 201
+        
+        data = self._customer(client)
+        after = next(c for c in data['customers'] if c['account_number'] == 1001)
+        assert after['total_packages'] == before['total_packages'] + 1
+        assert after['shipped_this_month'] >= 1
+        assert after['unpaid_balance'] > before['unpaid_balance']
+        assert data['totals']['packages'] == sum(c['total_packages'] for c in data['customers'])
+        
+        drift = client.get('/api/admin/customers/verify', headers={'Authorization': 'Bearer 1'}).get_json()
+        assert drift['drift'] == []
+    
+    def test_paging_and_sorting(self, client):
+        """Test that pages are sized and ordered as requested"""
+        first = self._customer(client, per_page=1, sort='total_packages', order='desc')
+        assert len(first['customers']) == 1
+        everyone = self._customer(client, sort='total_packages', order='desc')['customers']
+        assert first['customers'][0]['total_packages'] == max(c['total_packages'] for c in everyone)
+        
+        response = client.get('/api/admin/customers?sort=email', headers={'Authorization': 'Bearer 1'})
+        assert response.status_code == 400
+    
+    def test_rebuild_repairs_drift(self, client):
+        """Test that the checker finds and fixes a corrupted summary"""
+        conn = get_db_connection()
+        conn.execute("UPDATE CustomerSummary SET total_packages = total_packages + 5 WHERE customer_id = 1")
+        conn.commit()
+        conn.close()
+        
+        admin = {'Authorization': 'Bearer 1'}
+        found = client.get('/api/admin/customers/verify', headers=admin).get_json()['drift']
+        assert [d['customer_id'] for d in found] == [1]
+        client.post('/api/admin/customers/verify', headers=admin)
+        assert client.get('/api/admin/customers/verify', headers=admin).get_json()['drift'] == []
+
+
+class TestBillingLedger:
+    """Test incrementally maintained balances and statement totals"""
+    
+    def _contract_token(self, client):
+        response = client.post('/api/login', json={
+            'email': 'contract@example.com',
+            'password': 'password123'
+        })
+        return response.get_json()['user']['id']
+    
+    def _ship_on_account(self, client, token):
+        return client.post('/api/ship', headers={'Authorization': f'Bearer {token}'}, json={
+            'sender_name': 'Sarah Contract', 'sender_addr1': '789 Business Blvd',
+            'sender_city': 'Chicago', 'sender_state': 'IL', 'sender_zip': '60601',
+            'recipient_name': 'Test Recipient', 'recipient_addr1': '1 Test St',
+            'recipient_city': 'Boston', 'recipient_state': 'MA', 'recipient_zip': '02101',
+            'service_id': 4, 'weight_lb': 2.0, 'payment_type': 'account'
+        })
+    
+    def test_account_shipment_updates_balance_and_statement(self, client):
+        """Test that shipping on account bumps the open statement and balance"""
+        token = self._contract_token(client)
+        headers = {'Authorization': f'Bearer {token}'}
+        before = client.get('/api/billing/balance', headers=headers).get_json()
+        
+        response = self._ship_on_account(client, token)
+        assert response.status_code == 201
+        cost = response.get_json()['estimated_cost']
+        
+        after = client.get('/api/billing/balance', headers=headers).get_json()
+        assert after['balance'] == pytest.approx(before['balance'] + cost)
+        
+        open_before = before['open_statement']['total_amount'] if before['open_statement'] else 0
+        assert after['open_statement']['total_amount'] == pytest.approx(open_before + cost)
+    
+    def test_payment_reduces_balance(self, client):
+        """Test that a payment is credited against the running balance"""
+        token = self._contract_token(client)
+        headers = {'Authorization': f'Bearer {token}'}
+        before = client.get('/api/billing/balance', headers=headers).get_json()['balance']
+        
+        response = client.post('/api/billing/make-payment', headers=headers,
+                               json={'amount': 10.00, 'method': 'account'})
+        assert response.status_code == 201
+        
+        after = client.get('/api/billing/balance', headers=headers).get_json()['balance']
+        assert after == pytest.approx(before - 10.00)
+    
+    def test_non_positive_payments_are_rejected(self, client):
+        """Test that zero, negative and non-numeric amounts are refused without touching the balance"""
+        headers = {'Authorization': f'Bearer {self._contract_token(client)}'}
+        before = client.get('/api/billing/balance', headers=headers).get_json()['balance']
+        
+        for amount in (0, -25.00, '10', None):
+            response = client.post('/api/billing/make-payment', headers=headers,
+                                   json={'amount': amount, 'method': 'account', 'statement_id': 2})
+            assert response.status_code == 400
+        
+        assert client.get('/api/billing/balance', headers=headers).get_json()['balance'] == before
+    
+    def test_verifier_finds_no_new_drift(self, client):
+        """Test that the bulk verifier agrees with the maintained values"""
+        import ledger
+        
+        conn = get_db_connection()
+        assert ledger.verify_balances(conn) == []
+        conn.close()
+        
+        self._ship_on_account(client, self._contract_token(client))
+        
+        conn = get_db_connection()
+        assert ledger.verify_balances(conn) == []
+        conn.close()
+    
+    def test_ledger_is_append_only(self, client):
+        """Test that ledger rows cannot be rewritten"""
+        conn = get_db_connection()
+        try:
+            with pytest.raises(Exception):
+                conn.execute("UPDATE LedgerEntry SET amount = 0")
+        finally:
+            conn.close()
+
+
+class TestPaymentReconciliation:
+    """Test statement payments and bulk remittance imports"""
+    
+    def _login(self, client, email, password):
+        response = client.post('/api/login', json={'email': email, 'password': password})
+        return response.get_json()['user']['id']
+    
+    def test_cannot_pay_someone_elses_statement(self, client):
+        """Test that a statement payment is checked against the caller"""
+        contract = self._login(client, 'contract@example.com', 'password123')
+        statements = client.get('/api/billing/statements',
+                                headers={'Authorization': f'Bearer {contract}'}).get_json()
+        statement_id = statements['statements'][0]['statement_id']
+        
+        customer = self._login(client, 'customer@example.com', 'password123')
+        response = client.post('/api/billing/make-payment',
+                               headers={'Authorization': f'Bearer {customer}'},
+                               json={'amount': 1.00, 'method': 'credit_card',
+                                     'statement_id': statement_id})
+        assert response.status_code == 403
+    
+    def test_remittance_import_reports_exceptions(self, client):
+        """Test that unmatched and malformed lines land in the exceptions report"""
+        admin = self._login(client, 'admin@shipping.com', 'admin123')
+        remittance = (
+            "account_number,statement_month,amount\n"
+            "1001,2025-12,0.01\n"
+            "1001,2099-01,10.00\n"
+            "abc,2025-12,10.00\n"
+        )
+        response = client.post('/api/admin/billing/reconcile',
+                               headers={'Authorization': f'Bearer {admin}',
+                                        'Content-Type': 'text/csv'},
+                               data=remittance)
+        assert response.status_code == 200
+        summary = response.get_json()
+        assert summary['lines'] == 3
+        assert summary['applied'] == 1
+        
+        reasons = {e['line']: e['reason'] for e in summary['exceptions']}
+        assert reasons[2] == 'partial_payment'
+        assert reasons[3] == 'no_matching_statement'
+        assert reasons[4] == 'malformed'
+    
+    def test_reimporting_a_remittance_posts_nothing_new(self, client):
+        """Test that lines whose reference was already imported are skipped"""
+        admin = {'Authorization': 'Bearer 1', 'Content-Type': 'text/csv'}
+        remittance = (
+            "account_number,statement_month,amount,reference\n"
+            "1001,2025-12,5.00,ACH-0001\n"
+            "1001,2025-12,5.00,ACH-0002\n"
+            "1001,2025-12,5.00,ACH-0002\n"
+        )
+        first = client.post('/api/admin/billing/reconcile', headers=admin, data=remittance).get_json()
+        assert first['applied'] == 2
+        balance = client.get('/api/billing/balance', headers={'Authorization': 'Bearer 4'}).get_json()
+        
+        second = client.post('/api/admin/billing/reconcile', headers=admin, data=remittance).get_json()
+        assert second['applied'] == 0
+        assert {e['reason'] for e in second['exceptions']} == {'duplicate_reference'}
+        assert client.get('/api/billing/balance', headers={'Authorization': 'Bearer 4'}).get_json() == balance
+        assert [e['reason'] for e in first['exceptions']] == ['partial_payment', 'partial_payment', 'duplicate_reference']
+
+
+class TestStreamingExports:
+    """Test the /export endpoints"""
+    
+    def _login(self, client, email, password):
+        response = client.post('/api/login', json={'email': email, 'password': password})
+        return response.get_json()['user']['id']
+    
+    def test_payment_history_csv(self, client):
+        """Test that payment history streams as CSV with a header row"""
+        token = self._login(client, 'contract@example.com', 'password123')
+        response = client.get('/api/export/payment-history',
+                              headers={'Authorization': f'Bearer {token}'})
+        assert response.status_code == 200
+        assert response.mimetype == 'text/csv'
+        lines = response.get_data(as_text=True).splitlines()
+        assert lines[0] == 'payment_id,date_paid,amount,method,tracking_number'
+        assert len(lines) > 1
+    
+    def test_packages_ndjson_gzip(self, client):
+        """Test that the package export can be gzip-compressed NDJSON"""
+        import gzip
+        import json
+        
+        token = self._login(client, 'staff@shipping.com', 'staff123')
+        response = client.get('/api/export/packages?format=ndjson&gzip=1',
+                              headers={'Authorization': f'Bearer {token}'})
+        assert response.status_code == 200
+        assert response.headers['Content-Encoding'] == 'gzip'
+        rows = [json.loads(line) for line in gzip.decompress(response.get_data()).splitlines()]
+        assert rows and 'tracking_number' in rows[0]
+    
+    def test_abandoned_export_returns_its_connection(self, monkeypatch):
+        """Test that a stream closed before its first chunk still releases the connection"""
+        import db
+        import export
+        monkeypatch.setattr(db, 'POOL_SIZE', 2)
+        with app.test_request_context('/api/export/payment-history?format=csv'):
+            response = export.stream_query(db.get_db_connection(), "SELECT * FROM Payment", (), 'payments')
+            assert db.get_pool().stats()['in_use'] == 1
+            response.close()
+        assert db.get_pool().stats()['in_use'] == 0
+    
+    def test_package_export_requires_staff(self, client):
+        """Test that customers cannot export every package"""
+        token = self._login(client, 'customer@example.com', 'password123')
+        response = client.get('/api/export/packages',
+                              headers={'Authorization': f'Bearer {token}'})
+        assert response.status_code == 403
+
+
+class TestHttpPolicies:
+    """Test response compression and cache headers"""
+    
+    def test_services_are_publicly_cacheable(self, client):
+        """Test that reference data gets a public policy and revalidates with 304"""
+        response = client.get('/api/services')
+        assert response.headers['Cache-Control'].startswith('public, max-age=')
+        etag = response.headers['ETag']
+        
+        response = client.get('/api/services', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+
+    def test_query_strings_do_not_grow_the_micro_cache(self, client):
+        """Test that query string variants of a cached path are served without adding entries"""
+        from middleware import micro_cache
+        micro_cache.invalidate()
+        client.get('/api/services')
+        for n in range(20):
+            assert client.get(f'/api/services?v={n}').status_code == 200
+        assert list(micro_cache._entries) == ['/api/services']
+
+    def test_micro_cache_is_bounded(self):
+        """Test that a full micro-cache drops expired entries first, then the oldest"""
+        from middleware import MicroCache
+        cache = MicroCache(max_entries=3)
+        cache.set('/expired', -1, b'', 'text/plain')
+        for n in range(3):
+            cache.set(f'/{n}', 60, b'', 'text/plain')
+        assert list(cache._entries) == ['/0', '/1', '/2']
+        cache.set('/3', 60, b'', 'text/plain')
+        assert list(cache._entries) == ['/1', '/2', '/3']
+
+    def test_admin_responses_are_not_stored(self, client):
+        """Test that admin data is marked no-store"""
+        response = client.get('/api/admin/packages', headers={'Authorization': 'Bearer 1'})
+        assert response.headers['Cache-Control'] == 'no-store'
+    
+    def test_user_data_is_private(self, client, auth_token):
+        """Test that per-user data is private"""
+        response = client.get('/api/user/packages', headers={'Authorization': f'Bearer {auth_token}'})
+        assert response.headers['Cache-Control'] == 'private, no-cache'
+    
+    def test_large_responses_are_gzipped(self, client):
+        """Test that responses over the threshold are compressed for gzip clients"""
+        import gzip
+        
+        client.application.config['COMPRESS_MIN_SIZE'] = 0
+        try:
+            response = client.get('/api/admin/locations', headers={
+                'Authorization': 'Bearer 1',
+                'Accept-Encoding': 'gzip'
+            })
+        finally:
+            client.application.config['COMPRESS_MIN_SIZE'] = 1024
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert b'locations' in gzip.decompress(response.get_data())
+
+
+class TestRequestTracing:
+    """Test per-request tracing and the /debug/trace buffer"""
+
+    def test_trace_requires_admin(self, client):
+        """Test that only admins can read traces"""
+        response = client.get('/debug/trace', headers={'Authorization': 'Bearer 2'})
+        assert response.status_code == 403
+
+    def test_tracking_request_is_traced(self, client, auth_token):
+        """Test that SQL, mapping and serialization spans are recorded when enabled"""
+        admin = {'Authorization': 'Bearer 1'}
+        headers = {'Authorization': f'Bearer {auth_token}'}
+        tracking_number = client.get('/api/user/packages', headers=headers).get_json()['packages'][0]['tracking_number']
+
+        client.delete('/debug/trace', headers=admin)
+        client.post('/debug/trace', headers=admin, json={'enabled': True})
+        try:
+            client.get(f'/api/tracking/{tracking_number}', headers=headers)
+        finally:
+            client.post('/debug/trace', headers=admin, json={'enabled': False})
+
+        traces = client.get('/debug/trace?path=/api/tracking', headers=admin).get_json()['traces']
+        assert len(traces) == 1
+        trace = traces[0]
+        assert trace['status'] == 200
+        names = {span['name'] for span in trace['spans']}
+        assert {'checkout', 'sql', 'fetch+map', 'serialize'} <= names
+        sql = [span['sql'] for span in trace['spans'] if span['name'] == 'sql']
+        assert any('WHERE p.package_id = ?' in text for text in sql)
+
+    def test_nothing_recorded_when_disabled(self, client):
+        """Test that requests leave no trace while tracing is off"""
+        admin = {'Authorization': 'Bearer 1'}
+        client.delete('/debug/trace', headers=admin)
+        client.get('/api/services')
+        data = client.get('/debug/trace', headers=admin).get_json()
+        assert data['enabled'] is False
+        assert data['traces'] == []
+
+
+class TestMetrics:
+    """Test the Prometheus /metrics endpoint"""
+
+    def test_metrics_exposition(self, client):
+        """Test that routes, SQL statements and gauges are reported"""
+        client.get('/api/services')
+        response = client.get('/metrics')
+        assert response.status_code == 200
+        assert response.mimetype == 'text/plain'
+        text = response.get_data(as_text=True)
+        assert 'http_requests_total{blueprint="package_routes",route="/api/services",method="GET",status="200"}' in text
+        assert 'http_request_duration_seconds_bucket{blueprint="package_routes",route="/api/services",method="GET",le="+Inf"}' in text
+        assert 'db_statements_total{verb="SELECT"}' in text
+        assert 'db_pool_connections{state="in_use"}' in text
+        assert 'sqlite_file_size_bytes{file="db"}' in text
+
+    def test_thread_shards_are_summed(self):
+        """Test that counters recorded on different threads add up on scrape"""
+        import threading
+        import metrics
+
+        metric = metrics.Metric('test_events_total', 'counter', 'test', ('kind',))
+        threads = [threading.Thread(target=lambda: [metric.inc('a') for _ in range(1000)]) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        counters, _ = metrics.collect()
+        assert counters[(metric, ('a',))] == 4000
+
+    def test_finished_threads_leave_no_shards(self):
+        """Test that an exited thread's counts are kept but its shard is dropped"""
+        import gc
+        import threading
+        import metrics
+
+        metric = metrics.Metric('test_finished_total', 'counter', 'test')
+        live = len(metrics._shards)
+        for _ in range(20):
+            thread = threading.Thread(target=metric.inc)
+            thread.start()
+            thread.join()
+        gc.collect()
+
+        assert len(metrics._shards) <= live
+        counters, _ = metrics.collect()
+        assert counters[(metric, ())] == 20
+
+
+class TestQueryStats:
+    """Test the slow-query log and per-statement stats"""
+
+    def test_query_stats_require_admin(self, client):
+        """Test that staff cannot read query stats"""
+        response = client.get('/api/admin/db/query-stats', headers={'Authorization': 'Bearer 2'})
+        assert response.status_code == 403
+
+    def test_slow_statement_gets_plan(self, client, monkeypatch):
+        """Test that statements over the threshold are aggregated with their query plan"""
+        import slowlog
+        admin = {'Authorization': 'Bearer 1'}
+        client.delete('/api/admin/db/query-stats', headers=admin)
+        monkeypatch.setattr(slowlog, 'threshold', 0)
+        cache_bus.invalidate_all()  # roles are cached; look this one up again
+
+        client.get('/api/admin/customers', headers=admin)
+        data = client.get('/api/admin/db/query-stats?sort=calls', headers=admin).get_json()
+
+        role_check = next(s for s in data['statements'] if s['sql'] == 'SELECT role FROM User WHERE user_id = ?')
+        assert role_check['calls'] >= 1
+        assert role_check['slowest_params'] == '(int)'
+        assert any('USING INTEGER PRIMARY KEY' in line for line in role_check['plan'])
+
+
+class TestArchival:
+    """Test moving old deliveries to the archive database"""
+    
+    def test_archived_package_is_still_tracked(self, client, tmp_path, monkeypatch):
+        """Test that tracking, statements and summaries fall back to the archive"""
+        import archive
+        import summaries
+        monkeypatch.setenv('ARCHIVE_PATH', str(tmp_path / 'archive.db'))
+        
+        conn = get_db_connection()
+        delivered = conn.execute("""
+            SELECT p.package_id FROM Package p JOIN Customer c ON c.customer_id = p.customer_id
+            WHERE c.account_number = 1001 AND p.date_delivered IS NOT NULL
+        """).fetchall()
+        assert delivered
+        moved = archive.run(conn, days=0)
+        assert moved >= len(delivered)
+        package_id = delivered[0][0]
+        assert conn.execute("SELECT COUNT(*) FROM main.Package WHERE package_id = ?", (package_id,)).fetchone()[0] == 0
+        assert conn.execute("SELECT COUNT(*) FROM main.TrackingEvent WHERE package_id = ?",
+                            (package_id,)).fetchone()[0] == 0
+        assert summaries.verify_summaries(conn) == []
+        conn.close()
+        
+        tracking_number = tracking_numbers.public(package_id)
+        headers = {'Authorization': 'Bearer 4'}
+        response = client.get(f'/api/tracking/{tracking_number}', headers=headers)
+        assert response.status_code == 200
+        assert response.get_json()['current_status']['status'] == 'delivered'
+        
+        statement = client.get('/api/billing/statements/1', headers=headers).get_json()
+        assert tracking_number in [p['tracking_number'] for p in statement['packages']]
+
+
+class TestEventPartitions:
+    """Test routing tracking events to monthly partition files"""
+    
+    def test_events_are_routed_to_current_month(self, client, tmp_path, monkeypatch):
+        """Test that new events land in this month's partition and are still read back"""
+        import db
+        import partitions
+        monkeypatch.setattr(db, 'EVENT_PARTITIONS', True)
+        monkeypatch.setenv('EVENT_PARTITION_DIR', str(tmp_path))
+        monkeypatch.setenv('ARCHIVE_PATH', str(tmp_path / 'archive.db'))
+        
+        headers = {'Authorization': 'Bearer 4'}
+        response = client.post('/api/ship', headers=headers, json={
+            'sender_name': 'Sarah Contract', 'sender_addr1': '789 Business Blvd',
+            'sender_city': 'Chicago', 'sender_state': 'IL', 'sender_zip': '60601',
+            'recipient_name': 'Test Recipient', 'recipient_addr1': '1 Test St',
+            'recipient_city': 'Boston', 'recipient_state': 'MA', 'recipient_zip': '02101',
+            'service_id': 4, 'weight_lb': 2.0, 'payment_type': 'account'
+        })
+        assert response.status_code == 201
+        tracking_number = response.get_json()['tracking_number']
+        package_id = tracking_numbers.decode(tracking_number)
+        month = partitions.current_month()
+        assert partitions.existing() == [month]
+        
+        response = client.post(f'/api/admin/packages/{tracking_number}/update-status',
+                               headers={'Authorization': 'Bearer 2'},
+                               json={'location_id': 2, 'status': 'arrived'})
+        assert response.status_code == 201
+        
+        conn = get_db_connection()
+        schema = partitions.schema_for(month)
+        rows = conn.execute(f"SELECT event_id FROM {schema}.TrackingEvent WHERE package_id = ?",
+                            (package_id,)).fetchall()
+        assert len(rows) == 2
+        assert all(row[0] >= (int(month[:4]) * 12 + int(month[5:7])) << 32 for row in rows)
+        assert conn.execute("SELECT COUNT(*) FROM main.TrackingEvent WHERE package_id = ?",
+                            (package_id,)).fetchone()[0] == 0
+        conn.close()
+        
+        tracking = client.get(f'/api/tracking/{tracking_number}', headers=headers).get_json()
+        assert sorted(e['status'] for e in tracking['tracking_history']) == ['arrived', 'processing']
+        
+        # Dropping the month removes its events without touching the live table
+        assert partitions.drop(month) > 0
+        tracking = client.get(f'/api/tracking/{tracking_number}', headers=headers).get_json()
+        assert tracking['tracking_history'] == []
+    
+    def test_late_events_go_to_a_month_package_reads_attach(self, client, tmp_path, monkeypatch):
+        """Test that events are routed by scan time, within the package's shipped-to-delivered months"""
+        import db
+        import partitions
+        monkeypatch.setattr(db, 'EVENT_PARTITIONS', True)
+        monkeypatch.setenv('EVENT_PARTITION_DIR', str(tmp_path))
+        monkeypatch.setenv('ARCHIVE_PATH', str(tmp_path / 'archive.db'))
+        conn = get_db_connection()
+        conn.execute("""
+            UPDATE Package SET date_shipped = '2025-10-05 09:00:00', date_delivered = '2025-11-02 15:00:00'
+            WHERE package_id = 1
+        """)
+        conn.commit()
+        conn.close()
+        
+        staff = {'Authorization': 'Bearer 2'}
+        for timestamp in ('2025-10-20 08:00:00', None):  # a late upload, then a correction made today
+            response = client.post(f'/api/admin/packages/{TestCompactEvents.TRACKING_NUMBER}/update-status',
+                                   headers=staff, json={'location_id': 2, 'status': 'arrived', 'timestamp': timestamp})
+            assert response.status_code == 201
+        
+        conn = get_db_connection()
+        for month, count in (('2025-10', 1), ('2025-11', 1)):
+            partitions.attach(conn, month)
+            assert conn.execute(f"SELECT COUNT(*) FROM {partitions.schema_for(month)}.TrackingEvent "
+                                "WHERE package_id = 1").fetchone()[0] == count
+        partitions.attach(conn, partitions.current_month())
+        assert conn.execute(f"SELECT COUNT(*) FROM {partitions.schema_for(partitions.current_month())}.TrackingEvent "
+                            "WHERE package_id = 1").fetchone()[0] == 0
+        conn.close()
+        
+        conn = get_db_connection()
+        assert set(partitions.hint_package(conn, 1)) == {'ev_2025_10', 'ev_2025_11'}
+        conn.close()
+        tracking = client.get(f'/api/tracking/{TestCompactEvents.TRACKING_NUMBER}',
+                              headers={'Authorization': 'Bearer 3'}).get_json()
+        assert [e['status'] for e in tracking['tracking_history']].count('arrived') == 2
+    
+    def test_archiving_more_months_than_attach_leaves_no_events(self, client, tmp_path, monkeypatch):
+        """Test that a batch spanning more than MAX_ATTACHED partitions moves the events of every month"""
+        import archive
+        import db
+        import partitions
+        monkeypatch.setattr(db, 'EVENT_PARTITIONS', True)
+        monkeypatch.setenv('EVENT_PARTITION_DIR', str(tmp_path))
+        monkeypatch.setenv('ARCHIVE_PATH', str(tmp_path / 'archive.db'))
+        conn = get_db_connection()
+        conn.execute("UPDATE Package SET date_delivered = NULL")
+        conn.execute("UPDATE Package SET date_shipped = '2024-01-05 09:00:00', date_delivered = '2024-01-20 15:00:00' "
+                     "WHERE package_id = 1")
+        conn.execute("UPDATE Package SET date_shipped = '2024-12-05 09:00:00', date_delivered = '2024-12-20 15:00:00' "
+                     "WHERE package_id = 2")
+        conn.commit()
+        months = partitions.months_between('2024-01', '2024-12')
+        assert len(months) > partitions.MAX_ATTACHED
+        columns = ', '.join(row[1] for row in conn.execute("PRAGMA main.table_info(TrackingEvent)") if row[1] != 'event_id')
+        for month in months:
+            partitions.attach(conn, month, create=True)
+        for package_id, month in ((1, '2024-01'), (2, '2024-12')):
+            partitions.attach(conn, month)
+            conn.execute(f"INSERT INTO {partitions.schema_for(month)}.TrackingEvent ({columns}) "
+                         f"SELECT {columns} FROM main.TrackingEvent WHERE package_id = ?", (package_id,))
+            conn.commit()
+        live = conn.execute("SELECT COUNT(*) FROM main.TrackingEvent WHERE package_id IN (1, 2)").fetchone()[0]
+
+        assert archive.run(conn, days=0) == 2
+        for month in ('2024-01', '2024-12'):
+            partitions.attach(conn, month)
+            assert conn.execute(f"SELECT COUNT(*) FROM {partitions.schema_for(month)}.TrackingEvent").fetchone()[0] == 0
+        assert conn.execute("SELECT COUNT(*) FROM archive.TrackingEvent").fetchone()[0] == 2 * live
+        conn.close()
+
+    def test_hint_covers_shipped_through_delivered(self):
+        """Test that the months between shipping and delivery are all candidates"""
+        import partitions
+        assert partitions.months_between('2025-11-28 10:00:00', '2026-01-02 09:00:00') == [
+            '2025-11', '2025-12', '2026-01']
+
+
+class TestSharding:
+    """Test the customer-sharded database layout"""
+    
+    def _ship(self, client, user_id, payment_type):
+        return client.post('/api/ship', headers={'Authorization': f'Bearer {user_id}'}, json={
+            'sender_name': 'Sender', 'sender_addr1': '1 Main St',
+            'sender_city': 'Chicago', 'sender_state': 'IL', 'sender_zip': '60601',
+            'recipient_name': 'Test Recipient', 'recipient_addr1': '1 Test St',
+            'recipient_city': 'Boston', 'recipient_state': 'MA', 'recipient_zip': '02101',
+            'service_id': 4, 'weight_lb': 2.0, 'payment_type': payment_type
+        }).get_json()['tracking_number']
+    
+    def test_customers_are_routed_to_their_shard(self, client, tmp_path, monkeypatch):
+        """Test that writes land in the customer's shard and admin reads merge all shards"""
+        import db
+        import sharding
+        monkeypatch.setattr(db, 'SHARDS', 2)
+        monkeypatch.setattr(db, '_customer_of_user', {})
+        status = sharding.init_shards()
+        assert status == {0: {'customers': 1, 'packages': 4}, 1: {'customers': 1, 'packages': 1}}
+        
+        contract_package = self._ship(client, 4, 'account')
+        card_package = self._ship(client, 3, 'credit_card')
+        assert db.shard_of_package(tracking_numbers.decode(contract_package)) == 0
+        assert db.shard_of_package(tracking_numbers.decode(card_package)) == 1
+        
+        tracking = client.get(f'/api/tracking/{card_package}', headers={'Authorization': 'Bearer 3'})
+        assert tracking.status_code == 200
+        assert tracking.get_json()['current_status']['status'] == 'processing'
+        assert client.get('/api/billing/balance', headers={'Authorization': 'Bearer 4'}).status_code == 200
+        
+        staff = {'Authorization': 'Bearer 2'}
+        packages = client.get('/api/admin/packages', headers=staff).get_json()['packages']
+        assert {contract_package, card_package} <= {p['tracking_number'] for p in packages}
+        dates = [p['date_shipped'] for p in packages]
+        assert dates == sorted(dates, reverse=True)
+        assert client.get('/api/admin/stats', headers=staff).get_json()['stats']['total_packages'] == 7
+        customers = client.get('/api/admin/customers?per_page=1&page=2&sort=total_packages',
+                               headers=staff).get_json()
+        assert customers['totals'] == {'customers': 2, 'contract_customers': 1, 'packages': 7}
+        assert [c['total_packages'] for c in customers['customers']] == [2]
+        
+        # Global rows are replicated into every shard
+        user_id = client.post('/api/register', json={
+            'email': 'sharded@example.com', 'password': 'password123', 'role': 'customer'
+        }).get_json()['id']
+        for shard in range(2):
+            conn = db.get_shard_connection(shard)
+            assert conn.execute("SELECT COUNT(*) FROM User WHERE user_id = ?", (user_id,)).fetchone()[0] == 1
+            conn.close()
+
+    def test_reconcile_and_verify_run_on_every_shard(self, client, monkeypatch):
+        """Test that remittances post on the owning shard and the verifiers check all shards"""
+        import db
+        import sharding
+        monkeypatch.setattr(db, 'SHARDS', 2)
+        monkeypatch.setattr(db, '_customer_of_user', {})
+        sharding.init_shards()
+        admin = {'Authorization': 'Bearer 1'}
+
+        summary = client.post('/api/admin/billing/reconcile', headers={**admin, 'Content-Type': 'text/csv'},
+                              data="account_number,statement_month,amount,reference\n"
+                                   "1001,2025-12,35.98,ACH-0001\n").get_json()
+        assert summary['applied'] == 1
+        assert summary['statements_paid'] == 1
+        assert client.get('/api/billing/balance', headers={'Authorization': 'Bearer 4'}).get_json()['balance'] == 0
+
+        assert client.get('/api/admin/billing/verify', headers=admin).get_json()['drift'] == []
+        assert client.get('/api/admin/customers/verify', headers=admin).get_json()['drift'] == []
+
+        # Drift on either shard is reported
+        for shard in range(2):
+            conn = db.get_shard_connection(shard)
+            conn.execute("INSERT OR REPLACE INTO CustomerBalance (customer_id, balance, updated_at) "
+                         "SELECT customer_id, 1000, '' FROM Customer")
+            conn.commit()
+            conn.close()
+        drift = client.get('/api/admin/billing/verify', headers=admin).get_json()['drift']
+        assert sorted(db.shard_of_customer(item['customer_id']) for item in drift) == [0, 1]
+
+
+class TestReadReplica:
+    """Test online backups and report reads from the replica"""
+    
+    def test_reports_use_replica_within_staleness_bound(self, client, tmp_path, monkeypatch):
+        """Test that stats come from the replica until it is too old"""
+        import backup
+        monkeypatch.setenv('REPLICA_PATH', str(tmp_path / 'replica.db'))
+        staff = {'Authorization': 'Bearer 2'}
+        backup.refresh_replica()
+        before = client.get('/api/admin/stats', headers=staff).get_json()['stats']['total_packages']
+        
+        conn = get_db_connection()
+        conn.execute("DELETE FROM TrackingEvent WHERE package_id = (SELECT MAX(package_id) FROM Package)")
+        conn.execute("DELETE FROM Package WHERE package_id = (SELECT MAX(package_id) FROM Package)")
+        conn.commit()
+        conn.close()
+        assert client.get('/api/admin/stats', headers=staff).get_json()['stats']['total_packages'] == before
+        
+        monkeypatch.setattr(backup, 'max_age', -1)
+        assert client.get('/api/admin/stats', headers=staff).get_json()['stats']['total_packages'] == before - 1
+    
+    def test_snapshots_are_rotated(self, client, tmp_path):
+        """Test that only the newest snapshots are kept and they are complete copies"""
+        import backup
+        directory = tmp_path / 'backups'
+        paths = [backup.snapshot(str(directory), keep=2) for _ in range(3)]
+        assert sorted(os.listdir(directory)) == sorted(os.path.basename(p) for p in paths[1:])
+        
+        copy = sqlite3.connect(paths[-1])
+        conn = get_db_connection()
+        assert copy.execute("SELECT COUNT(*) FROM Package").fetchone()[0] == \
+            conn.execute("SELECT COUNT(*) FROM Package").fetchone()[0]
+        copy.close()
+        conn.close()
+
+
+class TestMigrations:
+    """Test versioned schema migrations"""
+    
+    def test_new_database_is_at_latest_version(self, client):
+        """Test that init_db applies every migration"""
+        import migrations
+        conn = get_db_connection()
+        assert migrations.current_version(conn) == migrations.latest_version()
+        assert migrations.pending(conn) == []
+        conn.close()
+    
+    def test_backfill_resumes_after_interruption(self, tmp_path, monkeypatch):
+        """Test that an interrupted backfill continues from its last committed batch"""
+        import db
+        import migrations
+        monkeypatch.setattr(db, 'DB_PATH', str(tmp_path / 'old.db'))
+        monkeypatch.setattr(migrations, 'BATCH_SIZE', 1)
+        init_db(version=1)
+        conn = db._connect(db.DB_PATH)
+        conn.execute("DELETE FROM CustomerSummary")
+        conn.commit()
+        
+        def stop_after_first_batch(message):
+            if 'values done' in message:
+                raise KeyboardInterrupt
+        with pytest.raises(KeyboardInterrupt):
+            migrations.migrate(conn, target=2, log=stop_after_first_batch)
+        assert migrations.current_version(conn) == 1
+        assert conn.execute("SELECT COUNT(*) FROM migration_progress").fetchone()[0] == 1
+        
+        messages = []
+        assert migrations.migrate(conn, target=2, log=messages.append) == [2]
+        assert any('resuming' in m for m in messages)
+        assert conn.execute("SELECT COUNT(*) FROM CustomerSummary").fetchone()[0] == \
+            conn.execute("SELECT COUNT(*) FROM Customer").fetchone()[0]
+        assert conn.execute("SELECT COUNT(*) FROM migration_progress").fetchone()[0] == 0
+        conn.close()
+    
+    def test_off_peak_migration_waits_for_window(self, tmp_path, monkeypatch):
+        """Test that off-peak migrations are held back outside the window"""
+        import db
+        import migrations
+        monkeypatch.setattr(db, 'DB_PATH', str(tmp_path / 'old.db'))
+        init_db(version=2)
+        conn = db._connect(db.DB_PATH)
+        assert migrations.migrate(conn, off_peak=False, log=lambda message: None) == []
+        waiting = [m.version for m in migrations.pending(conn)]
+        assert waiting[0] == 3
+        assert migrations.migrate(conn, off_peak=True, log=lambda message: None) == waiting
+        conn.close()
+
+    
+    def test_statements_from_before_the_ledger_get_opening_entries(self, tmp_path, monkeypatch):
+        """Test that upgrading a pre-ledger database keeps its statement totals and balances"""
+        import db
+        import ledger
+        import migrations
+        monkeypatch.setattr(db, 'DB_PATH', str(tmp_path / 'old.db'))
+        init_db(version=migrations.OPENING_BALANCES - 1)
+        conn = db._connect(db.DB_PATH)
+        # As a database from before the ledger: statements and payments, no entries
+        conn.executescript("""
+            DROP TRIGGER ledger_no_delete;
+            DELETE FROM LedgerEntry;
+            DELETE FROM CustomerBalance;
+        """)
+        totals = dict(conn.execute("SELECT statement_id, total_amount FROM BillingStatement").fetchall())
+        customer_id = conn.execute("SELECT customer_id FROM BillingStatement LIMIT 1").fetchone()[0]
+        assert ledger.verify_balances(conn) != []
+        
+        assert migrations.migrate(conn, target=migrations.OPENING_BALANCES, log=lambda message: None) == \
+            [migrations.OPENING_BALANCES]
+        assert ledger.verify_balances(conn) == []
+        assert dict(conn.execute("SELECT statement_id, total_amount FROM BillingStatement").fetchall()) == totals
+        unpaid = conn.execute("SELECT SUM(total_amount) FROM BillingStatement WHERE status = 'unpaid'").fetchone()[0]
+        assert ledger.get_balance(conn, customer_id) == pytest.approx(unpaid)
+        assert ledger.rebuild_balances(conn) == []
+        conn.close()
+
+class TestCompactEvents:
+    """Test integer-coded tracking event storage"""
+    
+    # Package 1's public tracking number
+    TRACKING_NUMBER = 18
+    
+    def test_events_are_stored_as_integers_and_served_as_text(self, client):
+        """Test that a new event is stored compactly and read back in the API's text form"""
+        staff = {'Authorization': 'Bearer 2'}
+        response = client.post(f'/api/admin/packages/{self.TRACKING_NUMBER}/update-status', headers=staff,
+                               json={'location_id': 2, 'status': 'out for delivery'})
+        assert response.status_code == 201
+        
+        conn = get_db_connection()
+        row = conn.execute("SELECT timestamp, status FROM TrackingEvent WHERE event_id = ?",
+                           (response.get_json()['event_id'],)).fetchone()
+        conn.close()
+        assert isinstance(row['timestamp'], int) and isinstance(row['status'], int)
+        
+        location = client.get(f'/api/admin/packages/{self.TRACKING_NUMBER}/location', headers=staff).get_json()['location']
+        assert location['status'] == 'out for delivery'
+        assert len(location['last_update']) == 19
+        
+        export = client.get('/api/export/tracking-events?format=ndjson&date_from=2025-12', headers=staff)
+        events = [json.loads(line) for line in export.get_data(as_text=True).splitlines()]
+        assert events and all(e['timestamp'] >= '2025-12' for e in events)
+        assert {'processing', 'out for delivery'} <= {e['status'] for e in events}
+        
+        # Marking the package delivered also writes Package (and its change log)
+        response = client.post(f'/api/admin/packages/{self.TRACKING_NUMBER}/update-status', headers=staff,
+                               json={'location_id': 2, 'status': 'delivered'})
+        conn = get_db_connection()
+        latest = conn.execute("SELECT MAX(event_id) FROM TrackingEvent WHERE package_id = 1").fetchone()[0]
+        conn.close()
+        assert response.get_json()['event_id'] == latest
+    
+    def test_unknown_status_is_rejected(self, client):
+        """Test that a status outside the known list is a client error"""
+        response = client.post(f'/api/admin/packages/{self.TRACKING_NUMBER}/update-status',
+                               headers={'Authorization': 'Bearer 2'}, json={'location_id': 2, 'status': 'lost'})
+        assert response.status_code == 400
+    
+    def test_migration_converts_existing_events(self, tmp_path, monkeypatch):
+        """Test that migrating a text-format database keeps every event's value"""
+        import db
+        import migrations
+        monkeypatch.setattr(db, 'DB_PATH', str(tmp_path / 'old.db'))
+        monkeypatch.setenv('ARCHIVE_PATH', str(tmp_path / 'old-archive.db'))
+        monkeypatch.setattr(migrations, 'BATCH_SIZE', 5)
+        init_db(version=migrations.COMPACT_EVENTS - 1)
+        conn = db._connect(db.DB_PATH)
+        before = conn.execute("SELECT event_id, timestamp, status FROM TrackingEvent ORDER BY event_id").fetchall()
+        sequence = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'TrackingEvent'").fetchone()[0]
+        
+        migrations.migrate(conn, target=migrations.COMPACT_EVENTS, off_peak=True, log=lambda message: None)
+        after = conn.execute("SELECT event_id, timestamp, status FROM TrackingEvent ORDER BY event_id").fetchall()
+        assert [(r[0], db.from_epoch(r[1]), db.status_name(r[2])) for r in after] == [tuple(r) for r in before]
+        assert conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'TrackingEvent'").fetchone()[0] == sequence
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE tbl_name = 'TrackingEvent'")}
+        assert {'idx_event_package', 'idx_event_timestamp'} <= indexes
+        conn.close()
+
+
+class TestEventSequence:
+    """Test per-package event numbering and late-arriving scans"""
+    
+    def _history(self, client, package_id):
+        response = client.get(f'/api/tracking/{tracking_numbers.public(package_id)}', headers={'Authorization': 'Bearer 3'})
+        return response.get_json()
+    
+    def _post(self, client, package_id, status, timestamp):
+        response = client.post(f'/api/admin/packages/{tracking_numbers.public(package_id)}/update-status',
+                               headers={'Authorization': 'Bearer 2'},
+                               json={'location_id': 2, 'status': status, 'timestamp': timestamp})
+        assert response.status_code == 201
+    
+    def test_same_second_scans_keep_arrival_order(self, client):
+        """Test that events with equal timestamps come back in the order they were recorded"""
+        self._post(client, 1, 'arrived', '2098-01-02 08:00:00')
+        self._post(client, 1, 'departed', '2098-01-02 08:00:00')
+        data = self._history(client, 1)
+        assert [e['status'] for e in data['tracking_history'][:2]] == ['departed', 'arrived']
+        assert data['current_status']['status'] == 'departed'
+    
+    def test_late_scan_is_placed_in_scan_order(self, client):
+        """Test that an event uploaded after later scans is slotted in by its scan time"""
+        self._post(client, 1, 'loaded', '2099-01-03 09:00:00')
+        self._post(client, 1, 'out for delivery', '2099-01-03 12:00:00')
+        self._post(client, 1, 'arrived', '2099-01-03 10:00:00')
+        data = self._history(client, 1)
+        assert [e['status'] for e in data['tracking_history'][:3]] == ['out for delivery', 'arrived', 'loaded']
+        assert data['current_status']['status'] == 'out for delivery'
+        
+        conn = get_db_connection()
+        seqs = [row[0] for row in conn.execute("SELECT seq FROM TrackingEvent WHERE package_id = 1 ORDER BY seq")]
+        last = conn.execute("SELECT last_event_seq FROM Package WHERE package_id = 1").fetchone()[0]
+        conn.close()
+        assert seqs == list(range(1, last + 1))
+    
+    def test_migration_numbers_existing_events(self, tmp_path, monkeypatch):
+        """Test that existing events are numbered in timestamp order per package"""
+        import db
+        import migrations
+        monkeypatch.setattr(db, 'DB_PATH', str(tmp_path / 'old.db'))
+        monkeypatch.setenv('ARCHIVE_PATH', str(tmp_path / 'old-archive.db'))
+        monkeypatch.setattr(migrations, 'BATCH_SIZE', 2)
+        init_db(version=migrations.SEQUENCED_EVENTS - 1)
+        conn = db._connect(db.DB_PATH)
+        migrations.migrate(conn, target=migrations.SEQUENCED_EVENTS, off_peak=True, log=lambda message: None)
+        
+        for package_id, last in conn.execute("SELECT package_id, last_event_seq FROM Package").fetchall():
+            by_seq = conn.execute("SELECT seq, timestamp FROM TrackingEvent WHERE package_id = ? ORDER BY seq",
+                                  (package_id,)).fetchall()
+            assert [row[0] for row in by_seq] == list(range(1, last + 1))
+            assert [row[1] for row in by_seq] == sorted(row[1] for row in by_seq)
+        plan = conn.execute("EXPLAIN QUERY PLAN SELECT status FROM TrackingEvent "
+                            "WHERE package_id = 1 ORDER BY seq DESC LIMIT 1").fetchall()
+        assert 'idx_event_package_seq' in plan[0][3]
+        conn.close()
+
+
+class TestTrackingNumbers:
+    """Test public tracking numbers and the known-package filter"""
+    
+    def test_check_digit_catches_typos(self):
+        """Test that every single-digit change of a tracking number is rejected"""
+        number = tracking_numbers.public(1234)
+        assert number == 12344
+        assert tracking_numbers.decode(number) == 1234
+        digits = str(number)
+        for i, digit in enumerate(digits):
+            for other in '0123456789':
+                if other != digit and not (i == 0 and other == '0'):
+                    assert tracking_numbers.decode(int(digits[:i] + other + digits[i + 1:])) is None
+    
+    def test_malformed_number_is_rejected_without_database(self, client, monkeypatch):
+        """Test that a bad check digit is a 404 before any connection is opened"""
+        import tracking
+    
+        def no_connection(package_id):
+            raise AssertionError('opened a connection')
+        monkeypatch.setattr(tracking, 'package_connection', no_connection)
+        response = client.get('/api/tracking/12345', headers={'Authorization': 'Bearer 3'})
+        assert response.status_code == 404
+    
+    def test_packages_from_other_workers_are_found(self, client):
+        """Test that ids above the loaded ones are read in instead of being rejected"""
+        assert tracking_numbers.lookup(tracking_numbers.public(1)) == 1
+        conn = get_db_connection()
+        columns = ', '.join(row[1] for row in conn.execute("PRAGMA table_info(Package)") if row[1] != 'package_id')
+        cursor = conn.execute(f"INSERT INTO Package ({columns}) SELECT {columns} FROM Package WHERE package_id = 1")
+        package_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+    
+        number = tracking_numbers.public(package_id)
+        response = client.get(f'/api/tracking/{number}', headers={'Authorization': 'Bearer 3'})
+        assert response.status_code == 200
+        assert response.get_json()['package']['tracking_number'] == number
+        assert tracking_numbers.lookup(tracking_numbers.public(package_id + 1000)) is None
+
+
+class TestQueryRegistry:
+    """Test the named query registry"""
+
+    def test_every_registered_query_passes_plan_guard(self, client, tmp_path, monkeypatch):
+        """Test that no registered query scans a table or sorts unless it declares it"""
+        import archive
+        import queries
+        monkeypatch.setenv('ARCHIVE_PATH', str(tmp_path / 'archive.db'))
+        conn = get_db_connection()
+        archive.attach(conn, create=True)
+        problems = {name: queries.plan_problems(conn, query) for name, query in queries.REGISTRY.items()}
+        conn.close()
+        assert {name: lines for name, lines in problems.items() if lines} == {}
+
+    def test_executions_are_counted_per_query(self, client):
+        """Test that query stats and metrics carry the registered query names"""
+        import db
+        import queries
+        assert db.STATEMENT_CACHE > queries.statement_count()
+        admin = {'Authorization': 'Bearer 1'}
+        client.delete('/api/admin/db/query-stats', headers=admin)
+        cache_bus.invalidate_all()  # roles are cached; look this one up again
+        client.get('/api/user/packages', headers={'Authorization': 'Bearer 3'})
+
+        data = client.get('/api/admin/db/query-stats?sort=calls&limit=500', headers=admin).get_json()
+        named = {s['query']: s['calls'] for s in data['statements'] if s['query']}
+        assert named['tracking.user_packages'] == 1
+        assert named['user.role'] >= 1
+        assert 'db_queries_total{query="tracking.user_packages"}' in client.get('/metrics').get_data(as_text=True)
+
+
+class TestAppFactory:
+    """Test create_app() and the API docs modes"""
+
+    def test_factory_builds_independent_apps(self, client):
+        """Test that each app gets its own config and serves the API"""
+        from main import create_app
+        other = create_app({'TESTING': True, 'APIDOCS': 'off', 'METRICS_TOKEN': 'secret'})
+        assert other is not app
+        assert app.config['METRICS_TOKEN'] != 'secret'
+        other_client = other.test_client()
+        assert other_client.get('/').status_code == 200
+        assert other_client.get('/api/services').status_code == 200
+        assert other_client.get('/apispec_1.json').status_code == 404
+
+    def test_lazy_spec_is_built_on_first_request(self, client):
+        """Test that the default mode serves the spec and the UI"""
+        spec = client.get('/apispec_1.json').get_json()
+        assert spec['info']['title'] == 'Package Delivery API'
+        assert '/api/tracking/{tracking_number}' in spec['paths']
+        assert client.get('/apidocs/').status_code == 200
+
+    def test_static_mode_serves_the_prebuilt_file(self, client, tmp_path):
+        """Test that APIDOCS=static serves what `apidocs.py build` wrote"""
+        import apidocs
+        from main import create_app
+        path = str(tmp_path / 'apispec.json')
+        static = create_app({'TESTING': True, 'APIDOCS': 'static', 'APISPEC_PATH': path}).test_client()
+        assert static.get('/apispec_1.json').status_code == 404
+
+        apidocs.main(['build', '--out', path])
+        static = create_app({'TESTING': True, 'APIDOCS': 'static', 'APISPEC_PATH': path}).test_client()
+        assert static.get('/apispec_1.json').get_json() == client.get('/apispec_1.json').get_json()
+
+
+    def test_deferred_background_threads_start_in_the_forked_worker(self, tmp_path, monkeypatch):
+        """Test that DEFER_BACKGROUND keeps threads out of the preloading process"""
+        import backup
+        import webhooks
+        from main import create_app, start_background
+        monkeypatch.setenv('REPLICA_PATH', str(tmp_path / 'replica.db'))
+        for module, name in ((backup, '_refresher'), (backup, '_refresh_settings'),
+                             (webhooks, '_thread'), (webhooks, '_poll')):
+            monkeypatch.setattr(module, name, None)
+        create_app({'TESTING': True, 'APIDOCS': 'off', 'DEFER_BACKGROUND': True,
+                    'WEBHOOK_WORKER': True, 'REPLICA_REFRESH': 3600})
+        assert backup._refresher is None and webhooks._thread is None
+
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            start_background()
+            os.write(write, b'1' if backup._refresher.is_alive() and webhooks._thread.is_alive() else b'0')
+            os._exit(0)
+        os.waitpid(pid, 0)
+        assert os.read(read, 1) == b'1'
+        assert backup._refresher is None and webhooks._thread is None
+
+class TestWebhooks:
+    """Test the tracking event outbox and webhook delivery against a local receiver"""
+
+    @pytest.fixture
+    def receiver(self, monkeypatch):
+        import threading
+        import webhooks
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        monkeypatch.setattr(webhooks, 'WEBHOOK_ALLOW_PRIVATE', True)
+
+        class Receiver(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                self.server.received.append((dict(self.headers), body, self.client_address))
+                held = self.server.held.get(json.loads(body)['subscription_id'])
+                if held is not None:
+                    held.wait(10)
+                self.send_response(self.server.statuses.pop(0) if self.server.statuses else 204)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Receiver)
+        server.received, server.statuses, server.held = [], [], {}
+        server.url = f'http://127.0.0.1:{server.server_port}/hooks?source=test'
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        yield server
+        server.shutdown()
+        server.server_close()
+
+    def _subscribe(self, client, url, **fields):
+        response = client.post('/api/customer/webhooks', headers={'Authorization': 'Bearer 4'},
+                               json={'url': url, **fields})
+        assert response.status_code == 201
+        return response.get_json()['subscription_id']
+
+    def _scan(self, client, package_id, status):
+        return client.post(f'/api/admin/packages/{tracking_numbers.public(package_id)}/update-status',
+                           headers={'Authorization': 'Bearer 2'},
+                           json={'location_id': 1, 'status': status, 'notes': f'{status} scan'})
+
+    def _queued(self):
+        conn = get_db_connection()
+        count = conn.execute("SELECT COUNT(*) FROM Outbox").fetchone()[0]
+        conn.close()
+        return count
+
+    def test_events_are_batched_signed_and_sent_over_one_connection(self, client, receiver):
+        """Test that queued events arrive in order, signed, reusing the connection"""
+        import hashlib
+        import hmac
+        import webhooks
+        subscription_id = self._subscribe(client, receiver.url, secret='s3cret')
+        for status in ('arrived', 'departed', 'loaded'):
+            assert self._scan(client, 2, status).status_code == 201
+        self._scan(client, 1, 'arrived')  # another customer's package
+        assert self._queued() == 3
+
+        deliverer = webhooks.Deliverer()
+        try:
+            assert deliverer.deliver_once() == (1, 0)
+            headers, body, first_peer = receiver.received[0]
+            events = json.loads(body)['events']
+            assert [e['status'] for e in events] == ['arrived', 'departed', 'loaded']
+            assert {e['tracking_number'] for e in events} == {tracking_numbers.public(2)}
+            assert headers['X-Webhook-Signature'] == \
+                'sha256=' + hmac.new(b's3cret', body, hashlib.sha256).hexdigest()
+            assert self._queued() == 0
+
+            self._scan(client, 3, 'delivered')
+            assert deliverer.deliver_once() == (1, 0)
+            assert receiver.received[1][2] == first_peer
+            assert deliverer.deliver_once() == (0, 0)
+        finally:
+            deliverer.close()
+
+        listed = client.get('/api/customer/webhooks', headers={'Authorization': 'Bearer 4'}).get_json()
+        assert listed['subscriptions'][0]['subscription_id'] == subscription_id
+        assert listed['subscriptions'][0]['queued'] == 0
+
+    def test_failed_delivery_backs_off_and_resends_the_same_batch(self, client, receiver):
+        """Test that a failure keeps the events and retries them after the backoff"""
+        import webhooks
+        subscription_id = self._subscribe(client, receiver.url)
+        self._scan(client, 2, 'arrived')
+        receiver.statuses.append(503)
+
+        deliverer = webhooks.Deliverer()
+        try:
+            assert deliverer.deliver_once() == (0, 0)
+            conn = get_db_connection()
+            failed = conn.execute("SELECT * FROM WebhookSubscription WHERE subscription_id = ?",
+                                  (subscription_id,)).fetchone()
+            assert failed['failures'] == 1 and failed['last_error'] == 'HTTP 503'
+            assert self._queued() == 1
+
+            assert deliverer.deliver_once() == (0, 0)  # still backing off
+            assert len(receiver.received) == 1
+            conn.execute("UPDATE WebhookSubscription SET retry_at = 0")
+            conn.commit()
+            conn.close()
+
+            assert deliverer.deliver_once() == (1, 0)
+        finally:
+            deliverer.close()
+        assert receiver.received[0][1] == receiver.received[1][1]
+        assert receiver.received[0][0]['X-Webhook-Delivery'] == receiver.received[1][0]['X-Webhook-Delivery']
+        assert self._queued() == 0
+
+    def test_outbox_rows_commit_with_the_event(self, client, receiver):
+        """Test that a rejected event queues nothing and deleting a subscription drops its queue"""
+        subscription_id = self._subscribe(client, receiver.url)
+        assert self._scan(client, 2, 'lost').status_code in (400, 500)
+        assert self._queued() == 0
+
+        self._scan(client, 2, 'arrived')
+        assert self._queued() == 1
+        assert client.post('/api/customer/webhooks', headers={'Authorization': 'Bearer 4'},
+                           json={'url': 'ftp://example.com'}).status_code == 400
+        assert client.delete(f'/api/customer/webhooks/{subscription_id}',
+                             headers={'Authorization': 'Bearer 3'}).status_code == 404
+        assert client.delete(f'/api/customer/webhooks/{subscription_id}',
+                             headers={'Authorization': 'Bearer 4'}).status_code == 200
+        assert self._queued() == 0
+
+
+    def test_slow_endpoint_does_not_block_writers(self, client, receiver):
+        """Test that a delivery waiting on one endpoint holds no write lock"""
+        import threading
+        import time
+        import webhooks
+        from db import DB_PATH
+        self._subscribe(client, receiver.url)
+        slow = self._subscribe(client, receiver.url.replace('/hooks', '/slow'))
+        receiver.held[slow] = threading.Event()
+        self._scan(client, 2, 'arrived')
+
+        deliverer = webhooks.Deliverer()
+        delivery = threading.Thread(target=deliverer.deliver_once)
+        try:
+            delivery.start()
+            deadline = time.time() + 5
+            while len(receiver.received) < 2 and time.time() < deadline:
+                time.sleep(0.01)
+            time.sleep(0.2)  # the fast endpoint has answered
+            writer = sqlite3.connect(DB_PATH, timeout=0)
+            writer.execute("UPDATE Package SET weight_lb = weight_lb WHERE package_id = 1")
+            writer.commit()
+            writer.close()
+        finally:
+            receiver.held[slow].set()
+            delivery.join(10)
+            deliverer.close()
+        assert self._queued() == 0
+
+    def test_private_hosts_are_refused(self, client, receiver, monkeypatch):
+        """Test that loopback, private and metadata addresses can't be subscribed or delivered to"""
+        import webhooks
+        monkeypatch.setattr(webhooks, 'WEBHOOK_ALLOW_PRIVATE', False)
+        for url in (receiver.url, 'http://localhost/hooks', 'http://10.0.0.8/hooks',
+                    'http://169.254.169.254/latest/meta-data', 'http://[::1]:8080/'):
+            response = client.post('/api/customer/webhooks', headers={'Authorization': 'Bearer 4'}, json={'url': url})
+            assert response.status_code == 400, url
+        assert client.post('/api/customer/webhooks', headers={'Authorization': 'Bearer 4'},
+                           data='not json').status_code == 400
+        assert client.post('/api/customer/webhooks', headers={'Authorization': 'Bearer 4'},
+                           json=['x']).status_code == 400
+
+        # Registered while allowed (or a host that resolves differently now)
+        monkeypatch.setattr(webhooks, 'WEBHOOK_ALLOW_PRIVATE', True)
+        subscription_id = self._subscribe(client, receiver.url)
+        monkeypatch.setattr(webhooks, 'WEBHOOK_ALLOW_PRIVATE', False)
+        self._scan(client, 2, 'arrived')
+        deliverer = webhooks.Deliverer()
+        try:
+            assert deliverer.deliver_once() == (0, 0)
+        finally:
+            deliverer.close()
+        assert receiver.received == []
+        conn = get_db_connection()
+        error = conn.execute("SELECT last_error FROM WebhookSubscription WHERE subscription_id = ?",
+                             (subscription_id,)).fetchone()[0]
+        conn.close()
+        assert error.startswith('UnsafeDestination')
+
+class TestJobs:
+    """Test the background job queue: submission, workers, priorities, cancellation and retries"""
+
+    def _job(self, client, job_id, token=1):
+        return client.get(f'/api/jobs/{job_id}', headers={'Authorization': f'Bearer {token}'}).get_json()
+
+    def test_export_job_runs_as_the_submitter(self, client):
+        """Test that an export job produces the same file the endpoint streams"""
+        import jobs
+        response = client.post('/api/jobs/export', headers={'Authorization': 'Bearer 2'},
+                               json={'path': '/api/export/packages', 'query': {'format': 'csv'}})
+        assert response.status_code == 202
+        job_id = response.get_json()['job_id']
+        assert self._job(client, job_id, 2)['state'] == 'queued'
+        assert client.get(f'/api/jobs/{job_id}/result', headers={'Authorization': 'Bearer 2'}).status_code == 409
+        assert client.get(f'/api/jobs/{job_id}', headers={'Authorization': 'Bearer 3'}).status_code == 404
+
+        assert jobs.run_next() == job_id
+        job = self._job(client, job_id, 2)
+        assert job['state'] == 'succeeded' and job['priority'] == 'bulk'
+        result = client.get(job['result_url'], headers={'Authorization': 'Bearer 2'})
+        direct = client.get('/api/export/packages?format=csv', headers={'Authorization': 'Bearer 2'})
+        assert result.data == direct.data
+        assert jobs.run_next() is None
+
+        # Run as the customer, the same export is refused and the job fails without a retry
+        job_id = client.post('/api/jobs/export', headers={'Authorization': 'Bearer 3'},
+                             json={'path': '/api/export/packages'}).get_json()['job_id']
+        jobs.run_next()
+        job = self._job(client, job_id, 3)
+        assert job['state'] == 'failed' and job['error'].startswith('403') and job['attempts'] == 1
+
+    def test_interactive_jobs_are_not_starved_by_bulk(self, client):
+        """Test that with the bulk slot taken, a worker skips queued bulk jobs for interactive ones"""
+        import jobs
+        bulk = [jobs.submit('billing-verify', {}, 1) for _ in range(2)]
+        assert jobs.claim('worker-1')['job_id'] == bulk[0]
+
+        statement = jobs.submit('export', {'path': '/api/export/statements/1'}, 4, priority='interactive')
+        later = jobs.submit('export', {'path': '/api/export/statements/1'}, 4, priority='interactive')
+        assert jobs.claim('worker-2')['job_id'] == statement
+        assert jobs.claim('worker-2')['job_id'] == later
+        assert jobs.claim('worker-2') is None
+
+        # A lost worker's job is queued again
+        conn = jobs.connect()
+        conn.execute("UPDATE Job SET heartbeat = 0 WHERE job_id = ?", (bulk[0],))
+        conn.commit()
+        conn.close()
+        assert jobs.claim('worker-3')['job_id'] == bulk[0]
+
+    def test_cancel_and_retry(self, client, monkeypatch):
+        """Test cancelling queued and running jobs, and retrying transient failures with backoff"""
+        import jobs
+        queued = jobs.submit('billing-verify', {}, 1)
+        assert client.post(f'/api/jobs/{queued}/cancel', headers={'Authorization': 'Bearer 2'}).status_code == 404
+        assert client.post(f'/api/jobs/{queued}/cancel',
+                           headers={'Authorization': 'Bearer 1'}).get_json()['state'] == 'cancelled'
+        assert jobs.run_next() is None
+
+        calls = []
+
+        def flaky(job, ctx):
+            calls.append(job['attempts'])
+            if len(calls) == 1:
+                raise sqlite3.OperationalError('database is locked')
+            jobs.cancel(job['job_id'])
+            ctx.progress(0.5)
+            return 'unreachable'
+
+        monkeypatch.setitem(jobs.KINDS, 'flaky', jobs.Kind('flaky', flaky, jobs.BULK, 3))
+        job_id = jobs.submit('flaky', {}, 1)
+        assert jobs.run_next() == job_id
+        job = self._job(client, job_id)
+        assert job['state'] == 'queued' and job['error'].startswith('OperationalError')
+        assert jobs.run_next() is None  # backing off
+
+        monkeypatch.setattr(jobs, 'JOB_RETRY_DELAY', 0)
+        conn = jobs.connect()
+        conn.execute("UPDATE Job SET run_after = 0 WHERE job_id = ?", (job_id,))
+        conn.commit()
+        conn.close()
+        assert jobs.run_next() == job_id
+        assert calls == [1, 2]
+        assert self._job(client, job_id)['state'] == 'cancelled'
+
+    def test_reconcile_job_reports_exceptions_to_a_file(self, client):
+        """Test that an uploaded remittance is applied by a worker with its exceptions as the result"""
+        import csv
+        import io
+        import jobs
+        remittance = (
+            "account_number,statement_month,amount\n"
+            "1001,2025-12,0.01\n"
+            "abc,2025-12,10.00\n"
+        )
+        assert client.post('/api/jobs/reconcile', headers={'Authorization': 'Bearer 2', 'Content-Type': 'text/csv'},
+                           data=remittance).status_code == 403
+        job_id = client.post('/api/jobs/reconcile', headers={'Authorization': 'Bearer 1', 'Content-Type': 'text/csv'},
+                             data=remittance).get_json()['job_id']
+        jobs.run_next()
+        job = self._job(client, job_id)
+        assert job['state'] == 'succeeded'
+        assert job['result']['applied'] == 1 and job['result']['exception_count'] == 2
+        report = client.get(job['result_url'], headers={'Authorization': 'Bearer 1'}).get_data(as_text=True)
+        assert [row['reason'] for row in csv.DictReader(io.StringIO(report))] == ['partial_payment', 'malformed']
+
+    def test_long_running_jobs_keep_their_lease(self, client, monkeypatch):
+        """Test that a job with no progress reports is not requeued while its worker is alive"""
+        import time
+        import jobs
+        monkeypatch.setattr(jobs, 'JOB_LEASE', 0.3)
+        stolen = []
+
+        def slow(job, ctx):
+            time.sleep(0.6)
+            stolen.append(jobs.claim('worker-2'))
+            return 'done'
+
+        monkeypatch.setitem(jobs.KINDS, 'slow', jobs.Kind('slow', slow, jobs.BULK, 2))
+        job_id = jobs.submit('slow', {}, 1)
+        assert jobs.run_next('worker-1') == job_id
+        assert stolen == [None]
+        job = self._job(client, job_id)
+        assert job['state'] == 'succeeded' and job['attempts'] == 1
+
+    def test_lost_worker_cannot_finish_a_reclaimed_job(self, client, monkeypatch):
+        """Test that after its lease expired a worker's result doesn't overwrite the new claim"""
+        import jobs
+
+        def lost(job, ctx):
+            conn = jobs.connect()
+            conn.execute("UPDATE Job SET heartbeat = 0 WHERE job_id = ?", (job['job_id'],))
+            conn.commit()
+            conn.close()
+            assert jobs.claim('worker-2')['job_id'] == job['job_id']
+            return 'late'
+
+        monkeypatch.setitem(jobs.KINDS, 'lost', jobs.Kind('lost', lost, jobs.BULK, 2))
+        job_id = jobs.submit('lost', {}, 1)
+        assert jobs.run_next('worker-1') == job_id
+        job = self._job(client, job_id)
+        assert job['state'] == 'running' and job['attempts'] == 2 and job['result'] is None
+
+    def test_failed_upload_cancels_the_held_job(self, client, monkeypatch):
+        """Test that a reconcile upload that can't be stored leaves no job held in the queue"""
+        import jobs
+
+        def broken(source, target):
+            raise OSError('No space left on device')
+
+        monkeypatch.setattr(jobs.shutil, 'copyfileobj', broken)
+        response = client.post('/api/jobs/reconcile', headers={'Authorization': 'Bearer 1', 'Content-Type': 'text/csv'},
+                               data="account_number,statement_month,amount\n")
+        assert response.status_code == 500
+        conn = jobs.connect()
+        assert [tuple(row) for row in conn.execute("SELECT kind, state FROM Job")] == [('reconcile', 'cancelled')]
+        conn.close()
+
+
+class TestChangeFeed:
+    """Test the change-data-capture log and /api/changes"""
+
+    def _changes(self, client, **params):
+        response = client.get('/api/changes', headers={'Authorization': 'Bearer 2'}, query_string=params)
+        assert response.status_code == 200
+        return response.get_json()
+
+    def test_writes_are_logged_in_commit_order(self, client):
+        """Test that a shipment, its charge, a scan and a payment appear in order with their rows"""
+        head = self._changes(client, limit=1)['head']
+        assert client.get('/api/changes', headers={'Authorization': 'Bearer 3'}).status_code == 403
+
+        headers = {'Authorization': 'Bearer 4'}
+        shipped = client.post('/api/ship', headers=headers, json={
+            'sender_name': 'Sarah Contract', 'sender_addr1': '789 Business Blvd',
+            'sender_city': 'Chicago', 'sender_state': 'IL', 'sender_zip': '60601',
+            'recipient_name': 'Test Recipient', 'recipient_addr1': '1 Test St',
+            'recipient_city': 'Boston', 'recipient_state': 'MA', 'recipient_zip': '02101',
+            'service_id': 4, 'weight_lb': 2.0, 'payment_type': 'account'
+        }).get_json()
+        tracking_number = shipped['tracking_number']
+        client.post(f'/api/admin/packages/{tracking_number}/update-status', headers={'Authorization': 'Bearer 2'},
+                    json={'location_id': 1, 'status': 'arrived', 'timestamp': '2026-01-02 03:04:05'})
+        client.post('/api/billing/make-payment', headers=headers, json={'amount': 10.00, 'method': 'account'})
+
+        feed = self._changes(client, since=head)
+        assert feed['head'] == feed['position'] > head and not feed['more']
+        changes = feed['changes']
+        assert [c['position'] for c in changes] == list(range(head + 1, feed['position'] + 1))
+        entities = [(c['entity'], c['op']) for c in changes]
+        assert entities.index(('package', 'insert')) < entities.index(('tracking_event', 'insert'))
+        assert entities[-1] == ('payment', 'insert')
+        assert ('billing_statement', 'update') in entities
+
+        package = next(c for c in changes if c['entity'] == 'package')
+        assert package['id'] == tracking_number and package['data']['recipient_city'] == 'Boston'
+        event = next(c for c in changes if c['entity'] == 'tracking_event' and c['data']['status'] == 'arrived')
+        assert event['data']['tracking_number'] == tracking_number
+        assert event['data']['timestamp'] == '2026-01-02 03:04:05'
+
+        # Paging: the position of one page is the since of the next
+        first = self._changes(client, since=head, limit=2)
+        assert first['more'] and first['position'] == head + 2
+        assert self._changes(client, since=first['position'])['changes'] == changes[2:]
+
+    def test_long_poll_returns_when_a_change_commits(self, client):
+        """Test that wait holds an empty read until the next write"""
+        import threading
+        import time
+        head = self._changes(client)['head']
+        start = time.monotonic()
+        assert self._changes(client, since=head, wait=0.2)['changes'] == []
+        assert time.monotonic() - start >= 0.2
+
+        def scan():
+            time.sleep(0.3)
+            app.test_client().post(f'/api/admin/packages/{tracking_numbers.public(2)}/update-status',
+                        headers={'Authorization': 'Bearer 2'}, json={'location_id': 1, 'status': 'departed'})
+
+        writer = threading.Thread(target=scan)
+        writer.start()
+        start = time.monotonic()
+        feed = self._changes(client, since=head, wait=10)
+        writer.join()
+        assert time.monotonic() - start < 5
+        assert feed['changes'][0]['entity'] == 'tracking_event'
+
+    def test_archive_and_prune(self, client, tmp_path, monkeypatch):
+        """Test that archived packages are reported as such and pruned history answers 410"""
+        import archive
+        import changes
+        monkeypatch.setenv('ARCHIVE_PATH', str(tmp_path / 'archive.db'))
+        head = self._changes(client)['head']
+        conn = get_db_connection()
+        moved = archive.run(conn, days=0)
+        ops = {c['op'] for c in self._changes(client, since=head)['changes'] if c['entity'] == 'package'}
+        assert moved and ops == {'archive'}
+
+        conn.execute("UPDATE ChangeLog SET changed_at = 0")
+        assert changes.prune(conn, days=1) > 0
+        conn.close()
+        latest = self._changes(client)['head']
+        assert client.get('/api/changes?since=0', headers={'Authorization': 'Bearer 2'}).status_code == 410
+        assert self._changes(client, since=latest - 1)['position'] == latest
+        assert self._changes(client, since=latest)['changes'] == []
+
+
+class TestCacheBus:
+    """Test invalidating in-process caches across worker processes"""
+
+    def _scan(self, package_id, status='arrived'):
+        # A write made by another worker process
+        response = app.test_client().post(f'/api/admin/packages/{tracking_numbers.public(package_id)}/update-status',
+                                          headers={'Authorization': 'Bearer 2'},
+                                          json={'location_id': 1, 'status': status})
+        os._exit(0 if response.status_code == 201 else 1)
+
+    def test_scan_in_another_process_reaches_this_cache(self, client):
+        """Test that a tracking payload cached here is dropped after another worker's scan"""
+        import multiprocessing
+        import tracking
+        headers = {'Authorization': 'Bearer 3'}
+        url = f'/api/tracking/{tracking_numbers.public(1)}'
+        before = client.get(url, headers=headers).get_json()
+        hits = tracking.payloads.hits
+        assert client.get(url, headers=headers).get_json() == before
+        assert tracking.payloads.hits == hits + 1
+
+        writer = multiprocessing.get_context('fork').Process(target=self._scan, args=(1,))
+        writer.start()
+        writer.join()
+        assert writer.exitcode == 0
+
+        assert cache_bus.poll(force=True) == 1
+        after = client.get(url, headers=headers).get_json()
+        assert len(after['tracking_history']) == len(before['tracking_history']) + 1
+        assert after['current_status']['status'] == 'arrived'
+        # Another customer still can't read the cached payload
+        assert client.get(url, headers={'Authorization': 'Bearer 4'}).status_code == 403
+
+    def test_invalidations_go_out_on_commit_only(self, client):
+        """Test that published keys wait for the commit and vanish with a rollback"""
+        import tracking
+        conn = get_db_connection()
+        tracking.payloads.set(1, (1, b'{}'))
+        conn.execute("UPDATE Package SET delivered_signature = 'x' WHERE package_id = 1")
+        cache_bus.publish(conn, 'tracking', 1)
+        assert tracking.payloads.get(1) is not None
+        conn.rollback()
+        assert tracking.payloads.get(1) is not None
+
+        conn.execute("UPDATE Package SET delivered_signature = 'x' WHERE package_id = 1")
+        cache_bus.publish(conn, 'tracking', 1)
+        conn.commit()
+        conn.close()
+        assert tracking.payloads.get(1) is None
+
+        bus = sqlite3.connect(cache_bus.bus_path())
+        rows = bus.execute("SELECT cache, key, publisher FROM CacheInvalidation").fetchall()
+        assert rows == [('tracking', '1', os.getpid())]
+        # Our own rows are not applied twice; another worker's are
+        bus.execute("INSERT INTO CacheInvalidation (cache, key, publisher, published_at) "
+                    "VALUES ('principal', '2', 0, 0)")
+        bus.commit()
+        bus.close()
+        assert cache_bus.poll(force=True) == 2
+
+    def test_role_change_reaches_cached_principals(self, client):
+        """Test that a demoted admin loses access although the role was cached"""
+        admin = {'Authorization': 'Bearer 1'}
+        response = client.post('/api/admin/users/create', headers=admin, json={
+            'email': 'second-admin@shipping.com', 'password': 'pw', 'role': 'admin'})
+        assert response.status_code == 201
+        user_id = response.get_json()['user_id']
+        other = {'Authorization': f'Bearer {user_id}'}
+        assert client.get('/api/admin/db/query-stats', headers=other).status_code == 200
+
+        assert client.put(f'/api/admin/users/{user_id}/update-role', headers=admin, json={'role': 'staff'}).status_code == 200
+        assert client.get('/api/admin/db/query-stats', headers=other).status_code == 403
+
+
 class TestDatabase:
     """Test database operations"""
     
@@ -199,9 +1778,29 @@ class TestDatabase:
         cursor.execute("SELECT COUNT(*) FROM Location")
         location_count = cursor.fetchone()[0]
         assert location_count >= 4, "Expected at least 4 locations"
-        
+
         conn.close()
 
+    def test_connection_pool_reuses_connections(self, client, monkeypatch):
+        """Test that pooled connections are recycled and rolled back on close"""
+        import db
+        monkeypatch.setattr(db, 'POOL_SIZE', 2)
+        monkeypatch.setattr(db, '_pools', {})
+
+        conn = get_db_connection()
+        conn.execute("UPDATE ServiceType SET base_price = -1")
+        conn.close()
+
+        again = get_db_connection()
+        assert again is conn
+        assert again.execute("SELECT MIN(base_price) FROM ServiceType").fetchone()[0] > 0
+        assert db.get_pool().stats() == {'size': 2, 'idle': 0, 'in_use': 1, 'created': 1}
+        again.close()
+
+        response = client.get('/api/services')
+        assert response.status_code == 200
+        assert db.get_pool().stats()['in_use'] == 0
+
 
 class TestDataValidation:
     """Test data validation and constraints"""
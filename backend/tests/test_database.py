@@ -9,15 +9,13 @@ import sqlite3
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from db import init_db, get_db_connection, DB_PATH
+from db import get_db_connection
 
 
-@pytest.fixture(scope='module')
-def db():
-    """Initialize database once for all tests in this module"""
-    init_db()
-    yield
-    # Cleanup after all tests (optional)
+@pytest.fixture
+def db(database):
+    """Seeded database for each test (a fresh copy, see conftest.py)"""
+    yield database
 
 
 class TestDatabaseStructure:
@@ -25,7 +23,7 @@ class TestDatabaseStructure:
     
     def test_database_file_exists(self, db):
         """Test that database file is created"""
-        assert os.path.exists(DB_PATH), "Database file not found"
+        assert os.path.exists(db), "Database file not found"
     
     def test_all_tables_exist(self, db):
         """Test that all required tables exist"""
@@ -317,6 +315,10 @@ class TestDatabaseOperations:
         """Test updating user data"""
         conn = get_db_connection()
         cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO User (email, password, role)
+            VALUES ('testuser@test.com', 'testpass', 'customer')
+        """)
         
         # Update password
         cursor.execute("""
@@ -340,6 +342,10 @@ class TestDatabaseOperations:
         """Test deleting a user"""
         conn = get_db_connection()
         cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO User (email, password, role)
+            VALUES ('testuser@test.com', 'testpass', 'customer')
+        """)
         
         # Count before
         cursor.execute("SELECT COUNT(*) FROM User WHERE email = 'testuser@test.com'")
@@ -0,0 +1,249 @@
+# backend/tracing.py
+"""
+tracing.py - Per-request tracing spans and a sampling profiler for slow requests
+
+When TRACE_ENABLED is on, every request gets a trace made of spans:
+
+    checkout     time to get a database connection
+    sql          one span per statement, with normalized SQL text
+    fetch+map    iterating a cursor through a RowMapper
+    serialize    JSON encoding (jsonify and fast_jsonify)
+
+plus the total time. Finished traces go into a per-process ring buffer
+that debug.py serves at /debug/trace.
+
+With TRACE_PROFILE_SLOW_MS > 0 a background thread samples the stacks of
+in-flight traced requests every TRACE_PROFILE_INTERVAL_MS; requests that
+end up slower than the threshold keep their samples (collapsed-stack
+format, ready for flamegraph tools), the rest are discarded.
+
+When tracing is off the only cost is one config lookup per request and an
+empty-list check per SQL statement. Under gunicorn each worker process has
+its own buffer.
+"""
+import os
+import re
+import sys
+import threading
+import time
+from itertools import count
+from collections import Counter, deque
+from contextlib import nullcontext
+from contextvars import ContextVar
+from functools import lru_cache
+from flask import current_app, request
+from flask.json.provider import DefaultJSONProvider
+import db
+
+DEFAULTS = {
+    'TRACE_ENABLED': os.environ.get('TRACE_ENABLED', '0') == '1',
+    'TRACE_BUFFER_SIZE': int(os.environ.get('TRACE_BUFFER_SIZE', 200)),
+    'TRACE_MAX_SPANS': int(os.environ.get('TRACE_MAX_SPANS', 500)),
+    'TRACE_PROFILE_SLOW_MS': float(os.environ.get('TRACE_PROFILE_SLOW_MS', 0)),
+    'TRACE_PROFILE_INTERVAL_MS': float(os.environ.get('TRACE_PROFILE_INTERVAL_MS', 5)),
+}
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r'\s+')
+
+_current = ContextVar('trace', default=None)
+_NO_SPAN = nullcontext()
+
+
+@lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    """
+    Collapse whitespace and replace literals with ? so equal queries group together.
+    """
+    return _WHITESPACE.sub(' ', _LITERALS.sub('?', sql)).strip()
+
+
+class Trace:
+    """
+    Spans recorded for one request.
+    """
+    _ids = count(1)
+
+    def __init__(self, max_spans):
+        self.id = next(Trace._ids)
+        self.method = request.method
+        self.path = request.full_path.rstrip('?')
+        self.endpoint = request.endpoint
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.max_spans = max_spans
+        self.spans = []
+        self.dropped = 0
+        self.status = None
+        self.duration = None
+        self.samples = Counter()
+        self.profile = None
+
+    def add(self, name, start, seconds, sql=None):
+        if len(self.spans) >= self.max_spans:
+            self.dropped += 1
+            return
+        span = {'name': name, 'offset_ms': round((start - self.start) * 1000, 3),
+                'duration_ms': round(seconds * 1000, 3)}
+        if sql is not None:
+            span['sql'] = normalize_sql(sql)
+        self.spans.append(span)
+
+    def to_dict(self):
+        result = {
+            'id': self.id,
+            'method': self.method,
+            'path': self.path,
+            'endpoint': self.endpoint,
+            'status': self.status,
+            'started_at': self.started_at,
+            'duration_ms': round(self.duration * 1000, 3),
+            'sql_ms': round(sum(s['duration_ms'] for s in self.spans if s['name'] == 'sql'), 3),
+            'spans': self.spans,
+        }
+        if self.dropped:
+            result['dropped_spans'] = self.dropped
+        if self.profile is not None:
+            result['profile'] = self.profile
+        return result
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'start')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.trace.add(self.name, self.start, time.perf_counter() - self.start)
+
+
+def span(name):
+    """
+    Context manager timing a block as a span of the current trace (no-op without one).
+    """
+    trace = _current.get()
+    return _Span(trace, name) if trace is not None else _NO_SPAN
+
+
+def _db_hook(event, cursor, sql, params, seconds):
+    trace = _current.get()
+    if trace is not None:
+        trace.add('checkout' if event == 'checkout' else 'sql',
+                  time.perf_counter() - seconds, seconds, sql)
+
+
+def _collapse(frame, limit=64):
+    stack = []
+    while frame is not None and len(stack) < limit:
+        code = frame.f_code
+        stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}')
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
+
+
+class Sampler:
+    """
+    Background thread that samples the stacks of registered request threads.
+    """
+    def __init__(self):
+        self.active = {}
+        self.interval = 0.005
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+
+    def running(self):
+        return self._thread is not None and self._pid == os.getpid() and self._thread.is_alive()
+
+    def start(self, interval):
+        self.interval = interval
+        if self.running():
+            return
+        self._stop = threading.Event()
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='trace-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+    def _run(self):
+        stop = self._stop
+        while not stop.wait(self.interval):
+            frames = sys._current_frames()
+            for ident, trace in list(self.active.items()):
+                frame = frames.get(ident)
+                samples = trace.samples
+                if frame is not None and samples is not None:
+                    samples[_collapse(frame)] += 1
+
+
+sampler = Sampler()
+traces = deque(maxlen=DEFAULTS['TRACE_BUFFER_SIZE'])
+
+
+class TracedJSONProvider(DefaultJSONProvider):
+    """
+    Flask's JSON provider with jsonify() recorded as a 'serialize' span.
+    """
+    def response(self, *args, **kwargs):
+        with span('serialize'):
+            return super().response(*args, **kwargs)
+
+
+def _begin():
+    config = current_app.config
+    if not config['TRACE_ENABLED']:
+        return
+    trace = Trace(config['TRACE_MAX_SPANS'])
+    _current.set(trace)
+    if config['TRACE_PROFILE_SLOW_MS'] > 0:
+        sampler.start(config['TRACE_PROFILE_INTERVAL_MS'] / 1000)
+        sampler.active[threading.get_ident()] = trace
+
+
+def _record_status(response):
+    trace = _current.get()
+    if trace is not None:
+        trace.status = response.status_code
+    return response
+
+
+def _finish(exc):
+    trace = _current.get()
+    if trace is None:
+        return
+    _current.set(None)
+    sampler.active.pop(threading.get_ident(), None)
+    trace.duration = time.perf_counter() - trace.start
+    slow_ms = current_app.config['TRACE_PROFILE_SLOW_MS']
+    if slow_ms > 0 and trace.duration * 1000 >= slow_ms:
+        samples = dict(trace.samples)
+        trace.profile = [{'stack': stack, 'samples': n}
+                         for stack, n in sorted(samples.items(), key=lambda item: -item[1])]
+    trace.samples = None
+    traces.append(trace)
+
+
+def init_tracing(app):
+    """
+    Install request tracing on a Flask app.
+    """
+    global traces
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
+    traces = deque(maxlen=app.config['TRACE_BUFFER_SIZE'])
+
+    app.json = TracedJSONProvider(app)
+    if _db_hook not in db.DB_HOOKS:
+        db.DB_HOOKS.append(_db_hook)
+
+    app.before_request(_begin)
+    app.after_request(_record_status)
+    app.teardown_request(_finish)
@@ -2,12 +2,77 @@
 """
 tracking.py - Package tracking routes
 """
-from flask import Blueprint, request, jsonify
+import os
+from flask import Blueprint, Response, request, jsonify
 from functools import wraps
-from db import get_db_connection
+from db import package_connection, user_connection
+from serializers import RowMapper, Bool, Call, Format, Status, Timestamp, fast_jsonify
+import archive
+import cache_bus
+import partitions
+import queries
+import tracking_numbers
 
 tracking_routes = Blueprint('tracking_routes', __name__)
 
+# package_id -> (customer_id, response body); db.insert_event publishes
+# 'tracking' invalidations, so every worker drops a package when it is scanned
+TRACKING_CACHE_TTL = float(os.environ.get('TRACKING_CACHE_TTL', 300))
+payloads = cache_bus.LocalCache('tracking', TRACKING_CACHE_TTL)
+
+
+def _street(addr1, addr2):
+    return f"{addr1}{' ' + addr2 if addr2 else ''}"
+
+
+PACKAGE_DETAIL = RowMapper({
+    'tracking_number': Call(tracking_numbers.public, 'package_id'),
+    'service': 'service_name',
+    'delivery_speed': 'delivery_speed',
+    'weight': 'weight_lb',
+    'date_shipped': 'date_shipped',
+    'date_delivered': 'date_delivered',
+    'delivered_signature': 'delivered_signature',
+    'is_hazardous': Bool('is_hazardous'),
+    'is_international': Bool('is_international'),
+    'sender': {
+        'name': 'sender_name',
+        'address': 'sender_addr1',
+        'address2': 'sender_addr2',
+        'city': 'sender_city',
+        'state': 'sender_state',
+        'zip': 'sender_zip'
+    },
+    'recipient': {
+        'name': 'recipient_name',
+        'address': Call(_street, 'recipient_addr1', 'recipient_addr2'),
+        'city': 'recipient_city',
+        'state': 'recipient_state',
+        'zip': 'recipient_zip'
+    }
+})
+
+TRACKING_EVENT = RowMapper({
+    'timestamp': Timestamp('timestamp'),
+    'status': Status('status'),
+    'location': 'location_name',
+    'location_type': 'location_type',
+    'city': 'location_city',
+    'state': 'location_state',
+    'notes': 'notes'
+})
+
+USER_PACKAGE = RowMapper({
+    'tracking_number': Call(tracking_numbers.public, 'package_id'),
+    'recipient_name': 'recipient_name',
+    'recipient_location': Format('{}, {}', 'recipient_city', 'recipient_state'),
+    'service': 'service_name',
+    'date_shipped': 'date_shipped',
+    'date_delivered': 'date_delivered',
+    'current_status': Status('current_status', 'Processing')
+})
+
+
 def login_required(f):
     """
     Decorator to require authentication for routes.
@@ -58,55 +123,40 @@ def get_package_tracking(tracking_number):
       403:
         description: Unauthorized to view this package
       404:
-        description: Package not found
+        description: Package not found (also malformed tracking numbers)
     """
-    conn = get_db_connection()
+    package_id = tracking_numbers.lookup(tracking_number)
+    if package_id is None:
+        return jsonify({'error': 'Package not found'}), 404
+    conn = package_connection(package_id)
     
     try:
+        cached = payloads.get(package_id)
+        if cached is not None:
+            if not conn.execute(queries.CUSTOMER_OWNS, (request.user_id, cached[0])).fetchone():
+                return jsonify({'error': 'Unauthorized to view this package'}), 403
+            return Response(cached[1], mimetype='application/json'), 200
+        
         # Get package details
-        package_query = """
-            SELECT 
-                p.package_id,
-                p.recipient_name,
-                p.recipient_addr1,
-                p.recipient_addr2,
-                p.recipient_city,
-                p.recipient_state,
-                p.recipient_zip,
-                p.sender_name,
-                p.sender_addr1,
-                p.sender_addr2,
-                p.sender_city,
-                p.sender_state,
-                p.sender_zip,
-                p.weight_lb,
-                p.date_shipped,
-                p.date_delivered,
-                p.delivered_signature,
-                p.is_hazardous,
-                p.is_international,
-                st.name as service_name,
-                st.delivery_speed,
-                c.customer_id
-            FROM Package p
-            JOIN ServiceType st ON p.service_id = st.service_id
-            JOIN Customer c ON p.customer_id = c.customer_id
-            WHERE p.package_id = ?
-        """
+        schema = 'main'
+        package = conn.execute(queries.PACKAGE_DETAIL.format(schema=schema), (package_id,)).fetchone()
         
-        package = conn.execute(package_query, (tracking_number,)).fetchone()
+        # Delivered packages may have been moved to the archive
+        if not package and archive.attach(conn):
+            schema = 'archive'
+            package = conn.execute(queries.PACKAGE_DETAIL.format(schema=schema), (package_id,)).fetchone()
         
         if not package:
             return jsonify({'error': 'Package not found'}), 404
         
+        # Live events may sit in monthly partitions; attach the package's months
+        events = 'archive.TrackingEvent' if schema == 'archive' else 'TrackingEvent'
+        if schema == 'main':
+            partitions.hint(conn, package['date_shipped'], package['date_delivered'])
+        
         # Verify the package belongs to the authenticated user
-        user_check = """
-            SELECT c.customer_id 
-            FROM Customer c
-            WHERE c.user_id = ? AND c.customer_id = ?
-        """
         user_package = conn.execute(
-            user_check, 
+            queries.CUSTOMER_OWNS,
             (request.user_id, package['customer_id'])
         ).fetchone()
         
@@ -114,76 +164,29 @@ def get_package_tracking(tracking_number):
             return jsonify({'error': 'Unauthorized to view this package'}), 403
         
         # Get tracking events (history)
-        tracking_query = """
-            SELECT 
-                te.timestamp,
-                te.status,
-                te.notes,
-                l.type as location_type,
-                l.name as location_name,
-                l.city as location_city,
-                l.state as location_state
-            FROM TrackingEvent te
-            JOIN Location l ON te.location_id = l.location_id
-            WHERE te.package_id = ?
-            ORDER BY te.timestamp DESC
-        """
-        
-        tracking_events = conn.execute(tracking_query, (tracking_number,)).fetchall()
+        tracking_history = TRACKING_EVENT.all(
+            conn.execute(queries.TRACKING_HISTORY.format(events=events), (package_id,))
+        )
         
         # Get current status (most recent event)
-        current_status = tracking_events[0] if tracking_events else None
+        current_status = tracking_history[0] if tracking_history else None
         
         # Format response
         response = {
-            'package': {
-                'tracking_number': package['package_id'],
-                'service': package['service_name'],
-                'delivery_speed': package['delivery_speed'],
-                'weight': package['weight_lb'],
-                'date_shipped': package['date_shipped'],
-                'date_delivered': package['date_delivered'],
-                'delivered_signature': package['delivered_signature'],
-                'is_hazardous': bool(package['is_hazardous']),
-                'is_international': bool(package['is_international']),
-                'sender': {
-                    'name': package['sender_name'],
-                    'address': package['sender_addr1'],
-                    'address2': package['sender_addr2'],
-                    'city': package['sender_city'],
-                    'state': package['sender_state'],
-                    'zip': package['sender_zip']
-                },
-                'recipient': {
-                    'name': package['recipient_name'],
-                    'address': f"{package['recipient_addr1']}{' ' + package['recipient_addr2'] if package['recipient_addr2'] else ''}",
-                    'city': package['recipient_city'],
-                    'state': package['recipient_state'],
-                    'zip': package['recipient_zip']
-                }
-            },
+            'package': PACKAGE_DETAIL.map(package),
             'current_status': {
-                'status': current_status['status'] if current_status else 'Unknown',
-                'location': current_status['location_name'] if current_status else 'Unknown',
-                'city': current_status['location_city'] if current_status else None,
-                'state': current_status['location_state'] if current_status else None,
-                'timestamp': current_status['timestamp'] if current_status else None
+                'status': current_status['status'],
+                'location': current_status['location'],
+                'city': current_status['city'],
+                'state': current_status['state'],
+                'timestamp': current_status['timestamp']
             } if current_status else None,
-            'tracking_history': [
-                {
-                    'timestamp': event['timestamp'],
-                    'status': event['status'],
-                    'location': event['location_name'],
-                    'location_type': event['location_type'],
-                    'city': event['location_city'],
-                    'state': event['location_state'],
-                    'notes': event['notes']
-                }
-                for event in tracking_events
-            ]
+            'tracking_history': tracking_history
         }
         
-        return jsonify(response), 200
+        body = fast_jsonify(response).get_data()
+        payloads.set(package_id, (package['customer_id'], body))
+        return Response(body, mimetype='application/json'), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -208,48 +211,12 @@ def get_user_packages():
       200:
         description: List of user's packages
     """
-    conn = get_db_connection()
+    conn = user_connection(request.user_id)
     
     try:
-        query = """
-            SELECT 
-                p.package_id,
-                p.recipient_name,
-                p.recipient_city,
-                p.recipient_state,
-                p.date_shipped,
-                p.date_delivered,
-                st.name as service_name,
-                (
-                    SELECT te.status 
-                    FROM TrackingEvent te 
-                    WHERE te.package_id = p.package_id 
-                    ORDER BY te.timestamp DESC 
-                    LIMIT 1
-                ) as current_status
-            FROM Package p
-            JOIN ServiceType st ON p.service_id = st.service_id
-            JOIN Customer c ON p.customer_id = c.customer_id
-            WHERE c.user_id = ?
-            ORDER BY p.date_shipped DESC
-        """
-        
-        packages = conn.execute(query, (request.user_id,)).fetchall()
+        packages = USER_PACKAGE.all(conn.execute(queries.USER_PACKAGES, (request.user_id,)))
         
-        return jsonify({
-            'packages': [
-                {
-                    'tracking_number': pkg['package_id'],
-                    'recipient_name': pkg['recipient_name'],
-                    'recipient_location': f"{pkg['recipient_city']}, {pkg['recipient_state']}",
-                    'service': pkg['service_name'],
-                    'date_shipped': pkg['date_shipped'],
-                    'date_delivered': pkg['date_delivered'],
-                    'current_status': pkg['current_status'] or 'Processing'
-                }
-                for pkg in packages
-            ]
-        }), 200
+        return fast_jsonify({'packages': packages}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -0,0 +1,197 @@
+# backend/tracking_numbers.py
+"""
+tracking_numbers.py - Public tracking numbers and fast rejection of unknown ones
+
+Package ids are dense autoincrement integers, so the API no longer hands
+them out as they are. A public tracking number is the package id with its
+shard written out in decimal and a Luhn check digit appended:
+
+    <shard><local id><check>        local id padded to 13 digits when shard > 0
+
+Unsharded this is simply the package id followed by its check digit
+(package 1234 -> 12344). Shard 2's package 7 is 2 0000000000007 3.
+
+decode() turns a public number back into a package id using arithmetic
+only: a wrong check digit (any single mistyped digit, most swaps) or a
+shard this deployment doesn't have is rejected before any connection is
+opened.
+
+Numbers that pass the check are then tested against a per-process bitmap of
+the package ids that exist in each database file (live and archived). Ids
+are dense, so one bit per id is exact and smaller than a Bloom filter of
+the same set: 1M packages take 125 KiB. The bitmap is loaded on first use,
+packages created by this process are added as they are inserted, and ids
+above the highest one loaded (created by another worker since) trigger one
+primary-key range read for the new ids, on a connection the bitmap keeps.
+An id the bitmap doesn't cover (TRACKING_FILTER_MAX_IDS) is always passed
+through to the database.
+
+    TRACKING_FILTER=0               skip the bitmap, only check digits
+"""
+import os
+import threading
+import archive
+import db
+
+ENABLED = os.environ.get('TRACKING_FILTER', '1') != '0'
+# Largest local id the bitmap tracks (bits); 2**27 = 16 MiB per database
+MAX_IDS = int(os.environ.get('TRACKING_FILTER_MAX_IDS', 2 ** 27))
+
+LOCAL_MASK = (1 << db.SHARD_BITS) - 1
+# Decimal width of the local id when a shard prefix is present
+LOCAL_DIGITS = 13
+_SHARD_SCALE = 10 ** LOCAL_DIGITS
+_DOUBLED = (0, 2, 4, 6, 8, 1, 3, 5, 7, 9)
+
+
+def check_digit(body):
+    """
+    Luhn check digit for a non-negative integer.
+    """
+    total = 0
+    double = True
+    while body:
+        body, digit = divmod(body, 10)
+        total += _DOUBLED[digit] if double else digit
+        double = not double
+    return -total % 10
+
+
+def public(package_id):
+    """
+    Public tracking number for a package id (None stays None).
+    """
+    if package_id is None:
+        return None
+    shard = package_id >> db.SHARD_BITS
+    body = shard * _SHARD_SCALE + (package_id & LOCAL_MASK)
+    return body * 10 + check_digit(body)
+
+
+def decode(number):
+    """
+    Package id for a public tracking number, or None when the number is not
+    well formed (check digit, shard range). No database access.
+    """
+    if number <= 0:
+        return None
+    body, check = divmod(number, 10)
+    if check_digit(body) != check:
+        return None
+    shard, local = divmod(body, _SHARD_SCALE)
+    if local == 0 or local > LOCAL_MASK or shard >= max(db.SHARDS, 1):
+        return None
+    return (shard << db.SHARD_BITS) | local
+
+
+class KnownIds:
+    """
+    Bitmap of the local package ids present in one database file. `high` is
+    the highest id read from the database; ids above it may have been
+    created elsewhere since. Keeps its own connection for catching up, so a
+    miss costs one index seek rather than a connection setup.
+    """
+    def __init__(self, path):
+        self.bits = bytearray()
+        self.high = 0
+        self.conn = db._connect(path, check_same_thread=False)
+
+    def add(self, local):
+        if local > MAX_IDS:
+            return
+        byte = local >> 3
+        if byte >= len(self.bits):
+            self.bits.extend(bytes(max(byte + 1, 2 * len(self.bits)) - len(self.bits)))
+        self.bits[byte] |= 1 << (local & 7)
+
+    def __contains__(self, local):
+        byte = local >> 3
+        return byte < len(self.bits) and bool(self.bits[byte] & (1 << (local & 7)))
+
+
+_known = {}
+_lock = threading.Lock()
+_pid = None
+
+
+def _path(shard):
+    return db.shard_path(shard) if db.SHARDS else db.DB_PATH
+
+
+def _catch_up(known, shard):
+    # Ids above `high` in the live table and the archive: primary-key range reads
+    base = shard << db.SHARD_BITS
+    bounds = (base + known.high, base + LOCAL_MASK)
+    queries = ["SELECT package_id FROM Package WHERE package_id > ? AND package_id <= ?"]
+    if archive.attach(known.conn):
+        queries.append("SELECT package_id FROM archive.Package WHERE package_id > ? AND package_id <= ?")
+    for sql in queries:
+        for (package_id,) in known.conn.execute(sql, bounds):
+            local = package_id & LOCAL_MASK
+            known.add(local)
+            known.high = max(known.high, local)
+
+
+def _table(shard):
+    global _pid
+    if _pid != os.getpid():
+        _known.clear()
+        _pid = os.getpid()
+    path = _path(shard)
+    known = _known.get(path)
+    if known is None:
+        known = _known[path] = KnownIds(path)
+        _catch_up(known, shard)
+    return known
+
+
+def might_exist(package_id):
+    """
+    False only when package_id certainly doesn't exist.
+    """
+    local = package_id & LOCAL_MASK
+    if not ENABLED or local > MAX_IDS:
+        return True
+    shard = package_id >> db.SHARD_BITS
+    with _lock:
+        known = _table(shard)
+        if local in known:
+            return True
+        if local <= known.high:
+            return False
+        _catch_up(known, shard)
+        return local in known
+
+
+def lookup(number):
+    """
+    Package id for a public tracking number, or None when it is malformed
+    or names a package that doesn't exist.
+    """
+    package_id = decode(number)
+    if package_id is None or not might_exist(package_id):
+        return None
+    return package_id
+
+
+def add(package_id):
+    """
+    Record a package created by this process (call after commit).
+    """
+    if not ENABLED:
+        return
+    with _lock:
+        known = _known.get(_path(package_id >> db.SHARD_BITS))
+        if known is not None:
+            # `high` stays put: ids below this one may come from other workers
+            known.add(package_id & LOCAL_MASK)
+
+
+def reset():
+    """
+    Forget every loaded bitmap (after replacing a database file).
+    """
+    with _lock:
+        for known in _known.values():
+            known.conn.close()
+        _known.clear()
@@ -6,6 +6,8 @@ import re
 import sqlite3
 from flask import Blueprint, request, jsonify
 from db import get_db_connection
+import queries
+import sharding
 
 
 user_routes = Blueprint('user_routes', __name__)
@@ -61,10 +63,7 @@ def login():
     password = data.get("password")
 
     conn = get_db_connection()
-    user = conn.execute(
-        "SELECT * FROM User WHERE email = ? AND password = ?",
-        (email, password)
-    ).fetchone()
+    user = conn.execute(queries.USER_LOGIN, (email, password)).fetchone()
     conn.close()
 
     if user:
@@ -111,12 +110,10 @@ def register():
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
-        cursor.execute(
-          "INSERT INTO User (email, password, role) VALUES (?, ?, ?)",
-          (email, password, role)
-        )
+        cursor.execute(queries.INSERT_USER, (email, password, role))
         conn.commit()
         user_id = cursor.lastrowid
+        sharding.replicate('User', user_id)
         return jsonify({"id": user_id, **data}), 201
     except sqlite3.IntegrityError:
         return jsonify({"error": "Email already registered"}), 400
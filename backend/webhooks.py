@@ -0,0 +1,459 @@
+# backend/webhooks.py
+"""
+webhooks.py - Push tracking events to customers' webhook endpoints
+
+Customers subscribe URLs at /api/customer/webhooks. Every tracking event
+is queued in Outbox, one row per active subscription of the package's
+customer, by db.insert_event() in the same transaction as the event
+itself: an event is delivered if and only if it was committed, whichever
+write path (status updates, new shipments, bulk loads) produced it.
+
+The delivery worker polls the outbox and POSTs each subscription's oldest
+events in batches of up to WEBHOOK_BATCH:
+
+    POST <url>
+    X-Webhook-Delivery: <subscription_id>-<last outbox_id>   (same on retries)
+    X-Webhook-Signature: sha256=<HMAC of the body with the secret, if any>
+    {"subscription_id": 3, "events": [{"event_id": ..., "tracking_number": ...,
+     "status": "arrived", "timestamp": "2025-12-01 10:30:00", "location_id": 1,
+     "notes": "..."}, ...]}
+
+A 2xx answer removes the batch from the outbox. Anything else backs the
+subscription off (WEBHOOK_BACKOFF seconds, doubling per consecutive
+failure up to WEBHOOK_BACKOFF_MAX, with jitter) and the same events are
+sent again, so a subscription's events always arrive in order, at least
+once. After WEBHOOK_MAX_FAILURES failures in a row the subscription is
+switched off; its queued events stay until it is deleted.
+
+Batches for different subscriptions are sent in parallel (WEBHOOK_THREADS),
+at most WEBHOOK_CONCURRENCY at a time to any one host, over kept-alive
+connections that are reused from batch to batch.
+
+Subscription URLs must resolve to public addresses only: loopback,
+private, link-local (cloud metadata) and other reserved ranges are
+refused when the URL is registered and again for each new connection,
+which goes to the address that was checked. WEBHOOK_ALLOW_PRIVATE=1
+lifts this for local development.
+
+Only one process delivers: the one holding the lock file next to DB_PATH.
+Run it on its own or inside the app with WEBHOOK_WORKER=1:
+
+    python webhooks.py run [--loop 1]
+    python webhooks.py status
+"""
+import argparse
+import fcntl
+import hashlib
+import hmac
+import http.client
+import ipaddress
+import json
+import logging
+import os
+import random
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import db
+import tracking_numbers
+
+DEFAULTS = {
+    'WEBHOOK_WORKER': os.environ.get('WEBHOOK_WORKER', '0') == '1',
+    'WEBHOOK_POLL': float(os.environ.get('WEBHOOK_POLL', 1)),
+}
+
+WEBHOOK_BATCH = int(os.environ.get('WEBHOOK_BATCH', 100))
+WEBHOOK_THREADS = int(os.environ.get('WEBHOOK_THREADS', 8))
+WEBHOOK_CONCURRENCY = int(os.environ.get('WEBHOOK_CONCURRENCY', 2))
+WEBHOOK_TIMEOUT = float(os.environ.get('WEBHOOK_TIMEOUT', 10))
+WEBHOOK_BACKOFF = float(os.environ.get('WEBHOOK_BACKOFF', 2))
+WEBHOOK_BACKOFF_MAX = float(os.environ.get('WEBHOOK_BACKOFF_MAX', 3600))
+WEBHOOK_MAX_FAILURES = int(os.environ.get('WEBHOOK_MAX_FAILURES', 20))
+WEBHOOK_ALLOW_PRIVATE = os.environ.get('WEBHOOK_ALLOW_PRIVATE', '0') == '1'
+
+USER_AGENT = 'package-delivery-webhooks/1.0'
+
+logger = logging.getLogger('webhooks')
+
+ENQUEUE = """
+    INSERT INTO Outbox (subscription_id, event_id, package_id, location_id, timestamp, status, notes, created_at)
+    SELECT s.subscription_id, ?, p.package_id, ?, ?, ?, ?, ?
+    FROM Package p
+    JOIN WebhookSubscription s ON s.customer_id = p.customer_id AND s.active = 1
+    WHERE p.package_id = ?
+"""
+
+DUE = """
+    SELECT s.subscription_id, s.url, s.secret, s.failures
+    FROM WebhookSubscription s
+    WHERE s.active = 1 AND s.retry_at <= ?
+      AND EXISTS (SELECT 1 FROM Outbox o WHERE o.subscription_id = s.subscription_id)
+    ORDER BY s.retry_at
+"""
+
+BATCH = """
+    SELECT outbox_id, event_id, package_id, location_id, timestamp, status, notes
+    FROM Outbox
+    WHERE subscription_id = ?
+    ORDER BY outbox_id
+    LIMIT ?
+"""
+
+
+def enqueue(cursor, event_id, package_id, location_id, timestamp, status, notes):
+    """
+    Queue a tracking event (stored forms) for every active subscription of
+    the package's customer. Call inside the transaction that inserts it.
+    """
+    # Own cursor: the caller's lastrowid stays the event's
+    cursor.connection.execute(ENQUEUE, (event_id, location_id, timestamp, status, notes, time.time(), package_id))
+
+
+def database_paths():
+    return [db.shard_path(s) for s in range(db.SHARDS)] if db.SHARDS else [db.DB_PATH]
+
+
+def payload(subscription_id, rows):
+    return json.dumps({
+        'subscription_id': subscription_id,
+        'events': [{
+            'event_id': row['event_id'],
+            'tracking_number': tracking_numbers.public(row['package_id']),
+            'status': db.status_name(row['status']),
+            'timestamp': db.from_epoch(row['timestamp']),
+            'location_id': row['location_id'],
+            'notes': row['notes'],
+        } for row in rows],
+    }, separators=(',', ':')).encode()
+
+
+class UnsafeDestination(OSError):
+    """
+    A webhook host that resolves to a non-public address.
+    """
+
+
+def resolve(host, port):
+    """
+    The address to connect to for host:port, refusing hosts that resolve
+    to any non-public address (unless WEBHOOK_ALLOW_PRIVATE).
+    """
+    addresses = {info[4][0] for info in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)}
+    if not WEBHOOK_ALLOW_PRIVATE:
+        for address in addresses:
+            ip = ipaddress.ip_address(address.split('%')[0])
+            if not ip.is_global or ip.is_multicast:
+                raise UnsafeDestination(f'{host} resolves to non-public address {ip}')
+    return sorted(addresses)[0]
+
+
+def check_url(url):
+    """
+    Raise ValueError unless `url` is an http(s) URL of a public host.
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ValueError('url must be an http:// or https:// URL')
+    try:
+        resolve(parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80))
+    except UnsafeDestination as e:
+        raise ValueError(str(e))
+    except (OSError, UnicodeError, ValueError):
+        raise ValueError(f'Cannot resolve {parts.hostname}')
+
+
+def backoff(failures):
+    """
+    Seconds to wait after `failures` consecutive failures (jittered).
+    """
+    delay = min(WEBHOOK_BACKOFF * 2 ** (failures - 1), WEBHOOK_BACKOFF_MAX)
+    return delay * random.uniform(0.5, 1.0)
+
+
+class Endpoint:
+    """
+    Kept-alive connections to one scheme://host:port, reused across batches.
+    """
+    def __init__(self, scheme, netloc):
+        self.scheme = scheme
+        self.netloc = netloc
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _open(self):
+        cls = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+        conn = cls(self.netloc, timeout=WEBHOOK_TIMEOUT)
+        # Connect to the address that passed the check, not a second lookup
+        # (TLS still verifies the certificate against the host name)
+        address = resolve(conn.host, conn.port)
+        conn._create_connection = lambda target, *args: socket.create_connection((address, target[1]), *args)
+        return conn
+
+    def post(self, path, body, headers):
+        """
+        POST and return the status code. A kept-alive connection the server
+        has closed meanwhile is replaced once.
+        """
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        reused = conn is not None
+        while True:
+            conn = conn or self._open()
+            try:
+                conn.request('POST', path, body, headers)
+                response = conn.getresponse()
+                response.read()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                if not reused:
+                    raise
+                conn, reused = None, False
+                continue
+            if response.will_close:
+                conn.close()
+            else:
+                with self._lock:
+                    self._idle.append(conn)
+            return response.status
+
+    def close(self):
+        with self._lock:
+            for conn in self._idle:
+                conn.close()
+            self._idle.clear()
+
+
+class Deliverer:
+    """
+    Sends due outbox batches; one instance per delivering process.
+    """
+    def __init__(self, threads=WEBHOOK_THREADS):
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='webhook')
+        self.endpoints = {}
+        self.sent = Counter()
+
+    def _endpoint(self, url):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        endpoint = self.endpoints.get(key)
+        if endpoint is None:
+            endpoint = self.endpoints[key] = Endpoint(*key)
+        return endpoint
+
+    def _send(self, endpoint, subscription, rows):
+        # Runs on a pool thread; returns an error message or None
+        body = payload(subscription['subscription_id'], rows)
+        headers = {
+            'Content-Type': 'application/json',
+            'User-Agent': USER_AGENT,
+            'X-Webhook-Delivery': f"{subscription['subscription_id']}-{rows[-1]['outbox_id']}",
+        }
+        if subscription['secret']:
+            digest = hmac.new(subscription['secret'].encode(), body, hashlib.sha256).hexdigest()
+            headers['X-Webhook-Signature'] = f'sha256={digest}'
+        parts = urlsplit(subscription['url'])
+        path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        try:
+            status = endpoint.post(path, body, headers)
+        except (http.client.HTTPException, OSError) as e:
+            return f'{type(e).__name__}: {e}'
+        return None if 200 <= status < 300 else f'HTTP {status}'
+
+    def deliver_once(self, path=None):
+        """
+        Send one batch for every subscription that is due (at most
+        WEBHOOK_CONCURRENCY per host). Returns (batches sent, batches that
+        left events behind).
+        """
+        conn = db.get_db_connection(path)
+        try:
+            now = time.time()
+            per_host = Counter()
+            work = []
+            for subscription in conn.execute(DUE, (now,)).fetchall():
+                host = self._endpoint(subscription['url'])
+                if per_host[host] >= WEBHOOK_CONCURRENCY:
+                    continue
+                per_host[host] += 1
+                rows = conn.execute(BATCH, (subscription['subscription_id'], WEBHOOK_BATCH)).fetchall()
+                work.append((subscription, rows, self.executor.submit(self._send, host, subscription, rows)))
+
+            # Wait for every send before writing: a write transaction held
+            # across a slow endpoint would lock out every other writer
+            results = [(subscription, rows, future.result()) for subscription, rows, future in work]
+
+            sent = full = 0
+            for subscription, rows, error in results:
+                if error is None:
+                    sent += 1
+                    full += len(rows) == WEBHOOK_BATCH
+                    self.sent['events'] += len(rows)
+                    conn.execute("DELETE FROM Outbox WHERE subscription_id = ? AND outbox_id <= ?",
+                                 (subscription['subscription_id'], rows[-1]['outbox_id']))
+                    conn.execute("""
+                        UPDATE WebhookSubscription SET failures = 0, retry_at = 0, last_error = NULL
+                        WHERE subscription_id = ?
+                    """, (subscription['subscription_id'],))
+                else:
+                    failures = subscription['failures'] + 1
+                    self.sent['failures'] += 1
+                    conn.execute("""
+                        UPDATE WebhookSubscription SET failures = ?, retry_at = ?, last_error = ?, active = ?
+                        WHERE subscription_id = ?
+                    """, (failures, time.time() + backoff(failures), error,
+                          0 if failures >= WEBHOOK_MAX_FAILURES else 1, subscription['subscription_id']))
+                    logger.warning("webhook %s failed (%s), attempt %s", subscription['url'], error, failures)
+            conn.commit()
+            return sent, full
+        finally:
+            conn.close()
+
+    def run(self, stopped, poll):
+        """
+        Deliver until `stopped` is set, draining backlogs without pausing.
+        """
+        while not stopped.is_set():
+            busy = False
+            for path in database_paths():
+                try:
+                    busy |= self.deliver_once(path)[1] > 0
+                except sqlite3.Error:
+                    logger.exception("webhook delivery failed")
+            if not busy:
+                stopped.wait(poll)
+
+    def close(self):
+        self.executor.shutdown()
+        for endpoint in self.endpoints.values():
+            endpoint.close()
+
+
+def _lock_path():
+    return os.path.splitext(db.DB_PATH)[0] + '-webhooks.lock'
+
+
+class DeliveryThread(threading.Thread):
+    """
+    Background delivery inside an app process. Only the process holding the
+    lock file delivers; the others keep trying so one takes over if it exits.
+    """
+    def __init__(self, poll):
+        super().__init__(name='webhook-delivery', daemon=True)
+        self.poll = poll
+        self.stopped = threading.Event()
+
+    def run(self):
+        handle = open(_lock_path(), 'w')
+        while not self.stopped.is_set():
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except OSError:
+                self.stopped.wait(self.poll)
+        deliverer = Deliverer()
+        try:
+            deliverer.run(self.stopped, self.poll)
+        finally:
+            deliverer.close()
+            handle.close()
+
+
+_thread = None
+# Poll interval once init_webhooks() has seen WEBHOOK_WORKER on
+_poll = None
+
+
+def start_delivery():
+    """
+    Start the delivery thread in this process if WEBHOOK_WORKER is on and it
+    isn't running here yet (a thread started before a fork doesn't survive it).
+    """
+    global _thread
+    if _poll is None or (_thread is not None and _thread.is_alive()):
+        return
+    _thread = DeliveryThread(_poll)
+    _thread.start()
+
+
+def init_webhooks(app):
+    """
+    With WEBHOOK_WORKER on, deliver webhooks from a background thread
+    (with DEFER_BACKGROUND, once start_delivery is called).
+    """
+    global _poll
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
+    if not app.config['WEBHOOK_WORKER']:
+        return
+    _poll = app.config['WEBHOOK_POLL']
+    if not app.config.get('DEFER_BACKGROUND'):
+        start_delivery()
+
+
+def status():
+    """
+    Per subscription: queued events, oldest event's age and failure state.
+    """
+    result = []
+    now = time.time()
+    for path in database_paths():
+        conn = db.get_db_connection(path)
+        try:
+            for row in conn.execute("""
+                SELECT s.subscription_id, s.customer_id, s.url, s.active, s.failures, s.last_error,
+                       COUNT(o.outbox_id) as queued, MIN(o.created_at) as oldest
+                FROM WebhookSubscription s
+                LEFT JOIN Outbox o ON o.subscription_id = s.subscription_id
+                GROUP BY s.subscription_id
+            """):
+                entry = dict(row)
+                entry['oldest_age_s'] = round(now - entry.pop('oldest'), 1) if row['oldest'] else None
+                result.append(entry)
+        finally:
+            conn.close()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Deliver queued webhook events")
+    sub = parser.add_subparsers(dest='command', required=True)
+    run = sub.add_parser('run')
+    run.add_argument('--loop', type=float, help='keep delivering, polling every LOOP seconds')
+    sub.add_parser('status')
+    args = parser.parse_args(argv)
+
+    if args.command == 'status':
+        for entry in status():
+            print(json.dumps(entry))
+        return 0
+
+    logging.basicConfig(level=logging.INFO)
+    handle = open(_lock_path(), 'w')
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        print("Another process is delivering webhooks", file=sys.stderr)
+        return 1
+    deliverer = Deliverer()
+    try:
+        if args.loop:
+            deliverer.run(threading.Event(), args.loop)
+        else:
+            while sum([deliverer.deliver_once(path)[1] for path in database_paths()]):
+                pass
+        print(f"Delivered {deliverer.sent['events']} event(s), {deliverer.sent['failures']} failed batch(es)")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        deliverer.close()
+        handle.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
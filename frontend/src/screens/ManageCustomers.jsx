@@ -2,26 +2,31 @@
 import React, { useState, useEffect } from 'react';
 import { Users, Package, ShieldCheck, AlertCircle, CheckCircle } from 'lucide-react';
 
+const PAGE_SIZE = 50;
+
 const ManageCustomers = () => {
   const [customers, setCustomers] = useState([]);
+  const [totals, setTotals] = useState({ customers: 0, contract_customers: 0, packages: 0 });
+  const [page, setPage] = useState(1);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState('');
   const [success, setSuccess] = useState('');
 
   useEffect(() => {
     fetchCustomers();
-  }, []);
+  }, [page]);
 
   const fetchCustomers = async () => {
     try {
       const token = localStorage.getItem('authToken');
-      const response = await fetch('http://localhost:8000/api/admin/customers', {
+      const response = await fetch(`http://localhost:8000/api/admin/customers?page=${page}&per_page=${PAGE_SIZE}`, {
         headers: { 'Authorization': `Bearer ${token}` }
       });
 
       if (response.ok) {
         const data = await response.json();
         setCustomers(data.customers);
+        setTotals(data.totals);
       } else {
         const errorData = await response.json();
         setError(errorData.error || 'Failed to load customers');
@@ -119,7 +124,7 @@ const ManageCustomers = () => {
               </div>
               <div>
                 <p className="text-sm text-gray-600">Total Customers</p>
-                <p className="text-2xl font-bold text-gray-800">{customers.length}</p>
+                <p className="text-2xl font-bold text-gray-800">{totals.customers}</p>
               </div>
             </div>
           </div>
@@ -132,7 +137,7 @@ const ManageCustomers = () => {
               <div>
                 <p className="text-sm text-gray-600">Contract Customers</p>
                 <p className="text-2xl font-bold text-gray-800">
-                  {customers.filter(c => c.has_contract).length}
+                  {totals.contract_customers}
                 </p>
               </div>
             </div>
@@ -146,7 +151,7 @@ const ManageCustomers = () => {
               <div>
                 <p className="text-sm text-gray-600">Total Shipments</p>
                 <p className="text-2xl font-bold text-gray-800">
-                  {customers.reduce((sum, c) => sum + c.total_packages, 0)}
+                  {totals.packages}
                 </p>
               </div>
             </div>
@@ -240,6 +245,29 @@ const ManageCustomers = () => {
               </tbody>
             </table>
           </div>
+
+          {/* Pagination */}
+          <div className="flex items-center justify-between px-6 py-3 border-t border-gray-200 text-sm text-gray-600">
+            <span>
+              Page {page} of {Math.max(1, Math.ceil(totals.customers / PAGE_SIZE))}
+            </span>
+            <div className="flex gap-2">
+              <button
+                onClick={() => setPage(page - 1)}
+                disabled={page === 1}
+                className="px-3 py-1 rounded-lg bg-gray-100 hover:bg-gray-200 disabled:opacity-50"
+              >
+                Previous
+              </button>
+              <button
+                onClick={() => setPage(page + 1)}
+                disabled={page * PAGE_SIZE >= totals.customers}
+                className="px-3 py-1 rounded-lg bg-gray-100 hover:bg-gray-200 disabled:opacity-50"
+              >
+                Next
+              </button>
+            </div>
+          </div>
         </div>
 
         {/* Info Box */}